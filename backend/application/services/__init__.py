@@ -0,0 +1,31 @@
+"""
+Application Services Package.
+
+Set-based engines for heavy operations shared by API views and Celery tasks.
+"""
+
+from .bom_clone import BOMCloneError, BOMCloner
+from .dashboard import DashboardBuilder, DashboardSnapshotStore
+from .goods_receipts import GoodsReceiptProcessor
+from .problem_detection import ProblemEvaluator
+from .progress import ProgressTracker
+from .project_expansion import BOMExpansionEngine, ExpansionResult
+from .requirements_sync import RequirementSynchronizer
+from .stock_ledger import InsufficientStock, StockLedger, StockMove
+
+
+__all__ = [
+    'BOMCloneError',
+    'BOMCloner',
+    'BOMExpansionEngine',
+    'DashboardBuilder',
+    'DashboardSnapshotStore',
+    'ExpansionResult',
+    'GoodsReceiptProcessor',
+    'InsufficientStock',
+    'ProblemEvaluator',
+    'ProgressTracker',
+    'RequirementSynchronizer',
+    'StockLedger',
+    'StockMove',
+]
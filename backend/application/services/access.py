@@ -0,0 +1,220 @@
+"""
+Effective Permissions.
+
+Per-user access summary resolved from roles and module access:
+project visibility type, module access levels and responsibility flags.
+Computed once, kept in the Django cache and invalidated by signals
+(see infrastructure.persistence.signals).
+"""
+
+import logging
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from infrastructure.persistence.models import Role, RoleModuleAccess, UserModuleAccess, UserRole
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = 'effective_permissions:v1:{user_id}'
+DEFAULT_CACHE_TIMEOUT = 10 * 60
+
+# Атрибут запроса, в котором живёт объект прав на время обработки запроса
+REQUEST_ATTR = '_effective_permissions'
+
+ACCESS_LEVELS = ('none', 'view', 'edit', 'full')
+
+ROLE_VALUES = (
+    'id',
+    'code',
+    'visibility_type',
+    'project_access_scope',
+    'can_be_production_responsible',
+    'can_be_responsible',
+    'can_be_inventory_responsible',
+    'see_only_own_items',
+    'see_child_structures',
+)
+
+
+@dataclass
+class EffectivePermissions:
+    """
+    Итоговые права пользователя.
+
+    visibility_type: 'all', 'own_and_children', 'own' или None (без ограничений).
+    module_access: module_id -> {module_id, module_code, module_name, access_level, source};
+    доступ пользователя перекрывает доступ по ролям.
+    """
+
+    user_id: Optional[str] = None
+    is_superuser: bool = False
+    visibility_type: Optional[str] = None
+    role_codes: List[str] = field(default_factory=list)
+    can_be_production_responsible: bool = False
+    can_be_inventory_responsible: bool = False
+    module_access: Dict[str, dict] = field(default_factory=dict)
+
+    @property
+    def restricts_items(self) -> bool:
+        return self.visibility_type in ('own', 'own_and_children')
+
+    def module_level(self, module_code: str) -> str:
+        if self.is_superuser:
+            return 'full'
+        for entry in self.module_access.values():
+            if entry['module_code'] == module_code:
+                return entry['access_level']
+        return 'none'
+
+    def has_module_access(self, module_code: str, level: str = 'view') -> bool:
+        return ACCESS_LEVELS.index(self.module_level(module_code)) >= ACCESS_LEVELS.index(level)
+
+
+def resolve_visibility_type(roles: Iterable[dict]) -> Optional[str]:
+    """
+    Тип видимости по активным ролям пользователя.
+
+    Учитываются только роли с флагами ответственности/видимости;
+    самый широкий тип побеждает.
+    """
+    visibility_roles = [
+        role for role in roles
+        if role['can_be_production_responsible']
+        or role['can_be_responsible']
+        or role['see_only_own_items']
+        or role['see_child_structures']
+    ]
+    if not visibility_roles:
+        return None
+
+    if any(role['visibility_type'] == Role.VISIBILITY_ALL for role in visibility_roles):
+        return Role.VISIBILITY_ALL
+
+    if any(
+        role['visibility_type'] == Role.VISIBILITY_OWN_AND_CHILDREN or role['see_child_structures']
+        for role in visibility_roles
+    ):
+        return Role.VISIBILITY_OWN_AND_CHILDREN
+
+    if any(
+        role['visibility_type'] == Role.VISIBILITY_OWN or role['see_only_own_items']
+        for role in visibility_roles
+    ):
+        return Role.VISIBILITY_OWN
+
+    return None
+
+
+def build_effective_permissions(user) -> EffectivePermissions:
+    """Собрать права пользователя из БД (три запроса)."""
+    permissions = EffectivePermissions(user_id=str(user.pk), is_superuser=user.is_superuser)
+
+    assignments = list(
+        UserRole.objects.filter(
+            user=user,
+            is_active=True,
+            role__is_active=True,
+        ).values('project_id', *(f'role__{name}' for name in ROLE_VALUES))
+    )
+    roles = {}
+    global_role_ids = set()
+    for row in assignments:
+        role = {name: row[f'role__{name}'] for name in ROLE_VALUES}
+        roles[role['id']] = role
+        if row['project_id'] is None:
+            global_role_ids.add(role['id'])
+
+    roles = list(roles.values())
+    permissions.role_codes = sorted(role['code'] for role in roles)
+    permissions.can_be_production_responsible = any(
+        role['can_be_production_responsible'] or role['can_be_responsible'] for role in roles
+    )
+    permissions.can_be_inventory_responsible = any(role['can_be_inventory_responsible'] for role in roles)
+    if not user.is_superuser:
+        permissions.visibility_type = resolve_visibility_type(roles)
+
+    # Доступ к модулям: сначала глобальные роли, затем персональный доступ
+    module_rows = []
+    if global_role_ids:
+        module_rows += [
+            (row, 'role') for row in RoleModuleAccess.objects.filter(
+                role_id__in=global_role_ids
+            ).values('module_id', 'module__code', 'module__name', 'access_level')
+        ]
+    module_rows += [
+        (row, 'user') for row in UserModuleAccess.objects.filter(
+            user=user
+        ).values('module_id', 'module__code', 'module__name', 'access_level')
+    ]
+    for row, source in module_rows:
+        module_id = str(row['module_id'])
+        permissions.module_access[module_id] = {
+            'module_id': module_id,
+            'module_code': row['module__code'],
+            'module_name': row['module__name'],
+            'access_level': row['access_level'],
+            'source': source,
+        }
+
+    return permissions
+
+
+def _cache_key(user_id) -> str:
+    return CACHE_KEY.format(user_id=user_id)
+
+
+def get_effective_permissions(user) -> EffectivePermissions:
+    """Права пользователя из кэша; при промахе - расчёт и запись в кэш."""
+    if not user.is_authenticated:
+        return EffectivePermissions()
+
+    key = _cache_key(user.pk)
+    cached = cache.get(key)
+    if cached is not None:
+        return EffectivePermissions(**cached)
+
+    permissions = build_effective_permissions(user)
+    timeout = getattr(settings, 'EFFECTIVE_PERMISSIONS_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT)
+    cache.set(key, asdict(permissions), timeout)
+    return permissions
+
+
+def get_request_permissions(request) -> EffectivePermissions:
+    """
+    Права текущего пользователя, общие для всех обращений в рамках запроса.
+
+    Объект кэшируется на самом запросе, поэтому несколько вызовов из
+    get_queryset/actions/serializers обходятся одним чтением кэша.
+    """
+    permissions = getattr(request, REQUEST_ATTR, None)
+    if permissions is None:
+        permissions = get_effective_permissions(request.user)
+        setattr(request, REQUEST_ATTR, permissions)
+    return permissions
+
+
+def invalidate_user_permissions(user_ids: Iterable) -> None:
+    """Сбросить кэш прав пользователей после фиксации транзакции."""
+    keys = [_cache_key(user_id) for user_id in set(user_ids) if user_id]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_role_permissions(role_ids: Iterable) -> None:
+    """Сбросить кэш прав всех пользователей, которым назначены роли."""
+    role_ids = [role_id for role_id in set(role_ids) if role_id]
+    if not role_ids:
+        return
+
+    def _invalidate():
+        user_ids = set(
+            UserRole.objects.filter(role_id__in=role_ids).values_list('user_id', flat=True)
+        )
+        cache.delete_many([_cache_key(user_id) for user_id in user_ids])
+        logger.debug("Effective permissions invalidated for %s users (roles %s)", len(user_ids), role_ids)
+
+    transaction.on_commit(_invalidate)
@@ -0,0 +1,121 @@
+"""
+BOM Cloning.
+
+Copy of a BOM structure in a constant number of queries: source items are
+read once with .values(), remapped in memory and written with bulk_create
+in batches. Used by the API (synchronously) and by the Celery task for
+very large structures (with progress reporting).
+"""
+
+import logging
+import uuid
+from typing import Callable, Optional
+
+from django.db import transaction
+from simple_history.utils import bulk_create_with_history
+
+from infrastructure.persistence.models import BOMItem, BOMStructure, NomenclatureItem
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Копируемые поля строки BOM (parent_item/bom задаются отдельно)
+ITEM_FIELDS = (
+    'parent_item_id',
+    'child_item_id',
+    'child_category',
+    'quantity',
+    'unit',
+    'position',
+    'drawing_number_override',
+    'notes',
+)
+
+
+class BOMCloneError(Exception):
+    """Клонирование невозможно (например, у изделия уже есть активная структура)."""
+
+
+class BOMCloner:
+    """
+    Клонирование структуры изделия.
+
+    parent_item строк ссылается на номенклатуру, поэтому перепривязывать
+    нужно только строки верхнего уровня: если копия строится для другого
+    корневого изделия, их родитель меняется на новый корень, а категория
+    корня (root_category) берётся из вида справочника нового корня.
+
+    progress(done, total) вызывается после каждой записанной пачки.
+    """
+
+    def __init__(
+        self,
+        source: BOMStructure,
+        name: str,
+        root_item_id=None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ):
+        self.source = source
+        self.name = name
+        self.root_item_id = self._parse_root_item_id(root_item_id) or source.root_item_id
+        self.batch_size = batch_size
+        self.progress = progress
+
+    def clone(self) -> BOMStructure:
+        # Одна активная структура на изделие (unique_active_bom_per_nomenclature)
+        if BOMStructure.all_objects.filter(root_item_id=self.root_item_id, is_active=True).exists():
+            raise BOMCloneError(
+                'У корневого изделия уже есть активная структура. '
+                'Укажите другое корневое изделие (root_item) для копии.'
+            )
+
+        root_category = self._root_category()
+        rows = list(
+            BOMItem.objects.filter(bom=self.source).order_by('parent_item', 'position').values(*ITEM_FIELDS)
+        )
+
+        with transaction.atomic():
+            new_bom = BOMStructure.objects.create(
+                name=self.name,
+                description=f"Копия: {self.source.name}. {self.source.description or ''}",
+                root_item_id=self.root_item_id,
+                root_category=root_category,
+                current_version=1,
+                is_active=True,
+                is_locked=False,
+            )
+
+            items = [self._copy(row, new_bom) for row in rows]
+            total = len(items)
+            for start in range(0, total, self.batch_size):
+                bulk_create_with_history(items[start:start + self.batch_size], BOMItem, batch_size=self.batch_size)
+                if self.progress:
+                    self.progress(min(start + self.batch_size, total), total)
+
+        logger.info("BOM %s cloned to %s: %s items", self.source.pk, new_bom.pk, total)
+        return new_bom
+
+    @staticmethod
+    def _parse_root_item_id(root_item_id):
+        if not root_item_id:
+            return None
+        try:
+            return uuid.UUID(str(root_item_id))
+        except ValueError:
+            raise BOMCloneError('Некорректный идентификатор корневого изделия (root_item)')
+
+    def _root_category(self) -> str:
+        if self.root_item_id == self.source.root_item_id:
+            return self.source.root_category
+        root = NomenclatureItem.objects.filter(pk=self.root_item_id).values('catalog_category__code').first()
+        if root is None:
+            raise BOMCloneError('Корневое изделие (root_item) не найдено')
+        return root['catalog_category__code'] or ''
+
+    def _copy(self, row, new_bom) -> BOMItem:
+        values = dict(row)
+        if values['parent_item_id'] == self.source.root_item_id:
+            values['parent_item_id'] = self.root_item_id
+        return BOMItem(bom=new_bom, **values)
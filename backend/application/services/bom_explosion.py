@@ -0,0 +1,269 @@
+"""
+BOM Explosion.
+
+Multi-level BOM rollups computed in the database with recursive queries:
+- exploded BOM: every leaf nomenclature of a structure with its total
+  quantity per one root unit, down through the active sub-BOMs of
+  manufactured children;
+- where-used: every product that contains a nomenclature item, directly or
+  through sub-assemblies, with the quantity per one unit of the product.
+
+Rollups are cached per BOM version and per "BOM generation" - a counter
+bumped by signals whenever BOM items or structures change, or nomenclature
+and catalog categories change in fields the rollups and BOM trees depend
+on, so one edit invalidates every explosion (and cached BOM tree) that
+might include it.
+
+Branches deeper than MAX_DEPTH (or cycles in the data) are not returned
+cut short: the rollup raises BOMDepthExceeded instead.
+"""
+
+import logging
+from decimal import Decimal
+from typing import Dict, List
+from uuid import UUID
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from infrastructure.persistence.models import BOMItem, BOMStructure, CatalogCategory, NomenclatureItem
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'bom_explosion:v1'
+GENERATION_KEY = f'{CACHE_PREFIX}:generation'
+DEFAULT_CACHE_TIMEOUT = 60 * 60
+# Защита от циклов в данных (BOM изделия, входящего само в себя)
+MAX_DEPTH = 50
+
+
+class BOMDepthExceeded(Exception):
+    """Ветвь структуры глубже MAX_DEPTH уровней (или цикл в данных) - развёртка была бы неполной."""
+
+    def __init__(self, nomenclature_ids):
+        super().__init__(
+            f'Структура содержит цикл или более {MAX_DEPTH} уровней вложенности'
+        )
+        self.nomenclature_ids = nomenclature_ids
+
+# Прямые дочерние элементы активной структуры: BOMItem.parent_item = BOMStructure.root_item
+_CHILD_EDGES = """
+    SELECT bi.parent_item_id AS parent_id, bi.child_item_id AS child_id, bi.quantity AS quantity
+    FROM {bom_items} bi
+    JOIN {boms} b ON b.id = bi.bom_id
+    WHERE b.is_active AND b.deleted_at IS NULL
+      AND bi.deleted_at IS NULL
+      AND bi.parent_item_id = b.root_item_id
+"""
+
+_IS_PURCHASED = """
+    COALESCE((
+        SELECT c.is_purchased FROM {nomenclature} n
+        JOIN {categories} c ON c.id = n.catalog_category_id
+        WHERE n.id = {column}
+    ), FALSE)
+"""
+
+EXPLODE_SQL = """
+WITH RECURSIVE
+edges AS ({child_edges}),
+explosion (nomenclature_id, quantity, depth, is_purchased) AS (
+    SELECT bi.child_item_id, CAST(bi.quantity AS NUMERIC), 1, {child_purchased}
+    FROM {bom_items} bi
+    JOIN {boms} b ON b.id = bi.bom_id
+    WHERE b.id = %s AND bi.deleted_at IS NULL AND bi.parent_item_id = b.root_item_id
+    UNION ALL
+    SELECT e.child_id, x.quantity * e.quantity, x.depth + 1, {edge_purchased}
+    FROM explosion x
+    JOIN edges e ON e.parent_id = x.nomenclature_id
+    WHERE NOT x.is_purchased AND x.depth < %s
+)
+SELECT x.nomenclature_id, SUM(x.quantity), MIN(x.depth),
+       MAX(CASE WHEN x.is_purchased THEN 1 ELSE 0 END),
+       MAX(CASE WHEN NOT x.is_purchased AND x.has_children AND x.depth >= %s THEN 1 ELSE 0 END)
+FROM (
+    SELECT x.*, EXISTS (SELECT 1 FROM edges e WHERE e.parent_id = x.nomenclature_id) AS has_children
+    FROM explosion x
+) x
+WHERE x.is_purchased OR NOT x.has_children OR x.depth >= %s
+GROUP BY x.nomenclature_id
+"""
+
+WHERE_USED_SQL = """
+WITH RECURSIVE
+edges AS ({child_edges}),
+usage (nomenclature_id, quantity, depth) AS (
+    SELECT e.parent_id, CAST(e.quantity AS NUMERIC), 1
+    FROM edges e
+    WHERE e.child_id = %s
+    UNION ALL
+    SELECT e.parent_id, u.quantity * e.quantity, u.depth + 1
+    FROM usage u
+    JOIN edges e ON e.child_id = u.nomenclature_id
+    WHERE u.depth < %s
+)
+SELECT u.nomenclature_id, SUM(u.quantity), MIN(u.depth),
+       MAX(CASE WHEN u.has_parents THEN 0 ELSE 1 END),
+       MAX(CASE WHEN u.has_parents AND u.depth >= %s THEN 1 ELSE 0 END)
+FROM (
+    SELECT u.*, EXISTS (SELECT 1 FROM edges e WHERE e.child_id = u.nomenclature_id) AS has_parents
+    FROM usage u
+) u
+GROUP BY u.nomenclature_id
+"""
+
+
+def _tables() -> dict:
+    return {
+        'bom_items': BOMItem._meta.db_table,
+        'boms': BOMStructure._meta.db_table,
+        'nomenclature': NomenclatureItem._meta.db_table,
+        'categories': CatalogCategory._meta.db_table,
+    }
+
+
+def _sql(template: str) -> str:
+    tables = _tables()
+    return template.format(
+        child_edges=_CHILD_EDGES.format(**tables),
+        child_purchased=_IS_PURCHASED.format(column='bi.child_item_id', **tables),
+        edge_purchased=_IS_PURCHASED.format(column='e.child_id', **tables),
+        **tables,
+    )
+
+
+def _fetch(sql: str, params) -> list:
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _check_depth(rows: list) -> list:
+    # Последний столбец - ветвь оборвана на MAX_DEPTH
+    truncated = [_uuid(row[0]) for row in rows if row[-1]]
+    if truncated:
+        raise BOMDepthExceeded(truncated)
+    return [row[:-1] for row in rows]
+
+
+def _pk(model, value):
+    return model._meta.pk.get_db_prep_value(value, connection)
+
+
+def _uuid(value) -> str:
+    return str(value if isinstance(value, UUID) else UUID(str(value)))
+
+
+def _decimal(value) -> Decimal:
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+# =============================================================================
+# Cache
+# =============================================================================
+
+def _timeout() -> int:
+    return getattr(settings, 'BOM_EXPLOSION_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT)
+
+
+def bom_cache_generation() -> int:
+    """Текущее поколение данных BOM (часть ключей кэша, производных от BOM)."""
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = 1
+        cache.add(GENERATION_KEY, generation, None)
+    return generation
+
+
+def invalidate_bom_explosions() -> None:
+    """Сбросить все кэшированные развёртки после фиксации транзакции."""
+    def _bump():
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.set(GENERATION_KEY, 2, None)
+
+    transaction.on_commit(_bump)
+
+
+# =============================================================================
+# Rollups
+# =============================================================================
+
+def explode_bom(bom: BOMStructure) -> List[dict]:
+    """
+    Листовые позиции структуры с количеством на одну единицу корневого изделия.
+
+    Лист - закупаемая позиция или изготавливаемая без активной структуры.
+    Элемент строки: nomenclature_id, quantity (Decimal), level (минимальная
+    глубина вхождения), is_purchased.
+
+    BOMDepthExceeded - ветвь не раскрыта до листьев за MAX_DEPTH уровней.
+    """
+    key = f'{CACHE_PREFIX}:{bom_cache_generation()}:explode:{bom.pk}:{bom.current_version}'
+    rows = cache.get(key)
+    if rows is None:
+        rows = [
+            {
+                'nomenclature_id': _uuid(nomenclature_id),
+                'quantity': str(_decimal(quantity)),
+                'level': level,
+                'is_purchased': bool(is_purchased),
+            }
+            for nomenclature_id, quantity, level, is_purchased in _check_depth(_fetch(
+                _sql(EXPLODE_SQL), [_pk(BOMStructure, bom.pk), MAX_DEPTH, MAX_DEPTH, MAX_DEPTH]
+            ))
+        ]
+        cache.set(key, rows, _timeout())
+    return [dict(row, quantity=Decimal(row['quantity'])) for row in rows]
+
+
+def where_used(nomenclature_id) -> List[dict]:
+    """
+    Изделия, в которые входит номенклатура (на любом уровне активных структур).
+
+    Элемент строки: nomenclature_id, quantity (Decimal, на одну единицу
+    изделия), level (минимальная глубина), is_top_level (само никуда не входит).
+
+    BOMDepthExceeded - цепочка вхождений длиннее MAX_DEPTH уровней.
+    """
+    nomenclature_id = _uuid(nomenclature_id)
+    key = f'{CACHE_PREFIX}:{bom_cache_generation()}:where_used:{nomenclature_id}'
+    rows = cache.get(key)
+    if rows is None:
+        rows = [
+            {
+                'nomenclature_id': _uuid(parent_id),
+                'quantity': str(_decimal(quantity)),
+                'level': level,
+                'is_top_level': bool(is_top_level),
+            }
+            for parent_id, quantity, level, is_top_level in _check_depth(_fetch(
+                _sql(WHERE_USED_SQL), [_pk(NomenclatureItem, nomenclature_id), MAX_DEPTH, MAX_DEPTH]
+            ))
+        ]
+        cache.set(key, rows, _timeout())
+    return [dict(row, quantity=Decimal(row['quantity'])) for row in rows]
+
+
+def with_nomenclature(rows: List[dict]) -> List[dict]:
+    """Дополнить строки развёртки кодом, наименованием и единицей номенклатуры (один запрос)."""
+    nomenclature: Dict[str, dict] = {
+        str(row['id']): row
+        for row in NomenclatureItem.objects.filter(
+            id__in=[row['nomenclature_id'] for row in rows]
+        ).values('id', 'code', 'name', 'unit', 'catalog_category__name')
+    }
+    result = []
+    for row in rows:
+        info = nomenclature.get(row['nomenclature_id'], {})
+        result.append({
+            **row,
+            'code': info.get('code'),
+            'name': info.get('name'),
+            'unit': info.get('unit'),
+            'catalog_category_name': info.get('catalog_category__name'),
+        })
+    result.sort(key=lambda row: (row['level'], row['code'] or '', row['name'] or ''))
+    return result
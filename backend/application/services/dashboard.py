@@ -0,0 +1,570 @@
+"""
+Dashboard Snapshots.
+
+Precomputed management dashboard data: per-project health, problems and
+early-warning candidates are built in a single pass over the items of all
+active projects and kept in the Django cache. Entries are refreshed by
+Celery beat, dropped by model signals when a project or its items change,
+and rebuilt on demand when missing or stale.
+"""
+
+import logging
+from datetime import date, timedelta
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from infrastructure.persistence.models import DelayReason, ProblemReason, Project, ProjectItem
+
+from .problem_detection import PROJECT_ITEM_FACTS, ProblemEvaluator
+from .reference_data import reference_table
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'dashboard:v1'
+DEFAULT_SNAPSHOT_TTL = 15 * 60
+# Горизонт ранних предупреждений, хранимых в снимке (дней)
+WARNING_HORIZON_DAYS = 30
+
+ACTIVE_PROJECT_STATUSES = ['in_progress']
+FINAL_PURCHASE_STATUSES = ['closed', 'written_off']
+SEVERITY_ORDER = {'critical': 0, 'risk': 1, 'normal': 2}
+
+
+def severity_level(days_overdue: int) -> str:
+    """
+    Уровень критичности по количеству дней просрочки.
+
+    - 'critical' (red): > 7 days overdue
+    - 'risk' (yellow): 1-7 days overdue
+    - 'normal' (green): on track
+    """
+    if days_overdue > 7:
+        return 'critical'
+    elif days_overdue > 0:
+        return 'risk'
+    return 'normal'
+
+
+def _clamp_percent(value) -> float:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return min(max(value, 0.0), 100.0)
+
+
+# Поля позиции для классификации (одна выборка .values() на все проекты)
+ITEM_VALUES = (
+    'id',
+    'project_id',
+    'parent_item_id',
+    'item_number',
+    'name',
+    'purchase_status',
+    'manufacturing_status',
+    'manufacturer_type',
+    'contractor_status',
+    'order_date',
+    'required_date',
+    'planned_start',
+    'planned_end',
+    'actual_start',
+    'progress_percent',
+    'has_problem',
+    'problem_reason_id',
+    'problem_notes',
+    'delay_reason_id',
+    'delay_notes',
+    'responsible__last_name',
+    'responsible__first_name',
+    'responsible__middle_name',
+    'nomenclature_item__catalog_category__is_purchased',
+)
+SCAN_CHUNK_SIZE = 2000
+
+
+def _full_name(row) -> Optional[str]:
+    """User.get_full_name() по полям выборки; None, если ответственный не задан."""
+    parts = (row['responsible__last_name'], row['responsible__first_name'], row['responsible__middle_name'])
+    if all(part is None for part in parts):
+        return None
+    return ' '.join(part for part in parts if part)
+
+
+class _ProjectAccumulator:
+    """Состояние одного проекта во время прохода по позициям."""
+
+    def __init__(self):
+        self.problem_count = 0
+        self.critical_count = 0
+        self.critical_date = None
+        self.counts = {'manufacturing': 0, 'purchasing': 0, 'contractor': 0}
+        self.problems = []
+        self.warnings = []
+        # id -> (parent_id, completed, leaf_progress) для расчёта прогресса
+        self.nodes = {}
+
+    def progress(self) -> float:
+        """Прогресс проекта по дереву позиций (без запросов, без рекурсии)."""
+        children = {}
+        for node_id, (parent_id, _, _) in self.nodes.items():
+            children.setdefault(parent_id, []).append(node_id)
+
+        order = []
+        stack = list(children.get(None, ()))
+        while stack:
+            node_id = stack.pop()
+            order.append(node_id)
+            stack.extend(children.get(node_id, ()))
+
+        progress = {}
+        for node_id in reversed(order):
+            _, completed, leaf_progress = self.nodes[node_id]
+            child_ids = children.get(node_id)
+            if completed:
+                progress[node_id] = 100.0
+            elif not child_ids:
+                progress[node_id] = leaf_progress
+            else:
+                progress[node_id] = sum(progress[child_id] for child_id in child_ids) / len(child_ids)
+
+        root_ids = children.get(None) or []
+        if not root_ids:
+            return 0.0
+        return sum(progress[root_id] for root_id in root_ids) / len(root_ids)
+
+
+class DashboardBuilder:
+    """
+    Расчёт данных дашборда за один проход по позициям активных проектов.
+
+    Позиции читаются одной выборкой .values() (с фактами ProblemEvaluator),
+    в потоке (iterator) и по порядку проектов; каждая строка сразу
+    раскладывается в проблемы, предупреждения, счётчики здоровья и узел
+    дерева прогресса своего проекта. Названия причин - из справочников,
+    загруженных один раз.
+
+    Правила (без изменений относительно экрана руководителя):
+    - проблемная позиция: просрочка (не заказано / не поставлено /
+      не начато / не завершено), флаг проблемы (для закупаемых - актуальное
+      решение ProblemEvaluator) или указанная причина задержки;
+    - здоровье проекта: critical при критичных позициях, risk при любых
+      проблемах, иначе normal;
+    - прогресс: финальный статус - 100%, лист - progress_percent,
+      родитель - среднее по дочерним, проект - среднее по корневым.
+    """
+
+    def __init__(self, today: Optional[date] = None, horizon_days: int = WARNING_HORIZON_DAYS):
+        self.today = today or date.today()
+        self.horizon = self.today + timedelta(days=horizon_days)
+        self.evaluator = ProblemEvaluator(today=self.today)
+        self._problem_reason_names = None
+        self._delay_reason_names = None
+
+    def active_projects(self):
+        return Project.objects.filter(
+            is_active=True,
+            status__in=ACTIVE_PROJECT_STATUSES,
+        ).select_related('project_manager').order_by('-created_at')
+
+    def _load_reason_names(self):
+        if self._problem_reason_names is None:
+            self._problem_reason_names = reference_table(ProblemReason).names()
+            self._delay_reason_names = reference_table(DelayReason).names()
+
+    def scan(self, project_ids):
+        """Позиции проектов одной потоковой выборкой, сгруппированные по проекту."""
+        return self.evaluator.annotate_project_items(ProjectItem.objects.filter(
+            project_id__in=project_ids,
+            is_active=True,
+        )).order_by('project_id').values(*ITEM_VALUES, *PROJECT_ITEM_FACTS).iterator(chunk_size=SCAN_CHUNK_SIZE)
+
+    def build(self, projects=None) -> Dict[str, dict]:
+        """Снимки проектов (по умолчанию - всех активных) за одну выборку позиций."""
+        projects = list(self.active_projects() if projects is None else projects)
+        if not projects:
+            return {}
+        self._load_reason_names()
+
+        by_id = {project.id: project for project in projects}
+        accumulators = {project.id: _ProjectAccumulator() for project in projects}
+        for row in self.scan(list(by_id)):
+            self._classify(row, by_id[row['project_id']], accumulators[row['project_id']])
+
+        generated_at = timezone.now().isoformat()
+        return {
+            str(project.id): self._entry(project, accumulators[project.id], generated_at)
+            for project in projects
+        }
+
+    def build_project(self, project) -> dict:
+        return self.build([project])[str(project.id)]
+
+    def _entry(self, project, acc, generated_at) -> dict:
+        if acc.critical_count > 0:
+            health_status = 'critical'
+        elif acc.problem_count > 0:
+            health_status = 'risk'
+        else:
+            health_status = 'normal'
+
+        return {
+            'project_id': str(project.id),
+            'date': self.today.isoformat(),
+            'generated_at': generated_at,
+            'overview': {
+                'id': str(project.id),
+                'name': project.name,
+                'project_status': project.status,
+                'project_status_display': project.get_status_display(),
+                'health_status': health_status,
+                'progress': acc.progress(),
+                'problem_count': acc.problem_count,
+                'critical_count': acc.critical_count,
+                'critical_date': acc.critical_date.isoformat() if acc.critical_date else None,
+                'planned_end': project.planned_end.isoformat() if project.planned_end else None,
+                'project_manager': project.project_manager.get_full_name() if project.project_manager else None,
+            },
+            'counts': acc.counts,
+            'problems': acc.problems,
+            'warnings': acc.warnings,
+        }
+
+    # ------------------------------------------------------------------
+    # Classification (one row at a time)
+    # ------------------------------------------------------------------
+
+    def _classify(self, row, project, acc):
+        is_purchased = bool(row['nomenclature_item__catalog_category__is_purchased'])
+        flagged, reason_id = self._flagged(row, is_purchased)
+
+        is_problem, is_critical, critical_date = self._health(row, is_purchased, flagged)
+        if is_problem:
+            acc.problem_count += 1
+            if is_critical:
+                acc.critical_count += 1
+            if critical_date and (acc.critical_date is None or critical_date < acc.critical_date):
+                acc.critical_date = critical_date
+            if is_purchased:
+                acc.counts['purchasing'] += 1
+            elif row['manufacturer_type'] == 'contractor':
+                acc.counts['contractor'] += 1
+            else:
+                acc.counts['manufacturing'] += 1
+
+        problem = self._problem(row, project, is_purchased, flagged, reason_id)
+        if problem:
+            acc.problems.append(problem)
+        warning = self._warning(row, project, is_purchased)
+        if warning:
+            acc.warnings.append(warning)
+
+        if is_purchased:
+            completed = row['purchase_status'] in FINAL_PURCHASE_STATUSES
+        elif row['manufacturer_type'] == 'contractor':
+            completed = row['contractor_status'] == 'completed'
+        else:
+            completed = row['manufacturing_status'] == 'completed'
+        # Leaf node: use explicit progress_percent if it is set
+        acc.nodes[row['id']] = (row['parent_item_id'], completed, _clamp_percent(row['progress_percent'] or 0))
+
+    def _flagged(self, row, is_purchased):
+        """(flag, problem_reason_id) - для закупаемых актуальное решение, а не сохранённый флаг."""
+        if not is_purchased:
+            return row['has_problem'], row['problem_reason_id']
+        item = SimpleNamespace(
+            purchase_status=row['purchase_status'],
+            order_date=row['order_date'],
+            required_date=row['required_date'],
+            has_problem=row['has_problem'],
+            problem_reason_id=row['problem_reason_id'],
+        )
+        return self.evaluator.decide_project_item(item, row)
+
+    def _health(self, row, is_purchased, flagged):
+        """(is_problem, is_critical, critical_date) для здоровья проекта и KPI."""
+        today = self.today
+        has_problem = False
+        is_critical = False
+        critical_date = None
+
+        if is_purchased:
+            if row['purchase_status'] not in FINAL_PURCHASE_STATUSES:
+                # Order overdue
+                if row['order_date'] and row['order_date'] < today and row['purchase_status'] == 'waiting_order':
+                    has_problem = is_critical = True
+                    critical_date = row['order_date']
+                # Delivery overdue
+                elif row['required_date'] and row['required_date'] < today:
+                    has_problem = is_critical = True
+                    critical_date = row['required_date']
+        elif row['manufacturing_status'] != 'completed':
+            # Start overdue
+            if row['planned_start'] and row['planned_start'] < today and not row['actual_start']:
+                has_problem = True
+                is_critical = (row['planned_start'] - today).days < -7
+                critical_date = row['planned_start']
+            # End overdue
+            elif row['planned_end'] and row['planned_end'] < today:
+                has_problem = is_critical = True
+                critical_date = row['planned_end']
+
+        if flagged or row['delay_reason_id']:
+            has_problem = True
+        return has_problem, is_critical, critical_date
+
+    def _problem(self, row, project, is_purchased, flagged, reason_id) -> Optional[dict]:
+        today = self.today
+        problem_types = []
+        days_overdue = 0
+
+        if is_purchased:
+            item_type = 'purchasing'
+            if row['purchase_status'] not in FINAL_PURCHASE_STATUSES:
+                # Order should have been placed
+                if row['order_date'] and row['order_date'] < today and row['purchase_status'] == 'waiting_order':
+                    problem_types.append('order_not_placed')
+                    days_overdue = max(days_overdue, (today - row['order_date']).days)
+                # Item should have been delivered
+                if row['required_date'] and row['required_date'] < today:
+                    problem_types.append('not_delivered')
+                    days_overdue = max(days_overdue, (today - row['required_date']).days)
+        else:
+            item_type = 'manufacturing'
+            if row['manufacturing_status'] != 'completed':
+                # Work should have started
+                if row['planned_start'] and row['planned_start'] < today and not row['actual_start']:
+                    problem_types.append('work_not_started')
+                    days_overdue = max(days_overdue, (today - row['planned_start']).days)
+                # Work should have completed
+                if row['planned_end'] and row['planned_end'] < today:
+                    problem_types.append('work_not_completed')
+                    days_overdue = max(days_overdue, (today - row['planned_end']).days)
+            if row['manufacturing_status'] == 'suspended' or (
+                row['manufacturer_type'] == 'contractor' and
+                row['contractor_status'] == 'suspended_by_contractor'
+            ):
+                problem_types.append('suspended')
+
+        if flagged:
+            problem_types.append('has_problem_flag')
+        if row['delay_reason_id']:
+            problem_types.append('has_delay_reason')
+
+        if not problem_types:
+            return None
+
+        planned_date = row['required_date'] if is_purchased and row['required_date'] else row['planned_end']
+        return {
+            'id': str(row['id']),
+            'item_number': row['item_number'],
+            'name': row['name'],
+            'project_id': str(row['project_id']),
+            'project_name': project.name,
+            'type': item_type,
+            'problem_types': problem_types,
+            'days_overdue': days_overdue,
+            'severity': severity_level(days_overdue),
+            'reason': (
+                self._problem_reason_names.get(reason_id) if reason_id else
+                self._delay_reason_names.get(row['delay_reason_id']) if row['delay_reason_id'] else None
+            ),
+            'notes': row['problem_notes'] or row['delay_notes'] or '',
+            'responsible': _full_name(row),
+            'planned_date': planned_date.isoformat() if planned_date else None,
+        }
+
+    def _warning(self, row, project, is_purchased) -> Optional[dict]:
+        """
+        Кандидаты раннего предупреждения в пределах горизонта снимка.
+
+        Порядок кандидатов = порядок проверок: при выдаче берётся первый,
+        попавший в запрошенное окно (days_ahead).
+        """
+        candidates = []
+        if is_purchased:
+            # Order date approaching but not ordered yet
+            if row['order_date'] and row['purchase_status'] == 'waiting_order':
+                candidates.append(('order_due_soon', row['order_date']))
+            # Delivery date approaching
+            if row['required_date'] and row['purchase_status'] not in FINAL_PURCHASE_STATUSES:
+                candidates.append(('delivery_due_soon', row['required_date']))
+        else:
+            # Work should start soon but not started
+            if row['planned_start'] and not row['actual_start'] and row['manufacturing_status'] == 'not_started':
+                candidates.append(('work_start_due_soon', row['planned_start']))
+            # Work end date approaching but not completed
+            if row['planned_end'] and row['manufacturing_status'] != 'completed':
+                candidates.append(('work_end_due_soon', row['planned_end']))
+
+        candidates = [
+            [warning_type, (warning_date - self.today).days]
+            for warning_type, warning_date in candidates
+            if self.today <= warning_date <= self.horizon
+        ]
+        if not candidates:
+            return None
+
+        return {
+            'id': str(row['id']),
+            'item_number': row['item_number'],
+            'name': row['name'],
+            'project_id': str(row['project_id']),
+            'project_name': project.name,
+            'type': 'purchasing' if is_purchased else 'manufacturing',
+            'responsible': _full_name(row),
+            'candidates': candidates,
+        }
+
+
+class DashboardSnapshotStore:
+    """
+    Хранилище снимков дашборда в кэше Django (Redis в production).
+
+    - index: упорядоченный список активных проектов;
+    - project: снимок одного проекта (DashboardBuilder.build_project).
+
+    Отсутствующие или вчерашние снимки пересобираются при чтении -
+    ответ всегда полон, даже если beat не успел отработать.
+    """
+
+    def __init__(self, builder: Optional[DashboardBuilder] = None):
+        self.builder = builder or DashboardBuilder()
+        self.timeout = getattr(settings, 'DASHBOARD_SNAPSHOT_TTL', DEFAULT_SNAPSHOT_TTL)
+
+    @staticmethod
+    def index_key() -> str:
+        return f'{CACHE_PREFIX}:index'
+
+    @staticmethod
+    def project_key(project_id) -> str:
+        return f'{CACHE_PREFIX}:project:{project_id}'
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+
+    def project_ids(self) -> List[str]:
+        project_ids = cache.get(self.index_key())
+        if project_ids is None:
+            project_ids = [str(pk) for pk in self.builder.active_projects().values_list('id', flat=True)]
+            cache.set(self.index_key(), project_ids, self.timeout)
+        return project_ids
+
+    def entries(self) -> List[dict]:
+        """Снимки всех активных проектов (в порядке index)."""
+        project_ids = self.project_ids()
+        keys = {self.project_key(project_id): project_id for project_id in project_ids}
+        cached = cache.get_many(list(keys))
+        today = self.builder.today.isoformat()
+
+        by_project = {}
+        missing = []
+        for key, project_id in keys.items():
+            entry = cached.get(key)
+            if entry is None or entry['date'] != today:
+                missing.append(project_id)
+            else:
+                by_project[project_id] = entry
+
+        if missing:
+            by_project.update(self.refresh(missing))
+        return [by_project[project_id] for project_id in project_ids if project_id in by_project]
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def refresh(self, project_ids: Optional[Iterable] = None) -> Dict[str, dict]:
+        """Пересобрать снимки проектов (по умолчанию - всех активных)."""
+        projects = self.builder.active_projects()
+        if project_ids is None:
+            cache.delete(self.index_key())
+        else:
+            projects = projects.filter(id__in=list(project_ids))
+
+        entries = self.builder.build(projects)
+
+        cache.set_many({self.project_key(pid): entry for pid, entry in entries.items()}, self.timeout)
+        if project_ids is None:
+            cache.set(self.index_key(), list(entries), self.timeout)
+        logger.info("Dashboard snapshots refreshed for %s projects", len(entries))
+        return entries
+
+    @classmethod
+    def invalidate(cls, project_ids: Iterable = (), index: bool = False) -> None:
+        """Сбросить снимки проектов (и список проектов) после фиксации транзакции."""
+        keys = [cls.project_key(project_id) for project_id in set(project_ids) if project_id]
+        if index:
+            keys.append(cls.index_key())
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
+
+    # ------------------------------------------------------------------
+    # Dashboard sections
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def generated_at(entries) -> Optional[str]:
+        """Время самого старого из использованных снимков."""
+        return min((entry['generated_at'] for entry in entries), default=timezone.now().isoformat())
+
+    @staticmethod
+    def projects_overview(entries) -> List[dict]:
+        return [entry['overview'] for entry in entries]
+
+    @staticmethod
+    def business_status(entries) -> dict:
+        health = [entry['overview']['health_status'] for entry in entries]
+        counts = {'manufacturing': 0, 'purchasing': 0, 'contractor': 0}
+        for entry in entries:
+            for key, value in entry['counts'].items():
+                counts[key] += value
+        return {
+            'active_projects': len(entries),
+            'projects_normal': health.count('normal'),
+            'projects_risk': health.count('risk'),
+            'projects_critical': health.count('critical'),
+            'problems_manufacturing': counts['manufacturing'],
+            'problems_purchasing': counts['purchasing'],
+            'problems_contractor': counts['contractor'],
+            'total_overdue': sum(counts.values()),
+        }
+
+    @staticmethod
+    def problems(entries) -> List[dict]:
+        problems = [problem for entry in entries for problem in entry['problems']]
+        # Sort by severity (critical first) then by days_overdue
+        problems.sort(key=lambda x: (SEVERITY_ORDER.get(x['severity'], 2), -x['days_overdue']))
+        return problems
+
+    def warnings(self, entries, days_ahead: int = 7) -> List[dict]:
+        if days_ahead > WARNING_HORIZON_DAYS:
+            # Окно шире хранимого горизонта - считаем по актуальным данным
+            builder = DashboardBuilder(today=self.builder.today, horizon_days=days_ahead)
+            entries = list(builder.build().values())
+
+        warnings = []
+        for entry in entries:
+            for warning in entry['warnings']:
+                # Первый кандидат, попавший в окно (как цепочка if/elif)
+                candidate = next((c for c in warning['candidates'] if c[1] <= days_ahead), None)
+                if candidate is None:
+                    continue
+                warning_type, days_until = candidate
+                data = {key: value for key, value in warning.items() if key != 'candidates'}
+                data.update({
+                    'warning_type': warning_type,
+                    'warning_date': (self.builder.today + timedelta(days=days_until)).isoformat(),
+                    'days_until': days_until,
+                })
+                warnings.append(data)
+
+        # Sort by days_until (soonest first)
+        warnings.sort(key=lambda x: x['days_until'])
+        return warnings
@@ -0,0 +1,740 @@
+"""
+Streaming Export.
+
+Excel/CSV export of BOMs, project trees and material requirements without
+loading whole datasets into memory:
+- rows are read with .values()/.values_list() and .iterator() (plain
+  tuples, no model instances) and produced by generators;
+- .xlsx is written by xlsxwriter in constant_memory mode: every row is
+  flushed to a temporary file as soon as the next one starts, column widths
+  and formats come from the column spec (nothing is measured afterwards);
+- .csv is produced chunk by chunk for StreamingHttpResponse.
+
+Big exports are generated by a Celery task (application.tasks.export_tasks)
+into EXPORT_ROOT/<user id>/<task id>/ - outside MEDIA_ROOT, which is served
+without authentication. Files are downloaded through the API by the user who
+started the export and removed after EXPORT_FILE_TTL.
+"""
+
+import csv
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Callable, Iterable, Iterator, List, Mapping, Optional, Sequence
+
+import xlsxwriter
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from infrastructure.persistence.models import (
+    BOMItem,
+    BOMStructure,
+    MaterialRequirement,
+    Project,
+    ProjectItem,
+)
+from infrastructure.persistence.models.project import ManufacturerTypeChoices
+
+from .bom_explosion import MAX_DEPTH
+
+logger = logging.getLogger(__name__)
+
+FORMAT_XLSX = 'xlsx'
+FORMAT_CSV = 'csv'
+FORMATS = (FORMAT_XLSX, FORMAT_CSV)
+
+CONTENT_TYPES = {
+    FORMAT_XLSX: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    FORMAT_CSV: 'text/csv; charset=utf-8',
+}
+
+# Выгрузки .xlsx больше этого числа строк генерируются в фоне
+DEFAULT_SYNC_ROW_LIMIT = 20000
+CSV_CHUNK_ROWS = 500
+ID_CHUNK_SIZE = 2000
+PROGRESS_EVERY = 1000
+
+TEXT, NUMBER, INTEGER, DATE, BOOL = 'text', 'number', 'integer', 'date', 'bool'
+
+KIND_BOM = 'bom'
+KIND_PROJECT_TREE = 'project_tree'
+KIND_REQUIREMENTS = 'requirements'
+
+
+class ExportError(Exception):
+    """Выгрузка невозможна (неизвестный формат, вид или объект)."""
+
+
+@dataclass(frozen=True)
+class Column:
+    title: str
+    width: float = 15
+    kind: str = TEXT
+
+
+@dataclass
+class ExportDataset:
+    """
+    Набор данных для выгрузки.
+
+    rows - итерируемое строк (последовательностей значений в порядке columns),
+    обычно генератор поверх queryset.iterator(); total - число строк, если
+    известно заранее (для прогресса и выбора фонового режима).
+    """
+    kind: str
+    title: str
+    columns: Sequence[Column]
+    rows: Iterable[Sequence]
+    total: Optional[int] = None
+
+    def filename(self, file_format: str) -> str:
+        stamp = timezone.localtime().strftime('%Y%m%d_%H%M%S')
+        return get_valid_filename(f'{self.title}_{stamp}.{file_format}')
+
+
+def sync_row_limit() -> int:
+    return getattr(settings, 'EXPORT_SYNC_ROW_LIMIT', DEFAULT_SYNC_ROW_LIMIT)
+
+
+# =============================================================================
+# Writers
+# =============================================================================
+
+def write_xlsx(
+    dataset: ExportDataset,
+    target,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None,
+) -> int:
+    """
+    Записать набор в .xlsx (путь или файловый объект); возвращает число строк.
+
+    constant_memory: строки пишутся строго по порядку и сразу сбрасываются
+    на диск, поэтому потребление памяти не зависит от размера выгрузки.
+    """
+    workbook = xlsxwriter.Workbook(target, {
+        'constant_memory': True,
+        'remove_timezone': True,
+        'strings_to_numbers': False,
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+    })
+    sheet = workbook.add_worksheet(re.sub(r'[\[\]:*?/\\]', '_', dataset.title)[:31])
+
+    header_format = workbook.add_format({
+        'bold': True, 'bg_color': '#D9E1F2', 'border': 1, 'text_wrap': True, 'valign': 'top',
+    })
+    formats = {
+        TEXT: None,
+        NUMBER: workbook.add_format({'num_format': '#,##0.###'}),
+        INTEGER: workbook.add_format({'num_format': '0'}),
+        DATE: workbook.add_format({'num_format': 'dd.mm.yyyy'}),
+        BOOL: None,
+    }
+    kinds = [column.kind for column in dataset.columns]
+
+    for index, column in enumerate(dataset.columns):
+        sheet.set_column(index, index, column.width)
+    sheet.write_row(0, 0, [column.title for column in dataset.columns], header_format)
+    sheet.freeze_panes(1, 0)
+
+    count = 0
+    for count, row in enumerate(dataset.rows, start=1):
+        for index, value in enumerate(row):
+            if value is None or value == '':
+                continue
+            kind = kinds[index]
+            if kind == BOOL:
+                value = 'Да' if value else ''
+            sheet.write(count, index, value, formats[kind])
+        if progress and count % PROGRESS_EVERY == 0:
+            progress(count, dataset.total)
+
+    sheet.autofilter(0, 0, max(count, 1), len(dataset.columns) - 1)
+    workbook.close()
+    return count
+
+
+class _Echo:
+    """Псевдо-буфер для csv.writer: writerow возвращает готовую строку."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value, kind):
+    if value is None:
+        return ''
+    if kind == BOOL:
+        return 'Да' if value else ''
+    if kind == DATE:
+        return value.isoformat()
+    if kind == NUMBER and isinstance(value, Decimal):
+        return format(value.normalize(), 'f')
+    return value
+
+
+def iter_csv(dataset: ExportDataset, chunk_rows: int = CSV_CHUNK_ROWS) -> Iterator[str]:
+    """CSV (UTF-8 с BOM - для Excel) порциями по chunk_rows строк."""
+    writer = csv.writer(_Echo())
+    kinds = [column.kind for column in dataset.columns]
+
+    chunk = ['\ufeff' + writer.writerow([column.title for column in dataset.columns])]
+    for row in dataset.rows:
+        chunk.append(writer.writerow([_csv_value(value, kind) for value, kind in zip(row, kinds)]))
+        if len(chunk) >= chunk_rows:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def export_dir(user_id, task_id) -> str:
+    """Каталог файлов фоновой выгрузки task_id пользователя user_id."""
+    return os.path.join(settings.EXPORT_ROOT, str(user_id), str(task_id))
+
+
+def create_export_dir(user_id, task_id) -> str:
+    """Создать каталог выгрузки при старте задачи: по нему проверяется владелец."""
+    directory = export_dir(user_id, task_id)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def find_export(user_id, task_id) -> Optional[str]:
+    """
+    Путь к файлу выгрузки task_id, если её запускал user_id (иначе None).
+    Владелец определяется каталогом: чужую выгрузку по task_id не найти.
+    """
+    try:
+        task_id = str(uuid.UUID(str(task_id)))
+    except ValueError:
+        return None
+
+    directory = export_dir(user_id, task_id)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return None
+    for name in names:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def is_export_owner(user_id, task_id) -> bool:
+    """Запущена ли выгрузка task_id пользователем user_id (см. create_export_dir)."""
+    try:
+        task_id = str(uuid.UUID(str(task_id)))
+    except ValueError:
+        return False
+    return os.path.isdir(export_dir(user_id, task_id))
+
+
+def save_export(
+    dataset: ExportDataset,
+    file_format: str,
+    directory: str,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None,
+) -> dict:
+    """Сохранить выгрузку в каталог directory (для фоновой генерации, см. export_dir)."""
+    filename = dataset.filename(file_format)
+    os.makedirs(directory, exist_ok=True)
+    filepath = os.path.join(directory, filename)
+
+    if file_format == FORMAT_XLSX:
+        rows = write_xlsx(dataset, filepath, progress=progress)
+    else:
+        rows = 0
+
+        def counted(source):
+            nonlocal rows
+            for rows, row in enumerate(source, start=1):
+                if progress and rows % PROGRESS_EVERY == 0:
+                    progress(rows, dataset.total)
+                yield row
+
+        dataset.rows = counted(dataset.rows)
+        with open(filepath, 'w', encoding='utf-8', newline='') as output:
+            for chunk in iter_csv(dataset):
+                output.write(chunk)
+
+    logger.info("Export %s saved: %s (%s rows)", dataset.kind, filepath, rows)
+    return {
+        'filename': filename,
+        'rows': rows,
+    }
+
+
+def cleanup_exports(max_age: Optional[int] = None) -> int:
+    """
+    Удалить фоновые выгрузки старше max_age секунд (по умолчанию EXPORT_FILE_TTL).
+    Возвращает число удалённых выгрузок.
+    """
+    max_age = settings.EXPORT_FILE_TTL if max_age is None else max_age
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        user_dirs = os.scandir(settings.EXPORT_ROOT)
+    except FileNotFoundError:
+        return 0
+
+    with user_dirs:
+        for user_dir in user_dirs:
+            if not user_dir.is_dir():
+                continue
+            with os.scandir(user_dir.path) as task_dirs:
+                for task_dir in task_dirs:
+                    if task_dir.is_dir() and task_dir.stat().st_mtime < cutoff:
+                        shutil.rmtree(task_dir.path, ignore_errors=True)
+                        removed += 1
+    return removed
+
+
+# =============================================================================
+# BOM
+# =============================================================================
+
+BOM_COLUMNS = (
+    Column('Поз.', 10),
+    Column('Уровень', 8, INTEGER),
+    Column('Обозначение', 30),
+    Column('Наименование', 50),
+    Column('Вид справочника', 22),
+    Column('Номер чертежа', 20),
+    Column('Кол-во', 10, NUMBER),
+    Column('Кол-во на изделие', 12, NUMBER),
+    Column('Ед.', 6),
+    Column('Примечание', 40),
+)
+
+BOM_ITEM_FIELDS = (
+    'parent_item_id',
+    'child_item_id',
+    'quantity',
+    'unit',
+    'notes',
+    'drawing_number_override',
+    'child_item__code',
+    'child_item__name',
+    'child_item__drawing_number',
+    'child_item__catalog_category__name',
+    'child_item__catalog_category__is_purchased',
+)
+
+
+def _load_bom_children(root_item_id) -> dict:
+    """
+    Прямые дочерние строки активных BOM всех достижимых изготавливаемых
+    позиций - по одному запросу на уровень (как BOMExpansionEngine).
+    """
+    children = defaultdict(list)
+    seen = set()
+    frontier = {root_item_id}
+    while frontier:
+        seen |= frontier
+        next_frontier = set()
+        rows = BOMItem.objects.filter(
+            bom__root_item_id__in=frontier,
+            bom__is_active=True,
+            bom__deleted_at__isnull=True,
+            parent_item_id=F('bom__root_item_id'),
+        ).order_by('position', 'created_at').values_list(*BOM_ITEM_FIELDS).iterator()
+        for row in rows:
+            children[row[0]].append(row)
+            if not row[-1] and row[1] not in seen:
+                next_frontier.add(row[1])
+        frontier = next_frontier
+    return children
+
+
+def _bom_rows(children: dict, root_item_id) -> Iterator[tuple]:
+    """Многоуровневая спецификация в порядке обхода в глубину."""
+    stack = [
+        (row, 1, str(number), row[2], frozenset({root_item_id}))
+        for number, row in reversed(list(enumerate(children.get(root_item_id, ()), start=1)))
+    ]
+    while stack:
+        row, level, number, total, path = stack.pop()
+        (_, child_id, quantity, unit, notes, drawing_override,
+         code, name, drawing_number, category_name, is_purchased) = row
+        yield (
+            number,
+            level,
+            ('  ' * (level - 1)) + (code or ''),
+            name,
+            category_name,
+            drawing_override or drawing_number,
+            quantity,
+            total,
+            unit,
+            notes,
+        )
+        if not _expands(row, level, path):
+            continue
+        sub_path = path | {child_id}
+        stack.extend(
+            (child, level + 1, f'{number}.{index}', total * child[2], sub_path)
+            for index, child in reversed(list(enumerate(children.get(child_id, ()), start=1)))
+        )
+
+
+def _expands(row, level, path) -> bool:
+    # Закупаемые - листья; цикл в данных и слишком глубокие ветви не раскрываем
+    return not (row[-1] or row[1] in path or level >= MAX_DEPTH)
+
+
+def _bom_row_count(children: dict, root_item_id) -> int:
+    """Число строк _bom_rows без их построения."""
+    count = 0
+    stack = [(row, 1, frozenset({root_item_id})) for row in children.get(root_item_id, ())]
+    while stack:
+        row, level, path = stack.pop()
+        count += 1
+        if _expands(row, level, path):
+            sub_path = path | {row[1]}
+            stack.extend((child, level + 1, sub_path) for child in children.get(row[1], ()))
+    return count
+
+
+def bom_dataset(bom: BOMStructure) -> ExportDataset:
+    """Спецификация изделия со всеми уровнями (через активные BOM подсборок)."""
+    children = _load_bom_children(bom.root_item_id)
+    root = bom.root_item
+    return ExportDataset(
+        kind=KIND_BOM,
+        title=f"BOM_{root.code if root else bom.pk}",
+        columns=BOM_COLUMNS,
+        rows=_bom_rows(children, bom.root_item_id),
+        total=_bom_row_count(children, bom.root_item_id),
+    )
+
+
+# =============================================================================
+# Project tree
+# =============================================================================
+
+PROJECT_TREE_COLUMNS = (
+    Column('ID', 10, INTEGER),
+    Column('Уровень', 8, INTEGER),
+    Column('Наименование', 50),
+    Column('Вид справочника', 22),
+    Column('Номер чертежа', 20),
+    Column('Кол-во', 10, NUMBER),
+    Column('Ед.', 6),
+    Column('Статус', 22),
+    Column('Изготовитель / поставщик', 30),
+    Column('Ответственный', 28),
+    Column('План. начало', 12, DATE),
+    Column('План. окончание', 12, DATE),
+    Column('Факт. начало', 12, DATE),
+    Column('Факт. окончание', 12, DATE),
+    Column('Требуется к', 12, DATE),
+    Column('Заказать до', 12, DATE),
+    Column('Прогресс, %', 10, NUMBER),
+    Column('Проблема', 10, BOOL),
+    Column('Примечание', 40),
+)
+
+PROJECT_ITEM_FIELDS = (
+    'item_number',
+    'tree_path',
+    'name',
+    'nomenclature_item__catalog_category__name',
+    'nomenclature_item__catalog_category__is_purchased',
+    'drawing_number',
+    'quantity',
+    'unit',
+    'manufacturer_type',
+    'manufacturing_status',
+    'contractor_status',
+    'purchase_status',
+    'contractor__name',
+    'supplier__name',
+    'responsible__last_name',
+    'responsible__first_name',
+    'planned_start',
+    'planned_end',
+    'actual_start',
+    'actual_end',
+    'required_date',
+    'order_date',
+    'calculated_progress',
+    'has_problem',
+    'notes',
+)
+
+
+def visible_project_items(project: Project, user=None, visibility_type: Optional[str] = None):
+    """
+    Позиции проекта с учётом области видимости роли:
+    own - только свои, own_and_children - свои и их поддеревья, иначе все.
+    """
+    items = ProjectItem.objects.filter(project=project)
+    if visibility_type == 'own':
+        return items.filter(responsible=user)
+    if visibility_type == 'own_and_children':
+        responsible_paths = items.filter(responsible=user).values_list('tree_path', flat=True)
+        return items.filter(ProjectItem.subtree_q(responsible_paths))
+    return items
+
+
+def _choices(field_name: str) -> dict:
+    return dict(ProjectItem._meta.get_field(field_name).flatchoices)
+
+
+def _tree_order(queryset) -> List:
+    """
+    id позиций в порядке дерева (как на экране: дети сразу после родителя,
+    соседи - по position) по одной лёгкой выборке (id, родитель, позиция).
+    Позиции, родитель которых не попал в выборку, считаются корнями.
+    """
+    children = defaultdict(list)
+    ids = set()
+    for pk, parent_id, position in queryset.values_list('id', 'parent_item_id', 'position').iterator():
+        children[parent_id].append((position, pk))
+        ids.add(pk)
+
+    roots = []
+    for parent_id, items in children.items():
+        items.sort(key=lambda item: item[0])
+        if parent_id is None or parent_id not in ids:
+            roots.extend(items)
+    roots.sort(key=lambda item: item[0])
+
+    order = []
+    stack = [pk for _, pk in reversed(roots)]
+    while stack:
+        pk = stack.pop()
+        order.append(pk)
+        stack.extend(child_pk for _, child_pk in reversed(children.get(pk, ())))
+    return order
+
+
+def _project_tree_rows(queryset, order: List, chunk_size: int = ID_CHUNK_SIZE) -> Iterator[tuple]:
+    manufacturing = _choices('manufacturing_status')
+    contractor = _choices('contractor_status')
+    purchase = _choices('purchase_status')
+
+    for start in range(0, len(order), chunk_size):
+        chunk = order[start:start + chunk_size]
+        rows = {
+            row[0]: row[1:]
+            for row in queryset.filter(id__in=chunk).values_list('id', *PROJECT_ITEM_FIELDS)
+        }
+        for pk in chunk:
+            (item_number, tree_path, name, category_name, is_purchased, drawing_number, quantity, unit,
+             manufacturer_type, manufacturing_status, contractor_status, purchase_status,
+             contractor_name, supplier_name, last_name, first_name, planned_start, planned_end,
+             actual_start, actual_end, required_date, order_date, progress, has_problem,
+             notes) = rows[pk]
+            if is_purchased:
+                status = purchase.get(purchase_status, purchase_status)
+                partner = supplier_name
+            elif manufacturer_type == ManufacturerTypeChoices.CONTRACTOR:
+                status = contractor.get(contractor_status, contractor_status)
+                partner = contractor_name
+            else:
+                status = manufacturing.get(manufacturing_status, manufacturing_status)
+                partner = ManufacturerTypeChoices.INTERNAL.label
+            yield (
+                item_number,
+                tree_path.count('/'),
+                name,
+                category_name,
+                drawing_number,
+                quantity,
+                unit,
+                status,
+                partner,
+                ' '.join(part for part in (last_name, first_name) if part),
+                planned_start,
+                planned_end,
+                actual_start,
+                actual_end,
+                required_date,
+                order_date,
+                progress,
+                has_problem,
+                notes,
+            )
+
+
+def project_tree_dataset(project: Project, user=None, visibility_type: Optional[str] = None) -> ExportDataset:
+    """
+    Дерево позиций проекта.
+
+    Порядок обхода считается в памяти по (id, родитель, позиция), полные
+    строки читаются пачками по ID_CHUNK_SIZE в этом порядке.
+    """
+    queryset = visible_project_items(project, user, visibility_type)
+    order = _tree_order(queryset)
+    return ExportDataset(
+        kind=KIND_PROJECT_TREE,
+        title=f"Project_{project.name}",
+        columns=PROJECT_TREE_COLUMNS,
+        rows=_project_tree_rows(queryset, order),
+        total=len(order),
+    )
+
+
+# =============================================================================
+# Material requirements
+# =============================================================================
+
+REQUIREMENT_COLUMNS = (
+    Column('ID позиции', 10, INTEGER),
+    Column('Код', 18),
+    Column('Наименование', 50),
+    Column('Вид справочника', 22),
+    Column('Проект', 30),
+    Column('Статус', 16),
+    Column('Приоритет', 12),
+    Column('Требуется', 12, NUMBER),
+    Column('Доступно', 12, NUMBER),
+    Column('Резерв', 12, NUMBER),
+    Column('В заказе', 12, NUMBER),
+    Column('К заказу', 12, NUMBER),
+    Column('Ед.', 6),
+    Column('Заказать до', 12, DATE),
+    Column('Срок поставки', 12, DATE),
+    Column('Поставщик', 30),
+    Column('Заказ', 16),
+    Column('Проблема', 10, BOOL),
+    Column('Причина', 30),
+    Column('Комментарий', 40),
+)
+
+REQUIREMENT_FIELDS = (
+    'project_item__item_number',
+    'nomenclature_item__code',
+    'nomenclature_item__name',
+    'nomenclature_item__catalog_category__name',
+    'project__name',
+    'status',
+    'priority',
+    'total_required',
+    'total_available',
+    'total_reserved',
+    'total_in_order',
+    'to_order',
+    'nomenclature_item__unit',
+    'order_by_date',
+    'delivery_date',
+    'supplier__name',
+    'purchase_order__number',
+    'has_problem',
+    'problem_reason__name',
+    'problem_notes',
+)
+
+
+def filter_requirements(queryset, params: Mapping):
+    """Фильтры списка потребностей (status, priority, supplier, project, critical_only, category, search)."""
+    status_filter = params.get('status')
+    if status_filter:
+        queryset = queryset.filter(status=status_filter)
+
+    priority = params.get('priority')
+    if priority:
+        queryset = queryset.filter(priority=priority)
+
+    supplier_id = params.get('supplier')
+    if supplier_id:
+        queryset = queryset.filter(supplier_id=supplier_id)
+
+    project_id = params.get('project')
+    if project_id:
+        queryset = queryset.filter(project_id=project_id)
+
+    critical_only = params.get('critical_only')
+    if critical_only and critical_only.lower() == 'true':
+        queryset = queryset.filter(
+            Q(priority__in=['critical', 'high']) |
+            Q(to_order__gt=0)
+        )
+
+    category_id = params.get('category')
+    if category_id:
+        queryset = queryset.filter(
+            nomenclature_item__catalog_category_id=category_id
+        )
+
+    search = params.get('search')
+    if search:
+        # Поддержка поиска по:
+        # - наименованию/коду номенклатуры
+        # - ID позиции проекта (project_item.item_number), включая значения вида "0000123"
+        q = Q(nomenclature_item__name__icontains=search) | Q(nomenclature_item__code__icontains=search)
+
+        try:
+            m = re.search(r'\d+', str(search))
+            if m:
+                num = int(m.group(0))
+                q = q | Q(project_item__item_number=num)
+        except Exception:
+            # Если что-то пошло не так с парсингом ID, просто игнорируем этот кусок.
+            pass
+
+        queryset = queryset.filter(q)
+
+    return queryset.order_by('priority', '-to_order')
+
+
+def _requirement_rows(queryset) -> Iterator[tuple]:
+    statuses = dict(MaterialRequirement.STATUS_CHOICES)
+    priorities = dict(MaterialRequirement.PRIORITY_CHOICES)
+    for row in queryset.values_list(*REQUIREMENT_FIELDS).iterator():
+        row = list(row)
+        row[5] = statuses.get(row[5], row[5])
+        row[6] = priorities.get(row[6], row[6])
+        yield row
+
+
+def requirements_dataset(params: Mapping) -> ExportDataset:
+    """Потребности в материалах с фильтрами списка (см. filter_requirements)."""
+    queryset = filter_requirements(MaterialRequirement.objects.all(), params)
+    return ExportDataset(
+        kind=KIND_REQUIREMENTS,
+        title='Material_requirements',
+        columns=REQUIREMENT_COLUMNS,
+        rows=_requirement_rows(queryset),
+        total=queryset.count(),
+    )
+
+
+# =============================================================================
+# Dispatch (Celery)
+# =============================================================================
+
+def build_dataset(kind: str, object_id=None, params: Optional[Mapping] = None, user=None) -> ExportDataset:
+    """Набор данных по виду выгрузки - для фоновой генерации по сериализуемым параметрам."""
+    params = params or {}
+    if kind == KIND_BOM:
+        bom = BOMStructure.objects.select_related('root_item').filter(pk=object_id).first()
+        if bom is None:
+            raise ExportError('BOM not found')
+        return bom_dataset(bom)
+
+    if kind == KIND_PROJECT_TREE:
+        project = Project.objects.filter(pk=object_id).first()
+        if project is None:
+            raise ExportError('Project not found')
+        visibility_type = None
+        if user is not None:
+            from .access import get_effective_permissions
+            visibility_type = get_effective_permissions(user).visibility_type
+        return project_tree_dataset(project, user, visibility_type)
+
+    if kind == KIND_REQUIREMENTS:
+        return requirements_dataset(params)
+
+    raise ExportError(f'Unknown export kind: {kind}')
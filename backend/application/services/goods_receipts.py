@@ -0,0 +1,489 @@
+"""
+Goods Receipts.
+
+Set-based confirmation and cancellation of goods receipts: stock items,
+requirements, reservations and project items of the whole receipt are
+loaded once, lines are processed in memory in document order and the
+result is written with bulk inserts/updates.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+
+from infrastructure.persistence.models import (
+    GoodsReceipt,
+    MaterialRequirement,
+    ProjectItem,
+    PurchaseOrderItem,
+    PurchaseStatusChoices,
+    StockBatch,
+    StockItem,
+    StockMovement,
+    StockReservation,
+)
+
+from .problem_detection import PROJECT_ITEM_FACTS, ProblemEvaluator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+ACTIVE_RESERVATION_STATUSES = ['pending', 'confirmed']
+# Потребности, под которые резервируется поступивший товар
+RESERVABLE_STATUSES = ('waiting_order', 'in_order', 'written_off')
+# Потребности, которые закрываются поступлением
+CLOSABLE_STATUSES = ('waiting_order', 'in_order')
+
+STOCK_FIELDS = ['quantity', 'reserved_quantity', 'updated_at', 'version']
+ORDER_LINE_FIELDS = ['delivered_quantity', 'status', 'actual_delivery_date', 'total_price', 'updated_at', 'version']
+REQUIREMENT_FIELDS = ['status', 'updated_at']
+CONFIRM_ITEM_FIELDS = ['purchase_status', 'actual_start', 'actual_end', 'has_problem', 'problem_reason', 'updated_at']
+CANCEL_ITEM_FIELDS = ['purchase_status', 'actual_end']
+
+
+def _requirement_sort_key(requirement, items):
+    item = items[requirement.project_item_id]
+    return (
+        requirement.order_by_date or date.max,
+        requirement.project.name if requirement.project else '',
+        item.name,
+        str(requirement.id),
+    )
+
+
+class GoodsReceiptProcessor:
+    """
+    Подтверждение и отмена подтверждения поступления.
+
+    Построчные правила те же, что у прежних GoodsReceipt.confirm /
+    cancel_confirmation: строки обрабатываются по порядку, каждая видит
+    остатки, резервы и статусы потребностей после предыдущих строк.
+    Отличие только в записи - одна пачка на таблицу вместо save()
+    на каждую строку, резерв и потребность.
+
+    Остатки и строки заказа блокируются (select_for_update) до конца
+    транзакции - параллельные приёмки по тем же позициям ждут друг друга.
+    """
+
+    def __init__(self, receipt: GoodsReceipt, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.receipt = receipt
+        self.order = receipt.purchase_order
+        self.batch_size = batch_size
+        self.reservation_note = f"Резерв по заказу {self.order.number}"
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def _lock_receipt(self, expected_status, message):
+        status = GoodsReceipt.all_objects.select_for_update().filter(
+            pk=self.receipt.pk
+        ).values_list('status', flat=True).first()
+        if status != expected_status:
+            raise ValueError(message)
+
+    def _load_lines(self):
+        lines = list(self.receipt.items.order_by('created_at', 'id'))
+        po_items = {
+            po_item.id: po_item
+            for po_item in PurchaseOrderItem.objects.select_for_update().filter(
+                id__in={line.purchase_order_item_id for line in lines}
+            ).order_by('id')
+        }
+        return lines, po_items
+
+    def _lock_stock(self, nomenclature_ids):
+        return {
+            stock.nomenclature_item_id: stock
+            for stock in StockItem.objects.select_for_update().filter(
+                warehouse_id=self.receipt.warehouse_id,
+                nomenclature_item_id__in=nomenclature_ids,
+            ).order_by('id')
+        }
+
+    @staticmethod
+    def _load_project_items(item_ids):
+        return {
+            item.id: item
+            for item in ProjectItem.all_objects.filter(id__in=item_ids).select_related(
+                'nomenclature_item__catalog_category'
+            )
+        }
+
+    def _reservation_totals(self, item_ids):
+        """(все активные резервы, резервы этого заказа) по позициям проекта."""
+        rows = StockReservation.objects.filter(
+            project_item_id__in=item_ids,
+            status__in=ACTIVE_RESERVATION_STATUSES,
+        ).order_by().values('project_item_id').annotate(
+            total=Sum('quantity'),
+            from_order=Sum('quantity', filter=Q(notes=self.reservation_note)),
+        )
+        reserved, from_order = defaultdict(Decimal), defaultdict(Decimal)
+        for row in rows:
+            reserved[row['project_item_id']] = row['total'] or Decimal('0')
+            from_order[row['project_item_id']] = row['from_order'] or Decimal('0')
+        return reserved, from_order
+
+    # ------------------------------------------------------------------
+    # Confirm
+    # ------------------------------------------------------------------
+
+    def confirm(self, user=None) -> GoodsReceipt:
+        receipt, order = self.receipt, self.order
+        if receipt.status != 'draft':
+            raise ValueError("Можно подтвердить только черновик поступления")
+
+        with transaction.atomic():
+            self._lock_receipt('draft', "Можно подтвердить только черновик поступления")
+            lines, po_items = self._load_lines()
+            nomenclature_ids = {po_item.nomenclature_item_id for po_item in po_items.values()}
+
+            stock = self._lock_stock(nomenclature_ids)
+            new_stock = []
+            for line in lines:
+                po_item = po_items[line.purchase_order_item_id]
+                if po_item.nomenclature_item_id not in stock:
+                    stock_item = StockItem(
+                        warehouse_id=receipt.warehouse_id,
+                        nomenclature_item_id=po_item.nomenclature_item_id,
+                        quantity=Decimal('0'),
+                        unit=po_item.unit,
+                    )
+                    stock[po_item.nomenclature_item_id] = stock_item
+                    new_stock.append(stock_item)
+
+            requirements = defaultdict(list)
+            for requirement in MaterialRequirement.objects.filter(
+                purchase_order=order,
+                nomenclature_item_id__in=nomenclature_ids,
+                status__in=RESERVABLE_STATUSES,
+                project_item__isnull=False,
+            ).select_related('project'):
+                requirements[requirement.nomenclature_item_id].append(requirement)
+
+            item_ids = {po_item.project_item_id for po_item in po_items.values() if po_item.project_item_id}
+            item_ids |= {req.project_item_id for reqs in requirements.values() for req in reqs}
+            items = self._load_project_items(item_ids)
+            for reqs in requirements.values():
+                reqs.sort(key=lambda req: _requirement_sort_key(req, items))
+            initial_statuses = {item_id: item.purchase_status for item_id, item in items.items()}
+            reserved, reserved_from_order = self._reservation_totals(item_ids)
+
+            now = timezone.now()
+            performed_by = user or receipt.received_by
+            batches, movements, reservations = [], [], []
+            touched_requirements = {}
+
+            for line in lines:
+                po_item = po_items[line.purchase_order_item_id]
+                stock_item = stock[po_item.nomenclature_item_id]
+                project_item = items.get(po_item.project_item_id)
+
+                # 1. Партия и движение
+                if line.batch_number:
+                    batches.append(StockBatch(
+                        stock_item=stock_item,
+                        batch_number=line.batch_number,
+                        initial_quantity=line.quantity,
+                        current_quantity=line.quantity,
+                        receipt_date=receipt.receipt_date,
+                        purchase_order=order,
+                        unit_cost=po_item.unit_price,
+                    ))
+                stock_item.quantity += line.quantity
+                movements.append(StockMovement(
+                    stock_item=stock_item,
+                    movement_type='receipt',
+                    quantity=line.quantity,
+                    balance_after=stock_item.quantity,
+                    source_document=f"Поступление {receipt.number}",
+                    performed_by=performed_by,
+                    reason=f"Приёмка по заказу {order.number}",
+                ))
+
+                # 2. Резерв под потребности проекта, связанные с заказом
+                candidates = [
+                    req for req in requirements[po_item.nomenclature_item_id]
+                    if req.status in RESERVABLE_STATUSES and req.is_active
+                ]
+                targets = []
+                if candidates:
+                    remaining = line.quantity
+                    for req in candidates:
+                        if remaining <= 0:
+                            break
+                        need_qty = req.total_required or 0
+                        if not need_qty or need_qty <= 0:
+                            continue
+                        still_need = max(0, need_qty - reserved[req.project_item_id])
+                        if still_need <= 0:
+                            continue
+                        reserve_qty = min(still_need, remaining)
+                        targets.append((req.project_id, items[req.project_item_id], reserve_qty))
+                        remaining -= reserve_qty
+                elif project_item:
+                    targets.append((project_item.project_id, project_item, line.quantity))
+
+                for project_id, target_item, reserve_qty in targets:
+                    reservations.append(StockReservation(
+                        stock_item=stock_item,
+                        project_id=project_id,
+                        project_item=target_item,
+                        quantity=reserve_qty,
+                        status='confirmed',
+                        required_date=target_item.required_date,
+                        notes=self.reservation_note,
+                    ))
+                    stock_item.reserved_quantity += reserve_qty
+                    reserved[target_item.id] += reserve_qty
+                    reserved_from_order[target_item.id] += reserve_qty
+
+                # 3. Строка заказа и её позиция проекта
+                po_item.delivered_quantity += line.quantity
+                delivered = po_item.delivered_quantity >= po_item.quantity
+                if delivered:
+                    po_item.status = 'delivered'
+                    po_item.actual_delivery_date = receipt.receipt_date
+                else:
+                    po_item.status = 'in_transit'
+
+                if project_item:
+                    if not project_item.actual_start:
+                        project_item.actual_start = order.order_date or receipt.receipt_date
+                    if delivered:
+                        project_item.purchase_status = PurchaseStatusChoices.CLOSED
+                        project_item.actual_end = receipt.receipt_date
+                    else:
+                        project_item.purchase_status = PurchaseStatusChoices.IN_ORDER
+
+                # 4. Закрытие потребностей: закрыта, если резервы этого заказа покрывают её
+                for req in requirements[po_item.nomenclature_item_id]:
+                    if req.status not in CLOSABLE_STATUSES:
+                        continue
+                    need_qty = req.total_required or 0
+                    if not need_qty or need_qty <= 0:
+                        continue
+
+                    from_order = reserved_from_order[req.project_item_id]
+                    req.status = 'closed' if from_order >= need_qty else 'in_order'
+                    req.updated_at = now
+                    touched_requirements[req.id] = req
+
+                    req_item = items[req.project_item_id]
+                    req_item.purchase_status = 'closed' if req.status == 'closed' else 'in_order'
+                    if from_order > 0 and not req_item.actual_start:
+                        req_item.actual_start = order.order_date or receipt.receipt_date
+                    if req.status == 'closed':
+                        req_item.actual_end = receipt.receipt_date
+
+            # 5. Запись
+            for stock_item in stock.values():
+                stock_item.updated_at = now
+            existing_stock = [stock_item for stock_item in stock.values() if not stock_item._state.adding]
+            if new_stock:
+                bulk_create_with_history(new_stock, StockItem, batch_size=self.batch_size)
+            if existing_stock:
+                for stock_item in existing_stock:
+                    stock_item.version += 1
+                bulk_update_with_history(existing_stock, StockItem, STOCK_FIELDS, batch_size=self.batch_size)
+            if batches:
+                bulk_create_with_history(batches, StockBatch, batch_size=self.batch_size)
+            if movements:
+                bulk_create_with_history(movements, StockMovement, batch_size=self.batch_size)
+            if reservations:
+                bulk_create_with_history(reservations, StockReservation, batch_size=self.batch_size)
+
+            self._write_order_lines(po_items.values(), now)
+            if touched_requirements:
+                bulk_update_with_history(
+                    list(touched_requirements.values()), MaterialRequirement,
+                    REQUIREMENT_FIELDS, batch_size=self.batch_size,
+                )
+
+            # Флаги проблем - по итоговому состоянию строк заказа и потребностей
+            evaluator = ProblemEvaluator()
+            purchased = [item for item in items.values() if item.is_purchased]
+            facts_by_id = {
+                row['id']: row
+                for row in evaluator.annotate_project_items(
+                    ProjectItem.all_objects.filter(id__in=[item.id for item in purchased])
+                ).values('id', *PROJECT_ITEM_FACTS)
+            }
+            for item in purchased:
+                evaluator.apply(item, evaluator.decide_project_item(item, facts_by_id.get(item.id, {})))
+            for item in items.values():
+                item.updated_at = now
+            self._write_project_items(items, initial_statuses, CONFIRM_ITEM_FIELDS)
+
+            order.update_total_amount()
+            order.update_status_from_deliveries()
+
+            receipt.status = 'confirmed'
+            receipt.save()
+
+        logger.info(
+            "Goods receipt %s confirmed: %s lines, %s reservations, %s requirements updated",
+            receipt.number, len(lines), len(reservations), len(touched_requirements),
+        )
+        return receipt
+
+    # ------------------------------------------------------------------
+    # Cancel confirmation
+    # ------------------------------------------------------------------
+
+    def cancel(self, user=None) -> GoodsReceipt:
+        receipt, order = self.receipt, self.order
+        if receipt.status != 'confirmed':
+            raise ValueError("Можно отменить только подтвержденное поступление")
+
+        with transaction.atomic():
+            self._lock_receipt('confirmed', "Можно отменить только подтвержденное поступление")
+            lines, po_items = self._load_lines()
+            nomenclature_ids = {po_item.nomenclature_item_id for po_item in po_items.values()}
+            stock = self._lock_stock(nomenclature_ids)
+
+            requirements = defaultdict(list)
+            for requirement in MaterialRequirement.objects.filter(
+                purchase_order=order,
+                nomenclature_item_id__in=nomenclature_ids,
+                status='closed',
+            ):
+                requirements[requirement.nomenclature_item_id].append(requirement)
+
+            item_ids = {po_item.project_item_id for po_item in po_items.values() if po_item.project_item_id}
+            item_ids |= {
+                req.project_item_id
+                for reqs in requirements.values() for req in reqs if req.project_item_id
+            }
+            items = self._load_project_items(item_ids)
+            initial_statuses = {item_id: item.purchase_status for item_id, item in items.items()}
+
+            now = timezone.now()
+            performed_by = user or receipt.received_by
+            movements, touched_stock, touched_requirements = [], {}, {}
+
+            for line in lines:
+                po_item = po_items[line.purchase_order_item_id]
+
+                # 1. Сторно остатка (складская позиция ищется с той же единицей измерения)
+                stock_item = stock.get(po_item.nomenclature_item_id)
+                if stock_item and stock_item.unit == po_item.unit:
+                    stock_item.quantity -= line.quantity
+                    movements.append(StockMovement(
+                        stock_item=stock_item,
+                        movement_type='correction',
+                        quantity=-line.quantity,
+                        balance_after=stock_item.quantity,
+                        source_document=f"Отмена поступления {receipt.number}",
+                        performed_by=performed_by,
+                        reason=f"Отмена поступления по заказу {order.number}",
+                    ))
+                    touched_stock[stock_item.id] = stock_item
+
+                # 2. Строка заказа
+                po_item.delivered_quantity -= line.quantity
+                if po_item.delivered_quantity < 0:
+                    po_item.delivered_quantity = 0
+
+                if po_item.delivered_quantity == 0:
+                    po_item.status = 'ordered'
+                    po_item.actual_delivery_date = None
+                elif po_item.delivered_quantity < po_item.quantity:
+                    po_item.status = 'partially_delivered'
+                else:
+                    po_item.status = 'delivered'
+
+                project_item = items.get(po_item.project_item_id)
+                if project_item:
+                    if po_item.delivered_quantity == 0:
+                        project_item.actual_end = None
+                    project_item.purchase_status = 'in_order'
+
+                # 3. Переоткрытие закрытых потребностей по заказу
+                for req in requirements[po_item.nomenclature_item_id]:
+                    if req.status != 'closed':
+                        continue
+                    req.status = 'in_order'
+                    touched_requirements[req.id] = req
+                    if req.project_item_id in items:
+                        req_item = items[req.project_item_id]
+                        req_item.purchase_status = 'in_order'
+                        req_item.actual_end = None
+
+            # 4. Запись
+            if touched_stock:
+                for stock_item in touched_stock.values():
+                    stock_item.updated_at = now
+                    stock_item.version += 1
+                bulk_update_with_history(
+                    list(touched_stock.values()), StockItem, STOCK_FIELDS, batch_size=self.batch_size
+                )
+            if movements:
+                bulk_create_with_history(movements, StockMovement, batch_size=self.batch_size)
+            self._write_order_lines(po_items.values(), now)
+            if touched_requirements:
+                bulk_update_with_history(
+                    list(touched_requirements.values()), MaterialRequirement,
+                    ['status'], batch_size=self.batch_size,
+                )
+            self._write_project_items(items, initial_statuses, CANCEL_ITEM_FIELDS)
+
+            # Резервы, созданные приёмками по этому заказу
+            StockReservation.objects.filter(
+                notes=self.reservation_note,
+                status='confirmed',
+            ).delete()
+
+            receipt.status = 'cancelled'
+            receipt.save()
+
+            order.update_total_amount()
+            order.update_status_from_deliveries()
+
+        logger.info(
+            "Goods receipt %s cancelled: %s lines, %s requirements reopened",
+            receipt.number, len(lines), len(touched_requirements),
+        )
+        return receipt
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def _write_order_lines(self, po_items, now):
+        po_items = list(po_items)
+        for po_item in po_items:
+            # Как в PurchaseOrderItem.save(); сумма заказа пересчитывается один раз
+            if po_item.unit_price and po_item.quantity:
+                po_item.total_price = po_item.unit_price * po_item.quantity
+            else:
+                po_item.total_price = 0
+            po_item.updated_at = now
+            po_item.version += 1
+        if po_items:
+            bulk_update_with_history(po_items, PurchaseOrderItem, ORDER_LINE_FIELDS, batch_size=self.batch_size)
+
+    def _write_project_items(self, items, initial_statuses, fields):
+        if not items:
+            return
+        bulk_update_with_history(list(items.values()), ProjectItem, fields, batch_size=self.batch_size)
+
+        # bulk_update не отправляет сигналы и не пересчитывает прогресс
+        from .dashboard import DashboardSnapshotStore
+        from .progress import ProgressTracker
+
+        changed = [
+            item_id for item_id, item in items.items()
+            if item.purchase_status != initial_statuses[item_id]
+        ]
+        if changed:
+            ProgressTracker().propagate(item_ids=changed)
+        DashboardSnapshotStore.invalidate({item.project_id for item in items.values()})
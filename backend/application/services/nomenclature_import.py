@@ -0,0 +1,361 @@
+"""
+Nomenclature Excel Import.
+
+Batched import of nomenclature items from .xlsx files:
+- parsing reads the sheet once and validates all rows in memory against
+  category, nomenclature type and existing-name dictionaries loaded once;
+- the parsed preview is kept in the Django cache under a token, so confirm
+  does not read the file again;
+- items are created with bulk_create in chunks (synchronously or in a
+  Celery task with progress for large files).
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from openpyxl import load_workbook
+from simple_history.utils import bulk_create_with_history
+
+from infrastructure.persistence.models import CatalogCategory, NomenclatureItem, NomenclatureType
+
+from .reference_data import reference_table
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_CACHE_KEY = 'nomenclature_import:v1:{token}'
+DEFAULT_PREVIEW_TIMEOUT = 30 * 60
+DEFAULT_BATCH_SIZE = 1000
+
+EXCEL_COLS = {
+    'A': 1,  # catalog category name
+    'B': 2,  # item name
+    'C': 3,  # drawing number (manufactured only)
+    'D': 4,  # unit
+    'E': 5,  # description
+    'F': 6,  # specifications
+    'G': 7,  # nomenclature type name (purchased only)
+}
+
+
+def _to_str(v: Any) -> str:
+    if v is None:
+        return ''
+    s = str(v).strip()
+    return s
+
+
+@dataclass(frozen=True)
+class ExcelImportError:
+    row: int
+    column: str
+    message: str
+
+    def to_dict(self) -> dict:
+        return {
+            'row': self.row,
+            'column': self.column,
+            'message': self.message,
+        }
+
+
+class ImportReferences:
+    """
+    Справочники для проверки строк импорта (из кэша справочников).
+
+    Поиск по наименованию без учёта регистра; при совпадении имён берётся
+    первый объект в порядке сортировки модели (как .filter(name__iexact).first()).
+    """
+
+    def __init__(self):
+        self.categories: Dict[str, CatalogCategory] = {}
+        for category in reference_table(CatalogCategory).active():
+            self.categories.setdefault(category.name.lower(), category)
+
+        self.types: Dict[Any, Dict[str, NomenclatureType]] = {}
+        for nomenclature_type in reference_table(NomenclatureType).active():
+            by_name = self.types.setdefault(nomenclature_type.catalog_category_id, {})
+            by_name.setdefault(nomenclature_type.name.lower(), nomenclature_type)
+
+    def category(self, name: str) -> Optional[CatalogCategory]:
+        return self.categories.get(name.lower())
+
+    def has_types(self, category) -> bool:
+        return bool(self.types.get(category.id))
+
+    def nomenclature_type(self, category, name: str) -> Optional[NomenclatureType]:
+        return self.types.get(category.id, {}).get(name.lower())
+
+
+def existing_names(category_ids: Iterable) -> Set[Tuple[str, str]]:
+    """(category_id, lower(name)) активных позиций номенклатуры - одним запросом."""
+    category_ids = {category_id for category_id in category_ids if category_id}
+    if not category_ids:
+        return set()
+    return {
+        (str(category_id), name.lower())
+        for category_id, name in NomenclatureItem.objects.filter(
+            is_active=True,
+            catalog_category_id__in=category_ids,
+        ).values_list('catalog_category_id', 'name')
+    }
+
+
+def _read_rows(file_obj) -> List[Tuple[int, list]]:
+    wb = load_workbook(filename=file_obj, read_only=True, data_only=True)
+    ws = wb.active
+
+    rows = []
+    for excel_row_idx, row_cells in enumerate(ws.iter_rows(min_row=2, max_col=7, values_only=True), start=2):
+        # Skip completely empty rows
+        values = list(row_cells) if row_cells is not None else []
+        if not values:
+            continue
+
+        # Normalize to length 7
+        while len(values) < 7:
+            values.append(None)
+
+        if all((_to_str(v) == '') for v in values[:7]):
+            continue
+
+        rows.append((excel_row_idx, [_to_str(v) for v in values[:7]]))
+    return rows
+
+
+def parse_nomenclature_excel(file_obj) -> Tuple[List[dict], List[ExcelImportError], dict]:
+    """
+    Parse and validate nomenclature import Excel.
+
+    Returns:
+        rows: list of parsed row dicts (including resolved FK ids/names when possible)
+        errors: list of ExcelImportError across the whole file
+        summary: counts
+    """
+    references = ImportReferences()
+    raw_rows = _read_rows(file_obj)
+    existing = existing_names(
+        category.id
+        for category in (references.category(values[0]) for _, values in raw_rows if values[0])
+        if category
+    )
+
+    errors: List[ExcelImportError] = []
+    parsed_rows: List[dict] = []
+    seen_keys: Set[Tuple[str, str]] = set()  # (category_id, lower(name))
+
+    for excel_row_idx, values in raw_rows:
+        category_name, name, drawing_number, unit, description, specifications, nomenclature_type_name = values
+
+        row_errors: List[ExcelImportError] = []
+
+        category_obj = None
+        if not category_name:
+            row_errors.append(ExcelImportError(row=excel_row_idx, column='A', message='Не указан "Вид справочника" (колонка A).'))
+        else:
+            category_obj = references.category(category_name)
+            if not category_obj:
+                row_errors.append(
+                    ExcelImportError(
+                        row=excel_row_idx,
+                        column='A',
+                        message=f'Вид справочника "{category_name}" не найден в настройках справочников.'
+                    )
+                )
+
+        if not name:
+            row_errors.append(ExcelImportError(row=excel_row_idx, column='B', message='Не указано "Наименование" (колонка B).'))
+
+        # Если в файле единица измерения не указана — подставим ниже:
+        # 1) из типа номенклатуры (для закупаемых),
+        # 2) иначе 'шт'.
+
+        nomenclature_type_obj = None
+        if category_obj and category_obj.is_purchased:
+            if nomenclature_type_name:
+                nomenclature_type_obj = references.nomenclature_type(category_obj, nomenclature_type_name)
+                if not nomenclature_type_obj:
+                    row_errors.append(
+                        ExcelImportError(
+                            row=excel_row_idx,
+                            column='G',
+                            message=f'Тип номенклатуры "{nomenclature_type_name}" не найден в виде справочника "{category_obj.name}".'
+                        )
+                    )
+            elif references.has_types(category_obj):
+                row_errors.append(
+                    ExcelImportError(
+                        row=excel_row_idx,
+                        column='G',
+                        message=f'Для закупаемого вида "{category_obj.name}" нужно указать "Тип номенклатуры" (колонка G).'
+                    )
+                )
+
+        # Unit: if empty, try to take from nomenclature_type.default_unit, else 'шт'
+        if not unit:
+            if nomenclature_type_obj and getattr(nomenclature_type_obj, 'default_unit', None):
+                unit = _to_str(nomenclature_type_obj.default_unit) or 'шт'
+            else:
+                unit = 'шт'
+
+        # Manufactured: drawing number is optional (can be added later). For purchased, ignore drawing number.
+        if category_obj and category_obj.is_purchased:
+            drawing_number = ''
+
+        # Duplicate checks
+        if category_obj and name:
+            key = (str(category_obj.id), name.lower())
+            if key in seen_keys:
+                row_errors.append(
+                    ExcelImportError(
+                        row=excel_row_idx,
+                        column='B',
+                        message='Дублирование в файле: такая позиция (вид справочника + наименование) уже встречалась.'
+                    )
+                )
+            else:
+                seen_keys.add(key)
+
+            if key in existing:
+                row_errors.append(_exists_error(excel_row_idx, category_obj.name, name))
+
+        errors.extend(row_errors)
+
+        parsed_rows.append({
+            'row': excel_row_idx,
+            'catalog_category': str(category_obj.id) if category_obj else None,
+            'catalog_category_name': category_obj.name if category_obj else category_name,
+            'is_purchased': bool(category_obj.is_purchased) if category_obj else None,
+            'name': name,
+            'drawing_number': drawing_number,
+            'unit': unit,
+            'description': description,
+            'specifications': specifications,
+            'nomenclature_type': str(nomenclature_type_obj.id) if nomenclature_type_obj else None,
+            'nomenclature_type_name': nomenclature_type_obj.name if nomenclature_type_obj else nomenclature_type_name,
+            'can_import': len(row_errors) == 0,
+            'row_errors': [e.to_dict() for e in row_errors],
+        })
+
+    return parsed_rows, errors, _summary(parsed_rows, errors)
+
+
+def _exists_error(row: int, category_name: str, name: str) -> ExcelImportError:
+    return ExcelImportError(
+        row=row,
+        column='B',
+        message=f'Такая позиция уже существует в справочнике ("{category_name}" / "{name}").'
+    )
+
+
+def _summary(rows: List[dict], errors: List[ExcelImportError]) -> dict:
+    return {
+        'total_rows': len(rows),
+        'parsed_rows': len(rows),
+        'valid_rows': sum(1 for r in rows if r.get('can_import')),
+        'error_rows': len({e.row for e in errors}),
+        'errors_count': len(errors),
+    }
+
+
+# =============================================================================
+# Preview cache
+# =============================================================================
+
+def store_preview(rows: List[dict], errors: List[ExcelImportError], summary: dict, user_id) -> str:
+    """Сохранить результат разбора файла; возвращает токен для подтверждения."""
+    token = uuid4().hex
+    timeout = getattr(settings, 'NOMENCLATURE_IMPORT_PREVIEW_TIMEOUT', DEFAULT_PREVIEW_TIMEOUT)
+    cache.set(PREVIEW_CACHE_KEY.format(token=token), {
+        'user_id': str(user_id) if user_id else None,
+        'rows': rows,
+        'errors': [e.to_dict() for e in errors],
+        'summary': summary,
+    }, timeout)
+    return token
+
+
+def load_preview(token: str, user_id) -> Optional[dict]:
+    """Результат разбора по токену (только для пользователя, загрузившего файл)."""
+    preview = cache.get(PREVIEW_CACHE_KEY.format(token=token))
+    if preview is None or preview['user_id'] != (str(user_id) if user_id else None):
+        return None
+    return preview
+
+
+def discard_preview(token: str) -> None:
+    cache.delete(PREVIEW_CACHE_KEY.format(token=token))
+
+
+# =============================================================================
+# Import
+# =============================================================================
+
+def recheck_existing(rows: List[dict]) -> List[ExcelImportError]:
+    """
+    Повторная проверка дублей с БД перед записью (одним запросом).
+
+    Между предпросмотром и подтверждением позиции могли быть созданы.
+    """
+    existing = existing_names(r['catalog_category'] for r in rows if r.get('can_import'))
+    return [
+        _exists_error(r['row'], r['catalog_category_name'], r['name'])
+        for r in rows
+        if r.get('can_import') and (r['catalog_category'], r['name'].lower()) in existing
+    ]
+
+
+def generate_unique_codes(count: int) -> List[str]:
+    """Уникальные коды nom_xxxxxxxx пачкой (проверка коллизий одним запросом на итерацию)."""
+    codes: Set[str] = set()
+    while len(codes) < count:
+        candidates = {f"nom_{uuid4().hex[:8]}" for _ in range(count - len(codes))} - codes
+        taken = set(NomenclatureItem.all_objects.filter(code__in=candidates).values_list('code', flat=True))
+        codes |= candidates - taken
+    return list(codes)
+
+
+def import_rows(
+    rows: List[dict],
+    user=None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> List[str]:
+    """Создать позиции номенклатуры из проверенных строк; возвращает id созданных."""
+    rows = [r for r in rows if r.get('can_import') and r.get('catalog_category')]
+    codes = generate_unique_codes(len(rows))
+
+    items = [
+        NomenclatureItem(
+            code=code,
+            name=r.get('name') or '',
+            catalog_category_id=r['catalog_category'],
+            nomenclature_type_id=r.get('nomenclature_type') or None,
+            drawing_number=r.get('drawing_number') or '',
+            unit=r.get('unit') or 'шт',
+            description=r.get('description') or '',
+            specifications=r.get('specifications') or '',
+            created_by=user,
+            updated_by=user,
+        )
+        for r, code in zip(rows, codes)
+    ]
+
+    total = len(items)
+    with transaction.atomic():
+        for start in range(0, total, batch_size):
+            bulk_create_with_history(
+                items[start:start + batch_size],
+                NomenclatureItem,
+                batch_size=batch_size,
+                default_user=user,
+            )
+            if progress:
+                progress(min(start + batch_size, total), total)
+
+    logger.info("Nomenclature import: %s items created", total)
+    return [str(item.id) for item in items]
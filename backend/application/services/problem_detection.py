@@ -0,0 +1,477 @@
+"""
+Problem Detection.
+
+Set-based evaluation of system problem flags (not ordered on time, ordered late,
+delivery delay) for purchased project items and material requirements.
+
+Flags are kept current by model saves, by a refresh of the affected rows after
+purchase order changes and by a scheduled sweep (the date-driven rules change
+with the calendar); read endpoints never write them. The time of the last
+sweep is stored as a SystemSetting and exposed as problems_evaluated_at().
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, Subquery, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from simple_history.utils import bulk_update_with_history
+
+from infrastructure.persistence.models import (
+    MaterialRequirement,
+    ProblemReason,
+    ProjectItem,
+    PurchaseOrderItem,
+    SystemSetting,
+)
+
+from .reference_data import reference_table
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+REASON_NOT_ORDERED = 'not_ordered_on_time'
+REASON_ORDERED_LATE = 'ordered_late'
+REASON_DELIVERY_DELAY = 'delivery_delay'
+SYSTEM_REASON_CODES = (REASON_NOT_ORDERED, REASON_ORDERED_LATE, REASON_DELIVERY_DELAY)
+
+FINAL_STATUSES = ('closed', 'written_off')
+# Legacy статусы закупки: 'pending' - ожидает заказа, 'ordered' - в заказе
+WAITING_STATUSES = ('waiting_order', 'pending')
+IN_ORDER_STATUSES = ('in_order', 'ordered')
+ACTIVE_ORDER_STATUSES = ('ordered', 'partially_delivered', 'closed')
+
+PROBLEM_FIELDS = ['has_problem', 'problem_reason']
+
+CACHE_PREFIX = 'problem_detection:v1'
+EVALUATED_AT_KEY = f'{CACHE_PREFIX}:evaluated_at'
+# Источник истины - БД (кэш сбрасывается и у LocMem свой в каждом процессе)
+EVALUATED_AT_SETTING = 'problem_flags.evaluated_at'
+EVALUATED_AT_CACHE_TIMEOUT = 60
+# Повторные изменения заказа в пределах задержки сливаются в один пересчёт
+ORDER_REFRESH_DELAY = 5
+
+# (has_problem, problem_reason_id)
+Decision = Tuple[bool, Optional[object]]
+
+
+def _latest_requirement():
+    return MaterialRequirement.objects.filter(
+        project_item_id=OuterRef('pk'),
+        is_active=True,
+        deleted_at__isnull=True,
+    ).order_by('-created_at')
+
+
+def _latest_confirmed_line():
+    return PurchaseOrderItem.objects.filter(
+        project_item_id=OuterRef('pk')
+    ).exclude(order__status='draft').order_by('-created_at')
+
+
+def project_item_facts():
+    """
+    Аннотации ProjectItem: последняя потребность и последняя строка
+    не чернового заказа - всё одним запросом (коррелированные подзапросы).
+    """
+    requirement = _latest_requirement()
+    line = _latest_confirmed_line()
+    return {
+        'pd_req_order_by_date': Subquery(requirement.values('order_by_date')[:1]),
+        'pd_req_po_status': Subquery(requirement.values('purchase_order__status')[:1]),
+        'pd_req_po_order_date': Subquery(requirement.values('purchase_order__order_date')[:1]),
+        'pd_req_po_expected_date': Subquery(requirement.values('purchase_order__expected_delivery_date')[:1]),
+        'pd_has_po_line': Exists(line),
+        'pd_line_expected_date': Subquery(line.values('expected_delivery_date')[:1]),
+        'pd_line_order_date': Subquery(line.values('order__order_date')[:1]),
+        'pd_line_order_expected_date': Subquery(line.values('order__expected_delivery_date')[:1]),
+    }
+
+
+def requirement_facts():
+    """
+    Аннотации MaterialRequirement: последняя строка связанного заказа
+    по той же номенклатуре (и той же позиции проекта, если она задана).
+    """
+    any_line = PurchaseOrderItem.objects.filter(
+        order_id=OuterRef('purchase_order_id'),
+        nomenclature_item_id=OuterRef('nomenclature_item_id'),
+    ).order_by('-created_at')
+    item_line = any_line.filter(project_item_id=OuterRef('project_item_id'))
+
+    def pick(field):
+        return Case(
+            When(project_item_id__isnull=True, then=Subquery(any_line.values(field)[:1])),
+            default=Subquery(item_line.values(field)[:1]),
+        )
+
+    return {
+        'pd_line_id': pick('id'),
+        'pd_line_expected_date': pick('expected_delivery_date'),
+        'pd_order_date': F('purchase_order__order_date'),
+        'pd_order_expected_date': F('purchase_order__expected_delivery_date'),
+    }
+
+
+PROJECT_ITEM_FACTS = tuple(project_item_facts())
+REQUIREMENT_FACTS = tuple(requirement_facts())
+
+
+def problems_evaluated_at() -> Optional[datetime]:
+    """Время последнего полного пересчёта флагов (None - ещё не выполнялся)."""
+    evaluated_at = cache.get(EVALUATED_AT_KEY)
+    if evaluated_at is None:
+        value = (
+            SystemSetting.objects.filter(key=EVALUATED_AT_SETTING)
+            .values_list('value', flat=True)
+            .first()
+        ) or {}
+        evaluated_at = parse_datetime(value.get('evaluated_at') or '')
+        if evaluated_at is not None:
+            cache.set(EVALUATED_AT_KEY, evaluated_at, EVALUATED_AT_CACHE_TIMEOUT)
+    return evaluated_at
+
+
+def _store_evaluated_at(evaluated_at: datetime) -> None:
+    SystemSetting.objects.update_or_create(
+        key=EVALUATED_AT_SETTING,
+        defaults={
+            'value': {'evaluated_at': evaluated_at.isoformat()},
+            'description': 'Время последнего полного пересчёта флагов проблем',
+        },
+    )
+    cache.set(EVALUATED_AT_KEY, evaluated_at, EVALUATED_AT_CACHE_TIMEOUT)
+
+
+def _order_pending_key(order_id) -> str:
+    return f'{CACHE_PREFIX}:order_pending:{order_id}'
+
+
+def schedule_order_refresh(order_id) -> None:
+    """
+    Пересчитать флаги строк заказа после фиксации транзакции (Celery).
+    Изменения одного заказа за ORDER_REFRESH_DELAY секунд дают одну задачу.
+    """
+    if not order_id:
+        return
+
+    def _enqueue():
+        if not cache.add(_order_pending_key(order_id), True, ORDER_REFRESH_DELAY * 2):
+            return
+        from application.tasks.problem_tasks import refresh_problem_flags
+        try:
+            refresh_problem_flags.apply_async(
+                kwargs={'purchase_order_id': str(order_id)},
+                countdown=ORDER_REFRESH_DELAY,
+            )
+        except Exception:
+            # Без брокера флаги обновит плановый пересчёт
+            cache.delete(_order_pending_key(order_id))
+            logger.warning("Could not schedule problem refresh for order %s", order_id, exc_info=True)
+
+    transaction.on_commit(_enqueue)
+
+
+def release_order_refresh(order_id) -> None:
+    """Снять отметку ожидания: следующие изменения заказа поставят новую задачу."""
+    cache.delete(_order_pending_key(order_id))
+
+
+class ProblemEvaluator:
+    """
+    Вычисление флага проблемы и системной причины.
+
+    Правила для закупаемой позиции проекта:
+    1. Закрыта/списана - флаг снимается, причина остаётся для истории.
+    2. Ожидает заказа, нет строки подтверждённого заказа и сегодня > "заказать до"
+       (order_date позиции или order_by_date последней потребности)
+       - "Не заказано вовремя".
+    3. В заказе (или есть строка подтверждённого заказа, или потребность в активном
+       заказе): сегодня > ожидаемой даты поставки - "Задержка поставки";
+       дата заказа позже "заказать до" - "Заказано с просрочкой".
+    4. Иначе проблемы нет.
+
+    Для потребностей - те же правила по статусу потребности и её заказу.
+
+    Факты для всех строк загружаются одним аннотированным запросом, решение
+    принимается в памяти, в БД записываются только изменившиеся строки.
+    """
+
+    def __init__(self, today=None, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.today = today or timezone.now().date()
+        self.batch_size = batch_size
+        self._reasons = None
+
+    # ------------------------------------------------------------------
+    # Reasons
+    # ------------------------------------------------------------------
+
+    @property
+    def reasons(self) -> Dict[str, ProblemReason]:
+        if self._reasons is None:
+            table = reference_table(ProblemReason)
+            self._reasons = {
+                code: table.by_code(code)
+                for code in SYSTEM_REASON_CODES
+                if table.by_code(code) is not None
+            }
+        return self._reasons
+
+    def get_reason(self, reason_id) -> Optional[ProblemReason]:
+        for reason in self.reasons.values():
+            if reason.id == reason_id:
+                return reason
+        return None
+
+    def _flag(self, code, current_reason_id) -> Decision:
+        # Если системной причины нет в справочнике - ставим только флаг
+        reason = self.reasons.get(code)
+        return True, reason.id if reason else current_reason_id
+
+    @staticmethod
+    def _no_problem(obj) -> Decision:
+        # Причина сбрасывается только вместе со снятием флага
+        return False, None if obj.has_problem else obj.problem_reason_id
+
+    # ------------------------------------------------------------------
+    # Decisions (in memory)
+    # ------------------------------------------------------------------
+
+    def decide_project_item(self, item, facts=None) -> Decision:
+        """
+        Решение для закупаемой позиции. `facts` - значения project_item_facts();
+        по умолчанию берутся из аннотаций самой позиции.
+        """
+        if facts is None:
+            facts = {name: getattr(item, name, None) for name in PROJECT_ITEM_FACTS}
+
+        if item.purchase_status in FINAL_STATUSES:
+            return False, item.problem_reason_id
+
+        order_by_date = item.order_date or facts.get('pd_req_order_by_date')
+        has_po_line = bool(facts.get('pd_has_po_line'))
+        has_requirement_po = facts.get('pd_req_po_status') in ACTIVE_ORDER_STATUSES
+
+        if (
+            item.purchase_status in WAITING_STATUSES
+            and not has_po_line
+            and order_by_date
+            and self.today > order_by_date
+        ):
+            return self._flag(REASON_NOT_ORDERED, item.problem_reason_id)
+
+        if item.purchase_status in IN_ORDER_STATUSES or has_po_line or has_requirement_po:
+            if has_po_line:
+                order_date = facts.get('pd_line_order_date')
+                expected_date = facts.get('pd_line_expected_date') or facts.get('pd_line_order_expected_date')
+            elif has_requirement_po:
+                order_date = facts.get('pd_req_po_order_date')
+                expected_date = facts.get('pd_req_po_expected_date')
+            else:
+                order_date = expected_date = None
+            expected_date = expected_date or item.required_date
+
+            # Приоритет: задержка поставки
+            if expected_date and self.today > expected_date:
+                return self._flag(REASON_DELIVERY_DELAY, item.problem_reason_id)
+            if order_date and order_by_date and order_date > order_by_date:
+                return self._flag(REASON_ORDERED_LATE, item.problem_reason_id)
+
+        return self._no_problem(item)
+
+    def decide_requirement(self, requirement, facts=None) -> Decision:
+        """Решение для потребности. `facts` - значения requirement_facts()."""
+        if facts is None:
+            facts = {name: getattr(requirement, name, None) for name in REQUIREMENT_FACTS}
+
+        if requirement.status in FINAL_STATUSES:
+            return False, requirement.problem_reason_id
+
+        if (
+            requirement.status == 'waiting_order'
+            and requirement.order_by_date
+            and self.today > requirement.order_by_date
+        ):
+            return self._flag(REASON_NOT_ORDERED, requirement.problem_reason_id)
+
+        if requirement.status == 'in_order':
+            order_date = None
+            expected_date = None
+            if requirement.purchase_order_id:
+                if facts.get('pd_line_id'):
+                    order_date = facts.get('pd_order_date')
+                    expected_date = facts.get('pd_line_expected_date')
+                expected_date = expected_date or facts.get('pd_order_expected_date')
+            expected_date = expected_date or requirement.delivery_date
+
+            if expected_date and self.today > expected_date:
+                return self._flag(REASON_DELIVERY_DELAY, requirement.problem_reason_id)
+            if order_date and requirement.order_by_date and order_date > requirement.order_by_date:
+                return self._flag(REASON_ORDERED_LATE, requirement.problem_reason_id)
+
+        return self._no_problem(requirement)
+
+    @staticmethod
+    def apply(obj, decision: Decision) -> bool:
+        """Применить решение к объекту. Возвращает True, если что-то изменилось."""
+        has_problem, reason_id = decision
+        if obj.has_problem == has_problem and obj.problem_reason_id == reason_id:
+            return False
+        obj.has_problem = has_problem
+        obj.problem_reason_id = reason_id
+        return True
+
+    # ------------------------------------------------------------------
+    # Single object (model check_problems)
+    # ------------------------------------------------------------------
+
+    def check_project_item(self, item) -> bool:
+        """Пересчитать флаг одной позиции в памяти (без сохранения)."""
+        if item._state.adding:
+            # У новой позиции ещё нет ни потребностей, ни заказов
+            facts = {}
+        else:
+            facts = ProjectItem.all_objects.filter(pk=item.pk).annotate(
+                **project_item_facts()
+            ).values(*PROJECT_ITEM_FACTS).first() or {}
+        return self.apply(item, self.decide_project_item(item, facts))
+
+    def check_requirement(self, requirement) -> bool:
+        """Пересчитать флаг одной потребности в памяти (без сохранения)."""
+        facts = {}
+        if requirement.status == 'in_order' and requirement.purchase_order_id:
+            lines = PurchaseOrderItem.objects.filter(
+                order_id=requirement.purchase_order_id,
+                nomenclature_item_id=requirement.nomenclature_item_id,
+            )
+            if requirement.project_item_id:
+                lines = lines.filter(project_item_id=requirement.project_item_id)
+            line = lines.order_by('-created_at').values('id', 'expected_delivery_date').first()
+            order = requirement.purchase_order
+            facts = {
+                'pd_line_id': line['id'] if line else None,
+                'pd_line_expected_date': line['expected_delivery_date'] if line else None,
+                'pd_order_date': order.order_date,
+                'pd_order_expected_date': order.expected_delivery_date,
+            }
+        return self.apply(requirement, self.decide_requirement(requirement, facts))
+
+    # ------------------------------------------------------------------
+    # Set-based
+    # ------------------------------------------------------------------
+
+    def annotate_project_items(self, queryset):
+        return queryset.annotate(**project_item_facts())
+
+    def annotate_requirements(self, queryset):
+        return queryset.annotate(**requirement_facts())
+
+    def evaluate_project_items(self, queryset) -> Dict[object, Decision]:
+        """Решения для закупаемых позиций queryset без записи в БД."""
+        rows = self.annotate_project_items(
+            queryset.filter(nomenclature_item__catalog_category__is_purchased=True)
+        ).only(
+            'id', 'purchase_status', 'order_date', 'required_date',
+            'has_problem', 'problem_reason',
+        )
+        return {item.id: self.decide_project_item(item) for item in rows.iterator()}
+
+    def refresh_project_items(self, queryset=None, project_id=None) -> int:
+        """
+        Пересчитать и сохранить флаги закупаемых позиций.
+        Возвращает количество изменённых позиций.
+        """
+        if queryset is None:
+            queryset = ProjectItem.objects.all()
+        if project_id is not None:
+            queryset = queryset.filter(project_id=project_id)
+
+        rows = self.annotate_project_items(
+            queryset.filter(nomenclature_item__catalog_category__is_purchased=True)
+        )
+        changed = [item for item in rows.iterator() if self.apply(item, self.decide_project_item(item))]
+        return self._write(changed, ProjectItem)
+
+    def refresh_requirements(self, requirements: Iterable) -> int:
+        """
+        Пересчитать и сохранить флаги потребностей.
+
+        Принимает queryset или список уже загруженных объектов (например,
+        страницу списка) - объекты обновляются на месте.
+        """
+        requirements = list(requirements)
+        if not requirements:
+            return 0
+
+        facts_by_id = {
+            row['id']: row
+            for row in self.annotate_requirements(
+                MaterialRequirement.all_objects.filter(id__in=[req.id for req in requirements])
+            ).values('id', *REQUIREMENT_FACTS)
+        }
+
+        changed = [
+            req for req in requirements
+            if self.apply(req, self.decide_requirement(req, facts_by_id.get(req.id, {})))
+        ]
+        return self._write(changed, MaterialRequirement)
+
+    def refresh_requirement_queryset(self, queryset=None) -> int:
+        """Пересчитать флаги потребностей queryset порциями по batch_size."""
+        if queryset is None:
+            queryset = MaterialRequirement.objects.all()
+        ids = list(queryset.order_by().values_list('id', flat=True))
+
+        changed = 0
+        for start in range(0, len(ids), self.batch_size):
+            changed += self.refresh_requirements(
+                MaterialRequirement.all_objects.filter(id__in=ids[start:start + self.batch_size])
+            )
+        return changed
+
+    def refresh_purchase_order(self, order_id) -> Dict[str, int]:
+        """Пересчитать флаги позиций и потребностей, связанных с заказом."""
+        project_items = ProjectItem.objects.filter(
+            Q(id__in=PurchaseOrderItem.objects.filter(order_id=order_id).values('project_item_id'))
+            | Q(id__in=MaterialRequirement.objects.filter(purchase_order_id=order_id).values('project_item_id'))
+        )
+        with transaction.atomic():
+            return {
+                'project_items': self.refresh_project_items(project_items),
+                'requirements': self.refresh_requirement_queryset(
+                    MaterialRequirement.objects.filter(purchase_order_id=order_id)
+                ),
+            }
+
+    def refresh_all(self) -> Dict[str, int]:
+        """
+        Полный пересчёт флагов всех позиций и потребностей
+        (даты "заказать до" и поставки устаревают сами по себе).
+        """
+        started = timezone.now()
+        # Без общей транзакции: строки не держатся заблокированными весь пересчёт
+        result = {
+            'project_items': self.refresh_project_items(),
+            'requirements': self.refresh_requirement_queryset(),
+        }
+        _store_evaluated_at(started)
+        logger.info(
+            "Problem flags refreshed: %s project items, %s requirements changed",
+            result['project_items'], result['requirements'],
+        )
+        return result
+
+    def _write(self, changed, model) -> int:
+        if changed:
+            bulk_update_with_history(changed, model, PROBLEM_FIELDS, batch_size=self.batch_size)
+            logger.debug("Problem flags updated for %s %s rows", len(changed), model.__name__)
+            if model is ProjectItem:
+                # bulk_update не отправляет сигналы - снимки дашборда сбрасываем явно
+                from .dashboard import DashboardSnapshotStore
+                DashboardSnapshotStore.invalidate({item.project_id for item in changed})
+        return len(changed)
@@ -0,0 +1,222 @@
+"""
+Procurement Schedule.
+
+Purchased project items that still have to be ordered or delivered, read
+with SQL aggregation: ordered/received quantities come from correlated
+subqueries over purchase order lines, groups (supplier, week of the
+required date, project) are GROUP BY queries. Lines are paged with a
+keyset cursor on (required_date, item_number), served by the partial
+index project_item_schedule_idx, and can be streamed as NDJSON for very
+large schedules.
+"""
+
+import base64
+import json
+from datetime import date
+from decimal import Decimal
+from typing import Iterator, List, Optional, Tuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import (
+    Count,
+    DecimalField,
+    F,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce, TruncWeek
+
+from infrastructure.persistence.models import ProjectItem, PurchaseOrderItem
+
+SCHEDULE_STATUSES = ('waiting_order', 'in_order')
+STREAM_CHUNK_SIZE = 2000
+
+GROUP_BY_SUPPLIER = 'supplier'
+GROUP_BY_WEEK = 'week'
+GROUP_BY_PROJECT = 'project'
+# группировка: (поля, выражения, поле сортировки)
+GROUPINGS = {
+    GROUP_BY_SUPPLIER: (('supplier_id',), {'supplier_name': F('supplier__name')}, 'supplier_name'),
+    GROUP_BY_WEEK: ((), {'week': TruncWeek('required_date')}, 'week'),
+    GROUP_BY_PROJECT: (('project_id',), {'project_name': F('project__name')}, 'project_name'),
+}
+
+# Поля строки графика (ключи ProcurementScheduleItemSerializer)
+LINE_VALUES = {
+    'project_name': F('project__name'),
+    'nomenclature_id': F('nomenclature_item_id'),
+    'nomenclature_name': F('nomenclature_item__name'),
+    'required_quantity': F('quantity'),
+    'status': F('purchase_status'),
+    'supplier_name': F('supplier__name'),
+}
+LINE_FIELDS = (
+    'id',
+    'item_number',
+    'project_id',
+    'name',
+    'unit',
+    'required_date',
+    'order_date',
+    'supplier_id',
+    'ordered_quantity',
+    'received_quantity',
+    'remaining_quantity',
+)
+
+QUANTITY = DecimalField(max_digits=15, decimal_places=3)
+ZERO = Value(Decimal('0'), output_field=QUANTITY)
+
+
+# Неотменённые строки активных заказов (для агрегирующего соединения в count())
+ACTIVE_ORDER_LINES = Q(
+    purchase_order_items__is_active=True,
+    purchase_order_items__order__is_active=True,
+) & ~Q(purchase_order_items__status='cancelled')
+
+
+class InvalidCursor(ValueError):
+    """Курсор страницы не удалось разобрать."""
+
+
+def _line_total(field):
+    """Сумма поля по неотменённым строкам активных заказов позиции."""
+    lines = PurchaseOrderItem.objects.filter(
+        project_item_id=OuterRef('pk'),
+        is_active=True,
+        order__is_active=True,
+    ).exclude(status='cancelled').order_by().values('project_item_id').annotate(
+        total=Sum(field)
+    ).values('total')
+    return Coalesce(Subquery(lines, output_field=QUANTITY), ZERO)
+
+
+def encode_cursor(row) -> str:
+    required_date = row['required_date']
+    payload = [required_date.isoformat() if required_date else None, row['item_number']]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[date], int]:
+    try:
+        required_date, item_number = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (date.fromisoformat(required_date) if required_date else None), int(item_number)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Некорректный курсор страницы')
+
+
+class ProcurementSchedule:
+    """
+    График закупок: позиции в статусах 'Ожидает заказа' / 'В заказе',
+    по которым ещё не всё получено.
+
+    - заказано - количество в неотменённых строках активных заказов;
+    - получено - поставленное количество по этим строкам;
+    - осталось - количество позиции минус полученное.
+
+    Порядок строк - по требуемой дате (без даты - в конце), затем по ID позиции.
+    """
+
+    def __init__(self, project_id=None, status=None, supplier_id=None):
+        self.project_id = project_id
+        self.status = status
+        self.supplier_id = supplier_id
+
+    def _filtered(self):
+        queryset = ProjectItem.objects.filter(
+            is_active=True,
+            purchase_status__in=SCHEDULE_STATUSES,
+            project__is_active=True,
+        )
+        if self.project_id:
+            queryset = queryset.filter(project_id=self.project_id)
+        if self.status:
+            queryset = queryset.filter(purchase_status=self.status)
+        if self.supplier_id:
+            queryset = queryset.filter(supplier_id=self.supplier_id)
+        return queryset
+
+    def queryset(self):
+        return self._filtered().annotate(
+            ordered_quantity=_line_total('quantity'),
+            received_quantity=_line_total('delivered_quantity'),
+        ).annotate(
+            remaining_quantity=F('quantity') - F('received_quantity'),
+        ).filter(remaining_quantity__gt=0)
+
+    def _ordered(self, queryset):
+        return queryset.order_by(F('required_date').asc(nulls_last=True), 'item_number')
+
+    def lines(self):
+        """Строки графика (.values(), в порядке графика)."""
+        return self._ordered(self.queryset()).values(*LINE_FIELDS, **LINE_VALUES)
+
+    def count(self) -> int:
+        """
+        Число строк графика. Полученное количество считается одним
+        агрегирующим соединением со строками заказов, а не подзапросом на строку.
+        """
+        received = Coalesce(
+            Sum('purchase_order_items__delivered_quantity', filter=ACTIVE_ORDER_LINES),
+            ZERO,
+        )
+        return self._filtered().annotate(
+            received_quantity=received,
+        ).filter(quantity__gt=F('received_quantity')).count()
+
+    def page(self, cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[dict], Optional[str]]:
+        """
+        Страница строк после курсора и курсор следующей страницы.
+
+        Строки с требуемой датой и без неё читаются отдельными запросами:
+        каждый идёт по индексу project_item_schedule_idx в порядке графика и
+        останавливается на limit + 1 строке, так что заказанное/полученное
+        считается только для прочитанных строк, а не для всего графика.
+        """
+        queryset = self.queryset()
+        dated = queryset.filter(required_date__isnull=False)
+        undated = queryset.filter(required_date__isnull=True)
+        if cursor:
+            required_date, item_number = decode_cursor(cursor)
+            if required_date is None:
+                dated = None
+                undated = undated.filter(item_number__gt=item_number)
+            else:
+                # required_date >= - граница диапазона индекса, OR уточняет её
+                dated = dated.filter(
+                    Q(required_date__gt=required_date)
+                    | Q(required_date=required_date, item_number__gt=item_number),
+                    required_date__gte=required_date,
+                )
+
+        rows = self._page_rows(dated, limit + 1) if dated is not None else []
+        if len(rows) <= limit:
+            rows += self._page_rows(undated, limit + 1 - len(rows))
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    def _page_rows(self, queryset, limit) -> List[dict]:
+        return list(self._ordered(queryset).values(*LINE_FIELDS, **LINE_VALUES)[:limit])
+
+    def iter_ndjson(self) -> Iterator[str]:
+        """Все строки графика построчно в формате NDJSON (серверный курсор)."""
+        for row in self.lines().iterator(chunk_size=STREAM_CHUNK_SIZE):
+            yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+    def groups(self, by: str):
+        """Итоги графика в разрезе поставщика, недели требуемой даты или проекта."""
+        fields, expressions, order = GROUPINGS[by]
+        return self.queryset().values(*fields, **expressions).annotate(
+            items=Count('id'),
+            waiting_order=Count('id', filter=Q(purchase_status='waiting_order')),
+            in_order=Count('id', filter=Q(purchase_status='in_order')),
+            total_required=Sum('quantity'),
+            total_ordered=Sum('ordered_quantity'),
+            total_received=Sum('received_quantity'),
+            total_remaining=Sum('remaining_quantity'),
+            earliest_required_date=Min('required_date'),
+        ).order_by(F(order).asc(nulls_last=True))
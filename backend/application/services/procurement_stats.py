@@ -0,0 +1,220 @@
+"""
+Procurement Statistics.
+
+Status buckets, overdue counts and amounts of purchase order lines computed
+with conditional aggregation: two queries for the summary (line metrics,
+order totals) and one GROUP BY query per breakdown (supplier, project).
+The summary and the full analytics are cached briefly under separate keys
+and dropped by signals when purchase orders or goods receipts change.
+"""
+
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DecimalField, Exists, F, OuterRef, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from infrastructure.persistence.models import PurchaseOrder, PurchaseOrderItem
+
+CACHE_PREFIX = 'procurement_stats:v1'
+GENERATION_KEY = f'{CACHE_PREFIX}:generation'
+DEFAULT_CACHE_TIMEOUT = 60
+
+LINE_STATUSES = ('pending', 'ordered', 'in_transit', 'delivered', 'cancelled')
+OPEN_LINE_STATUSES = ('pending', 'ordered', 'in_transit')
+ORDER_STATUSES = ('draft', 'ordered', 'partially_delivered', 'closed', 'cancelled')
+
+ZERO = Decimal('0')
+
+
+def _line_metrics(prefix: str, today: date, scope: Q = Q()) -> dict:
+    """
+    Агрегаты по строкам заказов. prefix - путь до строки
+    ('' для PurchaseOrderItem, 'items__' для PurchaseOrder),
+    scope - дополнительное условие на строку.
+    """
+    def q(**lookups):
+        return Q(**{f'{prefix}{name}': value for name, value in lookups.items()})
+
+    def count(condition):
+        return Count(f'{prefix}id', filter=condition)
+
+    def amount(condition):
+        return Coalesce(
+            Sum(f'{prefix}total_price', filter=condition),
+            Value(ZERO),
+            output_field=DecimalField(max_digits=15, decimal_places=2),
+        )
+
+    order_cancelled = Q(**{'status' if prefix else 'order__status': 'cancelled'})
+    line = q(is_active=True, deleted_at__isnull=True) & scope
+    overdue = line & q(status__in=OPEN_LINE_STATUSES, expected_delivery_date__lt=today)
+    delivered = line & q(status='delivered')
+    # Для доли "в срок" учитываются поставки, у которых известны обе даты
+    delivered_dated = delivered & q(expected_delivery_date__isnull=False, actual_delivery_date__isnull=False)
+
+    metrics = {'total_items': count(line)}
+    for status in LINE_STATUSES:
+        metrics[status] = count(line & q(status=status))
+    metrics.update(
+        overdue=count(overdue),
+        overdue_amount=amount(overdue),
+        total_amount=amount(line & ~q(status='cancelled') & ~order_cancelled),
+        delivered_amount=amount(delivered & ~order_cancelled),
+        delivered_dated=count(delivered_dated),
+        delivered_on_time=count(
+            delivered_dated & q(actual_delivery_date__lte=F(f'{prefix}expected_delivery_date'))
+        ),
+    )
+    return metrics
+
+
+def _finish(row: dict) -> dict:
+    """Доля поставок в срок (%) вместо служебного счётчика."""
+    dated = row.pop('delivered_dated')
+    row['on_time_rate'] = round(row['delivered_on_time'] * 100 / dated, 1) if dated else None
+    return row
+
+
+class ProcurementStats:
+    """
+    Аналитика закупок по строкам активных заказов.
+
+    - summary(): статусы строк, просрочка, суммы, количество заказов
+      по статусам и доля поставок в срок - запросом по строкам и запросом
+      по суммам заказов;
+    - by_supplier() / by_project(): те же показатели строк
+      в разрезе поставщиков и проектов (проект строки - проект её позиции,
+      для строк без позиции - проект заказа).
+
+    Просроченная строка - не поставлена, ожидаемая дата поставки прошла.
+    Сумма (total_amount) в summary() - сумма total_amount неотменённых
+    заказов, как в прежнем /purchase-orders/stats/ (включает отменённые строки
+    неотменённых заказов); в разрезах - стоимость неотменённых строк
+    неотменённых заказов (заказ может относиться к нескольким проектам).
+    """
+
+    def __init__(self, supplier_id=None, project_id=None, today: Optional[date] = None):
+        self.supplier_id = supplier_id
+        self.project_id = project_id
+        self.today = today or date.today()
+
+    def _project_scope(self, prefix: str) -> Q:
+        if not self.project_id:
+            return Q()
+        order_project = 'project_id' if prefix else 'order__project_id'
+        return (
+            Q(**{f'{prefix}project_item__project_id': self.project_id})
+            | Q(**{f'{prefix}project_item__isnull': True, order_project: self.project_id})
+        )
+
+    def lines(self):
+        queryset = PurchaseOrderItem.objects.filter(
+            order__is_active=True,
+            order__deleted_at__isnull=True,
+        ).filter(self._project_scope(''))
+        if self.supplier_id:
+            queryset = queryset.filter(order__supplier_id=self.supplier_id)
+        return queryset
+
+    def summary(self) -> dict:
+        queryset = PurchaseOrder.objects.filter(is_active=True)
+        if self.supplier_id:
+            queryset = queryset.filter(supplier_id=self.supplier_id)
+
+        scope = self._project_scope('items__')
+        # Заказ входит в проект, если он оформлен на проект или содержит его строки
+        in_scope = (Q(project_id=self.project_id) | scope) if self.project_id else Q()
+        metrics = {'total_orders': Count('id', distinct=True, filter=in_scope)}
+        for status in ORDER_STATUSES:
+            metrics[f'orders_{status}'] = Count('id', distinct=True, filter=in_scope & Q(status=status))
+        metrics.update(_line_metrics('items__', self.today, scope))
+        metrics.pop('total_amount')
+        row = _finish(queryset.aggregate(**metrics))
+
+        # Суммы заказов - отдельным запросом без соединения со строками (без дублей)
+        orders = queryset.exclude(status='cancelled')
+        if self.project_id:
+            project_lines = PurchaseOrderItem.objects.filter(order_id=OuterRef('pk')).filter(
+                self._project_scope('')
+            )
+            orders = orders.filter(Q(project_id=self.project_id) | Exists(project_lines))
+        row['total_amount'] = orders.aggregate(total=Sum('total_amount'))['total']
+        return row
+
+    def by_supplier(self) -> List[dict]:
+        rows = self.lines().values(
+            supplier_id=F('order__supplier_id'),
+            supplier_name=F('order__supplier__name'),
+        ).annotate(**_line_metrics('', self.today)).order_by('-total_amount', 'supplier_name')
+        return [_finish(row) for row in rows]
+
+    def by_project(self) -> List[dict]:
+        rows = self.lines().values(
+            project_id=Coalesce('project_item__project_id', 'order__project_id'),
+            project_name=Coalesce('project_item__project__name', 'order__project__name'),
+        ).annotate(**_line_metrics('', self.today)).order_by('-total_amount', 'project_name')
+        return [_finish(row) for row in rows]
+
+    def build(self) -> Dict[str, object]:
+        return {
+            'date': self.today.isoformat(),
+            'summary': self.summary(),
+            'by_supplier': self.by_supplier(),
+            'by_project': self.by_project(),
+        }
+
+
+# =============================================================================
+# Cache
+# =============================================================================
+
+def _timeout() -> int:
+    return getattr(settings, 'PROCUREMENT_STATS_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT)
+
+
+def _generation() -> int:
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = 1
+        cache.add(GENERATION_KEY, generation, None)
+    return generation
+
+
+def _cached(part: str, stats: ProcurementStats, build):
+    key = (
+        f'{CACHE_PREFIX}:{part}:{_generation()}:{stats.today.isoformat()}:'
+        f'{stats.supplier_id or "-"}:{stats.project_id or "-"}'
+    )
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, _timeout())
+    return data
+
+
+def get_procurement_stats(supplier_id=None, project_id=None) -> Dict[str, object]:
+    """Аналитика закупок из кэша (или пересчёт при отсутствии)."""
+    stats = ProcurementStats(supplier_id=supplier_id, project_id=project_id)
+    return _cached('analytics', stats, stats.build)
+
+
+def get_procurement_summary(supplier_id=None, project_id=None) -> dict:
+    """Итоги закупок (summary) из кэша - без расчёта разрезов по поставщикам и проектам."""
+    stats = ProcurementStats(supplier_id=supplier_id, project_id=project_id)
+    return _cached('summary', stats, stats.summary)
+
+
+def invalidate_procurement_stats() -> None:
+    """Сбросить кэш аналитики после фиксации транзакции."""
+    def _bump():
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.set(GENERATION_KEY, 2, None)
+
+    transaction.on_commit(_bump)
@@ -0,0 +1,214 @@
+"""
+Project Progress.
+
+Stored progress of project items (ProjectItem.calculated_progress):
+incremental recomputation of a changed node and its ancestor chain,
+and a single-pass rebuild of whole projects.
+"""
+
+import logging
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, Iterable, Optional
+
+from django.db.models import Avg, Count
+from django.utils import timezone
+
+from infrastructure.persistence.models import Project, ProjectItem
+
+logger = logging.getLogger(__name__)
+
+ZERO = Decimal('0')
+HUNDRED = Decimal('100')
+PRECISION = Decimal('0.01')
+
+UPDATE_CHUNK_SIZE = 1000
+
+FINAL_PURCHASE_STATUSES = ('closed', 'written_off')
+# Fallback ProjectItem.is_purchased: позиция без категории считается закупаемой по статусу
+PURCHASE_STATUSES = ('waiting_order', 'in_order', 'closed', 'written_off')
+
+PROGRESS_VALUES = (
+    'id',
+    'parent_item_id',
+    'purchase_status',
+    'manufacturer_type',
+    'manufacturing_status',
+    'contractor_status',
+    'nomenclature_item__catalog_category__is_purchased',
+)
+
+
+def quantize(value) -> Decimal:
+    return Decimal(str(value)).quantize(PRECISION, rounding=ROUND_HALF_UP)
+
+
+def is_completed(row) -> bool:
+    """Финальный статус позиции (прогресс всегда 100%, даже при наличии детей)."""
+    is_purchased = row['nomenclature_item__catalog_category__is_purchased']
+    if is_purchased is None:
+        is_purchased = row['purchase_status'] in PURCHASE_STATUSES
+
+    if is_purchased:
+        return row['purchase_status'] in FINAL_PURCHASE_STATUSES
+    if row['manufacturer_type'] == 'contractor':
+        return row['contractor_status'] == 'completed'
+    return row['manufacturing_status'] == 'completed'
+
+
+def compute_progress(rows: Iterable[dict]) -> Dict[object, Decimal]:
+    """
+    Прогресс всех позиций за один проход (без рекурсии).
+
+    rows - значения PROGRESS_VALUES. Правила:
+    1. Финальный статус - 100%.
+    2. Лист - 0%.
+    3. Родитель - среднее арифметическое прогресса дочерних (равный вес).
+    """
+    rows = list(rows)
+    by_id = {row['id']: row for row in rows}
+    children = defaultdict(list)
+    roots = []
+    for row in rows:
+        parent_id = row['parent_item_id']
+        if parent_id in by_id:
+            children[parent_id].append(row['id'])
+        else:
+            roots.append(row['id'])
+
+    # Pre-order обход; в обратном порядке дети идут раньше родителей
+    order = []
+    stack = list(roots)
+    while stack:
+        node_id = stack.pop()
+        order.append(node_id)
+        stack.extend(children.get(node_id, ()))
+
+    progress = {}
+    for node_id in reversed(order):
+        child_ids = children.get(node_id)
+        if is_completed(by_id[node_id]):
+            progress[node_id] = HUNDRED
+        elif not child_ids:
+            progress[node_id] = ZERO
+        else:
+            progress[node_id] = quantize(sum(progress[child_id] for child_id in child_ids) / len(child_ids))
+    return progress
+
+
+class ProgressTracker:
+    """
+    Поддержание сохранённого прогресса позиций и проектов.
+
+    - propagate(): пересчёт позиций и их цепочки предков. Подъём прекращается,
+      как только значение узла не изменилось - выше ничего измениться не может.
+    - rebuild(): полный пересчёт проекта (или всех проектов) за один запрос
+      на чтение; записываются только изменившиеся значения.
+
+    Прогресс проекта - среднее прогресса корневых позиций.
+    Значения производные, поэтому пишутся через update() без истории изменений.
+    """
+
+    def propagate(self, item_ids: Iterable = (), project_ids: Iterable = ()) -> None:
+        project_ids = set(project_ids)
+        for item_id in {item_id for item_id in item_ids if item_id}:
+            root_project_id = self._walk_up(item_id)
+            if root_project_id:
+                project_ids.add(root_project_id)
+
+        for project_id in project_ids:
+            self.refresh_project(project_id)
+
+    def item_saved(self, item, old_parent_id=None, created=False, structure_changed=False) -> None:
+        """
+        Хук записи позиции.
+
+        structure_changed - позиция создана, перемещена, удалена или восстановлена:
+        меняется состав дочерних у старого и нового родителя.
+        """
+        item_ids = set() if created else {item.id}
+        project_ids = set()
+        if created or structure_changed:
+            item_ids |= {item.parent_item_id, old_parent_id}
+            if item.parent_item_id is None or old_parent_id is None:
+                # Изменился состав корневых позиций проекта
+                project_ids.add(item.project_id)
+
+        self.propagate(item_ids, project_ids)
+
+    def _walk_up(self, item_id) -> Optional[object]:
+        """Пересчитать узел и предков. Возвращает project_id, если изменился корень."""
+        while item_id:
+            row = ProjectItem.objects.filter(pk=item_id).values(
+                *PROGRESS_VALUES, 'project_id', 'calculated_progress'
+            ).first()
+            if row is None:
+                return None
+
+            value = self._node_progress(row)
+            if value == row['calculated_progress']:
+                return None
+
+            ProjectItem.objects.filter(pk=item_id).update(calculated_progress=value)
+            if row['parent_item_id'] is None:
+                return row['project_id']
+            item_id = row['parent_item_id']
+        return None
+
+    @staticmethod
+    def _node_progress(row) -> Decimal:
+        if is_completed(row):
+            return HUNDRED
+        stats = ProjectItem.objects.filter(parent_item_id=row['id']).aggregate(
+            avg=Avg('calculated_progress'),
+            count=Count('id'),
+        )
+        if not stats['count']:
+            return ZERO
+        return quantize(stats['avg'] or 0)
+
+    def refresh_project(self, project_id) -> Decimal:
+        """Прогресс проекта = среднее прогресса корневых позиций."""
+        avg = ProjectItem.objects.filter(
+            project_id=project_id,
+            parent_item__isnull=True,
+        ).aggregate(avg=Avg('calculated_progress'))['avg']
+        value = quantize(avg or 0)
+        Project.objects.filter(pk=project_id).update(
+            progress_percent=value,
+            last_progress_calculation=timezone.now(),
+        )
+        return value
+
+    def rebuild(self, project_id=None) -> int:
+        """
+        Полный пересчёт прогресса за один проход.
+        Возвращает количество позиций, у которых изменилось значение.
+        """
+        queryset = ProjectItem.objects.all()
+        if project_id is not None:
+            queryset = queryset.filter(project_id=project_id)
+
+        rows = list(queryset.values(*PROGRESS_VALUES, 'project_id', 'calculated_progress'))
+        progress = compute_progress(rows)
+
+        changed_by_value = defaultdict(list)
+        for row in rows:
+            value = progress.get(row['id'], ZERO)
+            if value != row['calculated_progress']:
+                changed_by_value[value].append(row['id'])
+
+        # Различных значений немного (0, 100, доли) - одно UPDATE на значение
+        changed = 0
+        for value, ids in changed_by_value.items():
+            for start in range(0, len(ids), UPDATE_CHUNK_SIZE):
+                changed += ProjectItem.objects.filter(
+                    id__in=ids[start:start + UPDATE_CHUNK_SIZE]
+                ).update(calculated_progress=value)
+
+        project_ids = [project_id] if project_id is not None else {row['project_id'] for row in rows}
+        for pid in project_ids:
+            self.refresh_project(pid)
+
+        logger.info("Progress rebuilt for %s items (%s changed)", len(rows), changed)
+        return changed
@@ -0,0 +1,181 @@
+"""
+Reference Data.
+
+Small, rarely changed dictionaries (problem reasons, delay reasons, catalog
+categories, nomenclature types, project statuses and analytics reasons) held
+in process memory of every worker. Each table has a version token in the
+Django cache (Redis), replaced after commit by save/delete signals (see
+infrastructure.persistence.signals). A worker re-checks the version at most
+every REFERENCE_DATA_CHECK_INTERVAL seconds and reloads a changed table from
+the shared cache or, if it is not there yet, with one query.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from infrastructure.persistence.models import (
+    CatalogCategory,
+    DelayReason,
+    ManufacturingProblemReason,
+    ManufacturingProblemSubreason,
+    ManufacturingStatus,
+    NomenclatureType,
+    ProblemReason,
+    PurchaseProblemReason,
+    PurchaseProblemSubreason,
+    PurchaseStatus,
+)
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'reference_data:v1'
+DEFAULT_CHECK_INTERVAL = 5
+# Таблица в общем кэше живёт до смены версии; срок - страховка от мусора
+SHARED_TIMEOUT = 24 * 60 * 60
+
+REFERENCE_MODELS = (
+    CatalogCategory,
+    DelayReason,
+    ManufacturingProblemReason,
+    ManufacturingProblemSubreason,
+    ManufacturingStatus,
+    NomenclatureType,
+    ProblemReason,
+    PurchaseProblemReason,
+    PurchaseProblemSubreason,
+    PurchaseStatus,
+)
+
+
+class ReferenceTable:
+    """
+    Снимок справочника: все строки, включая неактивные и удалённые,
+    в порядке сортировки модели.
+
+    Объекты общие для всех потоков процесса - их нельзя изменять.
+    """
+
+    def __init__(self, rows: List):
+        self.rows = rows
+        self._by_id = {row.pk: row for row in rows}
+        self._by_code = {}
+        for row in self.active():
+            code = getattr(row, 'code', None)
+            if code:
+                self._by_code.setdefault(code, row)
+
+    def get(self, pk):
+        """Строка по id (в том числе неактивная) или None."""
+        return self._by_id.get(pk)
+
+    def by_code(self, code):
+        """Активная строка по коду или None."""
+        return self._by_code.get(code)
+
+    def active(self) -> List:
+        """Активные неудалённые строки."""
+        return [
+            row for row in self.rows
+            if getattr(row, 'is_active', True) and getattr(row, 'deleted_at', None) is None
+        ]
+
+    def names(self) -> Dict[object, str]:
+        """id -> наименование для всех строк."""
+        return {row.pk: row.name for row in self.rows}
+
+
+class _Entry:
+    __slots__ = ('version', 'checked_at', 'table')
+
+    def __init__(self, version, table):
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.table = table
+
+
+_local: Dict[str, _Entry] = {}
+_lock = threading.Lock()
+
+
+def _label(model) -> str:
+    return model._meta.label_lower
+
+
+def _version_key(model) -> str:
+    return f'{CACHE_PREFIX}:{_label(model)}:version'
+
+
+def _check_interval() -> float:
+    return getattr(settings, 'REFERENCE_DATA_CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL)
+
+
+def _new_version() -> str:
+    # Случайный токен, а не счётчик: после вытеснения ключа версии новая
+    # версия не совпадёт с прежними, и старый снимок не станет "текущим"
+    return uuid.uuid4().hex
+
+
+def _version(model) -> str:
+    key = _version_key(model)
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, None):
+            version = cache.get(key) or version
+    return version
+
+
+def _load(model, version) -> ReferenceTable:
+    key = f'{CACHE_PREFIX}:{_label(model)}:{version}'
+    rows = cache.get(key)
+    if rows is None:
+        manager = getattr(model, 'all_objects', model._default_manager)
+        rows = list(manager.all())
+        cache.set(key, rows, SHARED_TIMEOUT)
+        logger.debug("Reference table %s loaded: %s rows (version %s)", _label(model), len(rows), version)
+    return ReferenceTable(rows)
+
+
+def reference_table(model) -> ReferenceTable:
+    """Справочник из памяти процесса (перезагружается при смене версии)."""
+    label = _label(model)
+    entry = _local.get(label)
+    if entry is not None and time.monotonic() - entry.checked_at < _check_interval():
+        return entry.table
+
+    version = _version(model)
+    if entry is not None and entry.version == version:
+        entry.checked_at = time.monotonic()
+        return entry.table
+
+    with _lock:
+        entry = _local.get(label)
+        if entry is None or entry.version != version:
+            entry = _Entry(version, _load(model, version))
+            _local[label] = entry
+    return entry.table
+
+
+def invalidate_reference_data(models: Iterable) -> None:
+    """Сменить версию справочников после фиксации транзакции."""
+    models = tuple(models)
+
+    def _bump():
+        for model in models:
+            cache.set(_version_key(model), _new_version(), None)
+            # Свой процесс видит изменение сразу, остальные - после проверки версии
+            _local.pop(_label(model), None)
+
+    transaction.on_commit(_bump)
+
+
+def problem_reason(code) -> Optional[ProblemReason]:
+    """Активная системная причина проблемы по коду."""
+    return reference_table(ProblemReason).by_code(code)
@@ -0,0 +1,263 @@
+"""
+Material Requirements Sync.
+
+Set-based synchronization of MaterialRequirement rows with purchased
+project items: grouped stock/reservation aggregates, in-memory diff and
+bulk writes instead of update_or_create + aggregates per item.
+"""
+
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from typing import Iterable, List, Optional
+
+from django.db.models import ProtectedError, Sum
+from django.utils import timezone
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+
+from infrastructure.persistence.models import (
+    MaterialRequirement,
+    ProjectItem,
+    PurchaseOrderItem,
+    StockItem,
+    StockReservation,
+)
+
+from .problem_detection import REQUIREMENT_FACTS, ProblemEvaluator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+# Потребности формируются только из проектов в статусе 'В работе'
+ACTIVE_PROJECT_STATUSES = ['in_progress']
+REQUIREMENT_STATUSES = ('waiting_order', 'in_order', 'closed', 'written_off')
+ACTIVE_RESERVATION_STATUSES = ['pending', 'confirmed']
+
+SYNC_FIELDS = [
+    'status',
+    'total_required',
+    'order_by_date',
+    'delivery_date',
+    'supplier',
+    'has_problem',
+    'problem_reason',
+    'problem_notes',
+    'priority',
+    'total_available',
+    'total_reserved',
+    'to_order',
+    'purchase_order',
+]
+# Атрибуты для сравнения "до/после" (FK - по *_id)
+COMPARED_ATTRS = [
+    f'{field}_id' if field in ('supplier', 'problem_reason', 'purchase_order') else field
+    for field in SYNC_FIELDS
+]
+# Служебные поля, которые save() обновлял бы автоматически
+WRITE_FIELDS = SYNC_FIELDS + ['calculation_date', 'updated_at', 'version']
+DELETE_FIELDS = ['deleted_at', 'deleted_by', 'updated_at']
+
+
+def _sum_by(queryset, *keys):
+    """{key(s): Sum(quantity)} одним GROUP BY запросом."""
+    result = {}
+    for row in queryset.order_by().values(*keys).annotate(total=Sum('quantity')):
+        key = row[keys[0]] if len(keys) == 1 else tuple(row[k] for k in keys)
+        result[key] = row['total'] or Decimal('0')
+    return result
+
+
+class RequirementSynchronizer:
+    """
+    Синхронизация потребностей из позиций проектов (ProjectItem).
+
+    Бизнес-правила (как у MaterialRequirement.sync_from_project_items):
+    - одна потребность = одна закупаемая позиция с назначенным поставщиком
+      из проекта в статусе 'В работе';
+    - статус потребности = статус закупки позиции;
+    - к заказу = потребность - (резерв под позицию + свободный остаток),
+      свободный остаток = остаток на складах - резервы других позиций;
+    - при уходе из статуса 'В заказе' потребность отвязывается от заказа
+      (строки заказа удаляются, если по ним ещё нет приёмки);
+    - потребности удалённых/неактуальных позиций мягко удаляются.
+
+    Инкрементальный режим: project_ids / nomenclature_ids ограничивают
+    и синхронизируемые позиции, и удаление устаревших потребностей.
+    """
+
+    def __init__(
+        self,
+        project_ids: Optional[Iterable] = None,
+        nomenclature_ids: Optional[Iterable] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ):
+        self.project_ids = list(project_ids) if project_ids is not None else None
+        self.nomenclature_ids = list(nomenclature_ids) if nomenclature_ids is not None else None
+        self.batch_size = batch_size
+        self.evaluator = ProblemEvaluator()
+
+    def _scope(self, queryset):
+        if self.project_ids is not None:
+            queryset = queryset.filter(project_id__in=self.project_ids)
+        if self.nomenclature_ids is not None:
+            queryset = queryset.filter(nomenclature_item_id__in=self.nomenclature_ids)
+        return queryset
+
+    def purchased_items(self):
+        return self._scope(ProjectItem.objects.filter(
+            project__status__in=ACTIVE_PROJECT_STATUSES,
+            nomenclature_item__catalog_category__is_purchased=True,
+            supplier__isnull=False,  # Только позиции с назначенным поставщиком
+        ))
+
+    def sync(self) -> List[MaterialRequirement]:
+        items_qs = self.purchased_items()
+        items = list(items_qs.select_related(
+            'project', 'nomenclature_item', 'supplier', 'problem_reason'
+        ))
+        item_ids = items_qs.values('id')
+        nomenclature_ids = {item.nomenclature_item_id for item in items}
+
+        existing = {}
+        for requirement in MaterialRequirement.objects.filter(
+            project_item_id__in=item_ids
+        ).select_related('purchase_order').order_by('created_at'):
+            key = (requirement.project_id, requirement.project_item_id, requirement.nomenclature_item_id)
+            existing.setdefault(key, requirement)
+
+        # Остатки и резервы - по одному GROUP BY запросу на всю выборку
+        stock = _sum_by(
+            StockItem.objects.filter(nomenclature_item_id__in=nomenclature_ids),
+            'nomenclature_item_id',
+        )
+        reserved = _sum_by(
+            StockReservation.objects.filter(
+                stock_item__nomenclature_item_id__in=nomenclature_ids,
+                status__in=ACTIVE_RESERVATION_STATUSES,
+            ),
+            'stock_item__nomenclature_item_id',
+        )
+        reserved_by_item = defaultdict(dict)
+        for (item_id, nomenclature_id), total in _sum_by(
+            StockReservation.objects.filter(
+                project_item_id__in=item_ids,
+                status__in=ACTIVE_RESERVATION_STATUSES,
+            ),
+            'project_item_id', 'stock_item__nomenclature_item_id',
+        ).items():
+            reserved_by_item[item_id][nomenclature_id] = total
+
+        facts_by_id = {
+            row['id']: row
+            for row in self.evaluator.annotate_requirements(
+                MaterialRequirement.objects.filter(
+                    id__in=[req.id for req in existing.values() if req.purchase_order_id]
+                )
+            ).values('id', *REQUIREMENT_FACTS)
+        }
+
+        now = timezone.now()
+        synced, to_create, to_update = [], [], []
+        for item in items:
+            key = (item.project_id, item.id, item.nomenclature_item_id)
+            requirement = existing.get(key)
+            created = requirement is None
+            if created:
+                requirement = MaterialRequirement(
+                    project=item.project,
+                    project_item=item,
+                    nomenclature_item=item.nomenclature_item,
+                )
+            before = None if created else self._snapshot(requirement)
+
+            self._fill(requirement, item, stock, reserved, reserved_by_item.get(item.id, {}))
+            self._unlink_order(requirement, item)
+
+            facts = facts_by_id.get(requirement.id, {}) if requirement.purchase_order_id else {}
+            self.evaluator.apply(requirement, self.evaluator.decide_requirement(requirement, facts))
+
+            if created:
+                to_create.append(requirement)
+            elif before != self._snapshot(requirement):
+                requirement.calculation_date = now
+                requirement.updated_at = now
+                requirement.version += 1
+                to_update.append(requirement)
+            synced.append(requirement)
+
+        if to_create:
+            bulk_create_with_history(to_create, MaterialRequirement, batch_size=self.batch_size)
+        if to_update:
+            bulk_update_with_history(to_update, MaterialRequirement, WRITE_FIELDS, batch_size=self.batch_size)
+        deleted = self._delete_obsolete(item_ids, now)
+
+        logger.info(
+            "Material requirements synced: %s items, %s created, %s updated, %s removed",
+            len(items), len(to_create), len(to_update), deleted,
+        )
+        return synced
+
+    @staticmethod
+    def _snapshot(requirement):
+        return {attr: getattr(requirement, attr) for attr in COMPARED_ATTRS}
+
+    @staticmethod
+    def _fill(requirement, item, stock, reserved, item_reserved):
+        # Статус потребности = статус позиции
+        status = item.purchase_status if item.purchase_status in REQUIREMENT_STATUSES else 'waiting_order'
+
+        requirement.status = status
+        requirement.total_required = item.quantity
+        requirement.order_by_date = item.order_date
+        requirement.delivery_date = item.required_date
+        requirement.supplier = item.supplier
+        requirement.has_problem = item.has_problem
+        requirement.problem_reason = item.problem_reason
+        requirement.problem_notes = getattr(item, 'problem_notes', '')
+        requirement.priority = 'high' if item.has_problem else 'normal'
+
+        nomenclature_id = item.nomenclature_item_id
+        total_available = stock.get(nomenclature_id, Decimal('0'))
+        # Резервы ДРУГИХ позиций (не текущей) - они занимают часть остатка
+        reserved_others = reserved.get(nomenclature_id, Decimal('0')) - item_reserved.get(nomenclature_id, Decimal('0'))
+        # Резервы для текущей позиции - уже обеспечено
+        reserved_for_this = sum(item_reserved.values(), Decimal('0'))
+        # Свободно на складе = всего - зарезервировано другими
+        free_stock = max(Decimal('0'), total_available - reserved_others)
+
+        requirement.total_available = total_available
+        requirement.total_reserved = reserved_others + reserved_for_this
+        requirement.to_order = max(Decimal('0'), item.quantity - (reserved_for_this + free_stock))
+
+    @staticmethod
+    def _unlink_order(requirement, item):
+        """Отвязать потребность от заказа, если она больше не 'В заказе'."""
+        if not requirement.purchase_order_id or requirement.status == 'in_order':
+            return
+        try:
+            PurchaseOrderItem.objects.filter(
+                order_id=requirement.purchase_order_id,
+                project_item=item,
+                nomenclature_item_id=item.nomenclature_item_id,
+            ).delete()
+        except ProtectedError:
+            # Если по строке уже есть приёмка, не удаляем и не отвязываем
+            return
+        requirement.purchase_order = None
+
+    def _delete_obsolete(self, item_ids, now) -> int:
+        """Мягко удалить потребности удалённых/неактуальных позиций проекта."""
+        obsolete = list(self._scope(MaterialRequirement.objects.filter(
+            project__status__in=ACTIVE_PROJECT_STATUSES,
+            project_item__isnull=False,
+            is_active=True,
+        )).exclude(project_item_id__in=item_ids))
+
+        for requirement in obsolete:
+            requirement.deleted_at = now
+            requirement.deleted_by = None
+            requirement.updated_at = now
+        if obsolete:
+            bulk_update_with_history(obsolete, MaterialRequirement, DELETE_FIELDS, batch_size=self.batch_size)
+        return len(obsolete)
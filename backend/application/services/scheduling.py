@@ -0,0 +1,240 @@
+"""
+Project Scheduling.
+
+Backward (as-late-as-possible) scheduling of a ProjectItem subtree in one
+pass: the subtree is read with a single tree_path query, supplier lead times
+with one query, dates are propagated from parents to children in memory and
+only changed rows are written (bulk_update with history). The same pass
+computes slack and the critical path and can be run as a dry run.
+"""
+
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from simple_history.utils import bulk_update_with_history
+
+from infrastructure.persistence.models import NomenclatureSupplier, ProjectItem
+
+from .dashboard import DashboardSnapshotStore
+from .progress import PURCHASE_STATUSES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+DATE_FIELDS = ('required_date', 'order_date', 'planned_end')
+
+NODE_VALUES = (
+    'id',
+    'parent_item_id',
+    'item_number',
+    'name',
+    'planned_start',
+    'planned_end',
+    'required_date',
+    'order_date',
+    'purchase_status',
+    'purchase_by_contractor',
+    'supplier_id',
+    'nomenclature_item_id',
+    'nomenclature_item__catalog_category__is_purchased',
+)
+
+
+def _is_purchased(row) -> bool:
+    """ProjectItem.is_purchased по строке .values()."""
+    is_purchased = row['nomenclature_item__catalog_category__is_purchased']
+    if is_purchased is None:
+        return row['purchase_status'] in PURCHASE_STATUSES
+    return is_purchased
+
+
+@dataclass
+class ScheduleResult:
+    """Result of a scheduling run."""
+
+    root_id: object
+    dry_run: bool
+    scheduled: int = 0
+    changes: List[dict] = field(default_factory=list)
+    critical_path: List[dict] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def changed(self) -> int:
+        return len(self.changes)
+
+
+class ProjectScheduler:
+    """
+    Обратное планирование дат поддерева позиции проекта.
+
+    Правила (как у прежнего ProjectItem.cascade_dates_to_children), для
+    каждой дочерней позиции узла с плановым началом:
+    1. Закупаемая подрядчиком - даты закупки очищаются.
+    2. Закупаемая - поставка за день до начала родителя:
+       required_date = planned_end = начало родителя - 1 день,
+       order_date = required_date - срок поставки поставщика позиции.
+    3. Изготавливаемая - planned_end = начало родителя - 1 день.
+    Дальше расчёт идёт от планового начала самой дочерней позиции
+    (без него поддерево не пересчитывается).
+
+    Резерв (slack) позиции - дней от сегодня до самого раннего "позднего
+    старта" в её поддереве (дата заказа закупаемой, плановое начало
+    изготавливаемой); отрицательный - график уже сорван. Критический путь -
+    цепочка от корня через дочерние позиции с минимальным резервом.
+    """
+
+    def __init__(self, root: ProjectItem, batch_size: int = DEFAULT_BATCH_SIZE, today: Optional[date] = None):
+        self.root = root
+        self.batch_size = batch_size
+        self.today = today or timezone.now().date()
+
+    def _load(self):
+        rows = ProjectItem.objects.filter(
+            Q(pk=self.root.pk) | Q(tree_path__startswith=self.root.tree_path)
+        ).values(*NODE_VALUES)
+        nodes = {row['id']: row for row in rows}
+        children = defaultdict(list)
+        for row in nodes.values():
+            if row['id'] != self.root.pk and row['parent_item_id'] in nodes:
+                children[row['parent_item_id']].append(row['id'])
+
+        pairs = {
+            (row['nomenclature_item_id'], row['supplier_id'])
+            for row in nodes.values()
+            if row['supplier_id'] and row['nomenclature_item_id']
+        }
+        lead_times = {}
+        if pairs:
+            for nomenclature_id, supplier_id, days in NomenclatureSupplier.objects.filter(
+                nomenclature_item_id__in={nomenclature_id for nomenclature_id, _ in pairs},
+                supplier_id__in={supplier_id for _, supplier_id in pairs},
+                is_active=True,
+            ).values_list('nomenclature_item_id', 'supplier_id', 'delivery_days'):
+                lead_times[(nomenclature_id, supplier_id)] = days or 0
+        return nodes, children, lead_times
+
+    @staticmethod
+    def _child_dates(child, parent_start, lead_times) -> Dict[str, Optional[date]]:
+        if _is_purchased(child):
+            if child['purchase_by_contractor']:
+                return {'required_date': None, 'order_date': None, 'planned_end': None}
+            delivery_date = parent_start - timedelta(days=1)
+            lead_time_days = lead_times.get((child['nomenclature_item_id'], child['supplier_id']), 0)
+            return {
+                'required_date': delivery_date,
+                'order_date': delivery_date - timedelta(days=lead_time_days),
+                'planned_end': delivery_date,
+            }
+        return {'planned_end': parent_start - timedelta(days=1)}
+
+    @staticmethod
+    def _latest_start(row) -> Optional[date]:
+        if _is_purchased(row):
+            return None if row['purchase_by_contractor'] else row['order_date']
+        return row['planned_start']
+
+    def reschedule(self, dry_run: bool = False) -> ScheduleResult:
+        started = time.monotonic()
+        result = ScheduleResult(root_id=self.root.pk, dry_run=dry_run)
+        if not self.root.planned_start:
+            return result
+
+        nodes, children, lead_times = self._load()
+        root = nodes.get(self.root.pk)
+        if root is None:
+            return result
+
+        # Прямой проход от корня: родители обрабатываются раньше детей
+        order = [root['id']]
+        new_values = {}
+        index = 0
+        while index < len(order):
+            parent = nodes[order[index]]
+            index += 1
+            parent_start = parent['planned_start']
+            if not parent_start:
+                continue
+            for child_id in children.get(parent['id'], ()):
+                child = nodes[child_id]
+                dates = self._child_dates(child, parent_start, lead_times)
+                changed = {
+                    name: {'old': child[name], 'new': value}
+                    for name, value in dates.items()
+                    if child[name] != value
+                }
+                child.update(dates)
+                if changed:
+                    new_values[child_id] = changed
+                order.append(child_id)
+        result.scheduled = len(order) - 1
+
+        # Обратный проход: самый ранний поздний старт поддерева
+        earliest = {}
+        for node_id in reversed(order):
+            candidates = [self._latest_start(nodes[node_id])]
+            candidates += [earliest[child_id] for child_id in children.get(node_id, ()) if child_id in earliest]
+            candidates = [value for value in candidates if value]
+            if candidates:
+                earliest[node_id] = min(candidates)
+
+        def slack(node_id):
+            return (earliest[node_id] - self.today).days if node_id in earliest else None
+
+        result.changes = [
+            {
+                'id': node_id,
+                'item_number': nodes[node_id]['item_number'],
+                'name': nodes[node_id]['name'],
+                'changes': changed,
+                'slack_days': slack(node_id),
+            }
+            for node_id, changed in new_values.items()
+        ]
+
+        node_id = root['id']
+        while node_id is not None:
+            row = nodes[node_id]
+            result.critical_path.append({
+                'id': node_id,
+                'item_number': row['item_number'],
+                'name': row['name'],
+                'latest_start': self._latest_start(row),
+                'slack_days': slack(node_id),
+            })
+            scheduled_children = [child_id for child_id in children.get(node_id, ()) if child_id in earliest]
+            node_id = min(
+                scheduled_children,
+                key=lambda child_id: (earliest[child_id], nodes[child_id]['item_number'] or 0),
+                default=None,
+            )
+
+        if new_values and not dry_run:
+            self._write(new_values)
+
+        result.elapsed = time.monotonic() - started
+        logger.info(
+            "Project schedule for item %s: %s items, %s changed%s in %.2fs",
+            self.root.pk, result.scheduled, result.changed, ' (dry run)' if dry_run else '', result.elapsed,
+        )
+        return result
+
+    def _write(self, new_values):
+        ids = list(new_values)
+        with transaction.atomic():
+            for start in range(0, len(ids), self.batch_size):
+                items = list(ProjectItem.objects.filter(id__in=ids[start:start + self.batch_size]))
+                for item in items:
+                    for name, change in new_values[item.id].items():
+                        setattr(item, name, change['new'])
+                bulk_update_with_history(items, ProjectItem, list(DATE_FIELDS), batch_size=self.batch_size)
+            # bulk_update не отправляет сигналы
+            DashboardSnapshotStore.invalidate([self.root.project_id])
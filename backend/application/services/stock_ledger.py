@@ -0,0 +1,277 @@
+"""
+Stock Ledger.
+
+Concurrency-safe changes of StockItem quantities: the affected stock items
+are locked (select_for_update, in id order) for the rest of the transaction,
+a batch of moves is applied to the locked rows in order, balance_after of
+every StockMovement is taken from the running balance and the result is
+written with bulk updates/inserts (history in batch). Reconciliation
+recomputes balances from StockMovement and reports drift.
+"""
+
+import logging
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, Exists, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Abs, Coalesce
+from django.utils import timezone
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+
+from infrastructure.persistence.models import StockItem, StockMovement
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+STOCK_FIELDS = ['quantity', 'reserved_quantity', 'updated_at', 'version']
+# Реквизиты движения, которые можно передать в StockMove.details
+MOVEMENT_DETAILS = (
+    'project', 'project_id',
+    'project_item', 'project_item_id',
+    'destination_warehouse', 'destination_warehouse_id',
+    'source_document',
+    'performed_by', 'performed_by_id',
+    'reason',
+    'notes',
+)
+# Исторически расход по этим типам хранится положительным количеством
+POSITIVE_OUTBOUND_TYPES = ('issue',)
+
+# Проверки остатка после движения
+CHECK_STOCK = 'stock'  # количество не отрицательно
+CHECK_AVAILABLE = 'available'  # количество не меньше резерва
+
+ZERO = Decimal('0')
+QUANTITY = DecimalField(max_digits=15, decimal_places=3)
+
+
+class InsufficientStock(ValueError):
+    """Движение уводит остаток ниже допустимого."""
+
+
+@dataclass
+class StockMove:
+    """
+    Изменение складской позиции.
+
+    quantity - изменение количества (со знаком), reserved - изменение резерва.
+    movement_type=None - только резерв, без записи StockMovement.
+    count - инвентаризация: количество становится равным count,
+    quantity движения вычисляется по заблокированному остатку.
+    """
+
+    stock_item_id: object
+    quantity: Decimal = ZERO
+    movement_type: Optional[str] = None
+    reserved: Decimal = ZERO
+    count: Optional[Decimal] = None
+    check: Optional[str] = None
+    details: Dict[str, object] = field(default_factory=dict)
+
+
+def recorded_quantity(movement_type: str, quantity: Decimal) -> Decimal:
+    """Количество в StockMovement для изменения остатка quantity."""
+    return abs(quantity) if movement_type in POSITIVE_OUTBOUND_TYPES else quantity
+
+
+def signed_quantity():
+    """Выражение: изменение остатка по строке StockMovement."""
+    return Case(
+        When(movement_type__in=POSITIVE_OUTBOUND_TYPES, then=-Abs(F('quantity'))),
+        default=F('quantity'),
+        output_field=QUANTITY,
+    )
+
+
+class StockLedger:
+    """
+    Складской журнал: изменение остатков под блокировкой строк.
+
+    Все вызовы должны выполняться внутри transaction.atomic() (apply
+    открывает её сам) - блокировки держатся до конца транзакции, так что
+    параллельные поступления и списания по одной позиции выполняются
+    по очереди и не теряют изменения друг друга.
+
+    lock() возвращает заблокированные позиции: решения "хватает ли
+    остатка" нужно принимать по ним, а не по ранее прочитанным объектам.
+    """
+
+    def __init__(self, user=None, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self._locked: Dict[object, StockItem] = {}
+
+    def lock(self, stock_items) -> Dict[object, StockItem]:
+        """
+        Заблокировать позиции (id, объекты или queryset) и вернуть их
+        актуальные версии: id -> StockItem.
+        """
+        if hasattr(stock_items, 'values_list'):
+            ids = set(stock_items.values_list('id', flat=True))
+        else:
+            ids = {getattr(stock_item, 'pk', stock_item) for stock_item in stock_items}
+
+        missing = ids - self._locked.keys()
+        if missing:
+            # Порядок блокировки по id - без взаимных блокировок между транзакциями
+            for stock_item in StockItem.objects.select_for_update().filter(id__in=missing).order_by('id'):
+                self._locked[stock_item.id] = stock_item
+        return {stock_id: self._locked[stock_id] for stock_id in ids if stock_id in self._locked}
+
+    def get(self, stock_item_id) -> StockItem:
+        """Заблокированная позиция."""
+        return self.lock([stock_item_id])[stock_item_id]
+
+    def apply(self, moves: Iterable[StockMove]) -> List[StockMovement]:
+        """
+        Применить движения по порядку. Возвращает созданные StockMovement
+        (остаток после движения - по текущему заблокированному остатку).
+        """
+        moves = list(moves)
+        if not moves:
+            return []
+
+        with transaction.atomic():
+            self.lock({move.stock_item_id for move in moves})
+
+            movements, touched = [], {}
+            try:
+                for move in moves:
+                    stock_item = self._locked.get(move.stock_item_id)
+                    if stock_item is None:
+                        raise StockItem.DoesNotExist(f"Складская позиция {move.stock_item_id} не найдена")
+                    touched[stock_item.id] = stock_item
+
+                    quantity = move.quantity
+                    if move.count is not None:
+                        quantity = move.count - stock_item.quantity
+                    stock_item.quantity += quantity
+                    stock_item.reserved_quantity += move.reserved
+                    self._check(stock_item, move, quantity)
+
+                    if move.movement_type and (quantity or move.count is None):
+                        movements.append(self._movement(stock_item, move, quantity))
+            except Exception:
+                # Изменения в памяти не записаны - при повторной блокировке позиции перечитываются
+                for stock_id in touched:
+                    self._locked.pop(stock_id, None)
+                raise
+
+            now = timezone.now()
+            for stock_item in touched.values():
+                stock_item.updated_at = now
+                stock_item.version += 1
+            bulk_update_with_history(
+                list(touched.values()), StockItem, STOCK_FIELDS,
+                batch_size=self.batch_size,
+                default_user=self.user,
+            )
+            if movements:
+                bulk_create_with_history(movements, StockMovement, batch_size=self.batch_size, default_user=self.user)
+
+        logger.debug("Stock ledger: %s moves, %s stock items, %s movements", len(moves), len(touched), len(movements))
+        return movements
+
+    def _movement(self, stock_item, move, quantity) -> StockMovement:
+        details = {name: value for name, value in move.details.items() if name in MOVEMENT_DETAILS}
+        if 'performed_by' not in details and 'performed_by_id' not in details:
+            details['performed_by'] = self.user
+        return StockMovement(
+            stock_item=stock_item,
+            movement_type=move.movement_type,
+            quantity=recorded_quantity(move.movement_type, quantity),
+            balance_after=stock_item.quantity,
+            **details,
+        )
+
+    def release_reserved(self, reservations) -> List[StockMovement]:
+        """
+        Снять резервы (StockReservation) с позиций склада; резерв
+        позиции не уходит ниже нуля. Статус резервов не меняется.
+        """
+        reservations = list(reservations)
+        with transaction.atomic():
+            stock = self.lock({reservation.stock_item_id for reservation in reservations})
+            reserved = {stock_id: stock_item.reserved_quantity for stock_id, stock_item in stock.items()}
+
+            moves = []
+            for reservation in reservations:
+                release = min(reservation.quantity, max(reserved.get(reservation.stock_item_id, ZERO), ZERO))
+                if release > 0:
+                    reserved[reservation.stock_item_id] -= release
+                    moves.append(StockMove(reservation.stock_item_id, reserved=-release))
+            return self.apply(moves)
+
+    @staticmethod
+    def _check(stock_item, move, quantity):
+        if move.check == CHECK_STOCK and stock_item.quantity < 0:
+            raise InsufficientStock(
+                f"Недостаточно {stock_item.nomenclature_item} на складе. "
+                f"Доступно: {stock_item.quantity - quantity}, требуется: {abs(quantity)}"
+            )
+        if move.check == CHECK_AVAILABLE and stock_item.quantity < stock_item.reserved_quantity:
+            available = (stock_item.quantity - quantity) - (stock_item.reserved_quantity - move.reserved)
+            raise InsufficientStock(f"Недостаточно товара на складе. Доступно: {available}")
+
+    # ------------------------------------------------------------------
+    # Reconciliation
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def reconcile(stock_item_ids=None) -> List[dict]:
+        """
+        Сверка остатков с журналом движений. Возвращает позиции, у которых
+        количество расходится с суммой движений или с остатком после
+        последнего движения.
+
+        Движения одной пачки могут иметь одинаковое время: остаток сверяется
+        со всеми движениями с последним временем (совпадение с любым из них -
+        не расхождение), в отчёт попадает остаток последнего из них по id.
+        """
+        # Мягко удалённые движения в журнал не входят - и в сумме, и в количестве
+        movements = StockMovement.objects.filter(stock_item_id=OuterRef('pk'), deleted_at__isnull=True)
+        totals = movements.order_by().values('stock_item_id')
+        latest = movements.order_by('-performed_at', '-created_at', '-id')
+
+        queryset = StockItem.objects.all()
+        if stock_item_ids is not None:
+            queryset = queryset.filter(id__in=stock_item_ids)
+
+        rows = queryset.annotate(
+            movement_count=Coalesce(Subquery(totals.annotate(count=Count('id')).values('count')), Value(0)),
+            ledger_quantity=Coalesce(
+                Subquery(totals.annotate(total=Sum(signed_quantity())).values('total'), output_field=QUANTITY),
+                Value(ZERO, output_field=QUANTITY),
+            ),
+            last_balance=Subquery(latest.values('balance_after')[:1], output_field=QUANTITY),
+            last_performed_at=Subquery(latest.values('performed_at')[:1]),
+            last_created_at=Subquery(latest.values('created_at')[:1]),
+        ).annotate(
+            last_balance_matches=Exists(movements.filter(
+                performed_at=OuterRef('last_performed_at'),
+                created_at=OuterRef('last_created_at'),
+                balance_after=OuterRef('quantity'),
+            )),
+        ).values(
+            'id', 'warehouse_id', 'nomenclature_item_id', 'quantity',
+            'movement_count', 'ledger_quantity', 'last_balance', 'last_balance_matches',
+        ).order_by('id')
+
+        drift = []
+        for row in rows.iterator():
+            ledger_drift = row['quantity'] - row['ledger_quantity']
+            if row.pop('last_balance_matches') or row['last_balance'] is None:
+                balance_drift = ZERO
+            else:
+                balance_drift = row['quantity'] - row['last_balance']
+            if ledger_drift or balance_drift:
+                row['ledger_drift'] = ledger_drift
+                row['balance_drift'] = balance_drift
+                drift.append(row)
+
+        if drift:
+            logger.warning("Stock ledger drift in %s stock items", len(drift))
+        return drift
@@ -0,0 +1,239 @@
+"""
+Project Subtree Updates.
+
+Bulk mutation of a ProjectItem and its subtree: the subtree is read with one
+tree_path query, per-category rules are applied to the items in memory,
+default suppliers come from one preloaded NomenclatureSupplier map, and only
+changed rows are written with bulk_update (history records in batch).
+"""
+
+import logging
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from django.db import transaction
+from django.db.models import Q
+from simple_history.utils import bulk_update_with_history
+
+from infrastructure.persistence.models import (
+    NomenclatureSupplier,
+    ProjectItem,
+    PurchaseStatusChoices,
+)
+from infrastructure.persistence.models.project import PROGRESS_UPDATE_FIELDS
+
+from .dashboard import DashboardSnapshotStore
+from .progress import ProgressTracker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+# Больше изменённых позиций - прогресс проекта пересчитывается целиком
+PROPAGATE_LIMIT = 50
+
+# Поля, которые могут менять правила (имя поля -> атрибут)
+MUTABLE_FIELDS = {
+    'responsible': 'responsible_id',
+    'manufacturer_type': 'manufacturer_type',
+    'contractor': 'contractor_id',
+    'material_supply_type': 'material_supply_type',
+    'contractor_status': 'contractor_status',
+    'manufacturing_status': 'manufacturing_status',
+    'purchase_by_contractor': 'purchase_by_contractor',
+    'purchase_status': 'purchase_status',
+    'supplier': 'supplier_id',
+    'planned_start': 'planned_start',
+    'planned_end': 'planned_end',
+    'required_date': 'required_date',
+    'order_date': 'order_date',
+}
+
+# rule(item, updater) -> True, если позиция учитывается в updated_count
+Rule = Callable[[ProjectItem, 'SubtreeUpdater'], bool]
+
+
+def _uuid(value) -> Optional[uuid.UUID]:
+    return value if value is None or isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+@dataclass
+class SubtreeUpdateResult:
+    """Result of a subtree update."""
+
+    updated_count: int
+    changed_count: int
+
+
+class SubtreeUpdater:
+    """
+    Массовое изменение позиции проекта и (при cascade) всех её потомков.
+
+    Поддерево - позиции, достижимые от корня через неудалённые дочерние
+    (как при рекурсии по children.all()). Правило вызывается для каждой
+    позиции в порядке обхода (родители раньше детей) и меняет её в памяти;
+    в БД записываются только изменившиеся поля изменившихся позиций.
+    После записи пересчитывается прогресс (если менялись влияющие на него
+    поля) и сбрасывается снимок дашборда проекта.
+    """
+
+    def __init__(self, root: ProjectItem, cascade: bool = True, user=None, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.root = root
+        self.cascade = cascade
+        self.user = user
+        self.batch_size = batch_size
+        self._suppliers = None
+
+    def items(self) -> List[ProjectItem]:
+        """Корень и поддерево в порядке обхода в ширину."""
+        queryset = ProjectItem.objects.select_related('nomenclature_item__catalog_category')
+        if not self.cascade:
+            return list(queryset.filter(pk=self.root.pk))
+
+        nodes = {
+            item.id: item
+            for item in queryset.filter(Q(pk=self.root.pk) | Q(tree_path__startswith=self.root.tree_path))
+        }
+        children = defaultdict(list)
+        for item in nodes.values():
+            if item.id != self.root.pk and item.parent_item_id in nodes:
+                children[item.parent_item_id].append(item)
+
+        ordered = [nodes[self.root.pk]] if self.root.pk in nodes else []
+        for item in ordered:
+            ordered.extend(children.get(item.id, ()))
+        return ordered
+
+    def default_supplier_id(self, nomenclature_id):
+        """Приоритетный (иначе любой активный) поставщик номенклатуры."""
+        return self._suppliers.get(nomenclature_id)
+
+    def _load_suppliers(self, items):
+        nomenclature_ids = {
+            item.nomenclature_item_id for item in items
+            if item.supplier_id is None and item.nomenclature_item_id is not None
+        }
+        self._suppliers = {}
+        if not nomenclature_ids:
+            return
+        # Порядок как у NomenclatureSupplier.Meta.ordering: приоритетный, затем самый быстрый
+        for nomenclature_id, supplier_id in NomenclatureSupplier.objects.filter(
+            nomenclature_item_id__in=nomenclature_ids,
+            is_active=True,
+            supplier__isnull=False,
+        ).order_by('-is_primary', 'delivery_days').values_list('nomenclature_item_id', 'supplier_id'):
+            self._suppliers.setdefault(nomenclature_id, supplier_id)
+
+    def apply(self, rule: Rule) -> SubtreeUpdateResult:
+        items = self.items()
+        self._load_suppliers(items)
+
+        updated_count = 0
+        changed: Dict[object, ProjectItem] = {}
+        changed_fields = set()
+        for item in items:
+            before = {name: getattr(item, attr) for name, attr in MUTABLE_FIELDS.items()}
+            if rule(item, self):
+                updated_count += 1
+            fields = {name for name, attr in MUTABLE_FIELDS.items() if getattr(item, attr) != before[name]}
+            if fields:
+                changed[item.id] = item
+                changed_fields |= fields
+
+        if changed:
+            self._write(list(changed.values()), sorted(changed_fields))
+
+        logger.info(
+            "Subtree update of item %s: %s items, %s counted, %s changed",
+            self.root.pk, len(items), updated_count, len(changed),
+        )
+        return SubtreeUpdateResult(updated_count=updated_count, changed_count=len(changed))
+
+    def _write(self, items, fields):
+        with transaction.atomic():
+            bulk_update_with_history(
+                items, ProjectItem, fields,
+                batch_size=self.batch_size,
+                default_user=self.user,
+            )
+
+            # bulk_update не отправляет сигналы и не пересчитывает прогресс
+            if PROGRESS_UPDATE_FIELDS.intersection(fields):
+                if len(items) > PROPAGATE_LIMIT:
+                    ProgressTracker().rebuild(self.root.project_id)
+                else:
+                    ProgressTracker().propagate(item_ids=[item.id for item in items])
+            DashboardSnapshotStore.invalidate([self.root.project_id])
+
+    # ------------------------------------------------------------------
+    # Rules
+    # ------------------------------------------------------------------
+
+    def set_responsible(self, responsible_id) -> SubtreeUpdateResult:
+        responsible_id = _uuid(responsible_id)
+
+        def rule(item, updater):
+            item.responsible_id = responsible_id
+            return True
+
+        return self.apply(rule)
+
+    def set_contractor(self, contractor_id, material_supply_type='our_supply') -> SubtreeUpdateResult:
+        """
+        Изготавливаемые - передаются подрядчику (статус 'sent_to_contractor',
+        плановое начало очищается). Закупаемые при снабжении подрядчиком
+        закупает подрядчик; иначе снимается признак закупки подрядчиком.
+        """
+        contractor_id = _uuid(contractor_id)
+
+        def rule(item, updater):
+            if not item.is_purchased:
+                item.manufacturer_type = 'contractor'
+                item.contractor_id = contractor_id
+                item.material_supply_type = material_supply_type
+                item.contractor_status = 'sent_to_contractor'
+                # Нам не важно, когда подрядчик начнёт - важна только дата окончания
+                item.planned_start = None
+                return True
+
+            if material_supply_type == 'contractor_supply':
+                item.purchase_by_contractor = True
+                item.purchase_status = PurchaseStatusChoices.WAITING_ORDER
+                item.supplier_id = None
+                item.required_date = None
+                item.order_date = None
+                item.planned_end = None
+            elif item.purchase_by_contractor:
+                item.purchase_by_contractor = False
+                item.purchase_status = PurchaseStatusChoices.WAITING_ORDER
+            return False
+
+        return self.apply(rule)
+
+    def set_internal_manufacturer(self) -> SubtreeUpdateResult:
+        """
+        Изготавливаемые - "Своими силами". Закупаемые закупаем мы:
+        статус 'Ожидает заказа', при отсутствии поставщика - поставщик
+        по умолчанию для номенклатуры.
+        """
+        def rule(item, updater):
+            if item.is_purchased:
+                item.purchase_by_contractor = False
+                item.purchase_status = PurchaseStatusChoices.WAITING_ORDER
+                if item.supplier_id is None and item.nomenclature_item_id is not None:
+                    supplier_id = updater.default_supplier_id(item.nomenclature_item_id)
+                    if supplier_id:
+                        item.supplier_id = supplier_id
+                return True
+
+            item.manufacturer_type = 'internal'
+            item.contractor_id = None
+            item.material_supply_type = 'our_supply'
+            # Поле не nullable - пустая строка вместо None
+            item.contractor_status = ''
+            if item.manufacturing_status is None:
+                item.manufacturing_status = 'not_started'
+            return True
+
+        return self.apply(rule)
@@ -6,7 +6,6 @@ Celery tasks for BOM-related operations.
 
 from celery import shared_task
 from django.db import transaction
-from django.utils import timezone
 import logging
 
 logger = logging.getLogger(__name__)
@@ -94,6 +93,34 @@ def validate_bom_structure(self, bom_id: str):
         self.retry(countdown=60)
 
 
+@shared_task(bind=True)
+def clone_bom_structure(self, bom_id: str, name: str, root_item_id: str = None):
+    """
+    Clone BOM structure in background (for very large BOMs).
+    
+    Progress is reported as PROGRESS state with meta {'done', 'total'}.
+    """
+    from application.services.bom_clone import BOMCloneError, BOMCloner
+    from infrastructure.persistence.models import BOMStructure
+    
+    def report(done, total):
+        self.update_state(state='PROGRESS', meta={'done': done, 'total': total})
+    
+    try:
+        source = BOMStructure.objects.get(id=bom_id)
+        new_bom = BOMCloner(source, name, root_item_id=root_item_id, progress=report).clone()
+    except BOMStructure.DoesNotExist:
+        return {'error': 'BOM not found'}
+    except BOMCloneError as e:
+        return {'error': str(e)}
+    
+    return {
+        'bom_id': str(new_bom.id),
+        'source_bom_id': bom_id,
+        'items_count': new_bom.items.count(),
+    }
+
+
 @shared_task(bind=True, max_retries=3)
 def recalculate_bom_paths(self, bom_id: str):
     """
@@ -136,87 +163,26 @@ def recalculate_bom_paths(self, bom_id: str):
         self.retry(countdown=60)
 
 
-@shared_task
-def export_bom_to_excel(bom_id: str, user_id: str):
+@shared_task(bind=True)
+def export_bom_to_excel(self, bom_id: str, user_id: str = None):
     """
     Export BOM to Excel file.
     
-    Creates Excel file and stores it for download.
+    Multi-level specification (through active sub-BOMs) written by the
+    streaming export engine and stored for download by user_id
+    (GET /exports/download/?task_id=).
     """
-    from infrastructure.persistence.models import BOMStructure
-    import openpyxl
-    from openpyxl.styles import Font, Alignment, Border, Side
-    from django.conf import settings
-    import os
+    from application.services.export import FORMAT_XLSX, KIND_BOM, ExportError, build_dataset, create_export_dir, save_export
     
+    directory = create_export_dir(user_id, self.request.id)
     try:
-        bom = BOMStructure.objects.get(id=bom_id)
-        items = bom.items.select_related('nomenclature').order_by('path')
-        
-        # Create workbook
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "BOM"
-        
-        # Header style
-        header_font = Font(bold=True)
-        
-        # Headers
-        headers = [
-            'Поз.', 'Уровень', 'Обозначение', 'Наименование',
-            'Категория', 'Кол-во', 'Ед.', 'Примечание'
-        ]
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-        
-        # Data
-        for row, item in enumerate(items, 2):
-            indent = "  " * item.level
-            ws.cell(row=row, column=1, value=item.position_number)
-            ws.cell(row=row, column=2, value=item.level)
-            ws.cell(row=row, column=3, value=f"{indent}{item.nomenclature.code}")
-            ws.cell(row=row, column=4, value=item.nomenclature.name)
-            ws.cell(row=row, column=5, value=item.nomenclature.get_category_display())
-            ws.cell(row=row, column=6, value=float(item.quantity))
-            ws.cell(row=row, column=7, value=item.unit)
-            ws.cell(row=row, column=8, value=item.notes or '')
-        
-        # Auto-width columns
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Save file
-        export_dir = os.path.join(settings.MEDIA_ROOT, 'exports', 'bom')
-        os.makedirs(export_dir, exist_ok=True)
-        
-        filename = f"BOM_{bom.code}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        filepath = os.path.join(export_dir, filename)
-        wb.save(filepath)
-        
-        logger.info(f"Exported BOM {bom.code} to {filename}")
-        
-        return {
-            'bom_id': bom_id,
-            'filename': filename,
-            'filepath': filepath,
-            'download_url': f"/media/exports/bom/{filename}",
-        }
-        
-    except BOMStructure.DoesNotExist:
-        return {'error': 'BOM not found'}
-    except Exception as e:
-        logger.error(f"Error exporting BOM {bom_id}: {e}")
+        dataset = build_dataset(KIND_BOM, object_id=bom_id)
+    except ExportError as e:
         return {'error': str(e)}
+    
+    result = save_export(dataset, FORMAT_XLSX, directory)
+    logger.info(f"Exported BOM {bom_id} to {result['filename']}")
+    return {'bom_id': bom_id, **result}
 
 
 @shared_task
@@ -0,0 +1,46 @@
+"""
+Catalog Tasks.
+
+Celery tasks for catalog (nomenclature) operations.
+"""
+
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True)
+def import_nomenclature_rows(self, token: str, user_id: str):
+    """
+    Create nomenclature items from a stored import preview (large files).
+    
+    Progress is reported as PROGRESS state with meta {'done', 'total'}.
+    """
+    from application.services.nomenclature_import import (
+        discard_preview,
+        import_rows,
+        load_preview,
+        recheck_existing,
+    )
+    from infrastructure.persistence.models import User
+    
+    preview = load_preview(token, user_id)
+    if preview is None:
+        return {'error': 'Import preview not found or expired'}
+    
+    errors = recheck_existing(preview['rows'])
+    if errors:
+        return {'error': 'Import has errors', 'errors': [e.to_dict() for e in errors]}
+    
+    def report(done, total):
+        self.update_state(state='PROGRESS', meta={'done': done, 'total': total})
+    
+    user = User.objects.filter(pk=user_id).first()
+    created_ids = import_rows(preview['rows'], user=user, progress=report)
+    discard_preview(token)
+    
+    return {
+        'created': len(created_ids),
+        'created_ids': created_ids,
+    }
@@ -0,0 +1,24 @@
+"""
+Dashboard Tasks.
+
+Celery tasks for precomputed dashboard snapshots.
+"""
+
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def refresh_dashboard_snapshots(project_id: str = None):
+    """
+    Rebuild dashboard snapshots.
+    
+    Scheduled by Celery beat for all active projects; with project_id
+    rebuilds a single project (e.g. after bulk changes that bypass signals).
+    """
+    from application.services.dashboard import DashboardSnapshotStore
+    
+    entries = DashboardSnapshotStore().refresh([project_id] if project_id else None)
+    return {'refreshed': len(entries), 'project_ids': list(entries)}
@@ -0,0 +1,50 @@
+"""
+Export Tasks.
+
+Celery tasks for generating large Excel/CSV exports.
+"""
+
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True)
+def generate_export(self, kind: str, file_format: str, object_id: str = None, params: dict = None, user_id: str = None):
+    """
+    Generate an export file into EXPORT_ROOT/<user_id>/<task id>
+    (see application.services.export).
+
+    Progress is reported as PROGRESS state with meta {'done', 'total'}.
+    """
+    from application.services.export import ExportError, build_dataset, create_export_dir, save_export
+    from infrastructure.persistence.models import User
+
+    directory = create_export_dir(user_id, self.request.id)
+
+    def report(done, total):
+        self.update_state(state='PROGRESS', meta={'done': done, 'total': total})
+
+    user = User.objects.filter(pk=user_id).first() if user_id else None
+    try:
+        dataset = build_dataset(kind, object_id=object_id, params=params, user=user)
+    except ExportError as e:
+        return {'error': str(e)}
+
+    return save_export(dataset, file_format, directory, progress=report)
+
+
+@shared_task
+def cleanup_exports():
+    """
+    Remove background exports older than EXPORT_FILE_TTL.
+
+    Scheduled by Celery beat.
+    """
+    from application.services.export import cleanup_exports as remove_expired
+
+    removed = remove_expired()
+    if removed:
+        logger.info("Removed %s expired exports", removed)
+    return {'removed': removed}
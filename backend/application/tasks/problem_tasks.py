@@ -0,0 +1,33 @@
+"""
+Problem Tasks.
+
+Celery tasks that keep system problem flags of project items and
+material requirements up to date.
+"""
+
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def refresh_problem_flags(purchase_order_id: str = None):
+    """
+    Refresh problem flags.
+    
+    Scheduled by Celery beat for all project items and requirements;
+    with purchase_order_id refreshes only rows linked to the order
+    (queued by signals when the order or its lines change).
+    """
+    from application.services.problem_detection import (
+        ProblemEvaluator,
+        release_order_refresh,
+    )
+    
+    if purchase_order_id:
+        release_order_refresh(purchase_order_id)
+        result = ProblemEvaluator().refresh_purchase_order(purchase_order_id)
+        return {'purchase_order_id': purchase_order_id, **result}
+    
+    return ProblemEvaluator().refresh_all()
@@ -6,7 +6,6 @@ Celery tasks for project-related operations.
 
 from celery import shared_task
 from django.db import transaction
-from django.db.models import Sum, Max
 from django.utils import timezone
 import logging
 
@@ -18,77 +17,28 @@ def recalculate_project_progress(self, project_id: str):
     """
     Recalculate progress for a specific project.
     
-    This task recalculates:
-    - Overall project progress
-    - Parent item progress (bottom-up)
-    - Project statistics
+    Полный пересчёт сохранённого прогресса позиций (calculated_progress)
+    за один проход и прогресса проекта. В обычной работе прогресс
+    поддерживается при записи позиций; задача нужна после массовых
+    изменений в обход модели (queryset.update, загрузка данных).
     """
-    from infrastructure.persistence.models import Project, ProjectItem
+    from application.services import ProgressTracker
+    from infrastructure.persistence.models import Project
     
     try:
         project = Project.objects.get(id=project_id)
         
         with transaction.atomic():
-            items = project.items.all()
-            
-            if not items.exists():
-                project.progress_percent = 0
-                project.save(update_fields=['progress_percent'])
-                return {'project_id': project_id, 'progress': 0}
-            
-            # Calculate from leaf items up
-            # First, recalculate all leaf items
-            leaf_items = items.filter(children__isnull=True)
-            
-            # Then calculate parent items
-            for level in range(items.aggregate(max_level=Max('level'))['max_level'] or 0, -1, -1):
-                level_items = items.filter(level=level, children__isnull=False)
-                
-                for item in level_items:
-                    children = item.children.all()
-                    if children.exists():
-                        total_required = children.aggregate(
-                            total=Sum('quantity_required')
-                        )['total'] or 0
-                        total_completed = children.aggregate(
-                            total=Sum('quantity_completed')
-                        )['total'] or 0
-                        
-                        if total_required > 0:
-                            # Weight the parent's progress by children's progress
-                            child_progress = (total_completed / total_required)
-                            item.quantity_completed = item.quantity_required * child_progress
-                            item.save(update_fields=['quantity_completed'])
-            
-            # Calculate overall project progress
-            total_required = items.aggregate(
-                total=Sum('quantity_required')
-            )['total'] or 0
-            total_completed = items.aggregate(
-                total=Sum('quantity_completed')
-            )['total'] or 0
-            
-            if total_required > 0:
-                project.progress_percent = round(
-                    (total_completed / total_required) * 100, 2
-                )
-            else:
-                project.progress_percent = 0
-            
-            # Calculate actual cost
-            project.actual_cost = items.aggregate(
-                total=Sum('actual_cost')
-            )['total'] or 0
-            
-            project.save(update_fields=['progress_percent', 'actual_cost'])
+            changed = ProgressTracker().rebuild(project_id=project.id)
         
+        project.refresh_from_db(fields=['progress_percent'])
         project_label = getattr(project, 'name', None) or str(project_id)
         logger.info(f"Recalculated project {project_label}: {project.progress_percent}%")
         
         return {
             'project_id': project_id,
             'progress': float(project.progress_percent),
-            'actual_cost': float(project.actual_cost),
+            'items_changed': changed,
         }
         
     except Project.DoesNotExist:
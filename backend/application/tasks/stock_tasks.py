@@ -0,0 +1,33 @@
+"""
+Stock Tasks.
+
+Celery tasks for checking stock balances against the movement ledger.
+"""
+
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Сколько расхождений вернуть в результате задачи
+DRIFT_SAMPLE_SIZE = 50
+
+
+@shared_task
+def reconcile_stock_ledger(stock_item_ids: list = None):
+    """
+    Reconcile stock balances.
+    
+    Scheduled by Celery beat for all stock items; recomputes balances
+    from StockMovement and reports items whose quantity drifted.
+    """
+    from application.services.stock_ledger import StockLedger
+    
+    drift = StockLedger.reconcile(stock_item_ids)
+    return {
+        'drift_count': len(drift),
+        'drift': [
+            {name: str(value) if value is not None else None for name, value in row.items()}
+            for row in drift[:DRIFT_SAMPLE_SIZE]
+        ],
+    }
@@ -35,6 +35,22 @@ app.conf.beat_schedule = {
         'task': 'infrastructure.messaging.tasks.recalculation.create_progress_snapshot',
         'schedule': 86400.0,  # Every 24 hours
     },
+    'refresh-dashboard-snapshots': {
+        'task': 'application.tasks.dashboard_tasks.refresh_dashboard_snapshots',
+        'schedule': 300.0,  # Every 5 minutes
+    },
+    'refresh-problem-flags': {
+        'task': 'application.tasks.problem_tasks.refresh_problem_flags',
+        'schedule': 900.0,  # Every 15 minutes
+    },
+    'reconcile-stock-ledger': {
+        'task': 'application.tasks.stock_tasks.reconcile_stock_ledger',
+        'schedule': 86400.0,  # Every 24 hours
+    },
+    'cleanup-exports': {
+        'task': 'application.tasks.export_tasks.cleanup_exports',
+        'schedule': 3600.0,  # Every hour
+    },
 }
 
 
@@ -150,6 +150,10 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = ROOT_DIR / 'media'
 
+# Фоновые выгрузки Excel/CSV: вне MEDIA_ROOT (/media/ отдаётся без авторизации),
+# скачиваются через API. Каталог общий для backend и celery_worker.
+EXPORT_ROOT = Path(config('EXPORT_ROOT', default=str(ROOT_DIR / 'exports')))
+
 # =============================================================================
 # DEFAULT PRIMARY KEY
 # =============================================================================
@@ -221,6 +225,17 @@ CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+# Модули задач слоя application (не являются Django-приложениями, autodiscover их не видит)
+CELERY_IMPORTS = [
+    'application.tasks.bom_tasks',
+    'application.tasks.catalog_tasks',
+    'application.tasks.dashboard_tasks',
+    'application.tasks.export_tasks',
+    'application.tasks.notification_tasks',
+    'application.tasks.problem_tasks',
+    'application.tasks.project_tasks',
+    'application.tasks.stock_tasks',
+]
 
 # =============================================================================
 # CHANNELS (WebSocket)
@@ -314,3 +329,9 @@ LOGGING = {
 # Значения по умолчанию для бизнес-логики
 DEFAULT_DELIVERY_DAYS = 7  # Срок поставки по умолчанию
 PROGRESS_CALCULATION_EQUAL_WEIGHT = True  # Равный вес для расчёта прогресса
+PROJECT_ITEM_NUMBER_CACHE_SIZE = 20  # Сколько ID позиций процесс резервирует про запас
+EFFECTIVE_PERMISSIONS_CACHE_TIMEOUT = 10 * 60  # Время жизни кэша прав пользователя (сек)
+DASHBOARD_SNAPSHOT_TTL = 15 * 60  # Время жизни снимка дашборда в кэше (сек)
+PROCUREMENT_STATS_CACHE_TIMEOUT = 60  # Время жизни кэша аналитики закупок (сек)
+EXPORT_FILE_TTL = 24 * 60 * 60  # Сколько хранятся файлы фоновых выгрузок (сек)
+REFERENCE_DATA_CHECK_INTERVAL = 5  # Как часто процесс сверяет версию кэша справочников (сек)
@@ -31,6 +31,7 @@ from domain.shared.exceptions import (
 )
 
 from .entities import BOMItem, BOMVersion
+from .graph import BOMGraph
 
 
 # Valid child categories for each parent category
@@ -103,6 +104,9 @@ class BOMStructure(AggregateRoot):
     is_active: bool = True
     is_locked: bool = False  # Prevent modifications when True
     
+    # Indexes over _items (parent -> children, child -> usages)
+    _graph: BOMGraph = field(init=False, repr=False, compare=False)
+    
     def __post_init__(self):
         if not self.root_item_id:
             raise ValidationException("Root item ID is required", "root_item_id")
@@ -116,6 +120,8 @@ class BOMStructure(AggregateRoot):
                 child_category=self.root_category,
             )
             self._items.append(root_item)
+        
+        self._graph = BOMGraph(self._items)
     
     # =========================================================================
     # PROPERTIES
@@ -129,9 +135,9 @@ class BOMStructure(AggregateRoot):
     @property
     def root_item(self) -> BOMItem:
         """Get the root BOM item."""
-        for item in self._items:
-            if item.is_root:
-                return item
+        root_items = self._graph.children(None)
+        if root_items:
+            return root_items[0]
         raise ValidationException("Root item not found in BOM structure")
     
     @property
@@ -145,10 +151,7 @@ class BOMStructure(AggregateRoot):
     
     def get_children(self, parent_item_id: UUID) -> List[BOMItem]:
         """Get all direct children of an item."""
-        return [
-            item for item in self._items
-            if item.parent_item_id == parent_item_id
-        ]
+        return self._graph.children(parent_item_id)
     
     def get_item_by_child_id(
         self,
@@ -156,37 +159,15 @@ class BOMStructure(AggregateRoot):
         parent_item_id: Optional[UUID] = None
     ) -> Optional[BOMItem]:
         """Get BOM item by child nomenclature item ID."""
-        for item in self._items:
-            if item.child_item_id == child_item_id:
-                if parent_item_id is None or item.parent_item_id == parent_item_id:
-                    return item
-        return None
+        return self._graph.find(child_item_id, parent_item_id)
     
     def get_all_descendants(self, parent_item_id: UUID) -> List[BOMItem]:
         """Get all descendants (children, grandchildren, etc.) of an item."""
-        descendants = []
-        children = self.get_children(parent_item_id)
-        
-        for child in children:
-            descendants.append(child)
-            descendants.extend(self.get_all_descendants(child.child_item_id))
-        
-        return descendants
+        return self._graph.descendants(parent_item_id)
     
     def get_path_to_root(self, item_id: UUID) -> List[BOMItem]:
         """Get the path from an item to the root."""
-        path = []
-        current_id = item_id
-        
-        while current_id is not None:
-            item = self.get_item_by_child_id(current_id)
-            if item:
-                path.append(item)
-                current_id = item.parent_item_id
-            else:
-                break
-        
-        return path
+        return self._graph.path_to_root(item_id)
     
     def get_level(self, item_id: UUID) -> int:
         """Get the level (depth) of an item in the tree (root = 0)."""
@@ -259,6 +240,7 @@ class BOMStructure(AggregateRoot):
         )
         
         self._items.append(bom_item)
+        self._graph.add(bom_item)
         self.updated_by = user_id
         self.increment_version()
         
@@ -305,8 +287,10 @@ class BOMStructure(AggregateRoot):
         if children:
             if remove_descendants:
                 # Remove all descendants first
-                for child in self.get_all_descendants(child_item_id):
-                    self._items.remove(child)
+                descendants = {id(child): child for child in self.get_all_descendants(child_item_id)}
+                self._items[:] = [i for i in self._items if id(i) not in descendants]
+                for child in descendants.values():
+                    self._graph.remove(child)
             else:
                 raise BusinessRuleViolationException(
                     "HAS_CHILDREN",
@@ -314,6 +298,7 @@ class BOMStructure(AggregateRoot):
                 )
         
         self._items.remove(item)
+        self._graph.remove(item)
         self.updated_by = user_id
         self.increment_version()
         
@@ -425,9 +410,8 @@ class BOMStructure(AggregateRoot):
         child_item_id: UUID
     ) -> None:
         """Check for circular reference when adding an item."""
-        # If child_item_id is an ancestor of parent_item_id, we have a cycle
-        path = self.get_path_to_root(parent_item_id)
-        ancestor_ids = {item.child_item_id for item in path}
+        # If child_item_id is an ancestor of parent_item_id (along any usage), we have a cycle
+        ancestor_ids = self._graph.ancestors(parent_item_id)
         
         if child_item_id in ancestor_ids:
             raise CircularReferenceException(
@@ -437,7 +421,7 @@ class BOMStructure(AggregateRoot):
     def validate(self) -> None:
         """Validate aggregate invariants."""
         # Check that we have a root item
-        root_items = [item for item in self._items if item.is_root]
+        root_items = self._graph.children(None)
         if len(root_items) != 1:
             raise ValidationException(
                 f"BOM must have exactly one root item, found {len(root_items)}"
@@ -445,12 +429,13 @@ class BOMStructure(AggregateRoot):
         
         # Check that all non-root items have valid parents
         for item in self._items:
-            if not item.is_root:
-                parent = self.get_item_by_child_id(item.parent_item_id)
-                if not parent:
-                    raise ValidationException(
-                        f"Item {item.child_item_id} has invalid parent {item.parent_item_id}"
-                    )
+            if not item.is_root and not self._graph.contains(item.parent_item_id):
+                raise ValidationException(
+                    f"Item {item.child_item_id} has invalid parent {item.parent_item_id}"
+                )
+        
+        # Check that the structure has no cycles
+        self._graph.topological_order()
     
     # =========================================================================
     # CALCULATIONS
@@ -467,54 +452,49 @@ class BOMStructure(AggregateRoot):
         
         Example: If item A contains 2 of B, and B contains 3 of C,
         then total C needed for 1 A is 2 * 3 = 6.
+        
+        For several items use calculate_total_quantities() - one pass for all.
         """
-        total = Decimal('0')
-        unit = "шт"
-        
-        def find_paths(current_id: UUID, accumulated_qty: Decimal):
-            nonlocal total, unit
-            
-            for item in self._items:
-                if item.child_item_id == current_id:
-                    current_qty = accumulated_qty * item.quantity.value
-                    unit = item.quantity.unit
-                    
-                    if item.is_root:
-                        total += current_qty
-                    else:
-                        find_paths(item.parent_item_id, current_qty)
-        
-        find_paths(child_item_id, root_quantity)
-        
-        return Quantity(total, unit)
+        return self._graph.total_quantity(child_item_id, root_quantity)
+    
+    def calculate_total_quantities(
+        self,
+        root_quantity: Decimal = Decimal('1')
+    ) -> Dict[UUID, Quantity]:
+        """Total quantities of all items in one topological pass."""
+        unit = self._graph.root_unit()
+        return {
+            child_item_id: Quantity(total, unit)
+            for child_item_id, total in self._graph.total_quantities(root_quantity).items()
+        }
     
     def get_purchased_items(self) -> List[Tuple[BOMItem, Quantity]]:
         """
         Get all purchased items in the BOM with their total quantities.
         Returns list of (BOMItem, total_quantity) tuples.
         """
-        result = []
-        
-        for item in self._items:
-            if item.is_purchased:
-                total_qty = self.calculate_total_quantity(item.child_item_id)
-                result.append((item, total_qty))
+        totals = self._graph.total_quantities()
+        unit = self._graph.root_unit()
         
-        return result
+        return [
+            (item, Quantity(totals.get(item.child_item_id, Decimal('0')), unit))
+            for item in self._items
+            if item.is_purchased
+        ]
     
     def get_manufactured_items(self) -> List[Tuple[BOMItem, Quantity]]:
         """
         Get all manufactured items in the BOM with their total quantities.
         Returns list of (BOMItem, total_quantity) tuples.
         """
-        result = []
-        
-        for item in self._items:
-            if item.is_manufactured:
-                total_qty = self.calculate_total_quantity(item.child_item_id)
-                result.append((item, total_qty))
+        totals = self._graph.total_quantities()
+        unit = self._graph.root_unit()
         
-        return result
+        return [
+            (item, Quantity(totals.get(item.child_item_id, Decimal('0')), unit))
+            for item in self._items
+            if item.is_manufactured
+        ]
     
     # =========================================================================
     # FACTORY METHODS
@@ -0,0 +1,182 @@
+"""
+BOM Domain - Graph Index.
+
+In-memory indexes over BOM items for the BOMStructure aggregate.
+
+Nodes are nomenclature items, every BOMItem is an edge
+parent_item_id -> child_item_id (root items have no parent). A nomenclature
+item may be used under several parents (shared sub-assemblies), so the
+structure is a DAG rather than a tree.
+"""
+
+from __future__ import annotations
+from collections import defaultdict, deque
+from decimal import Decimal
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set
+from uuid import UUID
+
+from domain.shared.exceptions import CircularReferenceException
+from domain.shared.value_objects import Quantity
+
+if TYPE_CHECKING:
+    from .entities import BOMItem
+
+
+class BOMGraph:
+    """
+    Parent -> children and child -> usages indexes over BOM items.
+
+    Both indexes keep items in insertion order, so lookups return the same
+    item a linear scan of the item list would return first.
+    """
+
+    def __init__(self, items: Iterable[BOMItem] = ()):
+        self._children: Dict[Optional[UUID], List[BOMItem]] = defaultdict(list)
+        self._usages: Dict[UUID, List[BOMItem]] = defaultdict(list)
+        for item in items:
+            self.add(item)
+
+    # =========================================================================
+    # MAINTENANCE
+    # =========================================================================
+
+    def add(self, item: BOMItem) -> None:
+        self._children[item.parent_item_id].append(item)
+        self._usages[item.child_item_id].append(item)
+
+    def remove(self, item: BOMItem) -> None:
+        self._discard(self._children, item.parent_item_id, item)
+        self._discard(self._usages, item.child_item_id, item)
+
+    @staticmethod
+    def _discard(index, key, item) -> None:
+        items = index.get(key)
+        if not items:
+            return
+        for position, candidate in enumerate(items):
+            if candidate is item:
+                del items[position]
+                break
+        if not items:
+            del index[key]
+
+    # =========================================================================
+    # LOOKUPS
+    # =========================================================================
+
+    def children(self, parent_item_id: Optional[UUID]) -> List[BOMItem]:
+        """Direct children of a node (root items for None)."""
+        return list(self._children.get(parent_item_id, ()))
+
+    def usages(self, child_item_id: UUID) -> List[BOMItem]:
+        """All BOM items whose child is the given node."""
+        return list(self._usages.get(child_item_id, ()))
+
+    def contains(self, child_item_id: UUID) -> bool:
+        return child_item_id in self._usages
+
+    def find(self, child_item_id: UUID, parent_item_id: Optional[UUID] = None) -> Optional[BOMItem]:
+        """First item with the given child (and parent, if specified)."""
+        for item in self._usages.get(child_item_id, ()):
+            if parent_item_id is None or item.parent_item_id == parent_item_id:
+                return item
+        return None
+
+    def path_to_root(self, child_item_id: UUID) -> List[BOMItem]:
+        """Path from a node to the root via the first usage of every node."""
+        path = []
+        visited = set()
+        current_id = child_item_id
+        while current_id is not None and current_id not in visited:
+            item = self.find(current_id)
+            if item is None:
+                break
+            visited.add(current_id)
+            path.append(item)
+            current_id = item.parent_item_id
+        return path
+
+    def descendants(self, parent_item_id: UUID) -> List[BOMItem]:
+        """All descendants in depth-first pre-order (shared sub-assemblies repeat)."""
+        result = []
+        stack = list(reversed(self._children.get(parent_item_id, ())))
+        while stack:
+            item = stack.pop()
+            result.append(item)
+            stack.extend(reversed(self._children.get(item.child_item_id, ())))
+        return result
+
+    def ancestors(self, child_item_id: UUID) -> Set[UUID]:
+        """The node itself and every node above it along all usages."""
+        seen = {child_item_id}
+        queue = deque([child_item_id])
+        while queue:
+            for item in self._usages.get(queue.popleft(), ()):
+                parent_id = item.parent_item_id
+                if parent_id is not None and parent_id not in seen:
+                    seen.add(parent_id)
+                    queue.append(parent_id)
+        return seen
+
+    # =========================================================================
+    # ORDERING AND ROLLUPS
+    # =========================================================================
+
+    def topological_order(self) -> List[UUID]:
+        """
+        Nodes ordered parents-first (Kahn's algorithm).
+
+        Raises CircularReferenceException with the nodes left on a cycle.
+        """
+        in_degree: Dict[UUID, int] = defaultdict(int)
+        nodes = set(self._usages)
+        for parent_id, items in self._children.items():
+            if parent_id is None:
+                continue
+            nodes.add(parent_id)
+            for item in items:
+                in_degree[item.child_item_id] += 1
+
+        queue = deque(node for node in nodes if not in_degree[node])
+        order = []
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for item in self._children.get(node, ()):
+                in_degree[item.child_item_id] -= 1
+                if not in_degree[item.child_item_id]:
+                    queue.append(item.child_item_id)
+
+        if len(order) != len(nodes):
+            raise CircularReferenceException([node for node in nodes if in_degree[node]])
+        return order
+
+    def total_quantities(self, root_quantity: Decimal = Decimal('1')) -> Dict[UUID, Decimal]:
+        """
+        Total quantity of every node per root_quantity of the product.
+
+        One pass in topological order: a node's total is the sum over its
+        usages of parent total * usage quantity, i.e. the sum of quantity
+        products over all paths from the root.
+        """
+        totals: Dict[UUID, Decimal] = defaultdict(Decimal)
+        for item in self._children.get(None, ()):
+            totals[item.child_item_id] += root_quantity * item.quantity.value
+
+        for node in self.topological_order():
+            total = totals.get(node)
+            if not total:
+                continue
+            for item in self._children.get(node, ()):
+                totals[item.child_item_id] += total * item.quantity.value
+        return dict(totals)
+
+    def root_unit(self) -> str:
+        root_items = self._children.get(None)
+        return root_items[0].quantity.unit if root_items else "шт"
+
+    def total_quantity(self, child_item_id: UUID, root_quantity: Decimal = Decimal('1')) -> Quantity:
+        return Quantity(
+            self.total_quantities(root_quantity).get(child_item_id, Decimal('0')),
+            self.root_unit(),
+        )
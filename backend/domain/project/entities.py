@@ -34,8 +34,8 @@ class ProjectItem(AuditableEntity):
     """
     
     project_id: UUID
-    bom_item_id: Optional[UUID] = None  # Reference to source BOM item
     nomenclature_item_id: UUID  # Reference to catalog item
+    bom_item_id: Optional[UUID] = None  # Reference to source BOM item
     parent_project_item_id: Optional[UUID] = None  # For tree structure
     
     # Item identification
@@ -279,8 +279,8 @@ class UserAssignment(AuditableEntity):
     """
     
     project_id: UUID
-    project_item_id: Optional[UUID] = None  # None = project-level assignment
     user_id: UUID
+    project_item_id: Optional[UUID] = None  # None = project-level assignment
     role: str = "responsible"  # responsible, reviewer, observer
     assigned_at: datetime = field(default_factory=datetime.utcnow)
     assigned_by_id: Optional[UUID] = None
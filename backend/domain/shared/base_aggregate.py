@@ -13,7 +13,7 @@ from .base_entity import AuditableEntity
 from .events import DomainEvent
 
 
-@dataclass
+@dataclass(kw_only=True)
 class AggregateRoot(AuditableEntity):
     """
     Base class for all aggregate roots.
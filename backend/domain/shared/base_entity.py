@@ -13,7 +13,7 @@ from typing import Any, Optional
 from uuid import UUID, uuid4
 
 
-@dataclass
+@dataclass(kw_only=True)
 class Entity(ABC):
     """
     Base class for all domain entities.
@@ -38,7 +38,7 @@ class Entity(ABC):
         return f"<{self.__class__.__name__} id={self.id}>"
 
 
-@dataclass
+@dataclass(kw_only=True)
 class VersionedEntity(Entity):
     """
     Entity with optimistic locking support.
@@ -53,7 +53,7 @@ class VersionedEntity(Entity):
         self.updated_at = datetime.utcnow()
 
 
-@dataclass
+@dataclass(kw_only=True)
 class AuditableEntity(VersionedEntity):
     """
     Entity with full audit trail support.
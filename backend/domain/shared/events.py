@@ -12,7 +12,7 @@ from typing import Any, Dict, Optional
 from uuid import UUID, uuid4
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, kw_only=True)
 class DomainEvent:
     """
     Base class for all domain events.
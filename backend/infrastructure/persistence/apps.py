@@ -8,5 +8,5 @@ class PersistenceConfig(AppConfig):
     verbose_name = 'PDM Persistence Layer'
     
     def ready(self):
-        # Import signal handlers if any
-        pass
+        # Import signal handlers
+        from . import signals  # noqa: F401
@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер клонирования BOM (BOMCloner) на синтетических структурах заданного размера: "
+        "число запросов и время. Структуры строятся из существующей номенклатуры "
+        "внутри транзакции, которая откатывается - данные не изменяются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,50000', help='Размеры BOM (строк) через запятую')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        from infrastructure.persistence.models import BOMStructure, NomenclatureItem
+
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        taken = BOMStructure.all_objects.filter(is_active=True).values('root_item_id')
+        free_ids = list(
+            NomenclatureItem.objects.exclude(id__in=taken).values_list('id', flat=True)[:2]
+        )
+        child_ids = list(NomenclatureItem.objects.values_list('id', flat=True)[:500])
+        if len(free_ids) < 2 or len(child_ids) < 2:
+            raise CommandError('Нужны как минимум две позиции номенклатуры без активной структуры.')
+
+        for size in sizes:
+            try:
+                with transaction.atomic():
+                    self._run(size, free_ids[0], free_ids[1], child_ids, options['batch_size'])
+                    raise _Rollback()
+            except _Rollback:
+                pass
+
+    def _run(self, size, source_root_id, target_root_id, child_ids, batch_size):
+        from application.services.bom_clone import BOMCloner
+        from infrastructure.persistence.models import BOMItem, BOMStructure
+
+        source = BOMStructure.objects.create(name=f'benchmark {size}', root_item_id=source_root_id)
+        # Дерево: первые строки - под корнем, остальные - под дочерними элементами предыдущих
+        items = []
+        for index in range(size):
+            parent_id = source_root_id if index < 10 else child_ids[(index // 10) % len(child_ids)]
+            items.append(BOMItem(
+                bom=source,
+                parent_item_id=parent_id,
+                child_item_id=child_ids[index % len(child_ids)],
+                position=index,
+            ))
+        BOMItem.objects.bulk_create(items, batch_size=5000)
+
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            clone = BOMCloner(source, f'benchmark {size} copy', root_item_id=target_root_id, batch_size=batch_size).clone()
+            elapsed = time.perf_counter() - started
+
+        copied = BOMItem.objects.filter(bom=clone).count()
+        self.stdout.write(
+            f'{size:>7} строк   скопировано: {copied:>7}   запросов: {len(context.captured_queries):>4}   '
+            f'время: {elapsed * 1000:9.1f} мс'
+        )
@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер расчёта дашборда руководителя: число запросов и время "
+        "однопроходной сборки по всем активным проектам в сравнении с "
+        "раздельной сборкой по проектам и чтением готовых снимков из кэша. "
+        "Данные не изменяет (кэш снимков перезаписывается)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3, help='Количество повторов каждого замера')
+
+    def handle(self, *args, **options):
+        from application.services.dashboard import DashboardBuilder, DashboardSnapshotStore
+
+        repeat = max(options['repeat'], 1)
+        projects = list(DashboardBuilder().active_projects())
+        self.stdout.write(f'Активных проектов: {len(projects)}')
+
+        def single_pass():
+            return DashboardBuilder().build(projects)
+
+        def per_project():
+            builder = DashboardBuilder()
+            return {str(project.id): builder.build_project(project) for project in projects}
+
+        def snapshot_read():
+            store = DashboardSnapshotStore()
+            entries = store.entries()
+            return store.business_status(entries), store.problems(entries), store.warnings(entries)
+
+        DashboardSnapshotStore().refresh()
+        for label, func in (
+            ('Раздельно по проектам', per_project),
+            ('Один проход', single_pass),
+            ('Снимки из кэша', snapshot_read),
+        ):
+            self._measure(label, func, repeat)
+
+    def _measure(self, label, func, repeat):
+        timings = []
+        queries = 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - started)
+            queries = len(context.captured_queries)
+
+        best = min(timings) * 1000
+        average = sum(timings) / len(timings) * 1000
+        self.stdout.write(f'{label:<24} запросов: {queries:>4}   лучшее: {best:8.1f} мс   среднее: {average:8.1f} мс')
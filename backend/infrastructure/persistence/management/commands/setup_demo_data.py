@@ -289,7 +289,7 @@ class Command(BaseCommand):
         )
 
         # Not re-exported via infrastructure.persistence.models
-        from infrastructure.persistence.models.project import ProjectItemSequence
+        from infrastructure.persistence.models.project import item_number_allocator
         from infrastructure.persistence.models.bom import BOMVersion
 
         def hard_delete(model_or_manager):
@@ -336,7 +336,7 @@ class Command(BaseCommand):
         hard_delete(ProjectItem)
         hard_delete(Project)
 
-        ProjectItemSequence.objects.filter(key='project_item').delete()
+        item_number_allocator.restart()
 
         # BOM
         hard_delete(BOMVersion)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Синхронизирует счётчики номеров документов (DocumentSequence) с максимальными "
+        "существующими номерами заказов, поступлений, инвентаризаций, передач и приёмок "
+        "подрядчиков. Запускать после ручных правок или загрузки данных в обход приложения. "
+        "Счётчики только увеличиваются."
+    )
+
+    def handle(self, *args, **options):
+        from infrastructure.persistence.models import (
+            ContractorReceipt,
+            ContractorWriteOff,
+            GoodsReceipt,
+            InventoryDocument,
+            PurchaseOrder,
+        )
+
+        for model in (PurchaseOrder, GoodsReceipt, InventoryDocument, ContractorWriteOff, ContractorReceipt):
+            old_value, new_value = model.numbering.sync(model)
+            label = model._meta.verbose_name
+            if new_value == old_value:
+                self.stdout.write(self.style.SUCCESS(f'{label}: счётчик актуален ({new_value}).'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{label}: счётчик поднят {old_value} -> {new_value}.'))
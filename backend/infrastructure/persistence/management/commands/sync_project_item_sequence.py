@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Синхронизирует последовательность ID позиций с MAX(item_number) позиций проекта. "
+        "Запускать после ручных правок, миграций или загрузки данных в обход приложения. "
+        "Последовательность только увеличивается. Рабочие процессы держат локальный кэш номеров, "
+        "поэтому после синхронизации их следует перезапустить."
+    )
+
+    def handle(self, *args, **options):
+        from infrastructure.persistence.models.project import item_number_allocator
+
+        old_value, new_value = item_number_allocator.sync_with_items()
+        if new_value == old_value:
+            self.stdout.write(self.style.SUCCESS(f'Последовательность актуальна: {new_value}.'))
+            return
+
+        self.stdout.write(self.style.SUCCESS(f'Последовательность поднята: {old_value} -> {new_value}.'))
@@ -0,0 +1,113 @@
+# Generated by Django 5.0.14 on 2026-10-16 20:42
+
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+from django.db.models import Avg
+
+# Правила прогресса на момент миграции (копия, не зависит от кода приложения)
+FINAL_PURCHASE_STATUSES = ('closed', 'written_off')
+PURCHASE_STATUSES = ('waiting_order', 'in_order', 'closed', 'written_off')
+PROGRESS_VALUES = (
+    'id',
+    'parent_item_id',
+    'purchase_status',
+    'manufacturer_type',
+    'manufacturing_status',
+    'contractor_status',
+    'nomenclature_item__catalog_category__is_purchased',
+)
+ZERO = Decimal('0')
+HUNDRED = Decimal('100')
+PRECISION = Decimal('0.01')
+
+
+def quantize(value):
+    return Decimal(str(value)).quantize(PRECISION, rounding=ROUND_HALF_UP)
+
+
+def is_completed(row):
+    is_purchased = row['nomenclature_item__catalog_category__is_purchased']
+    if is_purchased is None:
+        is_purchased = row['purchase_status'] in PURCHASE_STATUSES
+
+    if is_purchased:
+        return row['purchase_status'] in FINAL_PURCHASE_STATUSES
+    if row['manufacturer_type'] == 'contractor':
+        return row['contractor_status'] == 'completed'
+    return row['manufacturing_status'] == 'completed'
+
+
+def compute_progress(rows):
+    """Финальный статус - 100%, лист - 0%, родитель - среднее дочерних."""
+    by_id = {row['id']: row for row in rows}
+    children = defaultdict(list)
+    roots = []
+    for row in rows:
+        if row['parent_item_id'] in by_id:
+            children[row['parent_item_id']].append(row['id'])
+        else:
+            roots.append(row['id'])
+
+    order = []
+    stack = list(roots)
+    while stack:
+        node_id = stack.pop()
+        order.append(node_id)
+        stack.extend(children.get(node_id, ()))
+
+    progress = {}
+    for node_id in reversed(order):
+        child_ids = children.get(node_id)
+        if is_completed(by_id[node_id]):
+            progress[node_id] = HUNDRED
+        elif not child_ids:
+            progress[node_id] = ZERO
+        else:
+            progress[node_id] = quantize(sum(progress[child_id] for child_id in child_ids) / len(child_ids))
+    return progress
+
+
+def rebuild_calculated_progress(apps, schema_editor):
+    ProjectItem = apps.get_model('persistence', 'ProjectItem')
+    Project = apps.get_model('persistence', 'Project')
+
+    rows = list(ProjectItem.objects.filter(deleted_at__isnull=True).values(*PROGRESS_VALUES))
+    progress = compute_progress(rows)
+
+    ids_by_value = defaultdict(list)
+    for item_id, value in progress.items():
+        if value:
+            ids_by_value[value].append(item_id)
+    for value, ids in ids_by_value.items():
+        for start in range(0, len(ids), 1000):
+            ProjectItem.objects.filter(id__in=ids[start:start + 1000]).update(calculated_progress=value)
+
+    root_progress = ProjectItem.objects.filter(
+        deleted_at__isnull=True,
+        parent_item__isnull=True,
+    ).values('project_id').annotate(avg=Avg('calculated_progress'))
+    for row in root_progress:
+        Project.objects.filter(pk=row['project_id']).update(progress_percent=quantize(row['avg'] or 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('persistence', '0031_add_project_access_scope'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalprojectitem',
+            name='calculated_progress',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='По статусам позиции и дочерних; поддерживается автоматически (ProgressTracker)', max_digits=5, verbose_name='Рассчитанный прогресс'),
+        ),
+        migrations.AddField(
+            model_name='projectitem',
+            name='calculated_progress',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='По статусам позиции и дочерних; поддерживается автоматически (ProgressTracker)', max_digits=5, verbose_name='Рассчитанный прогресс'),
+        ),
+        migrations.RunPython(rebuild_calculated_progress, migrations.RunPython.noop),
+    ]
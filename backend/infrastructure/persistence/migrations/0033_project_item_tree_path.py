@@ -0,0 +1,54 @@
+# Generated by Django 5.0.14 on 2026-10-16 20:43
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def backfill_tree_paths(apps, schema_editor):
+    ProjectItem = apps.get_model('persistence', 'ProjectItem')
+
+    rows = list(ProjectItem.objects.values_list('id', 'parent_item_id'))
+    ids = {item_id for item_id, _ in rows}
+    children = defaultdict(list)
+    for item_id, parent_id in rows:
+        children[parent_id if parent_id in ids else None].append(item_id)
+
+    paths = {}
+    stack = [(item_id, '') for item_id in children[None]]
+    while stack:
+        item_id, parent_path = stack.pop()
+        path = f'{parent_path}{item_id.hex}/'
+        paths[item_id] = path
+        stack.extend((child_id, path) for child_id in children.get(item_id, ()))
+
+    ProjectItem.objects.bulk_update(
+        [ProjectItem(id=item_id, tree_path=path) for item_id, path in paths.items()],
+        ['tree_path'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('persistence', '0032_project_item_calculated_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalprojectitem',
+            name='tree_path',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Путь в дереве'),
+        ),
+        migrations.AddField(
+            model_name='projectitem',
+            name='tree_path',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Путь в дереве'),
+        ),
+        migrations.AddIndex(
+            model_name='projectitem',
+            index=models.Index(fields=['tree_path'], name='project_item_tree_path_idx', opclasses=['text_pattern_ops']),
+        ),
+        migrations.RunPython(backfill_tree_paths, migrations.RunPython.noop),
+    ]
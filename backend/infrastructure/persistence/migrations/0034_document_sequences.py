@@ -0,0 +1,25 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('persistence', '0033_project_item_tree_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('key', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='Ключ')),
+                ('last_value', models.PositiveBigIntegerField(default=0, verbose_name='Последнее значение')),
+            ],
+            options={
+                'db_table': 'document_sequences',
+                'verbose_name': 'Счётчик номеров документов',
+                'verbose_name_plural': 'Счётчики номеров документов',
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+# Последовательность вместо строки-счётчика project_item_sequences: nextval()
+# не блокирует строку до конца транзакции и не откатывается вместе с ней.
+# Начальное значение - наибольший из уже выданных номеров (включая мягко
+# удалённые позиции) и значения прежнего счётчика.
+CREATE_SEQUENCE = """
+CREATE SEQUENCE project_item_number_seq AS bigint MINVALUE 1;
+SELECT setval('project_item_number_seq', GREATEST(seed.last_value, 1), seed.last_value > 0)
+FROM (
+    SELECT GREATEST(
+        COALESCE((SELECT MAX(item_number) FROM project_items), 0),
+        COALESCE((SELECT last_value FROM project_item_sequences WHERE key = 'project_item'), 0)
+    ) AS last_value
+) AS seed;
+"""
+
+DROP_SEQUENCE = """
+INSERT INTO project_item_sequences (key, last_value)
+SELECT 'project_item', CASE WHEN is_called THEN last_value ELSE last_value - 1 END
+FROM project_item_number_seq;
+DROP SEQUENCE project_item_number_seq;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('persistence', '0034_document_sequences'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SEQUENCE, DROP_SEQUENCE),
+        migrations.DeleteModel(
+            name='ProjectItemSequence',
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('persistence', '0035_project_item_number_sequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='projectitem',
+            index=models.Index(
+                condition=models.Q(('is_active', True), ('purchase_status__in', ['waiting_order', 'in_order'])),
+                fields=['required_date', 'item_number'],
+                name='project_item_schedule_idx',
+            ),
+        ),
+    ]
@@ -97,6 +97,11 @@ from .inventory import (
     ContractorReceiptItem,
 )
 
+# Sequence models
+from .sequences import (
+    DocumentSequence,
+)
+
 # Production models
 from .production import (
     ProductionOrder,
@@ -190,6 +195,9 @@ __all__ = [
     'ContractorReceipt',
     'ContractorReceiptItem',
     
+    # Sequences
+    'DocumentSequence',
+    
     # Production
     'ProductionOrder',
     'ProductionTask',
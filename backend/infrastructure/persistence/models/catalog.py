@@ -18,6 +18,24 @@ from django.core.exceptions import ValidationError
 
 from .base import BaseModelWithHistory, ActiveManager, AllObjectsManager
 
+# Поля, от которых зависят развёртки и деревья BOM (application.services.bom_explosion):
+# правка остальных полей кэш развёрток не сбрасывает
+CATEGORY_BOM_FIELDS = ('name', 'is_purchased', 'deleted_at')
+NOMENCLATURE_BOM_FIELDS = ('name', 'unit', 'catalog_category_id', 'deleted_at')
+_UNKNOWN = object()
+
+
+def _bom_state(instance, fields):
+    # Отложенные (deferred) поля не загружаем - считаем их неизвестными
+    return tuple(instance.__dict__.get(name, _UNKNOWN) for name in fields)
+
+
+def _bom_fields_changed(instance, fields) -> bool:
+    old_state = getattr(instance, '_bom_state', None)
+    new_state = _bom_state(instance, fields)
+    instance._bom_state = new_state
+    return old_state is None or old_state != new_state or _UNKNOWN in new_state
+
 
 class CatalogCategory(BaseModelWithHistory):
     """
@@ -91,6 +109,16 @@ class CatalogCategory(BaseModelWithHistory):
     def __str__(self):
         return self.name
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._bom_state = _bom_state(instance, CATEGORY_BOM_FIELDS)
+        return instance
+    
+    def bom_fields_changed(self) -> bool:
+        """Изменились ли поля, влияющие на BOM, с момента загрузки или прошлой проверки."""
+        return _bom_fields_changed(self, CATEGORY_BOM_FIELDS)
+    
     @property
     def is_manufactured(self):
         """Изготавливаемая позиция (противоположность закупаемой)."""
@@ -592,6 +620,16 @@ class NomenclatureItem(BaseModelWithHistory):
     def __str__(self):
         return f"[{self.code}] {self.name}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._bom_state = _bom_state(instance, NOMENCLATURE_BOM_FIELDS)
+        return instance
+    
+    def bom_fields_changed(self) -> bool:
+        """Изменились ли поля, влияющие на BOM, с момента загрузки или прошлой проверки."""
+        return _bom_fields_changed(self, NOMENCLATURE_BOM_FIELDS)
+    
     @property
     def is_purchased(self):
         """Закупаемая позиция."""
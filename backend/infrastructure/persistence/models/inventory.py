@@ -10,6 +10,7 @@ from django.conf import settings
 from .base import BaseModelWithHistory, ActiveManager, AllObjectsManager
 from .catalog import NomenclatureItem
 from .project import Project, ProjectItem
+from .sequences import DocumentNumbering
 
 
 class Warehouse(BaseModelWithHistory):
@@ -519,15 +520,12 @@ class InventoryDocument(BaseModelWithHistory):
     def __str__(self):
         return f"Инвентаризация {self.number} ({self.warehouse})"
 
+    numbering = DocumentNumbering('inventory_document', 'ИНВ-', daily=True)
+
     @classmethod
     def generate_number(cls):
-        """Генерация номера инвентаризации в формате ИНВ-YYYYMMDD-XXXX."""
-        from django.utils import timezone
-        today = timezone.now().date()
-        prefix = f"ИНВ-{today.strftime('%Y%m%d')}-"
-        # Учитываем даже soft-deleted документы, иначе можно получить дубликат номера
-        count = cls.all_objects.filter(number__startswith=prefix).count() + 1
-        return f"{prefix}{count:04d}"
+        """Генерация номера инвентаризации в формате ИНВ-YYYYMMDD-XXXX (счётчик на день)."""
+        return cls.numbering.next_number(cls)
 
     def save(self, *args, **kwargs):
         if not self.number:
@@ -541,12 +539,19 @@ class InventoryDocument(BaseModelWithHistory):
         if self.status != 'in_progress':
             raise ValueError("Можно завершить только инвентаризацию в статусе 'В работе'")
         
+        from application.services.stock_ledger import StockLedger, StockMove
+
         with transaction.atomic():
+            items = list(self.items.filter(is_counted=True).select_related('stock_item__nomenclature_item'))
+            # Резерв и остаток - по заблокированным позициям склада
+            ledger = StockLedger(user=user)
+            stock = ledger.lock({item.stock_item_id for item in items})
+
             blocked_items = []
-            for item in self.items.filter(is_counted=True):
+            for item in items:
                 if item.actual_quantity is None:
                     continue
-                reserved_qty = item.stock_item.reserved_quantity or 0
+                reserved_qty = stock[item.stock_item_id].reserved_quantity or 0
                 if item.actual_quantity < reserved_qty:
                     blocked_items.append({
                         'name': item.stock_item.nomenclature_item.name,
@@ -564,23 +569,23 @@ class InventoryDocument(BaseModelWithHistory):
                     f"Резерв: {details}."
                 )
 
-            for item in self.items.filter(is_counted=True):
-                if item.difference != 0:
-                    # Create stock movement for adjustment
-                    movement = StockMovement.objects.create(
-                        stock_item=item.stock_item,
-                        movement_type='adjustment',
-                        quantity=item.difference,
-                        balance_after=item.actual_quantity,
-                        source_document=f"Инвентаризация {self.number}",
-                        performed_by=user,
-                        reason=f"Корректировка по инвентаризации. Учётное: {item.system_quantity}, факт: {item.actual_quantity}"
-                    )
-                    
-                    # Update stock item quantity
-                    item.stock_item.quantity = item.actual_quantity
-                    item.stock_item.last_inventory_date = timezone.now().date()
-                    item.stock_item.save()
+            # Остаток становится равным факту; движение - разница с остатком на момент завершения
+            adjusted = [item for item in items if item.difference != 0]
+            ledger.apply([
+                StockMove(
+                    item.stock_item_id,
+                    count=item.actual_quantity,
+                    movement_type='adjustment',
+                    details={
+                        'source_document': f"Инвентаризация {self.number}",
+                        'reason': f"Корректировка по инвентаризации. Учётное: {item.system_quantity}, факт: {item.actual_quantity}",
+                    },
+                )
+                for item in adjusted
+            ])
+            StockItem.objects.filter(id__in=[item.stock_item_id for item in adjusted]).update(
+                last_inventory_date=timezone.now().date()
+            )
             
             self.status = 'completed'
             self.actual_date = timezone.now().date()
@@ -778,22 +783,22 @@ class StockTransfer(BaseModelWithHistory):
         if self.status != 'pending':
             raise ValueError("Можно отправить только документ в статусе 'Ожидает подтверждения'")
         
+        from application.services.stock_ledger import StockLedger, StockMove
+        
         with transaction.atomic():
-            for item in self.items.all():
-                # Create outgoing movement
-                StockMovement.objects.create(
-                    stock_item=item.source_stock_item,
-                    movement_type='transfer_out',
+            # Списание со склада-отправителя с записью движений
+            StockLedger(user=user).apply([
+                StockMove(
+                    item.source_stock_item_id,
                     quantity=-item.quantity,
-                    balance_after=item.source_stock_item.quantity - item.quantity,
-                    source_document=f"Перемещение {self.number}",
-                    performed_by=user,
-                    reason=f"Перемещение на склад {self.destination_warehouse}"
+                    movement_type='transfer_out',
+                    details={
+                        'source_document': f"Перемещение {self.number}",
+                        'reason': f"Перемещение на склад {self.destination_warehouse}",
+                    },
                 )
-                
-                # Update source stock item
-                item.source_stock_item.quantity -= item.quantity
-                item.source_stock_item.save()
+                for item in self.items.all()
+            ])
             
             self.status = 'in_transit'
             self.shipped_date = timezone.now().date()
@@ -807,37 +812,37 @@ class StockTransfer(BaseModelWithHistory):
         if self.status != 'in_transit':
             raise ValueError("Можно получить только документ в статусе 'В пути'")
         
+        from application.services.stock_ledger import StockLedger, StockMove
+        
         with transaction.atomic():
-            for item in self.items.all():
+            moves = []
+            for item in self.items.select_related('source_stock_item'):
                 # Get or create destination stock item
                 dest_stock_item, created = StockItem.objects.get_or_create(
                     warehouse=self.destination_warehouse,
-                    nomenclature_item=item.source_stock_item.nomenclature_item,
+                    nomenclature_item_id=item.source_stock_item.nomenclature_item_id,
                     defaults={
                         'quantity': 0,
                         'min_quantity': item.source_stock_item.min_quantity,
                     }
                 )
-                
-                # Create incoming movement
-                StockMovement.objects.create(
-                    stock_item=dest_stock_item,
-                    movement_type='transfer_in',
+                moves.append(StockMove(
+                    dest_stock_item.id,
                     quantity=item.quantity,
-                    balance_after=dest_stock_item.quantity + item.quantity,
-                    source_document=f"Перемещение {self.number}",
-                    performed_by=user,
-                    reason=f"Перемещение со склада {self.source_warehouse}"
-                )
-                
-                # Update destination stock item
-                dest_stock_item.quantity += item.quantity
-                dest_stock_item.save()
+                    movement_type='transfer_in',
+                    details={
+                        'source_document': f"Перемещение {self.number}",
+                        'reason': f"Перемещение со склада {self.source_warehouse}",
+                    },
+                ))
                 
                 # Update transfer item with destination reference
                 item.destination_stock_item = dest_stock_item
                 item.save()
             
+            # Приход на склад-получатель с записью движений
+            StockLedger(user=user).apply(moves)
+            
             self.status = 'completed'
             self.received_date = timezone.now().date()
             self.received_by = user
@@ -1207,86 +1212,11 @@ class MaterialRequirement(BaseModelWithHistory):
         """
         Проверка и установка флага проблемы.
         Вызывается автоматически при сохранении.
+        Правила - в ProblemEvaluator (общие с массовым пересчётом).
         """
-        from django.utils import timezone
-        from infrastructure.persistence.models.procurement import PurchaseOrderItem
-        today = timezone.now().date()
-        
-        # Сбросить проблему если потребность закрыта/списана
-        if self.status in ['closed', 'written_off']:
-            # Сбрасываем только флаг проблемы, причину не трогаем (сохраняем историю)
-            self.has_problem = False
-            return
-        
-        # Проблема 1: Не заказано вовремя
-        if (self.status == 'waiting_order' and 
-            self.order_by_date and 
-            today > self.order_by_date):
-            self.has_problem = True
-            # Попытка найти системную причину
-            reason = ProblemReason.objects.filter(
-                code='not_ordered_on_time',
-                is_active=True
-            ).first()
-            if reason:
-                self.problem_reason = reason
-            return
-        
-        # Проблема 2: Задержка поставки
-        # По ТЗ сравниваем с ожидаемой датой поставки из заказа (по позиции),
-        # иначе используем ожидаемую дату заказа, и только потом delivery_date.
-        expected_delivery_date = None
-        ordered_late = False
-        if self.status == 'in_order':
-            if self.purchase_order_id:
-                po_item_qs = PurchaseOrderItem.objects.filter(
-                    order_id=self.purchase_order_id,
-                    nomenclature_item_id=self.nomenclature_item_id,
-                )
-                if self.project_item_id:
-                    po_item_qs = po_item_qs.filter(project_item_id=self.project_item_id)
-                po_item = po_item_qs.order_by('-created_at').select_related('order').first()
-                if po_item:
-                    if po_item.order and po_item.order.order_date and self.order_by_date:
-                        if po_item.order.order_date > self.order_by_date:
-                            ordered_late = True
-                    expected_delivery_date = (
-                        po_item.expected_delivery_date
-                        or po_item.order.expected_delivery_date
-                    )
-                else:
-                    expected_delivery_date = self.purchase_order.expected_delivery_date
-            expected_delivery_date = expected_delivery_date or self.delivery_date
-
-        if self.status == 'in_order' and ordered_late:
-            self.has_problem = True
-            reason = ProblemReason.objects.filter(
-                code='ordered_late',
-                is_active=True
-            ).first()
-            if reason:
-                self.problem_reason = reason
+        from application.services.problem_detection import ProblemEvaluator
 
-        if (
-            self.status == 'in_order'
-            and expected_delivery_date
-            and today > expected_delivery_date
-        ):
-            self.has_problem = True
-            reason = ProblemReason.objects.filter(
-                code='delivery_delay',
-                is_active=True
-            ).first()
-            if reason:
-                self.problem_reason = reason
-            return
-
-        if self.status == 'in_order' and ordered_late:
-            return
-        
-        # Нет проблем
-        self.has_problem = False
-        self.problem_reason = None
+        ProblemEvaluator().check_requirement(self)
     
     def save(self, *args, **kwargs):
         # Проверить проблемы перед сохранением
@@ -1427,7 +1357,7 @@ class MaterialRequirement(BaseModelWithHistory):
         return requirement
 
     @classmethod
-    def sync_from_project_items(cls):
+    def sync_from_project_items(cls, project_ids=None, nomenclature_ids=None):
         """
         Синхронизация потребностей из позиций проектов (ProjectItem).
         
@@ -1435,115 +1365,17 @@ class MaterialRequirement(BaseModelWithHistory):
         - Потребности формируются автоматически из активных проектов
         - Одна потребность = одна позиция проекта с is_purchased=True
         - Статус потребности = статус позиции проекта
-        """
-        from infrastructure.persistence.models import Project, ProjectItem
-        from django.utils import timezone
-        
-        synced = []
-        
-        # Получить все закупаемые позиции из АКТИВНЫХ проектов
-        # Согласно ERP-требованиям: только проекты в статусе 'В работе' (in_progress)
-        # Проекты в планировании - НЕ должны создавать потребности
-        active_statuses = ['in_progress']  # Только активные проекты!
-        
-        purchased_items = ProjectItem.objects.filter(
-            project__status__in=active_statuses,
-            nomenclature_item__catalog_category__is_purchased=True,
-            supplier__isnull=False  # Только позиции с назначенным поставщиком
-        ).select_related(
-            'project', 
-            'nomenclature_item', 
-            'supplier',
-            'problem_reason'
-        )
-
-        active_item_ids = set(purchased_items.values_list('id', flat=True))
         
-        for item in purchased_items:
-            # Статус потребности = статус позиции
-            req_status = item.purchase_status
-            if req_status not in ['waiting_order', 'in_order', 'closed', 'written_off']:
-                req_status = 'waiting_order'  # Fallback
-            
-            # Создать или обновить потребность
-            requirement, created = cls.objects.update_or_create(
-                project=item.project,
-                project_item=item,
-                nomenclature_item=item.nomenclature_item,
-                defaults={
-                    'status': req_status,
-                    'total_required': item.quantity,
-                    'order_by_date': item.order_date,
-                    'delivery_date': item.required_date,
-                    'supplier': item.supplier,
-                    'has_problem': item.has_problem,
-                    'problem_reason': item.problem_reason,
-                    'problem_notes': getattr(item, 'problem_notes', ''),
-                    'priority': 'high' if item.has_problem else 'normal',
-                }
-            )
-            
-            # Обновить количества со склада
-            total_available = StockItem.objects.filter(
-                nomenclature_item=item.nomenclature_item,
-            ).aggregate(total=models.Sum('quantity'))['total'] or 0
-            
-            # Резервы ДРУГИХ позиций (не текущей) - они занимают часть остатка
-            total_reserved_others = StockReservation.objects.filter(
-                stock_item__nomenclature_item=item.nomenclature_item,
-                status__in=['pending', 'confirmed'],
-            ).exclude(
-                project_item=item  # Исключаем резервы для текущей позиции
-            ).aggregate(total=models.Sum('quantity'))['total'] or 0
-            
-            # Резервы для текущей позиции - уже обеспечено
-            reserved_for_this = StockReservation.objects.filter(
-                project_item=item,
-                status__in=['pending', 'confirmed'],
-            ).aggregate(total=models.Sum('quantity'))['total'] or 0
-            
-            # Свободно на складе = всего - зарезервировано другими
-            free_stock = max(0, total_available - total_reserved_others)
-            
-            # К заказу = потребность - (уже зарезервировано для этой позиции + свободный остаток)
-            already_covered = reserved_for_this + free_stock
-            
-            requirement.total_available = total_available
-            requirement.total_reserved = total_reserved_others + reserved_for_this  # Для отображения общего резерва
-            requirement.to_order = max(0, item.quantity - already_covered)
-            requirement.save()
-
-            # Если статус потребности изменился и больше не in_order, отвязать от заказа
-            if requirement.purchase_order and req_status != 'in_order':
-                from django.db.models.deletion import ProtectedError
-                from infrastructure.persistence.models import PurchaseOrderItem
-                po_items = PurchaseOrderItem.objects.filter(
-                    order=requirement.purchase_order,
-                    project_item=item,
-                    nomenclature_item=item.nomenclature_item,
-                )
-                try:
-                    po_items.delete()
-                    requirement.purchase_order = None
-                    requirement.save(update_fields=['purchase_order'])
-                except ProtectedError:
-                    # Если по строке уже есть приёмка, не удаляем и не отвязываем
-                    pass
-            
-            synced.append(requirement)
-
-        # Удалить потребности для удалённых/неактуальных позиций проекта
-        obsolete_requirements = cls.objects.filter(
-            project__status__in=active_statuses,
-            project_item__isnull=False,
-            is_active=True,
-            deleted_at__isnull=True
-        ).exclude(project_item_id__in=active_item_ids)
+        project_ids / nomenclature_ids - инкрементальная синхронизация
+        только указанных проектов / номенклатуры.
+        Реализация - RequirementSynchronizer (групповые запросы и bulk-запись).
+        """
+        from application.services.requirements_sync import RequirementSynchronizer
 
-        for req in obsolete_requirements:
-            req.soft_delete()
-        
-        return synced
+        return RequirementSynchronizer(
+            project_ids=project_ids,
+            nomenclature_ids=nomenclature_ids,
+        ).sync()
 
 
 class ContractorWriteOff(BaseModelWithHistory):
@@ -1646,19 +1478,12 @@ class ContractorWriteOff(BaseModelWithHistory):
     def __str__(self):
         return f"Передача {self.number} подрядчику {self.contractor} от {self.writeoff_date}"
 
+    numbering = DocumentNumbering('contractor_writeoff', 'ПРД-')
+
     @classmethod
     def generate_number(cls):
-        """Генерация номера передачи подрядчику в формате ПРД-XXXX."""
-        from django.db.models import Max
-        import re
-
-        last_num = cls.objects.aggregate(max_num=Max('number'))['max_num']
-        if last_num:
-            match = re.search(r'ПРД-(\d+)', last_num)
-            next_num = int(match.group(1)) + 1 if match else 1
-        else:
-            next_num = 1
-        return f"ПРД-{next_num:04d}"
+        """Генерация номера передачи подрядчику в формате ПРД-XXXX (счётчик DocumentSequence)."""
+        return cls.numbering.next_number(cls)
 
     def save(self, *args, **kwargs):
         from django.utils import timezone
@@ -1678,8 +1503,11 @@ class ContractorWriteOff(BaseModelWithHistory):
         if self.status != 'draft':
             raise ValueError("Можно подтвердить только черновик")
         
+        from application.services.stock_ledger import CHECK_STOCK, StockLedger, StockMove
+        
         with transaction.atomic():
-            for item in self.items.all():
+            moves = []
+            for item in self.items.select_related('nomenclature_item'):
                 # Найти позицию на складе
                 stock_item = StockItem.objects.filter(
                     warehouse=self.warehouse,
@@ -1692,26 +1520,20 @@ class ContractorWriteOff(BaseModelWithHistory):
                         f"Номенклатура {item.nomenclature_item} отсутствует на складе {self.warehouse}"
                     )
                 
-                if stock_item.quantity < item.quantity:
-                    raise ValueError(
-                        f"Недостаточно {item.nomenclature_item} на складе. "
-                        f"Доступно: {stock_item.quantity}, требуется: {item.quantity}"
-                    )
-                
-                # Списать со склада
-                stock_item.quantity -= item.quantity
-                stock_item.save()
-                
-                # Создать запись о движении
-                StockMovement.objects.create(
-                    stock_item=stock_item,
-                    movement_type='contractor_writeoff',
+                # Списать со склада (остаток проверяется под блокировкой позиции)
+                moves.append(StockMove(
+                    stock_item.id,
                     quantity=-item.quantity,
-                    balance_after=stock_item.quantity,
-                    source_document=f"Передача подрядчику {self.number}",
-                    performed_by=user or self.transferred_by,
-                    reason=f"Передача подрядчику {self.contractor.name}",
-                )
+                    movement_type='contractor_writeoff',
+                    check=CHECK_STOCK,
+                    details={
+                        'source_document': f"Передача подрядчику {self.number}",
+                        'performed_by': user or self.transferred_by,
+                        'reason': f"Передача подрядчику {self.contractor.name}",
+                    },
+                ))
+            
+            StockLedger(user=user or self.transferred_by).apply(moves)
             
             self.status = 'confirmed'
             self.save()
@@ -1858,19 +1680,12 @@ class ContractorReceipt(BaseModelWithHistory):
     def __str__(self):
         return f"Приёмка {self.number} от {self.contractor} {self.receipt_date}"
 
+    numbering = DocumentNumbering('contractor_receipt', 'ПРМ-')
+
     @classmethod
     def generate_number(cls):
-        """Генерация номера приёмки от подрядчика в формате ПРМ-XXXX."""
-        from django.db.models import Max
-        import re
-
-        last_num = cls.objects.aggregate(max_num=Max('number'))['max_num']
-        if last_num:
-            match = re.search(r'ПРМ-(\d+)', last_num)
-            next_num = int(match.group(1)) + 1 if match else 1
-        else:
-            next_num = 1
-        return f"ПРМ-{next_num:04d}"
+        """Генерация номера приёмки от подрядчика в формате ПРМ-XXXX (счётчик DocumentSequence)."""
+        return cls.numbering.next_number(cls)
 
     def save(self, *args, **kwargs):
         from django.utils import timezone
@@ -1886,11 +1701,13 @@ class ContractorReceipt(BaseModelWithHistory):
         Приходует изделия на склад.
         """
         from django.db import transaction
+        from application.services.stock_ledger import StockLedger, StockMove
         
         if self.status != 'draft':
             raise ValueError("Можно подтвердить только черновик")
         
         with transaction.atomic():
+            ledger = StockLedger(user=user or self.received_by)
             for item in self.items.all():
                 # Найти или создать позицию на складе
                 stock_item, created = StockItem.objects.get_or_create(
@@ -1902,20 +1719,17 @@ class ContractorReceipt(BaseModelWithHistory):
                     }
                 )
                 
-                # Приходовать на склад
-                stock_item.quantity += item.quantity
-                stock_item.save()
-                
-                # Создать запись о движении
-                StockMovement.objects.create(
-                    stock_item=stock_item,
-                    movement_type='contractor_receipt',
+                # Приходовать на склад с записью движения
+                ledger.apply([StockMove(
+                    stock_item.id,
                     quantity=item.quantity,
-                    balance_after=stock_item.quantity,
-                    source_document=f"Приёмка от подрядчика {self.number}",
-                    performed_by=user or self.received_by,
-                    reason=f"Приёмка от подрядчика {self.contractor.name}",
-                )
+                    movement_type='contractor_receipt',
+                    details={
+                        'source_document': f"Приёмка от подрядчика {self.number}",
+                        'performed_by': user or self.received_by,
+                        'reason': f"Приёмка от подрядчика {self.contractor.name}",
+                    },
+                )])
                 
                 # Обновить статус позиции проекта если есть связь
                 if item.project_item:
@@ -4,14 +4,13 @@ Procurement ORM Models.
 Models for purchase orders and procurement tracking.
 """
 
-from datetime import date
-from decimal import Decimal
 from django.db import models
 from django.conf import settings
 
 from .base import BaseModelWithHistory, ActiveManager, AllObjectsManager
 from .catalog import Supplier, NomenclatureItem, DelayReason
-from .project import Project, ProjectItem, PurchaseStatusChoices
+from .project import Project, ProjectItem
+from .sequences import DocumentNumbering
 
 
 class PurchaseOrder(BaseModelWithHistory):
@@ -207,26 +206,14 @@ class PurchaseOrder(BaseModelWithHistory):
         self.delete()
         return True
     
+    numbering = DocumentNumbering('purchase_order', 'З-')
+    
     @classmethod
     def generate_order_number(cls):
         """
-        Генерация номера заказа в формате З-ХХХХ.
+        Генерация номера заказа в формате З-ХХХХ (счётчик DocumentSequence).
         """
-        from django.db.models import Max
-        import re
-        
-        last_order = cls.objects.aggregate(max_num=Max('number'))['max_num']
-        if last_order:
-            # Извлечь число из номера
-            match = re.search(r'З-(\d+)', last_order)
-            if match:
-                next_num = int(match.group(1)) + 1
-            else:
-                next_num = 1
-        else:
-            next_num = 1
-        
-        return f'З-{next_num:04d}'
+        return cls.numbering.next_number(cls)
     
     def save(self, *args, **kwargs):
         """Автоматическая генерация номера и установка даты."""
@@ -558,26 +545,14 @@ class GoodsReceipt(BaseModelWithHistory):
     def __str__(self):
         return f"Поступление {self.number} от {self.receipt_date}"
     
+    numbering = DocumentNumbering('goods_receipt', 'П-')
+    
     @classmethod
     def generate_receipt_number(cls):
         """
-        Генерация номера поступления в формате П-ХХХХ.
+        Генерация номера поступления в формате П-ХХХХ (счётчик DocumentSequence).
         """
-        from django.db.models import Max
-        import re
-        
-        last_receipt = cls.objects.aggregate(max_num=Max('number'))['max_num']
-        if last_receipt:
-            # Извлечь число из номера
-            match = re.search(r'П-(\d+)', last_receipt)
-            if match:
-                next_num = int(match.group(1)) + 1
-            else:
-                next_num = 1
-        else:
-            next_num = 1
-        
-        return f'П-{next_num:04d}'
+        return cls.numbering.next_number(cls)
     
     def save(self, *args, **kwargs):
         """Автоматическая генерация номера поступления и даты."""
@@ -592,332 +567,19 @@ class GoodsReceipt(BaseModelWithHistory):
         """
         Подтверждение поступления.
         Системная операция: обновляет остатки, статусы заказа и потребностей.
+        Выполняется пачкой для всех строк (GoodsReceiptProcessor).
         """
-        from django.db import transaction
-        from .inventory import StockItem, StockMovement, StockBatch, StockReservation
-        
-        if self.status != 'draft':
-            raise ValueError("Можно подтвердить только черновик поступления")
-        
-        with transaction.atomic():
-            for receipt_item in self.items.all():
-                po_item = receipt_item.purchase_order_item
-                
-                # 1. Get or create StockItem
-                stock_item, created = StockItem.objects.get_or_create(
-                    warehouse=self.warehouse,
-                    nomenclature_item=po_item.nomenclature_item,
-                    defaults={
-                        'quantity': 0,
-                        'unit': po_item.unit,
-                    }
-                )
-                
-                # 2. Create StockBatch if batch number provided
-                batch = None
-                if receipt_item.batch_number:
-                    batch = StockBatch.objects.create(
-                        stock_item=stock_item,
-                        batch_number=receipt_item.batch_number,
-                        initial_quantity=receipt_item.quantity,
-                        current_quantity=receipt_item.quantity,
-                        receipt_date=self.receipt_date,
-                        purchase_order=self.purchase_order,
-                        unit_cost=po_item.unit_price,
-                    )
-                
-                # 3. Update StockItem quantity
-                stock_item.quantity += receipt_item.quantity
-                stock_item.save()
-                
-                # 4. Create StockMovement record
-                StockMovement.objects.create(
-                    stock_item=stock_item,
-                    movement_type='receipt',
-                    quantity=receipt_item.quantity,
-                    balance_after=stock_item.quantity,
-                    source_document=f"Поступление {self.number}",
-                    performed_by=user or self.received_by,
-                    reason=f"Приёмка по заказу {self.purchase_order.number}",
-                )
-
-                # 4.1 Reserve received items for project requirements linked to this order
-                from .inventory import MaterialRequirement, StockReservation as SR
-
-                remaining_to_reserve = receipt_item.quantity
-                requirements = MaterialRequirement.objects.filter(
-                    purchase_order=self.purchase_order,
-                    nomenclature_item=po_item.nomenclature_item,
-                    status__in=['waiting_order', 'in_order', 'written_off'],
-                    project_item__isnull=False,
-                    is_active=True,
-                    deleted_at__isnull=True
-                ).select_related('project', 'project_item')
-
-                requirements = sorted(
-                    requirements,
-                    key=lambda r: (
-                        r.order_by_date or date.max,
-                        r.project.name if r.project else '',
-                        r.project_item.name if r.project_item else '',
-                        str(r.id)
-                    )
-                )
-
-                if requirements:
-                    for req in requirements:
-                        if remaining_to_reserve <= 0:
-                            break
-                        # Используем total_required для корректного резервирования полного количества
-                        need_qty = req.total_required or 0
-                        if not need_qty or need_qty <= 0:
-                            continue
-                        # Проверяем сколько уже зарезервировано для этой потребности
-                        already_reserved = SR.objects.filter(
-                            project_item=req.project_item,
-                            status__in=['pending', 'confirmed']
-                        ).aggregate(total=models.Sum('quantity'))['total'] or 0
-                        still_need = max(0, need_qty - already_reserved)
-                        if still_need <= 0:
-                            continue
-                        reserve_qty = min(still_need, remaining_to_reserve)
-
-                        StockReservation.objects.create(
-                            stock_item=stock_item,
-                            project=req.project,
-                            project_item=req.project_item,
-                            quantity=reserve_qty,
-                            status='confirmed',
-                            required_date=req.project_item.required_date if req.project_item else None,
-                            notes=f"Резерв по заказу {self.purchase_order.number}",
-                        )
-                        stock_item.reserved_quantity += reserve_qty
-                        stock_item.save(update_fields=['reserved_quantity'])
-
-                        remaining_to_reserve -= reserve_qty
-                elif po_item.project_item:
-                    StockReservation.objects.create(
-                        stock_item=stock_item,
-                        project=po_item.project_item.project,
-                        project_item=po_item.project_item,
-                        quantity=receipt_item.quantity,
-                        status='confirmed',
-                        required_date=po_item.project_item.required_date,
-                        notes=f"Резерв по заказу {self.purchase_order.number}",
-                    )
-                    stock_item.reserved_quantity += receipt_item.quantity
-                    stock_item.save(update_fields=['reserved_quantity'])
-                
-                # 5. Update PurchaseOrderItem delivered quantity
-                po_item.delivered_quantity += receipt_item.quantity
-                if po_item.delivered_quantity >= po_item.quantity:
-                    po_item.status = 'delivered'
-                    po_item.actual_delivery_date = self.receipt_date
-                else:
-                    po_item.status = 'in_transit'
-                po_item.save()
+        from application.services.goods_receipts import GoodsReceiptProcessor
 
-                if po_item.project_item:
-                    if not po_item.project_item.actual_start:
-                        po_item.project_item.actual_start = self.purchase_order.order_date or self.receipt_date
-                    if po_item.delivered_quantity >= po_item.quantity:
-                        po_item.project_item.purchase_status = PurchaseStatusChoices.CLOSED
-                        po_item.project_item.actual_end = self.receipt_date
-                    else:
-                        po_item.project_item.purchase_status = PurchaseStatusChoices.IN_ORDER
-                    po_item.project_item.save(update_fields=[
-                        'purchase_status',
-                        'actual_start',
-                        'actual_end',
-                        'has_problem',
-                        'problem_reason',
-                        'updated_at'
-                    ])
-                
-                # 6. Close related material requirements
-                self._close_material_requirements(po_item, receipt_item.quantity)
-            
-            # 7. Update PurchaseOrder status
-            self.purchase_order.update_status_from_deliveries()
-            
-            # 8. Update GoodsReceipt status
-            self.status = 'confirmed'
-            self.save()
+        return GoodsReceiptProcessor(self).confirm(user=user)
 
     def cancel_confirmation(self, user=None):
         """
         Отмена подтверждения поступления (откат изменений).
         """
-        from django.db import transaction
-        from .inventory import StockMovement, StockReservation
-        
-        if self.status != 'confirmed':
-            raise ValueError("Можно отменить только подтвержденное поступление")
-            
-        with transaction.atomic():
-            for receipt_item in self.items.all():
-                po_item = receipt_item.purchase_order_item
-                stock_item = None
-                
-                # 1. Find Stock Item
-                try:
-                    from .inventory import StockItem
-                    stock_item = StockItem.objects.get(
-                        warehouse=self.warehouse,
-                        nomenclature_item=po_item.nomenclature_item,
-                        unit=po_item.unit
-                    )
-                except StockItem.DoesNotExist:
-                    # Если сток-айтм удален (маловероятно), ничего не делаем со стоком
-                    pass
-                
-                if stock_item:
-                    # 2. Subtract Stock
-                    stock_item.quantity -= receipt_item.quantity
-                    # Ensure not negative? In theory yes, but if stock was consumed, we have a problem.
-                    # We allow negative stock for consistency during cancel, or we should block?
-                    # ERP logic: if goods are used, we typically BLOCK cancellation.
-                    # However, User asked to "Force cancel". We will proceed but log/warn if negative.
-                    
-                    # 3. Revert Reservations (find those created by this receipt/order)
-                    # We can't know exactly WHICH reservation was created by THIS receipt item easily 
-                    # unless we tracked it.
-                    # But we know reservations for this project/item with source notes.
-                    # Simple heuristic: Reduce confirmed reservations for this project/item.
-                    
-                    pass # Stock update handled below
-
-                    # 3. Create Reverse Movement
-                    StockMovement.objects.create(
-                        stock_item=stock_item,
-                        movement_type='correction', # or specific 'cancellation'
-                        quantity=-receipt_item.quantity,
-                        balance_after=stock_item.quantity,
-                        source_document=f"Отмена поступления {self.number}",
-                        performed_by=user or self.received_by,
-                        reason=f"Отмена поступления по заказу {self.purchase_order.number}",
-                    )
-                    stock_item.save()
-
-                # 4. Revert PurchaseOrderItem
-                po_item.delivered_quantity -= receipt_item.quantity
-                if po_item.delivered_quantity < 0:
-                    po_item.delivered_quantity = 0
-                
-                if po_item.delivered_quantity == 0:
-                    po_item.status = 'ordered' # Back to ordered
-                    po_item.actual_delivery_date = None
-                elif po_item.delivered_quantity < po_item.quantity:
-                    po_item.status = 'partially_delivered'
-                else:
-                    po_item.status = 'delivered' # Should not happen if we subtract
-                
-                po_item.save()
-
-                # 4.1 Revert Project Item dates if necessary
-                if po_item.project_item:
-                    if po_item.delivered_quantity == 0:
-                        po_item.project_item.actual_end = None
-                        po_item.project_item.purchase_status = 'in_order' # Back to in_order
-                    else:
-                        po_item.project_item.purchase_status = 'in_order' # Partially delivered is still "in_order" or custom?
-                        # Current logic: 'in_order' covers everything until closed.
-                    
-                    po_item.project_item.save(update_fields=['actual_end', 'purchase_status'])
-
-                # 5. Reopen Requirements
-                self._reopen_material_requirements(po_item, receipt_item.quantity)
-
-            # 6. Delete reservations created by this receipt
-            # We filter by notes hack or use more complex logic. 
-            # For now, we will relax constraints and rely on requirement reopening.
-            # We should remove 'confirmed' reservations that were likely created by this.
-            StockReservation.objects.filter(
-                notes=f"Резерв по заказу {self.purchase_order.number}",
-                status='confirmed'
-            ).delete()
-
-            # 7. Update GoodsReceipt status
-            self.status = 'cancelled'
-            self.save()
-            
-            # 8. Update PurchaseOrder status
-            self.purchase_order.update_status_from_deliveries()
-
-    def _reopen_material_requirements(self, po_item, qty):
-        """Reopen requirements when receipt is cancelled."""
-        from .inventory import MaterialRequirement
-        
-        # Open requirements linked to this PO Item
-        reqs = MaterialRequirement.objects.filter(
-            nomenclature_item=po_item.nomenclature_item,
-            purchase_order=self.purchase_order,
-            status='closed'
-        )
-        for req in reqs:
-            req.status = 'in_order'
-            req.save(update_fields=['status'])
-            if req.project_item:
-                req.project_item.purchase_status = 'in_order'
-                req.project_item.actual_end = None
-                req.project_item.save(update_fields=['purchase_status', 'actual_end'])
-
-    
-    def _close_material_requirements(self, po_item, received_qty):
-        """Закрыть связанные потребности при поступлении."""
-        from .inventory import MaterialRequirement, StockReservation as SR
-
-        requirements = MaterialRequirement.objects.filter(
-            nomenclature_item=po_item.nomenclature_item,
-            purchase_order=self.purchase_order,
-            status__in=['waiting_order', 'in_order'],
-            project_item__isnull=False,
-        ).select_related('project', 'project_item')
-
-        requirements = sorted(
-            requirements,
-            key=lambda r: (
-                r.order_by_date or date.max,
-                r.project.name if r.project else '',
-                r.project_item.name if r.project_item else '',
-                str(r.id)
-            )
-        )
-
-        for req in requirements:
-            # Используем total_required - это количество из позиции проекта
-            need_qty = req.total_required or 0
-            if not need_qty or need_qty <= 0:
-                continue
-
-            # Учитываем только резервы, созданные этим заказом
-            reserved_from_order = SR.objects.filter(
-                project_item=req.project_item,
-                status__in=['pending', 'confirmed'],
-                notes=f"Резерв по заказу {self.purchase_order.number}",
-            ).aggregate(total=models.Sum('quantity'))['total'] or Decimal('0')
-
-            if reserved_from_order >= need_qty:
-                req.status = 'closed'
-            else:
-                req.status = 'in_order'
-
-            req.save(update_fields=['status', 'updated_at'])
+        from application.services.goods_receipts import GoodsReceiptProcessor
 
-            if req.project_item:
-                req.project_item.purchase_status = 'closed' if req.status == 'closed' else 'in_order'
-                if reserved_from_order > 0 and not req.project_item.actual_start:
-                    req.project_item.actual_start = self.purchase_order.order_date or self.receipt_date
-                if req.status == 'closed':
-                    req.project_item.actual_end = self.receipt_date
-                req.project_item.save(update_fields=[
-                    'purchase_status',
-                    'actual_start',
-                    'actual_end',
-                    'has_problem',
-                    'problem_reason',
-                    'updated_at'
-                ])
+        return GoodsReceiptProcessor(self).cancel(user=user)
 
 
 class GoodsReceiptItem(BaseModelWithHistory):
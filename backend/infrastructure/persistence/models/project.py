@@ -4,13 +4,18 @@ Project ORM Models.
 Models for project (Stand) execution tracking.
 """
 
-from django.db import models, transaction
-from django.db.models import Max
+import uuid
+from decimal import Decimal
+
+from django.db import models
+from django.db.models import Max, Value
+from django.db.models.functions import Concat, Substr
 from django.conf import settings
 
 from .base import BaseModelWithHistory, ActiveManager, AllObjectsManager
 from .catalog import NomenclatureItem, Contractor, Supplier, DelayReason
 from .bom import BOMStructure, BOMItem
+from .sequences import DatabaseSequenceAllocator
 
 
 class ProjectStatusChoices(models.TextChoices):
@@ -346,42 +351,57 @@ class Project(BaseModelWithHistory):
 
     def calculate_progress(self):
         """Calculate and update project progress based on item statuses."""
-        from django.utils import timezone
-        from decimal import Decimal
+        from application.services.progress import ProgressTracker
 
-        def calculate_item_progress(item):
-            return Decimal(str(item.calculate_progress()))
+        # Полный пересчёт сохранённого прогресса позиций за один проход
+        ProgressTracker().rebuild(project_id=self.id)
+        self.refresh_from_db(fields=['progress_percent', 'last_progress_calculation'])
 
-        root_items = self.items.filter(parent_item__isnull=True)
-        if not root_items.exists():
-            self.progress_percent = Decimal('0')
-        else:
-            total = sum(calculate_item_progress(item) for item in root_items)
-            self.progress_percent = total / root_items.count()
+        return self.progress_percent
 
-        self.last_progress_calculation = timezone.now()
-        self.save(update_fields=['progress_percent', 'last_progress_calculation'])
 
-        return self.progress_percent
+# Поля, влияющие на рассчитанный прогресс позиции и её предков.
+# parent_item_id - первый, deleted_at - последний (см. ProjectItem.save).
+PROGRESS_TRACKED_FIELDS = (
+    'parent_item_id',
+    'nomenclature_item_id',
+    'purchase_status',
+    'manufacturing_status',
+    'contractor_status',
+    'manufacturer_type',
+    'deleted_at',
+)
+PROGRESS_UPDATE_FIELDS = frozenset(
+    PROGRESS_TRACKED_FIELDS + ('parent_item', 'nomenclature_item')
+)
+_UNKNOWN = object()
 
 
-class ProjectItemSequence(models.Model):
-    """Global sequence for ProjectItem item_number values."""
+class ItemNumberAllocator(DatabaseSequenceAllocator):
+    """
+    Per-process allocator of ProjectItem.item_number values
+    (PostgreSQL SEQUENCE project_item_number_seq, see DatabaseSequenceAllocator).
+    """
 
-    key = models.CharField(
-        max_length=50,
-        primary_key=True,
-        verbose_name="Ключ"
-    )
-    last_value = models.PositiveBigIntegerField(
-        default=0,
-        verbose_name="Последнее значение"
-    )
+    sequence_name = 'project_item_number_seq'
+    cache_size_setting = 'PROJECT_ITEM_NUMBER_CACHE_SIZE'
+    default_cache_size = 20
 
-    class Meta:
-        db_table = 'project_item_sequences'
-        verbose_name = 'Счётчик ID позиций проекта'
-        verbose_name_plural = 'Счётчики ID позиций проекта'
+    def sync_with_items(self):
+        """
+        Поднять последовательность до MAX(item_number) существующих позиций.
+
+        Нужна после ручных правок/загрузки данных в обход приложения. Учитываются
+        и мягко удалённые позиции: их номера тоже заняты.
+        Возвращает (старое значение, новое значение).
+        """
+        max_existing = ProjectItem.all_objects.aggregate(
+            max_item_number=Max('item_number')
+        ).get('max_item_number') or 0
+        return self.sync(max_existing)
+
+
+item_number_allocator = ItemNumberAllocator()
 
 
 class ProjectItem(BaseModelWithHistory):
@@ -423,6 +443,14 @@ class ProjectItem(BaseModelWithHistory):
         related_name='children',
         verbose_name="Родительский элемент"
     )
+    # Материализованный путь: id.hex всех предков и самой позиции через "/".
+    # Поддерево = tree_path LIKE '<путь>%', предки - разбор строки без запросов.
+    tree_path = models.TextField(
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name="Путь в дереве"
+    )
     
     # Item info - category теперь произвольная строка (code из CatalogCategory)
     category = models.CharField(
@@ -591,6 +619,13 @@ class ProjectItem(BaseModelWithHistory):
         default=0,
         verbose_name="Процент выполнения"
     )
+    calculated_progress = models.DecimalField(
+        max_digits=5,
+        decimal_places=2,
+        default=0,
+        verbose_name="Рассчитанный прогресс",
+        help_text="По статусам позиции и дочерних; поддерживается автоматически (ProgressTracker)"
+    )
     
     # Delay tracking
     delay_reason = models.ForeignKey(
@@ -678,6 +713,23 @@ class ProjectItem(BaseModelWithHistory):
             models.Index(fields=['manufacturing_status']),
             models.Index(fields=['purchase_status']),
             models.Index(fields=['responsible']),
+            models.Index(
+                fields=['tree_path'],
+                name='project_item_tree_path_idx',
+                opclasses=['text_pattern_ops'],
+            ),
+            # График закупок: порядок и keyset-курсор (required_date, item_number)
+            models.Index(
+                fields=['required_date', 'item_number'],
+                name='project_item_schedule_idx',
+                condition=models.Q(
+                    is_active=True,
+                    purchase_status__in=[
+                        PurchaseStatusChoices.WAITING_ORDER,
+                        PurchaseStatusChoices.IN_ORDER,
+                    ],
+                ),
+            ),
         ]
     
     def __str__(self):
@@ -773,46 +825,15 @@ class ProjectItem(BaseModelWithHistory):
         """
         Cascade date calculations to all child items.
         
-        For manufactured children: planned_end = this item's planned_start
+        For manufactured children: planned_end = this item's planned_start - 1
         For purchased children: calculate based on parent's planned_start
-        """
-        from datetime import timedelta
         
-        if not self.planned_start:
-            return []
-        
-        updated_items = []
-        
-        for child in self.children.all():
-            if child.is_purchased:
-                if child.purchase_by_contractor:
-                    child.required_date = None
-                    child.order_date = None
-                    child.planned_end = None
-                    if save:
-                        child.save(update_fields=['required_date', 'order_date', 'planned_end'])
-                    updated_items.append(child)
-                else:
-                    # Calculate purchase dates
-                    dates = child.calculate_purchase_dates(self.planned_start)
-                    if dates:
-                        child.required_date = dates['required_date']
-                        child.order_date = dates['order_date']
-                        child.planned_end = dates['planned_end']
-                        if save:
-                            child.save(update_fields=['required_date', 'order_date', 'planned_end'])
-                        updated_items.append(child)
-            else:
-                # Manufactured: must be done before parent starts
-                child.planned_end = self.planned_start - timedelta(days=1)
-                if save:
-                    child.save(update_fields=['planned_end'])
-                updated_items.append(child)
-            
-            # Recursively update grandchildren
-            updated_items.extend(child.cascade_dates_to_children(save=save))
-        
-        return updated_items
+        Пересчёт всего поддерева за один проход (ProjectScheduler).
+        Возвращает список изменений дат; save=False - без записи в БД.
+        """
+        from application.services.scheduling import ProjectScheduler
+
+        return ProjectScheduler(self).reschedule(dry_run=not save).changes
     
     def has_date_conflicts(self):
         """Check if this item has date conflicts with parent."""
@@ -833,138 +854,164 @@ class ProjectItem(BaseModelWithHistory):
            → has_problem = True, причина = "Не заказано вовремя"
         2. Если позиция в заказе (статус "В заказе") и сегодня > required_date:
            → has_problem = True, причина = "Задержка поставки"
-        """
-        from django.utils import timezone
-        from infrastructure.persistence.models import ProblemReason
-        from infrastructure.persistence.models.inventory import MaterialRequirement
-        from infrastructure.persistence.models.procurement import PurchaseOrderItem
-        
-        today = timezone.now().date()
         
+        Правила - в ProblemEvaluator (общие с массовым пересчётом и дашбордом).
+        """
+        from application.services.problem_detection import ProblemEvaluator
+
         # Только для закупаемых позиций
         if not self.is_purchased:
             return
-        
-        # Если позиция закрыта/списана - сбрасываем только флаг проблемы
-        # Причина проблемы остаётся для истории (согласно ТЗ)
-        if self.purchase_status in ['closed', 'written_off']:
-            if self.has_problem:
-                self.has_problem = False
-                # problem_reason НЕ обнуляем - оставляем для истории
-            return
-        
-        requirement = MaterialRequirement.objects.filter(
-            project_item_id=self.id,
-            is_active=True,
-            deleted_at__isnull=True
-        ).order_by('-created_at').first()
 
-        order_by_date = self.order_date
-        if not order_by_date and requirement and requirement.order_by_date:
-            order_by_date = requirement.order_by_date
-
-        # Проблема 1: Не заказано вовремя
-        if (self.purchase_status == 'waiting_order' and 
-            order_by_date and 
-            today > order_by_date):
-            self.has_problem = True
-            # Попытка найти системную причину
-            reason = ProblemReason.objects.filter(
-                code='not_ordered_on_time',
-                is_active=True
-            ).first()
-            if reason:
-                self.problem_reason = reason
-            return
-        
-        # Проблема 2: Задержка поставки
-        # По ТЗ сравниваем с ожидаемой датой поставки из заказа (по позиции),
-        # иначе используем ожидаемую дату заказа, и только потом required_date.
-        expected_delivery_date = None
-        ordered_late = False
-        has_confirmed_po = PurchaseOrderItem.objects.filter(
-            project_item_id=self.id
-        ).exclude(order__status='draft').exists()
-        has_requirement_po = bool(
-            requirement and requirement.purchase_order and requirement.purchase_order.status in ['ordered', 'partially_delivered', 'closed']
-        )
-        if self.purchase_status == 'in_order' or has_confirmed_po or has_requirement_po:
-            po_item = (
-                PurchaseOrderItem.objects.filter(project_item_id=self.id)
-                .exclude(order__status='draft')
-                .select_related('order')
-                .order_by('-created_at')
-                .first()
-            )
-            if po_item:
-                if po_item.order and po_item.order.order_date and order_by_date:
-                    if po_item.order.order_date > order_by_date:
-                        ordered_late = True
-                expected_delivery_date = (
-                    po_item.expected_delivery_date
-                    or po_item.order.expected_delivery_date
-                )
-            elif has_requirement_po:
-                po = requirement.purchase_order
-                if po.order_date and order_by_date and po.order_date > order_by_date:
-                    ordered_late = True
-                expected_delivery_date = po.expected_delivery_date
-            expected_delivery_date = expected_delivery_date or self.required_date
-
-        if (self.purchase_status == 'in_order' or has_confirmed_po or has_requirement_po) and ordered_late:
-            self.has_problem = True
-            reason = ProblemReason.objects.filter(
-                code='ordered_late',
-                is_active=True
-            ).first()
-            if reason:
-                self.problem_reason = reason
+        ProblemEvaluator().check_project_item(self)
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._progress_state = instance._get_progress_state()
+        return instance
 
-        if (
-            (self.purchase_status == 'in_order' or has_confirmed_po or has_requirement_po)
-            and expected_delivery_date
-            and today > expected_delivery_date
-        ):
-            self.has_problem = True
-            reason = ProblemReason.objects.filter(
-                code='delivery_delay',
-                is_active=True
-            ).first()
-            if reason:
-                self.problem_reason = reason
-            return
+    def _get_progress_state(self):
+        # Отложенные (deferred) поля не загружаем - считаем их неизвестными
+        return tuple(self.__dict__.get(name, _UNKNOWN) for name in PROGRESS_TRACKED_FIELDS)
 
-        if (self.purchase_status == 'in_order' or has_confirmed_po or has_requirement_po) and ordered_late:
-            return
-        
-        # Нет проблем
-        if self.has_problem:
-            self.has_problem = False
-            self.problem_reason = None
-    
     def save(self, *args, **kwargs):
-        """Переопределение save для автонумерации и проверки проблем."""
+        """Переопределение save для автонумерации, проверки проблем и прогресса."""
+        from application.services.progress import ProgressTracker, is_completed
+
+        created = self._state.adding
 
         # 1) Глобальная автонумерация ID позиции (item_number)
         # ВАЖНО: это значение используется в UI как "ID позиции" и должно быть сквозным.
         if not self.item_number:
-            with transaction.atomic():
-                seq, _ = ProjectItemSequence.objects.select_for_update().get_or_create(key='project_item')
-
-                # На случай ручных правок/миграций: не выдавать уже существующие номера.
-                max_existing = ProjectItem.objects.aggregate(max_item_number=Max('item_number')).get('max_item_number')
-                if max_existing is not None and max_existing > (seq.last_value or 0):
-                    seq.last_value = max_existing
-
-                seq.last_value += 1
-                seq.save(update_fields=['last_value'])
-                self.item_number = seq.last_value
+            self.item_number = item_number_allocator.allocate()
 
         # 2) Проверка проблем (до сохранения) для закупаемых
         if self.is_purchased:
             self.check_problems()
 
+        # 3) У новой позиции ещё нет детей - прогресс определяется её статусом
+        if created:
+            self.calculated_progress = Decimal('100') if is_completed(self._progress_row()) else Decimal('0')
+
+        # 4) Материализованный путь: при создании и перемещении
+        old_state = getattr(self, '_progress_state', None)
+        loaded_parent_id = old_state[0] if old_state else _UNKNOWN
+        moved_from_path = None
+        if created or loaded_parent_id is _UNKNOWN or loaded_parent_id != self.parent_item_id:
+            moved_from_path = self._sync_tree_path(created)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'tree_path' not in update_fields:
+                kwargs['update_fields'] = list(update_fields) + ['tree_path']
+
         super().save(*args, **kwargs)
+
+        if moved_from_path:
+            # Одним UPDATE переписываем пути всего поддерева
+            ProjectItem.all_objects.filter(
+                tree_path__startswith=moved_from_path
+            ).exclude(pk=self.pk).update(
+                tree_path=Concat(
+                    Value(self.tree_path),
+                    Substr('tree_path', len(moved_from_path) + 1),
+                    output_field=models.TextField(),
+                )
+            )
+
+        # 5) Пересчёт прогресса узла и его предков - только если изменились
+        # влияющие на прогресс поля
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not PROGRESS_UPDATE_FIELDS.intersection(update_fields):
+            return
+
+        new_state = self._get_progress_state()
+        self._progress_state = new_state
+        if not created and old_state == new_state and _UNKNOWN not in new_state:
+            return
+
+        old_parent_id = old_state[0] if old_state and old_state[0] is not _UNKNOWN else self.parent_item_id
+        old_deleted_at = old_state[-1] if old_state else _UNKNOWN
+        structure_changed = (
+            old_parent_id != self.parent_item_id
+            or old_deleted_at is _UNKNOWN
+            or (old_deleted_at is None) != (self.deleted_at is None)
+        )
+        ProgressTracker().item_saved(
+            self,
+            old_parent_id=old_parent_id,
+            created=created,
+            structure_changed=structure_changed,
+        )
+
+    def delete(self, *args, **kwargs):
+        from application.services.progress import ProgressTracker
+
+        parent_id, project_id = self.parent_item_id, self.project_id
+        result = super().delete(*args, **kwargs)
+        ProgressTracker().propagate(
+            item_ids=[parent_id],
+            project_ids=[] if parent_id else [project_id],
+        )
+        return result
+
+    def _sync_tree_path(self, created):
+        """
+        Пересчитать tree_path по текущему родителю.
+        Возвращает прежний путь, если позиция переместилась (нужно переписать поддерево).
+        """
+        parent_path = ''
+        if self.parent_item_id:
+            # Путь родителя берём из БД: объект в памяти мог устареть после перемещения
+            parent_path = ProjectItem.all_objects.filter(
+                pk=self.parent_item_id
+            ).values_list('tree_path', flat=True).first() or ''
+
+        new_path = f'{parent_path}{self.pk.hex}/'
+        old_path = '' if created else self.tree_path
+        if old_path and parent_path.startswith(old_path):
+            raise ValueError('Нельзя переместить позицию внутрь её собственной структуры')
+
+        self.tree_path = new_path
+        if old_path and old_path != new_path:
+            return old_path
+        return None
+
+    @staticmethod
+    def ids_from_path(path):
+        """id всех позиций пути - от корня до самой позиции."""
+        return [uuid.UUID(part) for part in path.split('/') if part]
+
+    @property
+    def ancestor_ids(self):
+        """id предков от корня к родителю (по tree_path, без запросов)."""
+        return self.ids_from_path(self.tree_path)[:-1]
+
+    @staticmethod
+    def subtree_q(paths, prefix=''):
+        """
+        Q-фильтр "позиция входит в поддерево одного из путей" (включая сами вершины).
+        Вложенные пути отбрасываются - каждое поддерево даёт один индексируемый LIKE.
+        """
+        roots = []
+        for path in sorted(p for p in paths if p):
+            if roots and path.startswith(roots[-1]):
+                continue
+            roots.append(path)
+
+        q = models.Q(pk__in=[])
+        for path in roots:
+            q |= models.Q(**{f'{prefix}tree_path__startswith': path})
+        return q
+
+    def _progress_row(self):
+        category = self.nomenclature_item.catalog_category if self.nomenclature_item_id else None
+        return {
+            'purchase_status': self.purchase_status,
+            'manufacturer_type': self.manufacturer_type,
+            'manufacturing_status': self.manufacturing_status,
+            'contractor_status': self.contractor_status,
+            'nomenclature_item__catalog_category__is_purchased': category.is_purchased if category else None,
+        }
     
     def calculate_progress(self):
         """
@@ -977,41 +1024,11 @@ class ProjectItem(BaseModelWithHistory):
         2. Для родительских позиций:
            - Среднее арифметическое от прогресса дочерних элементов
            - Вес каждого дочернего элемента одинаковый
-        """
-        from decimal import Decimal
         
-        children = self.children.all()
-
-        # Если сам элемент в финальном статусе, прогресс всегда 100%
-        # (даже если у него есть дочерние элементы).
-        if self.is_purchased:
-            if self.purchase_status in ['closed', 'written_off']:
-                return Decimal('100')
-        else:
-            if self.manufacturer_type == 'contractor':
-                if self.contractor_status == 'completed':
-                    return Decimal('100')
-            else:
-                if self.manufacturing_status == 'completed':
-                    return Decimal('100')
-        
-        if not children.exists():
-            # Leaf node - progress is based on final status only
-            if self.is_purchased:
-                # Для закупаемых: 100% если закрыта/списано
-                return Decimal('100') if self.purchase_status in ['closed', 'written_off'] else Decimal('0')
-            else:
-                # Для изготавливаемых: 100% только если статус "Изготовлено"
-                if self.manufacturer_type == 'contractor':
-                    # Подрядчик - смотрим contractor_status
-                    return Decimal('100') if self.contractor_status == 'completed' else Decimal('0')
-                else:
-                    # Своими силами - смотрим manufacturing_status
-                    return Decimal('100') if self.manufacturing_status == 'completed' else Decimal('0')
-        
-        # Parent node - average of children (equal weight)
-        total = sum(child.calculate_progress() for child in children)
-        return total / children.count() if children.count() > 0 else Decimal('0')
+        Значение хранится в calculated_progress и пересчитывается при записи
+        (ProgressTracker), поэтому чтение не выполняет запросов.
+        """
+        return self.calculated_progress
 
 
 class UserAssignment(BaseModelWithHistory):
@@ -0,0 +1,357 @@
+"""
+Sequence ORM Models.
+
+Counters for human-readable numbers without MAX() scans. Document numbers
+come from counter rows (a block is reserved by a single UPDATE ... RETURNING),
+project item IDs from a PostgreSQL SEQUENCE (nextval() takes no row lock).
+"""
+
+import os
+import re
+import threading
+from collections import deque
+from typing import Callable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+
+class NumberSequence(models.Model):
+    """Именованный счётчик (строка на ключ)."""
+
+    key = models.CharField(
+        max_length=50,
+        primary_key=True,
+        verbose_name="Ключ"
+    )
+    last_value = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name="Последнее значение"
+    )
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def reserve(cls, count, key, initial: Optional[Callable[[], int]] = None):
+        """
+        Зарезервировать блок из `count` последовательных номеров.
+
+        Один запрос UPDATE ... RETURNING: счётчик увеличивается сразу на весь блок,
+        строка счётчика блокируется до конца текущей транзакции, поэтому
+        параллельные резервирования не пересекаются.
+        initial() - начальное значение счётчика при первом обращении к ключу.
+        Возвращает первый номер блока.
+        """
+        if count <= 0:
+            raise ValueError('count must be positive')
+
+        qn = connection.ops.quote_name
+        sql = (
+            f'UPDATE {qn(cls._meta.db_table)} '
+            f'SET {qn("last_value")} = {qn("last_value")} + %s '
+            f'WHERE {qn("key")} = %s '
+            f'RETURNING {qn("last_value")}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [count, key])
+            row = cursor.fetchone()
+
+        if row is None:
+            # Первое обращение: создаём строку счётчика и повторяем
+            cls.objects.get_or_create(key=key, defaults={'last_value': initial() if initial else 0})
+            return cls.reserve(count, key=key)
+
+        return row[0] - count + 1
+
+
+class DocumentSequence(NumberSequence):
+    """Счётчики номеров документов (ключ - тип документа, при ежедневной нумерации - тип и дата)."""
+
+    class Meta:
+        db_table = 'document_sequences'
+        verbose_name = 'Счётчик номеров документов'
+        verbose_name_plural = 'Счётчики номеров документов'
+
+
+class SequenceAllocator:
+    """
+    Per-process allocator of sequence numbers.
+
+    - allocate(): одиночный номер из локального кэша заранее зарезервированных
+      номеров; к счётчику в БД обращаемся только когда кэш исчерпан.
+    - allocate_block(count): диапазон номеров для массового создания,
+      резервируется одним запросом.
+
+    Кэш пополняется только вне транзакции: номера, зарезервированные внутри
+    транзакции, откатились бы вместе с ней и были бы выданы повторно.
+    Номера из кэша, использованные в откатившейся транзакции, дают пропуски
+    в нумерации - это допустимо, номер обязан быть уникальным, но не плотным.
+    """
+
+    sequence_model = None
+    cache_size_setting = None
+    default_cache_size = 20
+
+    def __init__(self, key, cache_size=None, initial: Optional[Callable[[], int]] = None):
+        self.key = key
+        self.initial = initial
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._next = 0
+        self._limit = 0
+        self._pid = None
+
+    @property
+    def cache_size(self):
+        if self._cache_size is not None:
+            return self._cache_size
+        return getattr(settings, self.cache_size_setting, self.default_cache_size)
+
+    def allocate(self):
+        """Выдать один номер."""
+        taken = self._take_cached(1)
+        if taken is not None:
+            return taken
+
+        size = self.cache_size
+        if size <= 1 or transaction.get_connection().in_atomic_block:
+            return self._reserve(1)
+
+        first = self._reserve(size)
+        with self._lock:
+            self._next, self._limit, self._pid = first + 1, first + size, os.getpid()
+        return first
+
+    def allocate_block(self, count):
+        """Выдать диапазон из `count` последовательных номеров."""
+        if count <= 0:
+            raise ValueError('count must be positive')
+
+        taken = self._take_cached(count)
+        if taken is not None:
+            return range(taken, taken + count)
+
+        first = self._reserve(count)
+        return range(first, first + count)
+
+    def reset(self):
+        """Сбросить локальный кэш (например, после синхронизации счётчика)."""
+        with self._lock:
+            self._next = self._limit = 0
+            self._pid = None
+
+    def _reserve(self, count):
+        return self.sequence_model.reserve(count, key=self.key, initial=self.initial)
+
+    def _take_cached(self, count):
+        with self._lock:
+            # После fork кэш родительского процесса не используем
+            if self._pid != os.getpid() or self._limit - self._next < count:
+                return None
+            first = self._next
+            self._next += count
+            return first
+
+
+class DatabaseSequenceAllocator:
+    """
+    Per-process allocator backed by a PostgreSQL SEQUENCE.
+
+    nextval() не блокирует строк и не откатывается вместе с транзакцией,
+    поэтому номера берутся и кэшируются и внутри transaction.atomic():
+    параллельные транзакции не ждут друг друга на общем счётчике.
+    Номера уникальны, но не плотны и не обязательно идут подряд: откат,
+    перезапуск процесса и параллельная выдача оставляют пропуски.
+    """
+
+    sequence_name = None
+    cache_size_setting = None
+    default_cache_size = 20
+
+    def __init__(self, cache_size=None):
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cached = deque()
+        self._pid = None
+
+    @property
+    def cache_size(self):
+        if self._cache_size is not None:
+            return self._cache_size
+        return getattr(settings, self.cache_size_setting, self.default_cache_size)
+
+    def allocate(self):
+        """Выдать один номер."""
+        taken = self._take_cached(1)
+        if taken is not None:
+            return taken[0]
+
+        values = self._nextval(max(self.cache_size, 1))
+        with self._lock:
+            if self._pid != os.getpid():
+                self._cached, self._pid = deque(), os.getpid()
+            self._cached.extend(values[1:])
+        return values[0]
+
+    def allocate_block(self, count) -> List[int]:
+        """Выдать `count` номеров по возрастанию (не обязательно подряд)."""
+        if count <= 0:
+            raise ValueError('count must be positive')
+
+        taken = self._take_cached(count)
+        if taken is not None:
+            return taken
+        return self._nextval(count)
+
+    def reset(self):
+        """Сбросить локальный кэш (например, после синхронизации последовательности)."""
+        with self._lock:
+            self._cached = deque()
+            self._pid = None
+
+    def last_value(self) -> int:
+        """Последний выданный последовательностью номер (0 - ещё не выдавался)."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT last_value, is_called FROM {connection.ops.quote_name(self.sequence_name)}'
+            )
+            last_value, is_called = cursor.fetchone()
+        return last_value if is_called else last_value - 1
+
+    def sync(self, max_existing: int) -> Tuple[int, int]:
+        """
+        Поднять последовательность до max_existing (только вверх).
+        Возвращает (старое значение, новое значение).
+        """
+        old_value = self.last_value()
+        if max_existing > old_value:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT setval(%s, %s)', [self.sequence_name, max_existing])
+        self.reset()
+        return old_value, max(old_value, max_existing)
+
+    def restart(self, last_value: int = 0):
+        """Перезапустить последовательность: следующий номер - last_value + 1."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'ALTER SEQUENCE {connection.ops.quote_name(self.sequence_name)} '
+                f'RESTART WITH {int(last_value) + 1}'
+            )
+        self.reset()
+
+    def _nextval(self, count) -> List[int]:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT nextval(%s) FROM generate_series(1, %s)',
+                [self.sequence_name, count],
+            )
+            return sorted(row[0] for row in cursor.fetchall())
+
+    def _take_cached(self, count):
+        with self._lock:
+            # После fork кэш родительского процесса не используем
+            if self._pid != os.getpid() or len(self._cached) < count:
+                return None
+            return [self._cached.popleft() for _ in range(count)]
+
+
+class DocumentNumberAllocator(SequenceAllocator):
+    sequence_model = DocumentSequence
+    cache_size_setting = 'DOCUMENT_NUMBER_CACHE_SIZE'
+    # По умолчанию без кэша: номера документов идут строго по порядку создания
+    default_cache_size = 1
+
+
+class DocumentNumbering:
+    """
+    Нумерация документов одного типа: <префикс><номер, не короче width цифр>.
+
+    Счётчик - строка DocumentSequence; при ежедневной нумерации (daily) ключ
+    и префикс включают дату (ИНВ-YYYYMMDD-XXXX). При первом обращении к ключу
+    счётчик инициализируется по уже существующим номерам - это единственный
+    просмотр таблицы документов, дальше номера выдаются без MAX()/COUNT().
+
+    DOCUMENT_NUMBER_CACHE_SIZE > 1 включает резервирование номеров блоками на
+    процесс (меньше обращений к счётчику ценой нарушения порядка номеров
+    между процессами и пропусков после перезапуска).
+    """
+
+    def __init__(self, key: str, prefix: str, width: int = 4, daily: bool = False):
+        self.key = key
+        self.prefix = prefix
+        self.width = width
+        self.daily = daily
+        self._allocators = {}
+        self._lock = threading.Lock()
+
+    def next_number(self, model) -> str:
+        """Следующий номер документа модели model."""
+        key, prefix = self._scope()
+        return self._format(prefix, self._allocator(model, key, prefix).allocate())
+
+    def next_numbers(self, model, count: int) -> List[str]:
+        """`count` номеров подряд - одним резервированием (для массового создания)."""
+        key, prefix = self._scope()
+        return [
+            self._format(prefix, value)
+            for value in self._allocator(model, key, prefix).allocate_block(count)
+        ]
+
+    def sync(self, model):
+        """
+        Поднять счётчик до максимального существующего номера (после ручных
+        правок/загрузки данных). Возвращает (старое значение, новое значение).
+        """
+        key, prefix = self._scope()
+        with transaction.atomic():
+            seq, _ = DocumentSequence.objects.select_for_update().get_or_create(key=key)
+            old_value = seq.last_value or 0
+            max_existing = self.max_existing(model, prefix)
+            if max_existing > old_value:
+                seq.last_value = max_existing
+                seq.save(update_fields=['last_value'])
+        self._allocator(model, key, prefix).reset()
+        return old_value, seq.last_value
+
+    def reset(self):
+        """Сбросить кэш номеров процесса для всех ключей."""
+        with self._lock:
+            allocators = list(self._allocators.values())
+        for allocator in allocators:
+            allocator.reset()
+
+    def max_existing(self, model, prefix: Optional[str] = None) -> int:
+        """
+        Наибольший числовой номер среди документов (включая мягко удалённые).
+
+        Сравнение по числу, а не по строке: 'З-10000' > 'З-9999'.
+        """
+        prefix = self._scope()[1] if prefix is None else prefix
+        manager = getattr(model, 'all_objects', model._default_manager)
+        pattern = re.compile(rf'^{re.escape(prefix)}(\d+)$')
+        max_value = 0
+        for number in manager.filter(number__startswith=prefix).values_list('number', flat=True).iterator():
+            match = pattern.match(number or '')
+            if match:
+                max_value = max(max_value, int(match.group(1)))
+        return max_value
+
+    def _scope(self):
+        if not self.daily:
+            return self.key, self.prefix
+        day = timezone.now().strftime('%Y%m%d')
+        return f'{self.key}:{day}', f'{self.prefix}{day}-'
+
+    def _allocator(self, model, key, prefix) -> DocumentNumberAllocator:
+        with self._lock:
+            allocator = self._allocators.get(key)
+            if allocator is None:
+                allocator = DocumentNumberAllocator(key, initial=lambda: self.max_existing(model, prefix))
+                # Для ежедневной нумерации держим только счётчик текущего дня
+                self._allocators = {key: allocator}
+            return allocator
+
+    def _format(self, prefix, value) -> str:
+        return f'{prefix}{value:0{self.width}d}'
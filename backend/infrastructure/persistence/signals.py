@@ -0,0 +1,170 @@
+"""
+Signal Handlers.
+
+Invalidation of cached data derived from models:
+- effective permissions (application.services.access) when users, roles,
+  role assignments or module access change;
+- dashboard snapshots (application.services.dashboard) when projects or
+  project items change;
+- BOM explosions and BOM trees (application.services.bom_explosion) when
+  BOM structures or BOM items change, and when nomenclature or catalog
+  categories are deleted or change in fields BOMs depend on;
+- procurement statistics (application.services.procurement_stats) when
+  purchase orders, their lines or goods receipts change;
+- problem flags (application.services.problem_detection) of rows linked to a
+  purchase order when the order or its lines change;
+- reference data (application.services.reference_data) when reasons,
+  statuses, catalog categories or nomenclature types change.
+"""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import (
+    BOMItem,
+    BOMStructure,
+    CatalogCategory,
+    DelayReason,
+    GoodsReceipt,
+    GoodsReceiptItem,
+    ManufacturingProblemReason,
+    ManufacturingProblemSubreason,
+    ManufacturingStatus,
+    NomenclatureItem,
+    NomenclatureType,
+    ProblemReason,
+    Project,
+    ProjectItem,
+    PurchaseOrder,
+    PurchaseOrderItem,
+    PurchaseProblemReason,
+    PurchaseProblemSubreason,
+    PurchaseStatus,
+    Role,
+    RoleModuleAccess,
+    User,
+    UserModuleAccess,
+    UserRole,
+)
+
+
+def _invalidate_users(*user_ids):
+    from application.services.access import invalidate_user_permissions
+    invalidate_user_permissions(user_ids)
+
+
+def _invalidate_roles(*role_ids):
+    from application.services.access import invalidate_role_permissions
+    invalidate_role_permissions(role_ids)
+
+
+@receiver([post_save, post_delete], sender=User, dispatch_uid='permissions_user_changed')
+def user_changed(sender, instance, **kwargs):
+    _invalidate_users(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=UserRole, dispatch_uid='permissions_user_role_changed')
+@receiver([post_save, post_delete], sender=UserModuleAccess, dispatch_uid='permissions_user_module_access_changed')
+def user_access_changed(sender, instance, **kwargs):
+    _invalidate_users(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Role, dispatch_uid='permissions_role_changed')
+def role_changed(sender, instance, **kwargs):
+    _invalidate_roles(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=RoleModuleAccess, dispatch_uid='permissions_role_module_access_changed')
+def role_module_access_changed(sender, instance, **kwargs):
+    _invalidate_roles(instance.role_id)
+
+
+# =============================================================================
+# Dashboard snapshots (application.services.dashboard)
+# =============================================================================
+
+def _invalidate_dashboard(project_ids=(), index=False):
+    from application.services.dashboard import DashboardSnapshotStore
+    DashboardSnapshotStore.invalidate(project_ids, index=index)
+
+
+@receiver([post_save, post_delete], sender=Project, dispatch_uid='dashboard_project_changed')
+def dashboard_project_changed(sender, instance, **kwargs):
+    _invalidate_dashboard([instance.pk], index=True)
+
+
+@receiver([post_save, post_delete], sender=ProjectItem, dispatch_uid='dashboard_project_item_changed')
+def dashboard_project_item_changed(sender, instance, **kwargs):
+    _invalidate_dashboard([instance.project_id])
+
+
+# =============================================================================
+# BOM explosions and trees (application.services.bom_explosion)
+# =============================================================================
+
+@receiver([post_save, post_delete], sender=BOMItem, dispatch_uid='bom_explosion_item_changed')
+@receiver([post_save, post_delete], sender=BOMStructure, dispatch_uid='bom_explosion_structure_changed')
+@receiver(post_delete, sender=CatalogCategory, dispatch_uid='bom_explosion_category_deleted')
+@receiver(post_delete, sender=NomenclatureItem, dispatch_uid='bom_explosion_nomenclature_deleted')
+def bom_explosion_source_changed(sender, instance, **kwargs):
+    from application.services.bom_explosion import invalidate_bom_explosions
+    invalidate_bom_explosions()
+
+
+@receiver(post_save, sender=CatalogCategory, dispatch_uid='bom_explosion_category_saved')
+@receiver(post_save, sender=NomenclatureItem, dispatch_uid='bom_explosion_nomenclature_saved')
+def bom_explosion_reference_saved(sender, instance, created, **kwargs):
+    # Новая запись ещё не входит ни в одну структуру; правка прочих полей
+    # (код, описание, тип и т.п.) развёртки и деревья BOM не меняет
+    changed = instance.bom_fields_changed()
+    if changed and not created:
+        from application.services.bom_explosion import invalidate_bom_explosions
+        invalidate_bom_explosions()
+
+
+# =============================================================================
+# Procurement statistics (application.services.procurement_stats)
+# =============================================================================
+
+@receiver([post_save, post_delete], sender=PurchaseOrder, dispatch_uid='procurement_stats_order_changed')
+@receiver([post_save, post_delete], sender=PurchaseOrderItem, dispatch_uid='procurement_stats_order_item_changed')
+@receiver([post_save, post_delete], sender=GoodsReceipt, dispatch_uid='procurement_stats_receipt_changed')
+@receiver([post_save, post_delete], sender=GoodsReceiptItem, dispatch_uid='procurement_stats_receipt_item_changed')
+def procurement_stats_source_changed(sender, instance, **kwargs):
+    from application.services.procurement_stats import invalidate_procurement_stats
+    invalidate_procurement_stats()
+
+
+# =============================================================================
+# Problem flags (application.services.problem_detection)
+# =============================================================================
+
+@receiver([post_save, post_delete], sender=PurchaseOrder, dispatch_uid='problem_flags_order_changed')
+def problem_flags_order_changed(sender, instance, **kwargs):
+    from application.services.problem_detection import schedule_order_refresh
+    schedule_order_refresh(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=PurchaseOrderItem, dispatch_uid='problem_flags_order_item_changed')
+def problem_flags_order_item_changed(sender, instance, **kwargs):
+    from application.services.problem_detection import schedule_order_refresh
+    schedule_order_refresh(instance.order_id)
+
+
+# =============================================================================
+# Reference data (application.services.reference_data)
+# =============================================================================
+
+@receiver([post_save, post_delete], sender=CatalogCategory, dispatch_uid='reference_data_category_changed')
+@receiver([post_save, post_delete], sender=DelayReason, dispatch_uid='reference_data_delay_reason_changed')
+@receiver([post_save, post_delete], sender=ManufacturingProblemReason, dispatch_uid='reference_data_m_reason_changed')
+@receiver([post_save, post_delete], sender=ManufacturingProblemSubreason, dispatch_uid='reference_data_m_subreason_changed')
+@receiver([post_save, post_delete], sender=ManufacturingStatus, dispatch_uid='reference_data_m_status_changed')
+@receiver([post_save, post_delete], sender=NomenclatureType, dispatch_uid='reference_data_type_changed')
+@receiver([post_save, post_delete], sender=ProblemReason, dispatch_uid='reference_data_problem_reason_changed')
+@receiver([post_save, post_delete], sender=PurchaseProblemReason, dispatch_uid='reference_data_p_reason_changed')
+@receiver([post_save, post_delete], sender=PurchaseProblemSubreason, dispatch_uid='reference_data_p_subreason_changed')
+@receiver([post_save, post_delete], sender=PurchaseStatus, dispatch_uid='reference_data_p_status_changed')
+def reference_data_changed(sender, instance, **kwargs):
+    from application.services.reference_data import invalidate_reference_data
+    invalidate_reference_data([sender])
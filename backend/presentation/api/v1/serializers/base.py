@@ -7,6 +7,8 @@ Common serializer mixins and base classes.
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 
+from application.services.reference_data import reference_table
+
 User = get_user_model()
 
 
@@ -53,6 +55,34 @@ class UserMinimalSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
+class ReferenceDetailField(serializers.Field):
+    """
+    Read-only nested representation of a reference-data row.
+    
+    The row is looked up by foreign key id (source='<field>_id') in the
+    process-wide reference cache (application.services.reference_data)
+    instead of a join or a query per row.
+    """
+    
+    def __init__(self, model, serializer_class, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+        self.model = model
+        self.serializer_class = serializer_class
+        self._table = None
+        self._representations = {}
+    
+    def to_representation(self, value):
+        table = reference_table(self.model)
+        if table is not self._table:
+            self._table = table
+            self._representations = {}
+        if value not in self._representations:
+            row = table.get(value)
+            self._representations[value] = self.serializer_class(row).data if row is not None else None
+        return self._representations[value]
+
+
 class RecursiveSerializer(serializers.Serializer):
     """Serializer for recursive tree structures."""
     
@@ -4,15 +4,111 @@ BOM Serializers.
 Serializers for Bill of Materials structures.
 """
 
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework import serializers
+
+from application.services.bom_explosion import bom_cache_generation
 from infrastructure.persistence.models import (
     BOMStructure,
     BOMItem,
+    NomenclatureItem,
 )
 from .base import BaseModelSerializer
 from .catalog import NomenclatureMinimalSerializer, NomenclatureListSerializer
 
 
+TREE_CACHE_KEY = 'bom_tree:v1:{generation}:{bom_id}:{version}'
+DEFAULT_TREE_CACHE_TIMEOUT = 60 * 60
+
+TREE_ITEM_FIELDS = ('id', 'parent_item_id', 'child_item_id', 'quantity', 'unit', 'position', 'notes')
+
+_quantity_field = serializers.DecimalField(max_digits=15, decimal_places=3)
+
+
+def bom_max_depth(pairs):
+    """
+    Максимальная глубина BOM по парам (parent_item_id, child_item_id).
+
+    Один проход с мемоизацией высоты узла (общие подсборки считаются один раз);
+    корни - строки без родителя, без корней глубина 1, без строк - 0.
+    """
+    if not pairs:
+        return 0
+
+    children_map = {}
+    root_ids = []
+    for parent_id, child_id in pairs:
+        if parent_id is None:
+            root_ids.append(child_id)
+        else:
+            children_map.setdefault(parent_id, []).append(child_id)
+    if not root_ids:
+        return 1
+
+    heights = {}
+    for root_id in root_ids:
+        stack = [(root_id, False)]
+        in_progress = set()
+        while stack:
+            node_id, expanded = stack.pop()
+            if node_id in heights:
+                continue
+            children = children_map.get(node_id, ())
+            if expanded:
+                in_progress.discard(node_id)
+                heights[node_id] = 1 + max((heights.get(child_id, 0) for child_id in children), default=0)
+                continue
+            in_progress.add(node_id)
+            stack.append((node_id, True))
+            # Узлы на текущем пути (цикл в данных) не раскрываем повторно
+            stack.extend((child_id, False) for child_id in children if child_id not in in_progress)
+    return max(heights[root_id] for root_id in root_ids)
+
+
+def build_bom_tree(bom):
+    """
+    Дерево BOM (как BOMItemTreeSerializer) из одной выборки строк
+    и одного запроса номенклатуры.
+
+    Возвращает (tree, max_depth, items_count).
+    """
+    rows = list(
+        BOMItem.objects.filter(bom=bom).order_by('position').values_list(*TREE_ITEM_FIELDS)
+    )
+    nomenclature = {
+        item['id']: item
+        for item in NomenclatureMinimalSerializer(
+            NomenclatureItem.objects.filter(
+                id__in={row[2] for row in rows}
+            ).select_related('catalog_category'),
+            many=True,
+        ).data
+    }
+
+    items_by_parent = {}
+    for row in rows:
+        items_by_parent.setdefault(row[1], []).append(row)
+
+    def build(parent_id, level, path):
+        nodes = []
+        for item_id, _, child_id, quantity, unit, position, notes in items_by_parent.get(parent_id, ()):
+            nodes.append({
+                'id': str(item_id),
+                'child_item': nomenclature.get(str(child_id)),
+                'quantity': _quantity_field.to_representation(quantity),
+                'unit': unit,
+                'position': position,
+                'notes': notes,
+                'level': level,
+                'children': [] if child_id in path else build(child_id, level + 1, path | {child_id}),
+            })
+        return nodes
+
+    tree = build(None, 0, frozenset())
+    return tree, bom_max_depth([(row[1], row[2]) for row in rows]), len(rows)
+
+
 class BOMItemSerializer(BaseModelSerializer):
     """Serializer for BOM items."""
     
@@ -70,7 +166,7 @@ class BOMStructureListSerializer(BaseModelSerializer):
         read_only=True
     )
     root_category_display = serializers.SerializerMethodField()
-    items_count = serializers.IntegerField(source='items.count', read_only=True)
+    items_count = serializers.SerializerMethodField()
     
     class Meta:
         model = BOMStructure
@@ -87,6 +183,11 @@ class BOMStructureListSerializer(BaseModelSerializer):
     def get_root_category_display(self, obj):
         """Return root_category as display (now it's just the code string)."""
         return obj.root_category or ''
+    
+    def get_items_count(self, obj):
+        # Список BOM аннотирует число строк (items_total); вложенный в проект - COUNT
+        items_total = getattr(obj, 'items_total', None)
+        return items_total if items_total is not None else obj.items.count()
 
 
 class BOMStructureDetailSerializer(BaseModelSerializer):
@@ -127,38 +228,14 @@ class BOMStructureDetailSerializer(BaseModelSerializer):
         return obj.root_category or ''
     
     def get_total_items_count(self, obj):
-        return obj.items.count()
+        # Строки уже загружены для поля items (prefetch во ViewSet)
+        return len(obj.items.all())
     
     def get_max_depth(self, obj):
         """Calculate maximum nesting depth of BOM."""
-        items = obj.items.all()
-        if not items:
-            return 0
-        
-        # Build parent-child mapping
-        children_map = {}
-        root_items = []
-        
-        for item in items:
-            if item.parent_item_id is None:
-                root_items.append(item.child_item_id)
-            else:
-                if item.parent_item_id not in children_map:
-                    children_map[item.parent_item_id] = []
-                children_map[item.parent_item_id].append(item.child_item_id)
-        
-        def calculate_depth(item_id, current_depth=1):
-            if item_id not in children_map:
-                return current_depth
-            return max(
-                calculate_depth(child_id, current_depth + 1)
-                for child_id in children_map[item_id]
-            )
-        
-        if not root_items:
-            return 1
-        
-        return max(calculate_depth(root_id) for root_id in root_items)
+        return bom_max_depth([
+            (item.parent_item_id, item.child_item_id) for item in obj.items.all()
+        ])
 
 
 class BOMStructureTreeSerializer(BaseModelSerializer):
@@ -186,29 +263,18 @@ class BOMStructureTreeSerializer(BaseModelSerializer):
         return obj.root_category or ''
     
     def get_tree(self, obj):
-        """Build hierarchical tree of BOM items."""
-        items = obj.items.select_related(
-            'child_item', 'parent_item'
-        ).order_by('position')
-        
-        # Build tree structure
-        items_by_parent = {}
-        for item in items:
-            parent_id = item.parent_item_id
-            if parent_id not in items_by_parent:
-                items_by_parent[parent_id] = []
-            items_by_parent[parent_id].append(item)
-        
-        def build_tree(parent_id=None, level=0):
-            result = []
-            for item in items_by_parent.get(parent_id, []):
-                item.level = level
-                item.children_items = build_tree(item.child_item_id, level + 1)
-                result.append(item)
-            return result
-        
-        root_items = build_tree(None)
-        return BOMItemTreeSerializer(root_items, many=True).data
+        """Build hierarchical tree of BOM items (cached per BOM version)."""
+        key = TREE_CACHE_KEY.format(
+            generation=bom_cache_generation(),
+            bom_id=obj.pk,
+            version=obj.current_version,
+        )
+        tree = cache.get(key)
+        if tree is None:
+            tree, _, _ = build_bom_tree(obj)
+            timeout = getattr(settings, 'BOM_TREE_CACHE_TIMEOUT', DEFAULT_TREE_CACHE_TIMEOUT)
+            cache.set(key, tree, timeout)
+        return tree
 
 
 class BOMComparisonSerializer(serializers.Serializer):
@@ -224,6 +290,17 @@ class BOMComparisonSerializer(serializers.Serializer):
     )
 
 
+class BOMCloneSerializer(serializers.Serializer):
+    """Parameters of BOM cloning (root_item - root item of the copy, default - source root)."""
+    
+    name = serializers.CharField(max_length=300)
+    root_item = serializers.PrimaryKeyRelatedField(
+        queryset=NomenclatureItem.objects.all(),
+        required=False,
+        allow_null=True,
+    )
+
+
 class BOMImportSerializer(serializers.Serializer):
     """Serializer for importing BOM from external sources."""
     
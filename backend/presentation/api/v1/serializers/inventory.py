@@ -23,7 +23,7 @@ from infrastructure.persistence.models import (
     ContractorReceipt,
     ContractorReceiptItem,
 )
-from .base import BaseModelSerializer
+from .base import BaseModelSerializer, ReferenceDetailField
 
 
 class WarehouseSerializer(BaseModelSerializer):
@@ -120,6 +120,7 @@ class StockItemListSerializer(BaseModelSerializer):
             'unit', 'min_quantity', 'location',
             'is_low_stock', 'last_inventory_date'
         ]
+        read_only_fields = ['quantity', 'reserved_quantity']
 
 
 class StockItemDetailSerializer(BaseModelSerializer):
@@ -145,7 +146,8 @@ class StockItemDetailSerializer(BaseModelSerializer):
             'is_low_stock', 'last_inventory_date',
             'batches', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        # Остатки меняются только движениями (StockLedger)
+        read_only_fields = ['id', 'quantity', 'reserved_quantity', 'created_at', 'updated_at']
 
 
 class StockReservationSerializer(BaseModelSerializer):
@@ -520,7 +522,7 @@ class MaterialRequirementModelSerializer(BaseModelSerializer):
     purchase_order_detail = serializers.SerializerMethodField()
     
     # Флаг и причина проблемы
-    problem_reason_detail = ProblemReasonSerializer(source='problem_reason', read_only=True)
+    problem_reason_detail = ReferenceDetailField(ProblemReason, ProblemReasonSerializer, source='problem_reason_id')
     
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     priority_display = serializers.CharField(source='get_priority_display', read_only=True)
@@ -259,9 +259,11 @@ class ProcurementScheduleItemSerializer(serializers.Serializer):
     """Serializer for procurement schedule (what needs to be ordered)."""
     
     id = serializers.UUIDField()
+    item_number = serializers.IntegerField()
     project_id = serializers.UUIDField()
     project_name = serializers.CharField()
-    nomenclature_id = serializers.UUIDField()
+    nomenclature_id = serializers.UUIDField(allow_null=True)
+    nomenclature_name = serializers.CharField(allow_null=True)
     name = serializers.CharField()
     required_quantity = serializers.DecimalField(max_digits=15, decimal_places=3)
     ordered_quantity = serializers.DecimalField(max_digits=15, decimal_places=3)
@@ -269,11 +271,19 @@ class ProcurementScheduleItemSerializer(serializers.Serializer):
     remaining_quantity = serializers.DecimalField(max_digits=15, decimal_places=3)
     unit = serializers.CharField()
     required_date = serializers.DateField(allow_null=True)
+    order_date = serializers.DateField(allow_null=True)
     status = serializers.CharField()
     supplier_id = serializers.UUIDField(allow_null=True)
     supplier_name = serializers.CharField(allow_null=True)
 
 
+class ProcurementAnalyticsFilterSerializer(serializers.Serializer):
+    """Query params of procurement statistics/analytics."""
+    
+    supplier = serializers.UUIDField(required=False)
+    project = serializers.UUIDField(required=False)
+
+
 class ProcurementStatsSerializer(serializers.Serializer):
     """Serializer for procurement statistics."""
     
@@ -282,9 +292,12 @@ class ProcurementStatsSerializer(serializers.Serializer):
     ordered = serializers.IntegerField()
     in_transit = serializers.IntegerField()
     delivered = serializers.IntegerField()
+    cancelled = serializers.IntegerField()
     overdue = serializers.IntegerField()
+    overdue_amount = serializers.DecimalField(max_digits=15, decimal_places=2)
     total_orders = serializers.IntegerField()
     total_amount = serializers.DecimalField(max_digits=15, decimal_places=2, allow_null=True)
+    on_time_rate = serializers.FloatField(allow_null=True)
 
 
 # =========================================================
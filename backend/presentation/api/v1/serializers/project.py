@@ -8,8 +8,12 @@ import uuid
 
 from rest_framework import serializers
 from django.db import models as db_models
+from django.db.models import Case, OuterRef, Subquery, When
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from infrastructure.persistence.models import (
+    DelayReason,
+    ProblemReason,
     Project,
     ProjectItem,
     PurchaseOrderItem,
@@ -19,7 +23,8 @@ from infrastructure.persistence.models import (
     PurchaseProblemSubreason,
 )
 from infrastructure.persistence.models import MaterialRequirement
-from .base import BaseModelSerializer, UserMinimalSerializer
+from application.services.reference_data import reference_table
+from .base import BaseModelSerializer, ReferenceDetailField, UserMinimalSerializer
 from .catalog import (
     NomenclatureMinimalSerializer,
     NomenclatureListSerializer,
@@ -30,6 +35,74 @@ from .catalog import (
 from .bom import BOMStructureListSerializer
 
 
+# Заказы в этих статусах не считаются оформленными для позиции
+INACTIVE_ORDER_STATUSES = ['draft', 'cancelled']
+
+
+def annotate_latest_purchase_order(queryset):
+    """
+    Добавить к queryset позиций последний актуальный заказ на закупку.
+
+    Приоритет - заказ из потребности (последняя изменённая), иначе - заказ
+    по строке заказа (последняя созданная). Черновики и отменённые не учитываются.
+    Аннотации latest_order_id / latest_order_number читает _LatestOrderMixin.
+    """
+    requirements = MaterialRequirement.objects.filter(
+        project_item=OuterRef('pk'),
+        purchase_order__isnull=False,
+        is_active=True,
+    ).exclude(
+        purchase_order__status__in=INACTIVE_ORDER_STATUSES
+    ).order_by('-updated_at')
+    order_lines = PurchaseOrderItem.objects.filter(
+        project_item=OuterRef('pk'),
+    ).exclude(
+        order__status__in=INACTIVE_ORDER_STATUSES
+    ).order_by('-created_at')
+
+    return queryset.annotate(
+        _requirement_order_id=Subquery(requirements.values('purchase_order_id')[:1]),
+        _requirement_order_number=Subquery(requirements.values('purchase_order__number')[:1]),
+        _line_order_id=Subquery(order_lines.values('order_id')[:1]),
+        _line_order_number=Subquery(order_lines.values('order__number')[:1]),
+    ).annotate(
+        latest_order_id=Coalesce(
+            '_requirement_order_id', '_line_order_id', output_field=db_models.UUIDField()
+        ),
+        latest_order_number=Case(
+            When(_requirement_order_id__isnull=False, then='_requirement_order_number'),
+            default='_line_order_number',
+        ),
+    )
+
+
+class _LatestOrderMixin:
+    """Поля purchase_order_id / purchase_order_number из аннотаций queryset."""
+
+    def _get_latest_order(self, obj):
+        """Return (order_id, order_number) of the latest relevant purchase order."""
+        if not hasattr(obj, 'latest_order_id'):
+            # Объект получен не из аннотированного queryset - один запрос на объект
+            row = annotate_latest_purchase_order(
+                ProjectItem.objects.filter(pk=obj.pk)
+            ).values('latest_order_id', 'latest_order_number').first() or {}
+            obj.latest_order_id = row.get('latest_order_id')
+            obj.latest_order_number = row.get('latest_order_number')
+        return obj.latest_order_id, obj.latest_order_number
+
+
+def _problem_reason_detail(reason_id):
+    """Системная причина проблемы из кэша справочников."""
+    reason = reference_table(ProblemReason).get(reason_id) if reason_id else None
+    if reason is None:
+        return None
+    return {
+        'id': str(reason.id),
+        'code': reason.code,
+        'name': reason.name,
+    }
+
+
 class _ReasonMinimalSerializer(BaseModelSerializer):
     class Meta:
         fields = ['id', 'name']
@@ -55,7 +128,7 @@ class PurchaseProblemSubreasonMinimalSerializer(_ReasonMinimalSerializer):
         model = PurchaseProblemSubreason
 
 
-class ProjectItemListSerializer(BaseModelSerializer):
+class ProjectItemListSerializer(_LatestOrderMixin, BaseModelSerializer):
     """List serializer for project items."""
     
     nomenclature_item_detail = NomenclatureMinimalSerializer(
@@ -96,27 +169,27 @@ class ProjectItemListSerializer(BaseModelSerializer):
         source='supplier',
         read_only=True
     )
-    delay_reason_detail = DelayReasonMinimalSerializer(
-        source='delay_reason',
-        read_only=True
+    delay_reason_detail = ReferenceDetailField(
+        DelayReason, DelayReasonMinimalSerializer,
+        source='delay_reason_id'
     )
 
     # Аналитика причин/подпричин (производство/закупки)
-    manufacturing_problem_reason_detail = ManufacturingProblemReasonMinimalSerializer(
-        source='manufacturing_problem_reason',
-        read_only=True
+    manufacturing_problem_reason_detail = ReferenceDetailField(
+        ManufacturingProblemReason, ManufacturingProblemReasonMinimalSerializer,
+        source='manufacturing_problem_reason_id'
     )
-    manufacturing_problem_subreason_detail = ManufacturingProblemSubreasonMinimalSerializer(
-        source='manufacturing_problem_subreason',
-        read_only=True
+    manufacturing_problem_subreason_detail = ReferenceDetailField(
+        ManufacturingProblemSubreason, ManufacturingProblemSubreasonMinimalSerializer,
+        source='manufacturing_problem_subreason_id'
     )
-    purchase_problem_reason_detail = PurchaseProblemReasonMinimalSerializer(
-        source='purchase_problem_reason',
-        read_only=True
+    purchase_problem_reason_detail = ReferenceDetailField(
+        PurchaseProblemReason, PurchaseProblemReasonMinimalSerializer,
+        source='purchase_problem_reason_id'
     )
-    purchase_problem_subreason_detail = PurchaseProblemSubreasonMinimalSerializer(
-        source='purchase_problem_subreason',
-        read_only=True
+    purchase_problem_subreason_detail = ReferenceDetailField(
+        PurchaseProblemSubreason, PurchaseProblemSubreasonMinimalSerializer,
+        source='purchase_problem_subreason_id'
     )
 
     # Проблемы закупки
@@ -215,49 +288,30 @@ class ProjectItemListSerializer(BaseModelSerializer):
         """Return whether this item is purchased (based on nomenclature's catalog category)."""
         return bool(getattr(obj, 'is_purchased', False))
 
-    def _get_latest_order(self, obj):
-        requirement = MaterialRequirement.objects.filter(
-            project_item=obj,
-            purchase_order__isnull=False,
-            is_active=True,
-            deleted_at__isnull=True,
-        ).exclude(
-            purchase_order__status__in=['draft', 'cancelled']
-        ).select_related('purchase_order').order_by('-updated_at').first()
-        if requirement and requirement.purchase_order:
-            return requirement.purchase_order
-
-        po_item = PurchaseOrderItem.objects.filter(
-            project_item=obj,
-        ).exclude(order__status__in=['draft', 'cancelled']).select_related('order').order_by('-created_at').first()
-        if po_item:
-            return po_item.order
-        return None
-
     def get_purchase_order_id(self, obj):
         if not self.context.get('include_purchase_order', False):
             return None
-        order = self._get_latest_order(obj)
-        return str(order.id) if order else None
+        order_id, _ = self._get_latest_order(obj)
+        return str(order_id) if order_id else None
 
     def get_purchase_order_number(self, obj):
         if not self.context.get('include_purchase_order', False):
             return None
-        order = self._get_latest_order(obj)
-        return order.number if order else None
+        _, order_number = self._get_latest_order(obj)
+        return order_number
 
     def get_calculated_progress(self, obj):
         """Calculate progress based on status (0% or 100%) and children."""
-        # В списках (особенно в "Рабочем месте") calculated_progress по умолчанию выключен,
-        # но для закупаемых позиций прогресс должен быть бинарным: 100% для "На складе"/"Списано",
-        # иначе 0%. Это вычисление дёшево, поэтому отдаём его всегда для is_purchased.
+        # Прогресс хранится на позиции (calculated_progress) и поддерживается при записи,
+        # чтение не выполняет запросов. Для закупаемых позиций отдаём всегда,
+        # для остальных - по флагу include_calculated_progress.
         if getattr(obj, 'is_purchased', False):
-            return float(obj.calculate_progress())
+            return float(obj.calculated_progress)
 
         if not self.context.get('include_calculated_progress', False):
             return None
 
-        return float(obj.calculate_progress())
+        return float(obj.calculated_progress)
 
     def validate(self, attrs):
         instance = getattr(self, 'instance', None)
@@ -326,16 +380,10 @@ class ProjectItemListSerializer(BaseModelSerializer):
         return False
 
     def get_problem_reason_detail(self, obj):
-        if obj.problem_reason:
-            return {
-                'id': str(obj.problem_reason.id),
-                'code': obj.problem_reason.code,
-                'name': obj.problem_reason.name,
-            }
-        return None
+        return _problem_reason_detail(obj.problem_reason_id)
 
 
-class ProjectItemDetailSerializer(BaseModelSerializer):
+class ProjectItemDetailSerializer(_LatestOrderMixin, BaseModelSerializer):
     """Detail serializer for project items."""
     
     nomenclature_item_detail = NomenclatureListSerializer(
@@ -378,27 +426,27 @@ class ProjectItemDetailSerializer(BaseModelSerializer):
         source='supplier',
         read_only=True
     )
-    delay_reason_detail = DelayReasonMinimalSerializer(
-        source='delay_reason',
-        read_only=True
+    delay_reason_detail = ReferenceDetailField(
+        DelayReason, DelayReasonMinimalSerializer,
+        source='delay_reason_id'
     )
 
     # Аналитика причин/подпричин (производство/закупки)
-    manufacturing_problem_reason_detail = ManufacturingProblemReasonMinimalSerializer(
-        source='manufacturing_problem_reason',
-        read_only=True
+    manufacturing_problem_reason_detail = ReferenceDetailField(
+        ManufacturingProblemReason, ManufacturingProblemReasonMinimalSerializer,
+        source='manufacturing_problem_reason_id'
     )
-    manufacturing_problem_subreason_detail = ManufacturingProblemSubreasonMinimalSerializer(
-        source='manufacturing_problem_subreason',
-        read_only=True
+    manufacturing_problem_subreason_detail = ReferenceDetailField(
+        ManufacturingProblemSubreason, ManufacturingProblemSubreasonMinimalSerializer,
+        source='manufacturing_problem_subreason_id'
     )
-    purchase_problem_reason_detail = PurchaseProblemReasonMinimalSerializer(
-        source='purchase_problem_reason',
-        read_only=True
+    purchase_problem_reason_detail = ReferenceDetailField(
+        PurchaseProblemReason, PurchaseProblemReasonMinimalSerializer,
+        source='purchase_problem_reason_id'
     )
-    purchase_problem_subreason_detail = PurchaseProblemSubreasonMinimalSerializer(
-        source='purchase_problem_subreason',
-        read_only=True
+    purchase_problem_subreason_detail = ReferenceDetailField(
+        PurchaseProblemSubreason, PurchaseProblemSubreasonMinimalSerializer,
+        source='purchase_problem_subreason_id'
     )
     
     # Computed fields
@@ -467,32 +515,13 @@ class ProjectItemDetailSerializer(BaseModelSerializer):
         """Return parent_item as string (not UUID object) for frontend tree building."""
         return str(obj.parent_item_id) if obj.parent_item_id else None
 
-    def _get_latest_order(self, obj):
-        requirement = MaterialRequirement.objects.filter(
-            project_item=obj,
-            purchase_order__isnull=False,
-            is_active=True,
-            deleted_at__isnull=True,
-        ).exclude(
-            purchase_order__status__in=['draft', 'cancelled']
-        ).select_related('purchase_order').order_by('-updated_at').first()
-        if requirement and requirement.purchase_order:
-            return requirement.purchase_order
-
-        po_item = PurchaseOrderItem.objects.filter(
-            project_item=obj,
-        ).exclude(order__status__in=['draft', 'cancelled']).select_related('order').order_by('-created_at').first()
-        if po_item:
-            return po_item.order
-        return None
-
     def get_purchase_order_id(self, obj):
-        order = self._get_latest_order(obj)
-        return str(order.id) if order else None
+        order_id, _ = self._get_latest_order(obj)
+        return str(order_id) if order_id else None
 
     def get_purchase_order_number(self, obj):
-        order = self._get_latest_order(obj)
-        return order.number if order else None
+        _, order_number = self._get_latest_order(obj)
+        return order_number
     
     def get_is_purchased(self, obj):
         """Return whether this item is purchased (based on nomenclature's catalog category)."""
@@ -543,20 +572,14 @@ class ProjectItemDetailSerializer(BaseModelSerializer):
         return None
 
     def get_problem_reason_detail(self, obj):
-        if obj.problem_reason:
-            return {
-                'id': str(obj.problem_reason.id),
-                'code': obj.problem_reason.code,
-                'name': obj.problem_reason.name,
-            }
-        return None
+        return _problem_reason_detail(obj.problem_reason_id)
     
     def get_children_count(self, obj):
         return obj.children.count()
     
     def get_calculated_progress(self, obj):
         """Calculate progress based on status (0% or 100%) and children."""
-        return float(obj.calculate_progress())
+        return float(obj.calculated_progress)
     
     def update(self, instance, validated_data):
         """
@@ -730,6 +753,9 @@ class ProjectListSerializer(BaseModelSerializer):
 
     def get_progress(self, obj):
         """Return progress based on root item calculated progress."""
+        # root_progress аннотируется в ProjectViewSet.list
+        if hasattr(obj, 'root_progress'):
+            return float(obj.root_progress or 0)
         root_item = obj.root_item
         if not root_item:
             return 0
@@ -919,17 +945,14 @@ class ProjectTreeSerializer(BaseModelSerializer):
         filter_responsible = self.context.get('filter_responsible')
         if filter_responsible:
             # Get all items where user is responsible
-            own_items = items_qs.filter(responsible_id=filter_responsible)
-            own_item_ids = set(own_items.values_list('id', flat=True))
+            own_paths = items_qs.filter(
+                responsible_id=filter_responsible
+            ).values_list('tree_path', flat=True)
             
-            # Also include all parent items up to root
-            all_item_ids = set(own_item_ids)
-            for item in own_items:
-                parent_id = item.parent_item_id
-                while parent_id:
-                    all_item_ids.add(parent_id)
-                    parent = items_qs.filter(id=parent_id).first()
-                    parent_id = parent.parent_item_id if parent else None
+            # Also include all parent items up to root (ids are encoded in tree_path)
+            all_item_ids = set()
+            for path in own_paths:
+                all_item_ids.update(ProjectItem.ids_from_path(path))
             
             items_qs = items_qs.filter(id__in=all_item_ids)
         
@@ -970,6 +993,7 @@ class ProjectGanttSerializer(serializers.Serializer):
     type = serializers.SerializerMethodField()
 
     def get_progress(self, obj):
+        # Прогресс позиции поддерживается при изменении позиций (ProgressTracker)
         try:
             return float(obj.calculate_progress())
         except Exception:
@@ -56,6 +56,7 @@ from .views.production import (
 )
 from .views.workplace import WorkplaceViewSet
 from .views.dashboard import DashboardViewSet
+from .views.exports import ExportViewSet
 from .views.inventory import (
     WarehouseViewSet,
     StockItemViewSet,
@@ -126,6 +127,9 @@ router.register(r'workplace', WorkplaceViewSet, basename='workplace')
 # Dashboard (Executive management panel)
 router.register(r'dashboard', DashboardViewSet, basename='dashboard')
 
+# Background exports (Excel/CSV)
+router.register(r'exports', ExportViewSet, basename='exports')
+
 # Warehouse / Inventory
 router.register(r'warehouses', WarehouseViewSet, basename='warehouses')
 router.register(r'stock-items', StockItemViewSet, basename='stock-items')
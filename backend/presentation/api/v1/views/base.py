@@ -4,12 +4,27 @@ Base Views.
 Common view mixins and base classes.
 """
 
+import tempfile
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.db import transaction
+from django.http import FileResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from application.services.problem_detection import problems_evaluated_at
+from application.services.export import (
+    CONTENT_TYPES,
+    FORMAT_CSV,
+    FORMAT_XLSX,
+    FORMATS,
+    iter_csv,
+    sync_row_limit,
+    write_xlsx,
+)
 
 
 class AuditViewMixin:
@@ -128,6 +143,87 @@ class HistoryViewMixin:
         return Response(data)
 
 
+class ProblemsEvaluatedAtMixin:
+    """
+    Mixin for lists with system problem flags (has_problem / problem_reason).
+    
+    The list is read-only: flags are maintained by ProblemEvaluator
+    (model saves, purchase order signals, scheduled refresh). Time of the
+    last full refresh is returned as `problems_evaluated_at` in paginated
+    responses and in the X-Problems-Evaluated-At header.
+    """
+    
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        evaluated_at = problems_evaluated_at()
+        value = evaluated_at.isoformat() if evaluated_at else None
+        if isinstance(response.data, dict):
+            response.data['problems_evaluated_at'] = value
+        if value:
+            response['X-Problems-Evaluated-At'] = value
+        return response
+
+
+class ExportViewMixin:
+    """
+    Mixin for Excel/CSV export actions (application.services.export).
+    
+    Query params:
+    - file_format: xlsx (default) or csv
+    - async: true - generate in background (202 + task_id,
+      progress via GET /exports/status/?task_id=, file via
+      GET /exports/download/?task_id=)
+    
+    CSV is streamed; .xlsx larger than EXPORT_SYNC_ROW_LIMIT rows
+    is always generated in background.
+    """
+    
+    def export_response(self, request, kind, dataset_factory, object_id=None, params=None):
+        file_format = str(request.query_params.get('file_format', FORMAT_XLSX)).lower()
+        if file_format not in FORMATS:
+            return Response(
+                {'error': f'Неподдерживаемый формат: {file_format}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        run_async = str(request.query_params.get('async', '')).lower() in ('1', 'true', 'yes')
+        dataset = None
+        if not run_async:
+            dataset = dataset_factory()
+            run_async = (
+                file_format == FORMAT_XLSX
+                and dataset.total is not None
+                and dataset.total > sync_row_limit()
+            )
+        
+        if run_async:
+            from application.tasks.export_tasks import generate_export
+            task = generate_export.delay(
+                kind,
+                file_format,
+                str(object_id) if object_id else None,
+                params,
+                str(request.user.pk),
+            )
+            return Response({'task_id': task.id}, status=status.HTTP_202_ACCEPTED)
+        
+        filename = dataset.filename(file_format)
+        if file_format == FORMAT_CSV:
+            response = StreamingHttpResponse(iter_csv(dataset), content_type=CONTENT_TYPES[FORMAT_CSV])
+            response['Content-Disposition'] = content_disposition_header(True, filename)
+            return response
+        
+        output = tempfile.TemporaryFile()
+        write_xlsx(dataset, output)
+        output.seek(0)
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=filename,
+            content_type=CONTENT_TYPES[FORMAT_XLSX],
+        )
+
+
 class BaseModelViewSet(
     AuditViewMixin,
     SoftDeleteViewMixin,
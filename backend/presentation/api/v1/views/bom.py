@@ -4,13 +4,18 @@ BOM Views.
 API views for Bill of Materials structures.
 """
 
+from decimal import Decimal, InvalidOperation
+
 from rest_framework import status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db import transaction
+from django.db.models import Count, Prefetch, Q
 
+from application.services.bom_clone import BOMCloneError, BOMCloner
+from application.services.bom_explosion import BOMDepthExceeded, explode_bom, with_nomenclature
+from application.services.export import KIND_BOM, bom_dataset
 from infrastructure.persistence.models import (
     BOMStructure,
     BOMItem,
@@ -21,11 +26,12 @@ from ..serializers.bom import (
     BOMStructureTreeSerializer,
     BOMItemSerializer,
     BOMItemTreeSerializer,
+    BOMCloneSerializer,
 )
-from .base import BaseModelViewSet
+from .base import BaseModelViewSet, ExportViewMixin
 
 
-class BOMStructureViewSet(BaseModelViewSet):
+class BOMStructureViewSet(ExportViewMixin, BaseModelViewSet):
     """
     ViewSet for BOM structures.
     
@@ -38,12 +44,18 @@ class BOMStructureViewSet(BaseModelViewSet):
     - GET /bom/{id}/tree/ - get BOM as tree
     - POST /bom/{id}/lock/ - lock BOM
     - POST /bom/{id}/unlock/ - unlock BOM
-    - POST /bom/{id}/clone/ - clone BOM
+    - POST /bom/{id}/clone/ - clone BOM (async=true - in background)
+    - GET /bom/clone_status/?task_id= - background clone progress
+    - GET /bom/{id}/exploded/?quantity= - leaf items through all sub-BOMs
+    - GET /bom/{id}/export/?file_format=xlsx|csv - multi-level specification file
     """
     
     queryset = BOMStructure.objects.select_related(
         'root_item'
-    ).prefetch_related('items').filter(is_active=True)
+    ).filter(is_active=True)
+    
+    # Действия, отдающие BOMStructureDetailSerializer со всеми строками
+    item_detail_actions = ('retrieve', 'update', 'partial_update', 'increment_version')
     
     serializer_classes = {
         'list': BOMStructureListSerializer,
@@ -63,6 +75,22 @@ class BOMStructureViewSet(BaseModelViewSet):
         filters.OrderingFilter,
     ]
     
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # Списку нужно только число строк - считается в том же запросе
+            return queryset.annotate(
+                items_total=Count('items', filter=Q(items__deleted_at__isnull=True))
+            )
+        if self.action in self.item_detail_actions:
+            # tree/exploded/export загружают строки отдельной выборкой (с кэшем)
+            queryset = queryset.prefetch_related(
+                Prefetch('items', queryset=BOMItem.objects.select_related(
+                    'child_item__catalog_category', 'parent_item__catalog_category'
+                ))
+            )
+        return queryset
+    
     def get_serializer_class(self):
         return self.serializer_classes.get(
             self.action,
@@ -76,6 +104,12 @@ class BOMStructureViewSet(BaseModelViewSet):
         serializer = BOMStructureTreeSerializer(bom, context={'request': request})
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """Export multi-level BOM (through active sub-BOMs) to Excel/CSV."""
+        bom = self.get_object()
+        return self.export_response(request, KIND_BOM, lambda: bom_dataset(bom), object_id=bom.pk)
+    
     @action(detail=True, methods=['post'])
     def lock(self, request, pk=None):
         """Lock BOM for editing."""
@@ -108,6 +142,42 @@ class BOMStructureViewSet(BaseModelViewSet):
         
         return Response({'message': 'BOM разблокирована'})
     
+    @action(detail=True, methods=['get'])
+    def exploded(self, request, pk=None):
+        """
+        Get exploded BOM: every leaf item with total quantity.
+        
+        Leaves are purchased items and manufactured items without an active
+        BOM; quantities are per `quantity` units of the root item (default 1).
+        409 if a branch is cyclic or deeper than MAX_DEPTH levels.
+        """
+        bom = self.get_object()
+        try:
+            quantity = Decimal(str(request.query_params.get('quantity', '1')))
+        except InvalidOperation:
+            quantity = None
+        # NaN/Infinity и неположительные значения не допускаются
+        if quantity is None or not quantity.is_finite() or quantity <= 0:
+            return Response(
+                {'error': 'Некорректное значение quantity'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            rows = with_nomenclature(explode_bom(bom))
+        except BOMDepthExceeded as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        for row in rows:
+            row['quantity'] = row['quantity'] * quantity
+        
+        return Response({
+            'bom_id': str(bom.id),
+            'root_item': str(bom.root_item_id),
+            'current_version': bom.current_version,
+            'quantity': quantity,
+            'items': rows,
+        })
+    
     @action(detail=True, methods=['post'])
     def increment_version(self, request, pk=None):
         """Increment BOM version."""
@@ -122,57 +192,46 @@ class BOMStructureViewSet(BaseModelViewSet):
     def clone(self, request, pk=None):
         """Clone BOM to a new BOM."""
         source_bom = self.get_object()
-        new_name = request.data.get('name')
+        params = BOMCloneSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        new_name = params.validated_data['name']
+        root_item = params.validated_data.get('root_item')
+        root_item_id = str(root_item.pk) if root_item else None
         
-        if not new_name:
-            return Response(
-                {'error': 'Необходимо указать name'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        if str(request.data.get('async', '')).lower() in ('1', 'true', 'yes'):
+            # Very large BOMs: clone in background, poll clone_status for progress
+            from application.tasks.bom_tasks import clone_bom_structure
+            task = clone_bom_structure.delay(str(source_bom.id), new_name, root_item_id)
+            return Response({'task_id': task.id}, status=status.HTTP_202_ACCEPTED)
         
-        with transaction.atomic():
-            # Create new BOM
-            new_bom = BOMStructure.objects.create(
-                name=new_name,
-                description=f"Копия: {source_bom.name}. {source_bom.description or ''}",
-                root_item=source_bom.root_item,
-                root_category=source_bom.root_category,
-                current_version=1,
-                is_active=True,
-                is_locked=False,
-            )
-            
-            # Clone items
-            items_map = {}  # old_id -> new_item
-            
-            # First pass: create all items without parent references
-            for item in source_bom.items.all():
-                new_item = BOMItem.objects.create(
-                    bom=new_bom,
-                    child_item=item.child_item,
-                    child_category=item.child_category,
-                    quantity=item.quantity,
-                    unit=item.unit,
-                    position=item.position,
-                    drawing_number_override=item.drawing_number_override,
-                    notes=item.notes,
-                )
-                items_map[item.id] = new_item
-            
-            # Second pass: set parent references
-            for old_item in source_bom.items.filter(parent_item__isnull=False):
-                new_item = items_map[old_item.id]
-                # Find new parent by matching child_item
-                old_parent = old_item.parent_item
-                for oi, ni in items_map.items():
-                    source_item = source_bom.items.get(id=oi)
-                    if source_item.child_item_id == old_parent.child_item_id:
-                        new_item.parent_item_id = source_item.child_item_id
-                        new_item.save(update_fields=['parent_item'])
-                        break
+        try:
+            new_bom = BOMCloner(source_bom, new_name, root_item_id=root_item_id).clone()
+        except BOMCloneError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         serializer = BOMStructureDetailSerializer(new_bom, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['get'])
+    def clone_status(self, request):
+        """Get progress/result of background BOM cloning."""
+        task_id = request.query_params.get('task_id')
+        if not task_id:
+            return Response(
+                {'error': 'Необходимо указать task_id'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        from celery.result import AsyncResult
+        result = AsyncResult(task_id)
+        data = {'task_id': task_id, 'state': result.state}
+        if result.state == 'PROGRESS':
+            data.update(result.info or {})
+        elif result.successful():
+            data['result'] = result.result
+        elif result.failed():
+            data['error'] = str(result.result)
+        return Response(data)
 
 
 class BOMItemViewSet(BaseModelViewSet):
@@ -4,21 +4,24 @@ Catalog Views.
 API views for nomenclature, suppliers, contractors, and catalog categories.
 """
 
-from dataclasses import dataclass
-from typing import Any
-from uuid import uuid4
-
 from rest_framework import status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django_filters.rest_framework import DjangoFilterBackend
 from django_filters import rest_framework as django_filters
 from django.db import models
-from django.db import transaction
 from django.db.models import Count, Q, Exists, OuterRef
 
-from openpyxl import load_workbook
+from application.services.bom_explosion import BOMDepthExceeded, where_used, with_nomenclature
+from application.services.nomenclature_import import (
+    discard_preview,
+    import_rows,
+    load_preview,
+    parse_nomenclature_excel,
+    recheck_existing,
+    store_preview,
+)
 
 from infrastructure.persistence.models import (
     CatalogCategory,
@@ -55,195 +58,6 @@ from ..serializers.catalog import (
 from .base import BaseModelViewSet, BulkActionMixin
 
 
-EXCEL_COLS = {
-    'A': 1,  # catalog category name
-    'B': 2,  # item name
-    'C': 3,  # drawing number (manufactured only)
-    'D': 4,  # unit
-    'E': 5,  # description
-    'F': 6,  # specifications
-    'G': 7,  # nomenclature type name (purchased only)
-}
-
-
-def _to_str(v: Any) -> str:
-    if v is None:
-        return ''
-    s = str(v).strip()
-    return s
-
-
-@dataclass(frozen=True)
-class ExcelImportError:
-    row: int
-    column: str
-    message: str
-
-    def to_dict(self) -> dict:
-        return {
-            'row': self.row,
-            'column': self.column,
-            'message': self.message,
-        }
-
-
-def _generate_unique_nomenclature_code() -> str:
-    code = f"nom_{uuid4().hex[:8]}"
-    while NomenclatureItem.objects.filter(code=code).exists():
-        code = f"nom_{uuid4().hex[:8]}"
-    return code
-
-
-def _parse_nomenclature_excel(file_obj) -> tuple[list[dict], list[ExcelImportError], dict]:
-    """
-    Parse and validate nomenclature import Excel.
-
-    Returns:
-        rows: list of parsed row dicts (including resolved FK ids/names when possible)
-        errors: list of ExcelImportError across the whole file
-        summary: counts
-    """
-    errors: list[ExcelImportError] = []
-    parsed_rows: list[dict] = []
-    seen_keys: set[tuple[str, str]] = set()  # (category_id, lower(name))
-
-    wb = load_workbook(filename=file_obj, read_only=True, data_only=True)
-    ws = wb.active
-
-    total_data_rows = 0
-    for excel_row_idx, row_cells in enumerate(ws.iter_rows(min_row=2, max_col=7, values_only=True), start=2):
-        # Skip completely empty rows
-        values = list(row_cells) if row_cells is not None else []
-        if not values:
-            continue
-
-        # Normalize to length 7
-        while len(values) < 7:
-            values.append(None)
-
-        if all((_to_str(v) == '') for v in values[:7]):
-            continue
-
-        total_data_rows += 1
-
-        category_name = _to_str(values[0])
-        name = _to_str(values[1])
-        drawing_number = _to_str(values[2])
-        unit = _to_str(values[3])
-        description = _to_str(values[4])
-        specifications = _to_str(values[5])
-        nomenclature_type_name = _to_str(values[6])
-
-        row_errors: list[ExcelImportError] = []
-
-        category_obj = None
-        if not category_name:
-            row_errors.append(ExcelImportError(row=excel_row_idx, column='A', message='Не указан "Вид справочника" (колонка A).'))
-        else:
-            category_obj = CatalogCategory.objects.filter(is_active=True, name__iexact=category_name).first()
-            if not category_obj:
-                row_errors.append(
-                    ExcelImportError(
-                        row=excel_row_idx,
-                        column='A',
-                        message=f'Вид справочника "{category_name}" не найден в настройках справочников.'
-                    )
-                )
-
-        if not name:
-            row_errors.append(ExcelImportError(row=excel_row_idx, column='B', message='Не указано "Наименование" (колонка B).'))
-
-        # Если в файле единица измерения не указана — подставим ниже:
-        # 1) из типа номенклатуры (для закупаемых),
-        # 2) иначе 'шт'.
-
-        nomenclature_type_obj = None
-        if category_obj and category_obj.is_purchased:
-            active_types_qs = category_obj.nomenclature_types.filter(is_active=True)
-            has_types = active_types_qs.exists()
-            if nomenclature_type_name:
-                nomenclature_type_obj = active_types_qs.filter(name__iexact=nomenclature_type_name).first()
-                if not nomenclature_type_obj:
-                    row_errors.append(
-                        ExcelImportError(
-                            row=excel_row_idx,
-                            column='G',
-                            message=f'Тип номенклатуры "{nomenclature_type_name}" не найден в виде справочника "{category_obj.name}".'
-                        )
-                    )
-            else:
-                if has_types:
-                    row_errors.append(
-                        ExcelImportError(
-                            row=excel_row_idx,
-                            column='G',
-                            message=f'Для закупаемого вида "{category_obj.name}" нужно указать "Тип номенклатуры" (колонка G).'
-                        )
-                    )
-
-        # Unit: if empty, try to take from nomenclature_type.default_unit, else 'шт'
-        if not unit:
-            if nomenclature_type_obj and getattr(nomenclature_type_obj, 'default_unit', None):
-                unit = _to_str(nomenclature_type_obj.default_unit) or 'шт'
-            else:
-                unit = 'шт'
-
-        # Manufactured: drawing number is optional (can be added later). For purchased, ignore drawing number.
-        if category_obj and category_obj.is_purchased:
-            drawing_number = ''
-
-        # Duplicate checks
-        if category_obj and name:
-            key = (str(category_obj.id), name.lower())
-            if key in seen_keys:
-                row_errors.append(
-                    ExcelImportError(
-                        row=excel_row_idx,
-                        column='B',
-                        message='Дублирование в файле: такая позиция (вид справочника + наименование) уже встречалась.'
-                    )
-                )
-            else:
-                seen_keys.add(key)
-
-            if NomenclatureItem.objects.filter(is_active=True, catalog_category=category_obj, name__iexact=name).exists():
-                row_errors.append(
-                    ExcelImportError(
-                        row=excel_row_idx,
-                        column='B',
-                        message=f'Такая позиция уже существует в справочнике ("{category_obj.name}" / "{name}").'
-                    )
-                )
-
-        errors.extend(row_errors)
-
-        parsed_rows.append({
-            'row': excel_row_idx,
-            'catalog_category': str(category_obj.id) if category_obj else None,
-            'catalog_category_name': category_obj.name if category_obj else category_name,
-            'is_purchased': bool(category_obj.is_purchased) if category_obj else None,
-            'name': name,
-            'drawing_number': drawing_number,
-            'unit': unit,
-            'description': description,
-            'specifications': specifications,
-            'nomenclature_type': str(nomenclature_type_obj.id) if nomenclature_type_obj else None,
-            'nomenclature_type_name': nomenclature_type_obj.name if nomenclature_type_obj else nomenclature_type_name,
-            'can_import': len(row_errors) == 0,
-            'row_errors': [e.to_dict() for e in row_errors],
-        })
-
-    summary = {
-        'total_rows': total_data_rows,
-        'parsed_rows': len(parsed_rows),
-        'valid_rows': sum(1 for r in parsed_rows if r.get('can_import')),
-        'error_rows': len({e.row for e in errors}),
-        'errors_count': len(errors),
-    }
-
-    return parsed_rows, errors, summary
-
-
 class NomenclatureFilterSet(django_filters.FilterSet):
     """Custom filterset for nomenclature items."""
     
@@ -433,6 +247,7 @@ class NomenclatureViewSet(BulkActionMixin, BaseModelViewSet):
     - GET /nomenclature/tree/ - get hierarchical tree
     - GET /nomenclature/by-category/ - get items grouped by category
     - GET /nomenclature/categories/ - get category choices
+    - GET /nomenclature/{id}/where-used/ - multi-level where-used
     """
     
     queryset = NomenclatureItem.objects.select_related(
@@ -488,7 +303,8 @@ class NomenclatureViewSet(BulkActionMixin, BaseModelViewSet):
         """Preview import of nomenclature items from Excel (.xlsx).
 
         Expects multipart/form-data with file field named `file`.
-        Returns preview rows + all validation errors (with row/column).
+        Returns preview rows + all validation errors (with row/column)
+        and a `token` for import-excel/confirm (the file is not parsed again).
         """
         upload = request.FILES.get('file')
         if not upload:
@@ -497,7 +313,7 @@ class NomenclatureViewSet(BulkActionMixin, BaseModelViewSet):
             return Response({'error': 'Поддерживается только формат .xlsx.'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            rows, errors, summary = _parse_nomenclature_excel(upload)
+            rows, errors, summary = parse_nomenclature_excel(upload)
         except Exception as exc:
             return Response(
                 {'error': f'Не удалось прочитать Excel файл: {exc}'},
@@ -505,6 +321,7 @@ class NomenclatureViewSet(BulkActionMixin, BaseModelViewSet):
             )
 
         return Response({
+            'token': store_preview(rows, errors, summary, request.user.pk),
             'rows': rows,
             'errors': [e.to_dict() for e in errors],
             'summary': summary,
@@ -514,71 +331,91 @@ class NomenclatureViewSet(BulkActionMixin, BaseModelViewSet):
         detail=False,
         methods=['post'],
         url_path='import-excel/confirm',
-        parser_classes=[MultiPartParser, FormParser],
+        parser_classes=[MultiPartParser, FormParser, JSONParser],
     )
     def import_excel_confirm(self, request):
         """Confirm import of nomenclature items from Excel (.xlsx).
 
-        Re-reads and re-validates the Excel file. If any errors exist, nothing is created.
+        Uses the preview stored under `token` (or parses `file`, if passed
+        instead). If any errors exist, nothing is created. With async=true
+        the items are created by a Celery task (poll import-excel/status).
         """
-        upload = request.FILES.get('file')
-        if not upload:
-            return Response({'error': 'Не передан файл (поле "file").'}, status=status.HTTP_400_BAD_REQUEST)
-        if not upload.name.lower().endswith('.xlsx'):
-            return Response({'error': 'Поддерживается только формат .xlsx.'}, status=status.HTTP_400_BAD_REQUEST)
+        token = request.data.get('token')
+        if token:
+            preview = load_preview(token, request.user.pk)
+            if preview is None:
+                return Response(
+                    {'error': 'Предпросмотр импорта не найден или устарел. Загрузите файл повторно.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            rows, errors, summary = preview['rows'], preview['errors'], preview['summary']
+        else:
+            upload = request.FILES.get('file')
+            if not upload:
+                return Response({'error': 'Не передан файл (поле "file").'}, status=status.HTTP_400_BAD_REQUEST)
+            if not upload.name.lower().endswith('.xlsx'):
+                return Response({'error': 'Поддерживается только формат .xlsx.'}, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                rows, errors, summary = parse_nomenclature_excel(upload)
+            except Exception as exc:
+                return Response(
+                    {'error': f'Не удалось прочитать Excel файл: {exc}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            errors = [e.to_dict() for e in errors]
 
-        try:
-            rows, errors, summary = _parse_nomenclature_excel(upload)
-        except Exception as exc:
-            return Response(
-                {'error': f'Не удалось прочитать Excel файл: {exc}'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        if not errors:
+            # Позиции могли появиться в справочнике после предпросмотра
+            errors = [e.to_dict() for e in recheck_existing(rows)]
 
         if errors:
             return Response(
                 {
                     'error': 'В файле есть ошибки. Исправьте их и повторите импорт.',
                     'rows': rows,
-                    'errors': [e.to_dict() for e in errors],
+                    'errors': errors,
                     'summary': summary,
                 },
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        created = 0
-        created_ids: list[str] = []
-        with transaction.atomic():
-            for r in rows:
-                if not r.get('can_import'):
-                    continue
-                category_id = r.get('catalog_category')
-                if not category_id:
-                    continue
-                category_obj = CatalogCategory.objects.get(pk=category_id)
-                nomenclature_type_obj = None
-                if r.get('nomenclature_type'):
-                    nomenclature_type_obj = NomenclatureType.objects.get(pk=r['nomenclature_type'])
+        if str(request.data.get('async', '')).lower() in ('1', 'true', 'yes'):
+            from application.tasks.catalog_tasks import import_nomenclature_rows
+            if not token:
+                token = store_preview(rows, [], summary, request.user.pk)
+            task = import_nomenclature_rows.delay(token, str(request.user.pk))
+            return Response({'task_id': task.id}, status=status.HTTP_202_ACCEPTED)
 
-                item = NomenclatureItem.objects.create(
-                    code=_generate_unique_nomenclature_code(),
-                    name=r.get('name') or '',
-                    catalog_category=category_obj,
-                    nomenclature_type=nomenclature_type_obj,
-                    drawing_number=r.get('drawing_number') or '',
-                    unit=r.get('unit') or 'шт',
-                    description=r.get('description') or '',
-                    specifications=r.get('specifications') or '',
-                    created_by=request.user,
-                    updated_by=request.user,
-                )
-                created += 1
-                created_ids.append(str(item.id))
+        created_ids = import_rows(rows, user=request.user)
+        if token:
+            discard_preview(token)
 
         return Response({
-            'created': created,
+            'created': len(created_ids),
             'created_ids': created_ids,
         }, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path='import-excel/status')
+    def import_excel_status(self, request):
+        """Get progress/result of background nomenclature import."""
+        task_id = request.query_params.get('task_id')
+        if not task_id:
+            return Response(
+                {'error': 'Необходимо указать task_id'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        from celery.result import AsyncResult
+        result = AsyncResult(task_id)
+        data = {'task_id': task_id, 'state': result.state}
+        if result.state == 'PROGRESS':
+            data.update(result.info or {})
+        elif result.successful():
+            data['result'] = result.result
+        elif result.failed():
+            data['error'] = str(result.result)
+        return Response(data)
     
     @action(detail=False, methods=['get'])
     def legacy_categories(self, request):
@@ -686,6 +523,25 @@ class NomenclatureViewSet(BulkActionMixin, BaseModelViewSet):
             'project_usage': list(project_usage),
         })
     
+    @action(detail=True, methods=['get'], url_path='where-used')
+    def where_used(self, request, pk=None):
+        """
+        Get multi-level where-used: every product containing this item.
+        
+        Goes up through active BOMs of all levels; quantity is per one unit
+        of the product, is_top_level marks products not used anywhere else.
+        409 if a chain of usages is cyclic or longer than MAX_DEPTH levels.
+        """
+        item = self.get_object()
+        try:
+            rows = with_nomenclature(where_used(item.id))
+        except BOMDepthExceeded as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response({
+            'nomenclature_id': str(item.id),
+            'items': rows,
+        })
+    
     @action(detail=True, methods=['get', 'post', 'delete'])
     def suppliers(self, request, pk=None):
         """Manage suppliers for nomenclature item."""
@@ -0,0 +1,86 @@
+"""
+Export Views.
+
+Status and download of background Excel/CSV exports
+(application.tasks.export_tasks).
+"""
+
+import os
+
+from django.http import FileResponse
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.reverse import reverse
+
+from application.services.export import CONTENT_TYPES, find_export, is_export_owner
+
+# Состояния, по которым о задаче ничего не известно (в т.ч. несуществующий task_id)
+UNSTARTED_STATES = ('PENDING', 'STARTED')
+
+
+class ExportViewSet(viewsets.ViewSet):
+    """
+    Background exports.
+
+    Exports are started by the export actions of BOMs, projects and
+    material requirements (?async=true or big .xlsx files). Only the user
+    who started an export sees its status and downloads the file.
+
+    Endpoints:
+    - GET /exports/status/?task_id= - progress and download link
+    - GET /exports/download/?task_id= - the export file
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    @action(detail=False, methods=['get'])
+    def status(self, request):
+        """Get progress/result of background export."""
+        task_id = request.query_params.get('task_id')
+        if not task_id:
+            return Response(
+                {'error': 'Необходимо указать task_id'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        from celery.result import AsyncResult
+        result = AsyncResult(task_id)
+        if result.state not in UNSTARTED_STATES and not is_export_owner(request.user.pk, task_id):
+            return Response(
+                {'error': 'Выгрузка не найдена'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        data = {'task_id': task_id, 'state': result.state}
+        if result.state == 'PROGRESS':
+            data.update(result.info or {})
+        elif result.successful():
+            data['result'] = result.result
+            if find_export(request.user.pk, task_id):
+                data['download_url'] = (
+                    f"{reverse('api_v1:exports-download', request=request)}?task_id={task_id}"
+                )
+        elif result.failed():
+            data['error'] = str(result.result)
+        return Response(data)
+
+    @action(detail=False, methods=['get'])
+    def download(self, request):
+        """Download the file of a finished background export."""
+        path = find_export(request.user.pk, request.query_params.get('task_id'))
+        if path is None:
+            return Response(
+                {'error': 'Файл выгрузки не найден или удалён'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        filename = os.path.basename(path)
+        file_format = os.path.splitext(filename)[1].lstrip('.')
+        return FileResponse(
+            open(path, 'rb'),
+            as_attachment=True,
+            filename=filename,
+            content_type=CONTENT_TYPES.get(file_format, 'application/octet-stream'),
+        )
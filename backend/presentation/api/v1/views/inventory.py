@@ -57,6 +57,9 @@ from ..serializers.inventory import (
     ContractorReceiptDetailSerializer,
     ContractorReceiptCreateSerializer,
 )
+from application.services.export import KIND_REQUIREMENTS, filter_requirements, requirements_dataset
+from application.services.stock_ledger import CHECK_AVAILABLE, StockLedger, StockMove
+from .base import ExportViewMixin, ProblemsEvaluatedAtMixin
 
 logger = logging.getLogger(__name__)
 
@@ -214,6 +217,12 @@ class StockItemViewSet(viewsets.ModelViewSet):
         remaining = quantity
 
         with transaction.atomic():
+            # Свободный остаток проверяется повторно под блокировкой позиции
+            ledger = StockLedger(user=request.user)
+            stock_item = ledger.get(stock_item.id)
+            if quantity > stock_item.available_quantity:
+                return Response({'error': 'Недостаточно свободного остатка'}, status=status.HTTP_400_BAD_REQUEST)
+
             for req in requirements:
                 if remaining <= 0:
                     break
@@ -241,8 +250,7 @@ class StockItemViewSet(viewsets.ModelViewSet):
                         required_date=req.project_item.required_date if req.project_item else None,
                         notes='Распределение свободного остатка'
                     )
-                    stock_item.reserved_quantity += take
-                    stock_item.save(update_fields=['reserved_quantity'])
+                    ledger.apply([StockMove(stock_item.id, reserved=take)])
 
                     total_available = StockItem.objects.filter(
                         nomenclature_item=req.project_item.nomenclature_item,
@@ -348,8 +356,7 @@ class StockItemViewSet(viewsets.ModelViewSet):
                         required_date=new_item.required_date,
                         notes='Распределение свободного остатка'
                     )
-                    stock_item.reserved_quantity += split_qty
-                    stock_item.save(update_fields=['reserved_quantity'])
+                    ledger.apply([StockMove(stock_item.id, reserved=split_qty)])
 
                     new_req = MaterialRequirement.objects.create(
                         project=new_item.project,
@@ -403,7 +410,7 @@ class StockItemViewSet(viewsets.ModelViewSet):
                 
                 if not created and data.get('location'):
                     stock_item.location = data['location']
-                    stock_item.save()
+                    stock_item.save(update_fields=['location', 'updated_at'])
                 
                 # Create batch if batch number provided
                 batch = None
@@ -420,22 +427,19 @@ class StockItemViewSet(viewsets.ModelViewSet):
                         expiry_date=data.get('expiry_date'),
                     )
                 
-                # Update stock quantity
-                old_quantity = stock_item.quantity
-                stock_item.quantity += data['quantity']
-                stock_item.save()
-                
-                # Create movement record
-                movement = StockMovement.objects.create(
-                    stock_item=stock_item,
-                    movement_type='receipt',
+                # Update stock quantity and create movement record
+                ledger = StockLedger(user=request.user)
+                movement, = ledger.apply([StockMove(
+                    stock_item.id,
                     quantity=data['quantity'],
-                    balance_after=stock_item.quantity,
-                    performed_by=request.user,
-                    reason='Приёмка на склад',
-                    notes=data.get('notes', ''),
-                    source_document=f'batch:{batch.id}' if batch else '',
-                )
+                    movement_type='receipt',
+                    details={
+                        'reason': 'Приёмка на склад',
+                        'notes': data.get('notes', ''),
+                        'source_document': f'batch:{batch.id}' if batch else '',
+                    },
+                )])
+                stock_item = ledger.get(stock_item.id)
                 
                 logger.info(
                     f"Stock received: {stock_item.nomenclature_item.name} "
@@ -466,9 +470,11 @@ class StockItemViewSet(viewsets.ModelViewSet):
         
         try:
             with transaction.atomic():
-                stock_item = StockItem.objects.select_for_update().get(
-                    id=data['stock_item_id']
-                )
+                ledger = StockLedger(user=request.user)
+                locked = ledger.lock([data['stock_item_id']])
+                if not locked:
+                    raise StockItem.DoesNotExist
+                stock_item = locked[data['stock_item_id']]
                 
                 quantity = data['quantity']
                 
@@ -509,22 +515,19 @@ class StockItemViewSet(viewsets.ModelViewSet):
                         batch.save()
                         remaining -= deduct
                 
-                # Update stock quantity
-                stock_item.quantity -= quantity
-                stock_item.save()
-                
-                # Create movement record
-                movement = StockMovement.objects.create(
-                    stock_item=stock_item,
+                # Update stock quantity and create movement record
+                movement, = ledger.apply([StockMove(
+                    stock_item.id,
+                    quantity=-quantity,
                     movement_type='issue',
-                    quantity=quantity,
-                    balance_after=stock_item.quantity,
-                    project_id=data.get('project_id'),
-                    project_item_id=data.get('project_item_id'),
-                    performed_by=request.user,
-                    reason=data.get('reason', 'Выдача со склада'),
-                    notes=data.get('notes', ''),
-                )
+                    check=CHECK_AVAILABLE,
+                    details={
+                        'project_id': data.get('project_id'),
+                        'project_item_id': data.get('project_item_id'),
+                        'reason': data.get('reason', 'Выдача со склада'),
+                        'notes': data.get('notes', ''),
+                    },
+                )])
                 
                 logger.info(
                     f"Stock issued: {stock_item.nomenclature_item.name} "
@@ -738,18 +741,17 @@ class StockReservationViewSet(viewsets.ModelViewSet):
         quantity = serializer.validated_data.get('quantity')
         status_value = serializer.validated_data.get('status') or 'pending'
 
-        if stock_item and status_value in ['pending', 'confirmed']:
-            if stock_item.available_quantity < quantity:
-                return Response(
-                    {'error': 'Недостаточно свободного остатка для резерва'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-        self.perform_create(serializer)
+        with transaction.atomic():
+            if stock_item and status_value in ['pending', 'confirmed']:
+                ledger = StockLedger(user=request.user)
+                if ledger.get(stock_item.id).available_quantity < quantity:
+                    return Response(
+                        {'error': 'Недостаточно свободного остатка для резерва'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                ledger.apply([StockMove(stock_item.id, reserved=quantity)])
 
-        if stock_item and status_value in ['pending', 'confirmed']:
-            stock_item.reserved_quantity += quantity
-            stock_item.save(update_fields=['reserved_quantity'])
+            self.perform_create(serializer)
 
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
@@ -767,7 +769,8 @@ class StockReservationViewSet(viewsets.ModelViewSet):
         
         try:
             with transaction.atomic():
-                stock_item = reservation.stock_item
+                ledger = StockLedger(user=request.user)
+                stock_item = ledger.get(reservation.stock_item_id)
                 
                 if stock_item.available_quantity < reservation.quantity:
                     return Response(
@@ -775,22 +778,18 @@ class StockReservationViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_400_BAD_REQUEST
                     )
                 
-                # Issue stock
-                stock_item.quantity -= reservation.quantity
-                stock_item.reserved_quantity -= reservation.quantity
-                stock_item.save()
-                
-                # Create movement
-                StockMovement.objects.create(
-                    stock_item=stock_item,
+                # Issue stock and create movement
+                ledger.apply([StockMove(
+                    stock_item.id,
+                    quantity=-reservation.quantity,
+                    reserved=-reservation.quantity,
                     movement_type='issue',
-                    quantity=reservation.quantity,
-                    balance_after=stock_item.quantity,
-                    project=reservation.project,
-                    project_item=reservation.project_item,
-                    performed_by=request.user,
-                    reason='Выдача по резерву',
-                )
+                    details={
+                        'project_id': reservation.project_id,
+                        'project_item_id': reservation.project_item_id,
+                        'reason': 'Выдача по резерву',
+                    },
+                )])
                 
                 # Update reservation status
                 reservation.status = 'confirmed'
@@ -818,9 +817,9 @@ class StockReservationViewSet(viewsets.ModelViewSet):
         
         try:
             with transaction.atomic():
-                stock_item = reservation.stock_item
-                stock_item.reserved_quantity -= reservation.quantity
-                stock_item.save()
+                StockLedger(user=request.user).apply([
+                    StockMove(reservation.stock_item_id, reserved=-reservation.quantity)
+                ])
                 
                 reservation.status = 'cancelled'
                 reservation.save()
@@ -848,10 +847,12 @@ class StockReservationViewSet(viewsets.ModelViewSet):
         
         with transaction.atomic():
             # Освободить резерв на складе
-            stock_item = reservation.stock_item
             if reservation.status in ['pending', 'confirmed']:
-                stock_item.reserved_quantity = max(0, stock_item.reserved_quantity - reservation.quantity)
-                stock_item.save(update_fields=['reserved_quantity'])
+                ledger = StockLedger(user=request.user)
+                stock_item = ledger.get(reservation.stock_item_id)
+                release = min(reservation.quantity, stock_item.reserved_quantity)
+                if release > 0:
+                    ledger.apply([StockMove(stock_item.id, reserved=-release)])
             
             # Если проектная позиция связана и закрыта - вернуть статус
             project_item = reservation.project_item
@@ -1347,8 +1348,15 @@ class StockTransferViewSet(viewsets.ModelViewSet):
             )
 
 
-class MaterialRequirementViewSet(viewsets.ModelViewSet):
-    """ViewSet for Material Requirement management."""
+class MaterialRequirementViewSet(ProblemsEvaluatedAtMixin, ExportViewMixin, viewsets.ModelViewSet):
+    """
+    ViewSet for Material Requirement management.
+    
+    GET /material-requirements/export/?file_format=xlsx|csv - export with list filters
+    
+    The list is read-only; problem flags are refreshed outside requests
+    (see ProblemsEvaluatedAtMixin).
+    """
     
     queryset = MaterialRequirement.objects.all()
     serializer_class = MaterialRequirementModelSerializer
@@ -1365,94 +1373,20 @@ class MaterialRequirementViewSet(viewsets.ModelViewSet):
             'project', 
             'project_item', 
             'supplier',
-            'problem_reason'
         )
         
-        # Filter by status
-        status_filter = self.request.query_params.get('status')
-        if status_filter:
-            queryset = queryset.filter(status=status_filter)
-        
-        # Filter by priority
-        priority = self.request.query_params.get('priority')
-        if priority:
-            queryset = queryset.filter(priority=priority)
-        
-        # Filter by supplier
-        supplier_id = self.request.query_params.get('supplier')
-        if supplier_id:
-            queryset = queryset.filter(supplier_id=supplier_id)
-        
-        # Filter by project
-        project_id = self.request.query_params.get('project')
-        if project_id:
-            queryset = queryset.filter(project_id=project_id)
-        
-        # Filter critical only
-        critical_only = self.request.query_params.get('critical_only')
-        if critical_only and critical_only.lower() == 'true':
-            queryset = queryset.filter(
-                Q(priority__in=['critical', 'high']) |
-                Q(to_order__gt=0)
-            )
-        
-        # Filter by category
-        category_id = self.request.query_params.get('category')
-        if category_id:
-            queryset = queryset.filter(
-                nomenclature_item__catalog_category_id=category_id
-            )
-        
-        # Search
-        search = self.request.query_params.get('search')
-        if search:
-            # Поддержка поиска по:
-            # - наименованию/коду номенклатуры
-            # - ID позиции проекта (project_item.item_number), включая значения вида "0000123"
-            q = Q(nomenclature_item__name__icontains=search) | Q(nomenclature_item__code__icontains=search)
-
-            try:
-                import re
-                m = re.search(r'\d+', str(search))
-                if m:
-                    num = int(m.group(0))
-                    q = q | Q(project_item__item_number=num)
-            except Exception:
-                # Если что-то пошло не так с парсингом ID, просто игнорируем этот кусок.
-                pass
-
-            queryset = queryset.filter(q)
-        
-        return queryset.order_by('priority', '-to_order')
-
-    def _update_problems(self, items):
-        """Update problem status for requirements."""
-        # Iterate over items (could be QuerySet or list)
-        for req in items:
-            # We only care if status is not closed (or closed to clear problem)
-            # check_problems handles 'closed' logic too
-            
-            original_has_problem = req.has_problem
-            original_reason_id = req.problem_reason_id
-            
-            req.check_problems()
-            
-            if (req.has_problem != original_has_problem or 
-                req.problem_reason_id != original_reason_id):
-                req.save(update_fields=['has_problem', 'problem_reason'])
+        return filter_requirements(queryset, self.request.query_params)
 
-    def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            self._update_problems(page)
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        self._update_problems(queryset)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Export requirements (with the same filters as the list) to Excel/CSV."""
+        params = request.query_params.dict()
+        return self.export_response(
+            request,
+            KIND_REQUIREMENTS,
+            lambda: requirements_dataset(params),
+            params=params,
+        )
     
     @action(detail=False, methods=['post'])
     def calculate(self, request):
@@ -1508,11 +1442,18 @@ class MaterialRequirementViewSet(viewsets.ModelViewSet):
         Синхронизировать потребности из активных проектов.
         
         Создаёт потребности для всех закупаемых позиций (is_purchased=True)
-        из проектов в статусах 'planning' и 'in_progress'.
+        из проектов в статусе 'in_progress'.
+        
+        Необязательные параметры (инкрементальная синхронизация):
+        - project_ids: список ID проектов
+        - nomenclature_ids: список ID номенклатуры
         """
         try:
             with transaction.atomic():
-                synced = MaterialRequirement.sync_from_project_items()
+                synced = MaterialRequirement.sync_from_project_items(
+                    project_ids=request.data.get('project_ids'),
+                    nomenclature_ids=request.data.get('nomenclature_ids'),
+                )
                 
                 result_serializer = MaterialRequirementModelSerializer(
                     synced, many=True
@@ -1849,17 +1790,8 @@ class MaterialRequirementViewSet(viewsets.ModelViewSet):
                         )
                     supplier = primary_supplier.supplier
                 
-                # Generate order number
-                from django.utils import timezone
-                today = timezone.now()
-                count = PurchaseOrder.objects.filter(
-                    created_at__date=today.date()
-                ).count() + 1
-                order_number = f"PO-{today.strftime('%Y%m%d')}-{count:04d}"
-                
-                # Create purchase order
+                # Create purchase order (number from PurchaseOrder.numbering)
                 order = PurchaseOrder.objects.create(
-                    number=order_number,
                     supplier=supplier,
                     status='draft',
                     created_by=request.user
@@ -10,23 +10,24 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
-from django.db.models import Sum, Count, Q, F
+from django.db.models import Count, Q, F
+from django.http import StreamingHttpResponse
 from django.utils import timezone
-from datetime import date
 
 from infrastructure.persistence.models import (
     PurchaseOrder,
     PurchaseOrderItem,
-    ProjectItem,
     GoodsReceipt,
     GoodsReceiptItem,
 )
+from presentation.api.pagination import StandardResultsSetPagination
 from ..serializers.procurement import (
     PurchaseOrderListSerializer,
     PurchaseOrderDetailSerializer,
     PurchaseOrderCreateSerializer,
     PurchaseOrderItemSerializer,
     ProcurementScheduleItemSerializer,
+    ProcurementAnalyticsFilterSerializer,
     ProcurementStatsSerializer,
     GoodsReceiptListSerializer,
     GoodsReceiptDetailSerializer,
@@ -46,6 +47,7 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
     - PUT/PATCH /api/v1/purchase-orders/{id}/ - update order
     - DELETE /api/v1/purchase-orders/{id}/ - delete order
     - GET /api/v1/purchase-orders/stats/ - get procurement statistics
+    - GET /api/v1/purchase-orders/analytics/ - statistics by supplier and project
     - POST /api/v1/purchase-orders/{id}/submit/ - submit order to supplier
     - POST /api/v1/purchase-orders/{id}/confirm/ - confirm order
     - POST /api/v1/purchase-orders/{id}/cancel/ - cancel order
@@ -70,35 +72,40 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
             return PurchaseOrderCreateSerializer
         return PurchaseOrderDetailSerializer
     
+    def get_analytics_filters(self, request):
+        """supplier/project из query params (некорректный UUID - 400)."""
+        serializer = ProcurementAnalyticsFilterSerializer(data={
+            name: request.query_params[name]
+            for name in ('supplier', 'project')
+            if request.query_params.get(name)
+        })
+        serializer.is_valid(raise_exception=True)
+        return {
+            'supplier_id': serializer.validated_data.get('supplier'),
+            'project_id': serializer.validated_data.get('project'),
+        }
+    
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """Get procurement statistics."""
-        queryset = self.get_queryset().filter(is_active=True)
-        
-        # Count items by status
-        items = PurchaseOrderItem.objects.filter(order__is_active=True, is_active=True)
-        
-        today = date.today()
-        
-        stats = {
-            'total_items': items.count(),
-            'pending': items.filter(status='pending').count(),
-            'ordered': items.filter(status='ordered').count(),
-            'in_transit': items.filter(status='in_transit').count(),
-            'delivered': items.filter(status='delivered').count(),
-            'overdue': items.filter(
-                status__in=['pending', 'ordered', 'in_transit'],
-                expected_delivery_date__lt=today
-            ).count(),
-            'total_orders': queryset.count(),
-            'total_amount': queryset.exclude(status='cancelled').aggregate(
-                total=Sum('total_amount')
-            )['total'],
-        }
-        
+        from application.services.procurement_stats import get_procurement_summary
+
+        stats = get_procurement_summary()
         serializer = ProcurementStatsSerializer(stats)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def analytics(self, request):
+        """
+        Аналитика закупок: статусы строк, просрочка, суммы и доля поставок
+        в срок - итого, по поставщикам и по проектам.
+        
+        Query params: supplier, project (UUID).
+        """
+        from application.services.procurement_stats import get_procurement_stats
+
+        return Response(get_procurement_stats(**self.get_analytics_filters(request)))
+    
     @action(detail=True, methods=['post'])
     def submit(self, request, pk=None):
         """Submit order to supplier."""
@@ -248,76 +255,79 @@ class ProcurementScheduleViewSet(viewsets.ViewSet):
     """
     ViewSet for procurement schedule - items that need to be ordered.
     
-    This aggregates data from project items that are marked for purchase.
+    Позиции проектов в статусах 'Ожидает заказа' / 'В заказе', по которым
+    ещё не всё получено (application.services.procurement_schedule).
+    
+    Endpoints (фильтры для всех: project, status, supplier):
+    - GET /procurement-schedule/?cursor=&page_size= - строки графика,
+      keyset-пагинация (next_cursor - курсор следующей страницы)
+    - GET /procurement-schedule/stream/ - все строки в формате NDJSON
+    - GET /procurement-schedule/groups/?by=supplier|week|project - итоги по группам
     """
     
     permission_classes = [IsAuthenticated]
+    default_page_size = 100
+    max_page_size = 1000
+    
+    def get_schedule(self, request):
+        from application.services.procurement_schedule import ProcurementSchedule
+
+        return ProcurementSchedule(
+            project_id=request.query_params.get('project') or None,
+            status=request.query_params.get('status') or None,
+            supplier_id=request.query_params.get('supplier') or None,
+        )
     
     def list(self, request):
         """
         Get list of items that need to be procured.
-        Aggregates from project items with purchase requirements.
         """
-        # Filter parameters
-        project_id = request.query_params.get('project')
-        status_filter = request.query_params.get('status')
-        
-        # Get project items that need procurement
-        queryset = ProjectItem.objects.filter(
-            is_active=True,
-            purchase_status__in=['waiting_order', 'in_order'],
-            project__is_active=True,
-        ).select_related(
-            'project', 'nomenclature_item', 'nomenclature_item__default_supplier'
-        )
-        
-        if project_id:
-            queryset = queryset.filter(project_id=project_id)
-        
-        if status_filter:
-            queryset = queryset.filter(purchase_status=status_filter)
-        
-        # Calculate ordered quantities from active Purchase Orders
-        po_items = PurchaseOrderItem.objects.filter(
-            project_item__in=queryset,
-            is_active=True,
-            order__is_active=True
-        ).exclude(
-            status='cancelled'
-        ).values('project_item_id').annotate(
-            total_ordered=Sum('quantity')
-        )
-        
-        ordered_map = {item['project_item_id']: item['total_ordered'] or 0 for item in po_items}
-        
-        # Build schedule items
-        schedule_items = []
-        for item in queryset:
-            ordered_qty = ordered_map.get(item.id, 0)
-            remaining = float(item.quantity_required) - float(item.quantity_purchased)
-            if remaining > 0:
-                schedule_items.append({
-                    'id': item.id,
-                    'project_id': item.project.id,
-                    'project_name': item.project.name,
-                    'nomenclature_id': item.nomenclature_item.id if item.nomenclature_item else None,
-                    'name': item.nomenclature_item.name if item.nomenclature_item else item.name,
-                    'required_quantity': item.quantity_required,
-                    'ordered_quantity': ordered_qty,
-                    'received_quantity': item.quantity_purchased,
-                    'remaining_quantity': remaining,
-                    'unit': item.unit,
-                    'required_date': item.planned_end_date,
-                    'status': item.purchase_status,
-                    'supplier_id': item.nomenclature_item.default_supplier.id if item.nomenclature_item and item.nomenclature_item.default_supplier else None,
-                    'supplier_name': item.nomenclature_item.default_supplier.name if item.nomenclature_item and item.nomenclature_item.default_supplier else None,
-                })
-        
-        serializer = ProcurementScheduleItemSerializer(schedule_items, many=True)
+        from application.services.procurement_schedule import InvalidCursor
+
+        try:
+            page_size = int(request.query_params.get('page_size', self.default_page_size))
+        except (TypeError, ValueError):
+            page_size = self.default_page_size
+        page_size = min(max(page_size, 1), self.max_page_size)
+
+        schedule = self.get_schedule(request)
+        try:
+            rows, next_cursor = schedule.page(request.query_params.get('cursor'), limit=page_size)
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = ProcurementScheduleItemSerializer(rows, many=True)
         return Response({
-            'count': len(schedule_items),
+            'count': schedule.count(),
+            'next_cursor': next_cursor,
             'results': serializer.data
         })
+    
+    @action(detail=False, methods=['get'])
+    def stream(self, request):
+        """Все строки графика построчно (NDJSON) - без загрузки в память."""
+        response = StreamingHttpResponse(
+            self.get_schedule(request).iter_ndjson(),
+            content_type='application/x-ndjson; charset=utf-8',
+        )
+        response['Cache-Control'] = 'no-cache'
+        return response
+    
+    @action(detail=False, methods=['get'])
+    def groups(self, request):
+        """Итоги графика по поставщикам, неделям требуемой даты или проектам."""
+        from application.services.procurement_schedule import GROUPINGS
+
+        by = request.query_params.get('by', 'supplier')
+        if by not in GROUPINGS:
+            return Response(
+                {'error': f'Неизвестная группировка: {by}. Допустимо: {", ".join(GROUPINGS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        paginator = StandardResultsSetPagination()
+        page = paginator.paginate_queryset(self.get_schedule(request).groups(by), request, view=self)
+        return paginator.get_paginated_response(page)
 
 
 class GoodsReceiptViewSet(viewsets.ModelViewSet):
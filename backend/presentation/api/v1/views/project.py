@@ -10,7 +10,7 @@ from rest_framework.response import Response
 from django.contrib.auth import get_user_model
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db import transaction
-from django.db.models import Sum, Count, Q, F, Avg, Max
+from django.db.models import Sum, Count, Q, F, Avg, Max, OuterRef, Subquery
 from django.utils import timezone
 from datetime import timedelta
 
@@ -20,7 +20,6 @@ from infrastructure.persistence.models import (
     BOMStructure,
     BOMItem,
     NomenclatureItem,
-    NomenclatureSupplier,
     CatalogCategory,
     Contractor,
     Supplier,
@@ -40,62 +39,21 @@ from ..serializers.project import (
     ProjectItemTreeSerializer,
     ProjectProgressUpdateSerializer,
     ProjectBulkProgressUpdateSerializer,
+    annotate_latest_purchase_order,
 )
 from ..serializers.catalog import NomenclatureMinimalSerializer
-from .base import BaseModelViewSet
+from .base import BaseModelViewSet, ExportViewMixin, ProblemsEvaluatedAtMixin
+from application.services import BOMExpansionEngine
+from application.services.access import get_request_permissions
+from application.services.export import KIND_PROJECT_TREE, project_tree_dataset, visible_project_items
+from application.services.reference_data import reference_table
+from application.services.stock_ledger import StockLedger, StockMove
+from application.services.subtree import SubtreeUpdater
+from infrastructure.persistence.models.project import item_number_allocator
 from presentation.api.pagination import LargeResultsSetPagination
 
 
-def _get_user_visibility_type(user):
-    """Return visibility type for user based on roles.
-
-    Returns one of: 'all', 'own_and_children', 'own', or None (no restriction).
-    Only roles with production responsibility flags affect visibility.
-    """
-    if not user.is_authenticated or user.is_superuser:
-        return None
-
-    from infrastructure.persistence.models import UserRole, Role
-
-    user_roles = UserRole.objects.filter(
-        user=user,
-        is_active=True
-    ).values_list('role_id', flat=True)
-
-    if not user_roles:
-        return None
-
-    roles = Role.objects.filter(id__in=user_roles, is_active=True)
-    if not roles.exists():
-        return None
-
-    visibility_roles = roles.filter(
-        Q(can_be_production_responsible=True) |
-        Q(can_be_responsible=True) |
-        Q(see_only_own_items=True) |
-        Q(see_child_structures=True)
-    )
-
-    if not visibility_roles.exists():
-        return None
-
-    if visibility_roles.filter(visibility_type='all').exists():
-        return 'all'
-
-    if visibility_roles.filter(
-        Q(visibility_type='own_and_children') | Q(see_child_structures=True)
-    ).exists():
-        return 'own_and_children'
-
-    if visibility_roles.filter(
-        Q(visibility_type='own') | Q(see_only_own_items=True)
-    ).exists():
-        return 'own'
-
-    return None
-
-
-class ProjectViewSet(BaseModelViewSet):
+class ProjectViewSet(ExportViewMixin, BaseModelViewSet):
     """
     ViewSet for projects.
     
@@ -106,6 +64,7 @@ class ProjectViewSet(BaseModelViewSet):
     - PUT/PATCH /projects/{id}/ - update project
     - DELETE /projects/{id}/ - soft delete project
     - GET /projects/{id}/tree/ - get project items as tree
+    - GET /projects/{id}/export/?file_format=xlsx|csv - project tree file
     - GET /projects/{id}/gantt/ - get Gantt chart data
     - POST /projects/{id}/generate-from-bom/ - generate items from BOM
     - POST /projects/{id}/add-product/ - add product with BOM expansion
@@ -146,10 +105,22 @@ class ProjectViewSet(BaseModelViewSet):
     def get_queryset(self):
         queryset = super().get_queryset()
 
-        visibility_type = _get_user_visibility_type(self.request.user)
-        if visibility_type in ['own', 'own_and_children']:
+        if get_request_permissions(self.request).restricts_items:
             queryset = queryset.filter(items__responsible=self.request.user).distinct()
 
+        if self.action == 'export':
+            # Позиции выгружаются потоково, без предзагрузки
+            queryset = queryset.prefetch_related(None)
+
+        if self.action == 'list':
+            # Прогресс в списке - прогресс первой корневой позиции (Project.root_item)
+            queryset = queryset.annotate(root_progress=Subquery(
+                ProjectItem.objects.filter(
+                    project_id=OuterRef('pk'),
+                    parent_item__isnull=True,
+                ).order_by('position').values('calculated_progress')[:1]
+            ))
+
         return queryset
     
     def perform_create(self, serializer):
@@ -196,115 +167,20 @@ class ProjectViewSet(BaseModelViewSet):
     
     def _expand_bom_tree(self, project, root_nomenclature, quantity=1):
         """
-        Recursively expand BOM structure into ProjectItems.
+        Expand BOM structure into ProjectItems.
         
         CRITICAL BUSINESS LOGIC:
         1. Creates ProjectItem for the root nomenclature (the product)
-        2. Recursively creates children from BOM
-        3. STOPS recursion at:
-           - PURCHASED items (materials, standard products, other products)
-             These are procurement leaf nodes - we need to buy them
-           - DETAILS (детали) - these are manufactured leaf nodes
-             We manufacture them, but don't track their internal material composition
-             in project structure (that's MRP territory)
-        4. Continues recursion for ASSEMBLY items (системы, подсистемы, сб.единицы)
-           These have meaningful sub-assemblies we need to track
-        
-        This approach gives us:
-        - Manufacturing planning: which assemblies/sub-assemblies to make, in what order
-        - Procurement planning: which items to buy, for which assemblies
-        - Without drowning in material-level detail inside simple parts
-        """
-        items_created = 0
-        
-        # NOTE: ProjectItem.item_number is a GLOBAL unique sequential ID.
-        # Do not assign it here (or per-project), rely on ProjectItem.save() sequence.
+        2. Creates children from BOM for every MANUFACTURED item
+           (systems, subsystems, assemblies, details)
+        3. STOPS at PURCHASED items (materials, standard products, other products)
+           These are procurement leaf nodes - we need to buy them
         
-        def create_project_item(item: NomenclatureItem, parent_project_item=None, qty_multiplier=1, position=0):
-            """
-            Recursively create ProjectItems from nomenclature and its BOM.
-            
-            BUSINESS LOGIC:
-            1. Purchased items (materials, standard products, other products):
-               - Create item with supplier info, STOP recursion
-            2. Manufactured items (details, assemblies, systems):
-               - Always expand BOM to include child items
-               - This ensures materials needed for details are visible
-            """
-            nonlocal items_created
-            
-            # Determine category from catalog_category
-            category_code = item.catalog_category.code if item.catalog_category else 'material'
-            
-            # Check if this is a purchased item
-            is_purchased = False
-            if item.catalog_category:
-                is_purchased = item.catalog_category.is_purchased
-            
-            # Create project item
-            project_item = ProjectItem.objects.create(
-                project=project,
-                nomenclature_item=item,
-                parent_item=parent_project_item,
-                category=category_code,
-                name=item.name,
-                drawing_number=item.drawing_number or '',
-                quantity=quantity * qty_multiplier if parent_project_item is None else qty_multiplier,
-                unit=item.unit,
-                position=position,
-                # Default statuses
-                manufacturing_status='not_started',
-                purchase_status=PurchaseStatusChoices.WAITING_ORDER if is_purchased else PurchaseStatusChoices.CLOSED,
-            )
-            items_created += 1
-            
-            # For PURCHASED items: set supplier and STOP recursion
-            # These are procurement items - we buy them, don't make them
-            if is_purchased:
-                primary_supplier = NomenclatureSupplier.objects.filter(
-                    nomenclature_item=item,
-                    is_primary=True,
-                    is_active=True
-                ).select_related('supplier').first()
-                
-                if primary_supplier:
-                    project_item.supplier = primary_supplier.supplier
-                    project_item.article_number = primary_supplier.supplier_article or ''
-                    project_item.save(update_fields=['supplier', 'article_number'])
-                
-                # STOP: Don't expand BOM for purchased items
-                return project_item
-            
-            # For ALL MANUFACTURED items: expand BOM recursively
-            # This includes details, assemblies, systems - all need to show their materials
-            bom = BOMStructure.objects.filter(
-                root_item=item,
-                is_active=True
-            ).first()
-            
-            if bom:
-                # Get direct children from BOM
-                bom_items = BOMItem.objects.filter(
-                    bom=bom,
-                    parent_item=item
-                ).select_related(
-                    'child_item', 
-                    'child_item__catalog_category'
-                ).order_by('position')
-                
-                for idx, bom_item in enumerate(bom_items):
-                    create_project_item(
-                        bom_item.child_item,
-                        project_item,
-                        float(bom_item.quantity),
-                        idx + 1
-                    )
-            
-            return project_item
-        
-        # Start expansion from root nomenclature
-        create_project_item(root_nomenclature, None, 1, 0)
-        return items_created
+        The whole tree is built in memory by BOMExpansionEngine and written
+        with bulk inserts (see application.services.project_expansion).
+        """
+        result = BOMExpansionEngine(project).expand(root_nomenclature, quantity=quantity)
+        return result.items_created
     
     @action(detail=True, methods=['get'])
     def tree(self, request, pk=None):
@@ -318,35 +194,34 @@ class ProjectViewSet(BaseModelViewSet):
         """
         project = self.get_object()
         user = request.user
-        visibility_type = _get_user_visibility_type(user)
+        visibility_type = get_request_permissions(request).visibility_type
 
         context = {'request': request}
-        if visibility_type == 'own':
-            visible_ids = list(
-                project.items.filter(responsible=user).values_list('id', flat=True)
-            )
-            context['filter_item_ids'] = visible_ids
-        elif visibility_type == 'own_and_children':
-            responsible_ids = list(
-                project.items.filter(responsible=user).values_list('id', flat=True)
+        if visibility_type in ('own', 'own_and_children'):
+            # Свои позиции (и их поддеревья - по материализованному пути tree_path)
+            context['filter_item_ids'] = list(
+                visible_project_items(project, user, visibility_type).values_list('id', flat=True)
             )
 
-            all_visible_ids = set(responsible_ids)
-
-            def get_children_ids(parent_ids):
-                if not parent_ids:
-                    return []
-                child_ids = list(
-                    project.items.filter(parent_item_id__in=parent_ids).values_list('id', flat=True)
-                )
-                return child_ids + get_children_ids(child_ids)
-
-            all_visible_ids.update(get_children_ids(responsible_ids))
-            context['filter_item_ids'] = list(all_visible_ids)
-
         serializer = ProjectTreeSerializer(project, context=context)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """
+        Export project tree to Excel/CSV.
+        
+        Same visibility rules as tree: own / own_and_children / all.
+        """
+        project = self.get_object()
+        visibility_type = get_request_permissions(request).visibility_type
+        return self.export_response(
+            request,
+            KIND_PROJECT_TREE,
+            lambda: project_tree_dataset(project, request.user, visibility_type),
+            object_id=project.pk,
+        )
+    
     @action(detail=True, methods=['get'])
     def gantt(self, request, pk=None):
         """Get Gantt chart data for the project."""
@@ -391,9 +266,14 @@ class ProjectViewSet(BaseModelViewSet):
             items_created = 0
             items_map = {}  # bom_item_id -> project_item
             
-            for bom_item in bom.items.select_related('child_item').all():
+            bom_items = list(bom.items.select_related('child_item').all())
+            # ID позиций - одним блоком на всю структуру
+            item_numbers = item_number_allocator.allocate_block(len(bom_items)) if bom_items else []
+
+            for item_number, bom_item in zip(item_numbers, bom_items):
                 project_item = ProjectItem.objects.create(
                     project=project,
+                    item_number=item_number,
                     bom_item=bom_item,
                     nomenclature_item=bom_item.child_item,
                     category=bom_item.child_category,
@@ -433,7 +313,7 @@ class ProjectViewSet(BaseModelViewSet):
         - nomenclature_item_id: UUID номенклатурной позиции
         - quantity: количество (default: 1)
         
-        Рекурсивно создаёт все элементы из BOM структуры.
+        Создаёт все элементы из BOM структуры.
         """
         project = self.get_object()
         nomenclature_id = request.data.get('nomenclature_item_id')
@@ -460,71 +340,10 @@ class ProjectViewSet(BaseModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        with transaction.atomic():
-            items_created = 0
-            
-            def expand_bom_tree(item: NomenclatureItem, parent_project_item=None, qty_multiplier=1):
-                """Рекурсивно развёртывает BOM дерево."""
-                nonlocal items_created
-                
-                # Определяем категорию
-                category = item.catalog_category.code if item.catalog_category else 'material'
-                
-                # Создаём элемент проекта
-                project_item = ProjectItem.objects.create(
-                    project=project,
-                    nomenclature_item=item,
-                    parent_item=parent_project_item,
-                    category=category,
-                    name=item.name,
-                    drawing_number=item.drawing_number or '',
-                    quantity=quantity * qty_multiplier if parent_project_item is None else qty_multiplier,
-                    unit=item.unit,
-                    # Устанавливаем статусы по умолчанию
-                    manufacturing_status='not_started' if item.is_manufactured else 'not_started',
-                    purchase_status=PurchaseStatusChoices.WAITING_ORDER if item.is_purchased else PurchaseStatusChoices.CLOSED,
-                )
-                items_created += 1
-                
-                # Получаем BOM для этого изделия
-                bom = BOMStructure.objects.filter(
-                    root_item=item,
-                    is_active=True
-                ).first()
-                
-                if bom:
-                    # Получаем дочерние элементы текущего item в BOM
-                    # parent_item=item означает компоненты первого уровня под этим item
-                    bom_items = BOMItem.objects.filter(
-                        bom=bom,
-                        parent_item=item  # Дочерние элементы текущего item
-                    ).select_related('child_item', 'child_item__catalog_category')
-                    
-                    for bom_item in bom_items:
-                        # Рекурсивно добавляем дочерние элементы
-                        expand_bom_tree(
-                            bom_item.child_item,
-                            project_item,
-                            float(bom_item.quantity)
-                        )
-                
-                # Для закупаемых позиций устанавливаем поставщика по умолчанию
-                if item.is_purchased:
-                    primary_supplier = NomenclatureSupplier.objects.filter(
-                        nomenclature_item=item,
-                        is_primary=True,
-                        is_active=True
-                    ).select_related('supplier').first()
-                    
-                    if primary_supplier:
-                        project_item.supplier = primary_supplier.supplier
-                        project_item.article_number = primary_supplier.supplier_article
-                        project_item.save(update_fields=['supplier', 'article_number'])
-                
-                return project_item
-            
-            # Развёртываем дерево начиная с корневого изделия
-            root_item = expand_bom_tree(nomenclature)
+        # Развёртываем дерево начиная с корневого изделия
+        result = BOMExpansionEngine(project).expand(nomenclature, quantity=quantity)
+        items_created = result.items_created
+        root_item = result.root_item
         
         return Response({
             'message': f'Добавлено изделие "{nomenclature.name}" с {items_created} позициями',
@@ -585,7 +404,7 @@ class ProjectViewSet(BaseModelViewSet):
         from decimal import Decimal
         from django.db import transaction
         from django.utils import timezone
-        from infrastructure.persistence.models import ProjectItem, StockItem, StockMovement, StockReservation
+        from infrastructure.persistence.models import ProjectItem, StockItem, StockReservation
 
         project = self.get_object()
 
@@ -631,6 +450,7 @@ class ProjectViewSet(BaseModelViewSet):
                 return Response({'error': f'Сумма поступления для позиции должна быть равна {required_qty}.'}, status=status.HTTP_400_BAD_REQUEST)
 
         with transaction.atomic():
+            moves = []
             for item_id, group in grouped.items():
                 item = items_map[str(item_id)]
                 for allocation in group:
@@ -643,20 +463,19 @@ class ProjectViewSet(BaseModelViewSet):
                         }
                     )
 
-                    stock_item.quantity += allocation['quantity']
-                    stock_item.save(update_fields=['quantity'])
-
-                    StockMovement.objects.create(
-                        stock_item=stock_item,
-                        movement_type='receipt',
+                    # Поступление сразу в резерв позиции
+                    moves.append(StockMove(
+                        stock_item.id,
                         quantity=allocation['quantity'],
-                        balance_after=stock_item.quantity,
-                        project=item.project,
-                        project_item=item,
-                        performed_by=request.user,
-                        reason='Поступление при активации проекта',
-                        notes=f'Поступление при активации проекта ({timezone.now().date()})',
-                    )
+                        reserved=allocation['quantity'],
+                        movement_type='receipt',
+                        details={
+                            'project_id': item.project_id,
+                            'project_item_id': item.id,
+                            'reason': 'Поступление при активации проекта',
+                            'notes': f'Поступление при активации проекта ({timezone.now().date()})',
+                        },
+                    ))
 
                     StockReservation.objects.create(
                         stock_item=stock_item,
@@ -667,8 +486,8 @@ class ProjectViewSet(BaseModelViewSet):
                         required_date=item.required_date,
                         notes='Резерв при активации проекта',
                     )
-                    stock_item.reserved_quantity += allocation['quantity']
-                    stock_item.save(update_fields=['reserved_quantity'])
+
+            StockLedger(user=request.user).apply(moves)
 
             project.status = 'in_progress'
             if not project.actual_start:
@@ -697,9 +516,18 @@ class ProjectViewSet(BaseModelViewSet):
         
         For manufactured children: planned_end = parent's planned_start - 1
         For purchased children: calculate based on supplier lead time
+        
+        Входные параметры:
+        - item_id: UUID элемента проекта
+        - dry_run: bool - только показать изменения, без сохранения (default: False)
+        
+        В ответе - изменённые даты (для dry_run), резерв дней и критический путь.
         """
+        from application.services.scheduling import ProjectScheduler
+
         project = self.get_object()
         item_id = request.data.get('item_id')
+        dry_run = str(request.data.get('dry_run', False)).lower() in ('1', 'true', 'yes')
         
         if not item_id:
             return Response(
@@ -721,12 +549,18 @@ class ProjectViewSet(BaseModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        updated_items = item.cascade_dates_to_children(save=True)
+        result = ProjectScheduler(item).reschedule(dry_run=dry_run)
         
-        return Response({
-            'message': f'Даты рассчитаны для {len(updated_items)} элементов',
-            'updated_count': len(updated_items),
-        })
+        data = {
+            'message': f'Даты рассчитаны для {result.scheduled} элементов, изменено: {result.changed}',
+            'updated_count': result.changed,
+            'scheduled_count': result.scheduled,
+            'dry_run': dry_run,
+            'critical_path': result.critical_path,
+        }
+        if dry_run:
+            data['changes'] = result.changes
+        return Response(data)
 
     @action(detail=True, methods=['post'])
     def set_responsible_cascade(self, request, pk=None):
@@ -757,24 +591,11 @@ class ProjectViewSet(BaseModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        updated_count = 0
-        
-        with transaction.atomic():
-            def update_responsible(project_item):
-                nonlocal updated_count
-                project_item.responsible_id = responsible_id
-                project_item.save(update_fields=['responsible_id'])
-                updated_count += 1
-                
-                if cascade:
-                    for child in project_item.children.all():
-                        update_responsible(child)
-            
-            update_responsible(item)
+        result = SubtreeUpdater(item, cascade=cascade, user=request.user).set_responsible(responsible_id)
         
         return Response({
-            'message': f'Ответственный установлен для {updated_count} элементов',
-            'updated_count': updated_count,
+            'message': f'Ответственный установлен для {result.updated_count} элементов',
+            'updated_count': result.updated_count,
         })
     
     @action(detail=True, methods=['post'])
@@ -813,59 +634,13 @@ class ProjectViewSet(BaseModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        updated_count = 0
-        
-        with transaction.atomic():
-            def update_contractor(project_item):
-                nonlocal updated_count
-                # Только для изготавливаемых позиций
-                if not project_item.is_purchased:
-                    project_item.manufacturer_type = 'contractor'
-                    project_item.contractor_id = contractor_id
-                    project_item.material_supply_type = material_supply_type
-                    # Автоматически устанавливаем статус "передано подрядчику"
-                    project_item.contractor_status = 'sent_to_contractor'
-                    # Очищаем плановую дату начала - нам не важно когда подрядчик начнёт
-                    project_item.planned_start = None
-                    project_item.save(update_fields=[
-                        'manufacturer_type', 
-                        'contractor_id', 
-                        'material_supply_type',
-                        'contractor_status',
-                        'planned_start',
-                    ])
-                    updated_count += 1
-                else:
-                    if material_supply_type == 'contractor_supply':
-                        project_item.purchase_by_contractor = True
-                        project_item.purchase_status = PurchaseStatusChoices.WAITING_ORDER
-                        project_item.supplier = None
-                        project_item.required_date = None
-                        project_item.order_date = None
-                        project_item.planned_end = None
-                        project_item.save(update_fields=[
-                            'purchase_by_contractor',
-                            'purchase_status',
-                            'supplier',
-                            'required_date',
-                            'order_date',
-                            'planned_end',
-                        ])
-                    elif project_item.purchase_by_contractor:
-                        project_item.purchase_by_contractor = False
-                        if project_item.purchase_status != PurchaseStatusChoices.WAITING_ORDER:
-                            project_item.purchase_status = PurchaseStatusChoices.WAITING_ORDER
-                        project_item.save(update_fields=['purchase_by_contractor', 'purchase_status'])
-                
-                if cascade:
-                    for child in project_item.children.all():
-                        update_contractor(child)
-            
-            update_contractor(item)
+        result = SubtreeUpdater(item, cascade=cascade, user=request.user).set_contractor(
+            contractor_id, material_supply_type
+        )
         
         return Response({
-            'message': f'Подрядчик установлен для {updated_count} элементов',
-            'updated_count': updated_count,
+            'message': f'Подрядчик установлен для {result.updated_count} элементов',
+            'updated_count': result.updated_count,
         })
     
     @action(detail=True, methods=['post'])
@@ -901,82 +676,11 @@ class ProjectViewSet(BaseModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        updated_count = 0
-        
-        with transaction.atomic():
-            def update_to_internal(project_item):
-                nonlocal updated_count
-                
-                # Если позиция закупаемая, то нужно установить статус "Ожидает заказа" и поставщика
-                if project_item.is_purchased:
-                    update_fields = []
-
-                    # Логика как при material_supply_type='our_supply': закупаем мы
-                    if project_item.purchase_by_contractor:
-                        project_item.purchase_by_contractor = False
-                        update_fields.append('purchase_by_contractor')
-
-                    if project_item.purchase_status != PurchaseStatusChoices.WAITING_ORDER:
-                        project_item.purchase_status = PurchaseStatusChoices.WAITING_ORDER
-                        update_fields.append('purchase_status')
-
-                    # Если поставщик не указан — подставляем приоритетного поставщика для номенклатуры
-                    if project_item.supplier_id is None and project_item.nomenclature_item_id is not None:
-                        default_supplier_link = (
-                            NomenclatureSupplier.objects
-                            .filter(
-                                nomenclature_item_id=project_item.nomenclature_item_id,
-                                is_primary=True,
-                                is_active=True,
-                            )
-                            .select_related('supplier')
-                            .first()
-                        )
-                        if not default_supplier_link:
-                            default_supplier_link = (
-                                NomenclatureSupplier.objects
-                                .filter(
-                                    nomenclature_item_id=project_item.nomenclature_item_id,
-                                    is_active=True,
-                                )
-                                .select_related('supplier')
-                                .first()
-                            )
-                        if default_supplier_link and default_supplier_link.supplier_id:
-                            project_item.supplier_id = default_supplier_link.supplier_id
-                            update_fields.append('supplier')
-
-                    if update_fields:
-                        project_item.save(update_fields=update_fields)
-                    updated_count += 1
-                else:
-                    # Если позиция изготавливаемая - ставим "Своими силами"
-                    project_item.manufacturer_type = 'internal'
-                    project_item.contractor = None
-                    project_item.material_supply_type = 'our_supply'
-                    # Сбрасываем статус подрядчика, устанавливаем статус изготовления
-                    # Используем пустую строку вместо None, так как поле не nullable
-                    project_item.contractor_status = ''
-                    if project_item.manufacturing_status is None:
-                        project_item.manufacturing_status = 'not_started'
-                    project_item.save(update_fields=[
-                        'manufacturer_type', 
-                        'contractor', 
-                        'material_supply_type',
-                        'contractor_status',
-                        'manufacturing_status',
-                    ])
-                    updated_count += 1
-
-                if cascade:
-                    for child in project_item.children.all():
-                        update_to_internal(child)
-            
-            update_to_internal(item)
+        result = SubtreeUpdater(item, cascade=cascade, user=request.user).set_internal_manufacturer()
         
         return Response({
-            'message': f'Исполнитель "Своими силами" установлен для {updated_count} элементов',
-            'updated_count': updated_count,
+            'message': f'Исполнитель "Своими силами" установлен для {result.updated_count} элементов',
+            'updated_count': result.updated_count,
         })
     
     @action(detail=True, methods=['post'])
@@ -1226,7 +930,7 @@ class ProjectViewSet(BaseModelViewSet):
         return Response(serializer.data)
 
 
-class ProjectItemViewSet(BaseModelViewSet):
+class ProjectItemViewSet(ProblemsEvaluatedAtMixin, BaseModelViewSet):
     """
     ViewSet for project items.
     
@@ -1248,12 +952,6 @@ class ProjectItemViewSet(BaseModelViewSet):
         'contractor',
         'supplier',
         'responsible',
-        'delay_reason',
-        'problem_reason',
-        'manufacturing_problem_reason',
-        'manufacturing_problem_subreason',
-        'purchase_problem_reason',
-        'purchase_problem_subreason',
     )
 
     pagination_class = LargeResultsSetPagination
@@ -1302,24 +1000,17 @@ class ProjectItemViewSet(BaseModelViewSet):
         
         # Apply visibility filtering based on user's roles
         user = self.request.user
-        visibility_type = _get_user_visibility_type(user)
+        visibility_type = get_request_permissions(self.request).visibility_type
         if visibility_type == 'own':
             queryset = queryset.filter(responsible=user)
         elif visibility_type == 'own_and_children':
-            responsible_items = queryset.filter(responsible=user)
-            responsible_ids = list(responsible_items.values_list('id', flat=True))
-
-            all_visible_ids = set(responsible_ids)
+            # Свои позиции и их поддеревья - по материализованному пути (tree_path)
+            responsible_paths = queryset.filter(responsible=user).values_list('tree_path', flat=True)
+            queryset = queryset.filter(ProjectItem.subtree_q(responsible_paths))
 
-            def get_children_ids(parent_ids):
-                if not parent_ids:
-                    return []
-                children = queryset.filter(parent_item_id__in=parent_ids)
-                child_ids = list(children.values_list('id', flat=True))
-                return child_ids + get_children_ids(child_ids)
-
-            all_visible_ids.update(get_children_ids(responsible_ids))
-            queryset = queryset.filter(id__in=all_visible_ids)
+        # Latest purchase order for purchase_order_id/number - one annotated query instead of N+1
+        if self.action != 'list' or self._qp_bool('include_purchase_order'):
+            queryset = annotate_latest_purchase_order(queryset)
 
         # Avoid N+1 in serializer for children_count
         queryset = queryset.annotate(
@@ -1328,18 +1019,18 @@ class ProjectItemViewSet(BaseModelViewSet):
         
         return queryset
 
+    def _qp_bool(self, name: str, default: bool = False) -> bool:
+        raw = self.request.query_params.get(name)
+        if raw is None:
+            return default
+        return str(raw).lower() in ('1', 'true', 'yes', 'y', 'on')
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
 
-        def _qp_bool(name: str, default: bool = False) -> bool:
-            raw = self.request.query_params.get(name)
-            if raw is None:
-                return default
-            return str(raw).lower() in ('1', 'true', 'yes', 'y', 'on')
-
         # Expensive fields (can cause N+1 / heavy compute) are opt-in for list endpoints.
-        context['include_purchase_order'] = _qp_bool('include_purchase_order', default=False)
-        context['include_calculated_progress'] = _qp_bool('include_calculated_progress', default=False)
+        context['include_purchase_order'] = self._qp_bool('include_purchase_order', default=False)
+        context['include_calculated_progress'] = self._qp_bool('include_calculated_progress', default=False)
         return context
 
     @action(detail=True, methods=['get'])
@@ -1354,14 +1045,10 @@ class ProjectItemViewSet(BaseModelViewSet):
         responsible_ids = {getattr(h, 'responsible_id', None) for h in history}
         contractor_ids = {getattr(h, 'contractor_id', None) for h in history}
         supplier_ids = {getattr(h, 'supplier_id', None) for h in history}
-        delay_reason_ids = {getattr(h, 'delay_reason_id', None) for h in history}
-        problem_reason_ids = {getattr(h, 'problem_reason_id', None) for h in history}
 
         responsible_ids.discard(None)
         contractor_ids.discard(None)
         supplier_ids.discard(None)
-        delay_reason_ids.discard(None)
-        problem_reason_ids.discard(None)
 
         User = get_user_model()
         users_map = {
@@ -1370,8 +1057,8 @@ class ProjectItemViewSet(BaseModelViewSet):
         }
         contractors_map = {c.id: c.name for c in Contractor.objects.filter(id__in=contractor_ids)}
         suppliers_map = {s.id: s.name for s in Supplier.objects.filter(id__in=supplier_ids)}
-        delay_map = {d.id: d.name for d in DelayReason.objects.filter(id__in=delay_reason_ids)}
-        problem_map = {p.id: p.name for p in ProblemReason.objects.filter(id__in=problem_reason_ids)}
+        delay_map = reference_table(DelayReason).names()
+        problem_map = reference_table(ProblemReason).names()
 
         choices_map = {
             'manufacturing_status': dict(ProjectItem._meta.get_field('manufacturing_status').choices),
@@ -1463,21 +1150,13 @@ class ProjectItemViewSet(BaseModelViewSet):
 
         return Response(data)
     
-    def list(self, request, *args, **kwargs):
-        # Update problems if project context is provided
-        project_id = request.query_params.get('project')
-        if project_id:
-            self._update_problems(project_id)
-            
-        return super().list(request, *args, **kwargs)
-
     def _is_planning_project(self, item: ProjectItem) -> bool:
         return bool(item.project and item.project.status == ProjectStatusChoices.PLANNING)
 
     def _reserve_stock_for_project_item(self, item: ProjectItem):
         """Reserve available stock when project item is closed."""
         from decimal import Decimal
-        from django.db.models import F, Sum
+        from django.db.models import Sum
         from infrastructure.persistence.models import StockItem, StockReservation
 
         if item.purchase_by_contractor or not item.is_purchased:
@@ -1493,23 +1172,31 @@ class ProjectItemViewSet(BaseModelViewSet):
         if need <= 0:
             return
 
-        stock_items = StockItem.objects.filter(
-            nomenclature_item=item.nomenclature_item
-        ).annotate(
-            available=F('quantity') - F('reserved_quantity')
-        ).filter(available__gt=0).order_by('-available')
+        # Свободный остаток - по заблокированным позициям склада
+        ledger = StockLedger(user=self.request.user)
+        stock_items = sorted(
+            (
+                stock_item for stock_item in ledger.lock(
+                    StockItem.objects.filter(nomenclature_item=item.nomenclature_item)
+                ).values()
+                if stock_item.available_quantity > 0
+            ),
+            key=lambda stock_item: stock_item.available_quantity,
+            reverse=True,
+        )
 
-        total_available = sum([s.available for s in stock_items]) if stock_items else Decimal('0')
+        total_available = sum([s.available_quantity for s in stock_items]) if stock_items else Decimal('0')
         if total_available < need:
             raise ValueError(
                 f"Недостаточно свободного остатка для перевода в «На складе». "
                 f"Требуется: {required_qty} {item.unit}, доступно: {total_available} {item.unit}."
             )
 
+        moves = []
         for stock_item in stock_items:
             if need <= 0:
                 break
-            available = stock_item.quantity - stock_item.reserved_quantity
+            available = stock_item.available_quantity
             if available <= 0:
                 continue
             reserve_qty = min(available, need)
@@ -1523,14 +1210,14 @@ class ProjectItemViewSet(BaseModelViewSet):
                 required_date=item.required_date,
                 notes=f"Резерв по проекту {item.project.name}"
             )
-            stock_item.reserved_quantity += reserve_qty
-            stock_item.save(update_fields=['reserved_quantity'])
+            moves.append(StockMove(stock_item.id, reserved=reserve_qty))
             need -= reserve_qty
+        ledger.apply(moves)
 
     def _consume_stock_for_project_item(self, item: ProjectItem, from_reserved: bool):
         """Write off stock for a purchased project item."""
         from decimal import Decimal
-        from django.db.models import F, Sum
+        from django.db.models import Sum
         from infrastructure.persistence.models import StockItem, StockMovement, StockReservation
 
         if item.purchase_by_contractor or not item.is_purchased:
@@ -1547,9 +1234,13 @@ class ProjectItemViewSet(BaseModelViewSet):
             return
         need -= consumed_qty
 
-        stock_items = StockItem.objects.filter(
-            nomenclature_item=item.nomenclature_item
-        ).order_by('-quantity')
+        # Остатки - по заблокированным позициям склада
+        ledger = StockLedger(user=self.request.user)
+        stock_items = sorted(
+            ledger.lock(StockItem.objects.filter(nomenclature_item=item.nomenclature_item)).values(),
+            key=lambda stock_item: stock_item.quantity,
+            reverse=True,
+        )
 
         reservation_qs = StockReservation.objects.filter(
             project_item=item,
@@ -1562,28 +1253,22 @@ class ProjectItemViewSet(BaseModelViewSet):
 
             if from_reserved:
                 available = min(stock_item.reserved_quantity, need)
-                if available <= 0:
-                    continue
-                stock_item.reserved_quantity -= available
             else:
-                free_available = stock_item.quantity - stock_item.reserved_quantity
-                available = min(free_available, need)
-                if available <= 0:
-                    continue
-
-            stock_item.quantity -= available
-            stock_item.save(update_fields=['quantity', 'reserved_quantity'])
+                available = min(stock_item.available_quantity, need)
+            if available <= 0:
+                continue
 
-            StockMovement.objects.create(
-                stock_item=stock_item,
-                movement_type='consumption',
+            ledger.apply([StockMove(
+                stock_item.id,
                 quantity=-available,
-                balance_after=stock_item.quantity,
-                project=item.project,
-                project_item=item,
-                performed_by=self.request.user,
-                reason=f"Списание по проекту {item.project.name}"
-            )
+                reserved=-available if from_reserved else Decimal('0'),
+                movement_type='consumption',
+                details={
+                    'project_id': item.project_id,
+                    'project_item_id': item.id,
+                    'reason': f"Списание по проекту {item.project.name}",
+                },
+            )])
 
             if from_reserved:
                 remaining_to_release = available
@@ -1611,7 +1296,7 @@ class ProjectItemViewSet(BaseModelViewSet):
         from decimal import Decimal
         from django.db.models import Sum
         from django.utils import timezone
-        from infrastructure.persistence.models import StockItem, StockReservation, StockMovement, Warehouse
+        from infrastructure.persistence.models import StockItem, StockReservation, Warehouse
 
         if item.purchase_by_contractor or not item.is_purchased:
             return
@@ -1641,21 +1326,18 @@ class ProjectItemViewSet(BaseModelViewSet):
                 unit=item.unit or 'шт'
             )
 
-        stock_item.quantity += need
-        stock_item.reserved_quantity += need
-        stock_item.save(update_fields=['quantity', 'reserved_quantity'])
-
-        StockMovement.objects.create(
-            stock_item=stock_item,
-            movement_type='receipt',
+        StockLedger(user=self.request.user).apply([StockMove(
+            stock_item.id,
             quantity=need,
-            balance_after=stock_item.quantity,
-            project=item.project,
-            project_item=item,
-            performed_by=self.request.user,
-            reason='Поступление при возврате в статус «На складе»',
-            notes=f'Возврат из статуса «Списано» ({timezone.now().date()})',
-        )
+            reserved=need,
+            movement_type='receipt',
+            details={
+                'project_id': item.project_id,
+                'project_item_id': item.id,
+                'reason': 'Поступление при возврате в статус «На складе»',
+                'notes': f'Возврат из статуса «Списано» ({timezone.now().date()})',
+            },
+        )])
 
         StockReservation.objects.create(
             stock_item=stock_item,
@@ -1689,17 +1371,13 @@ class ProjectItemViewSet(BaseModelViewSet):
         """Release reserved stock when project item reopens."""
         from infrastructure.persistence.models import StockReservation
 
-        reservations = StockReservation.objects.filter(
+        reservations = list(StockReservation.objects.filter(
             project_item=item,
             status__in=['pending', 'confirmed']
-        ).select_related('stock_item')
+        ))
 
+        StockLedger(user=self.request.user).release_reserved(reservations)
         for reservation in reservations:
-            stock_item = reservation.stock_item
-            stock_item.reserved_quantity = max(
-                0, stock_item.reserved_quantity - reservation.quantity
-            )
-            stock_item.save(update_fields=['reserved_quantity'])
             reservation.status = 'cancelled'
             reservation.save(update_fields=['status'])
 
@@ -1737,19 +1415,21 @@ class ProjectItemViewSet(BaseModelViewSet):
                 )
 
         if not is_planning:
-            if new_status == PurchaseStatusChoices.CLOSED:
-                if old_status == PurchaseStatusChoices.WRITTEN_OFF:
-                    self._restore_reserved_stock_for_project_item(item)
-                else:
-                    self._reserve_stock_for_project_item(item)
-            elif new_status == PurchaseStatusChoices.WRITTEN_OFF:
-                from_reserved = old_status == PurchaseStatusChoices.CLOSED
-                self._consume_stock_for_project_item(item, from_reserved)
-            elif old_status == PurchaseStatusChoices.CLOSED and new_status in [
-                PurchaseStatusChoices.WAITING_ORDER,
-                PurchaseStatusChoices.IN_ORDER,
-            ]:
-                self._release_stock_reservations(item)
+            # Остатки и резервы меняются одной транзакцией под блокировкой позиций склада
+            with transaction.atomic():
+                if new_status == PurchaseStatusChoices.CLOSED:
+                    if old_status == PurchaseStatusChoices.WRITTEN_OFF:
+                        self._restore_reserved_stock_for_project_item(item)
+                    else:
+                        self._reserve_stock_for_project_item(item)
+                elif new_status == PurchaseStatusChoices.WRITTEN_OFF:
+                    from_reserved = old_status == PurchaseStatusChoices.CLOSED
+                    self._consume_stock_for_project_item(item, from_reserved)
+                elif old_status == PurchaseStatusChoices.CLOSED and new_status in [
+                    PurchaseStatusChoices.WAITING_ORDER,
+                    PurchaseStatusChoices.IN_ORDER,
+                ]:
+                    self._release_stock_reservations(item)
 
         # Sync material requirement status
         from infrastructure.persistence.models import MaterialRequirement, PurchaseOrderItem
@@ -1775,135 +1455,6 @@ class ProjectItemViewSet(BaseModelViewSet):
 
                 requirement.save(update_fields=['status', 'purchase_order', 'updated_at'])
 
-    def _update_problems(self, project_id):
-        """
-        Автоматическое обновление проблем (задержки, просрочки) при просмотре проекта.
-        """
-        from django.utils import timezone
-        from django.db.models import Q
-        from infrastructure.persistence.models import ProblemReason, PurchaseOrderItem
-        from infrastructure.persistence.models.inventory import MaterialRequirement
-        
-        today = timezone.now().date()
-        
-        # 1. Не заказано вовремя
-        # waiting_order AND today > order_by_date (с учётом legacy pending),
-        # но ТОЛЬКО если нет подтверждённого заказа.
-        reason_not_ordered = ProblemReason.objects.filter(code='not_ordered_on_time').first()
-        if reason_not_ordered:
-            waiting_items = ProjectItem.objects.filter(
-                project_id=project_id,
-                purchase_status__in=['waiting_order', 'pending']
-            )
-            for item in waiting_items:
-                order_by_date = item.order_date
-                if not order_by_date:
-                    requirement = MaterialRequirement.objects.filter(
-                        project_item_id=item.id,
-                        is_active=True,
-                        deleted_at__isnull=True
-                    ).order_by('-created_at').first()
-                    if requirement and requirement.order_by_date:
-                        order_by_date = requirement.order_by_date
-
-                has_confirmed_po = PurchaseOrderItem.objects.filter(
-                    project_item_id=item.id
-                ).exclude(order__status='draft').exists()
-
-                if has_confirmed_po:
-                    if item.has_problem and item.problem_reason_id == reason_not_ordered.id:
-                        item.has_problem = False
-                        item.problem_reason = None
-                        item.save(update_fields=['has_problem', 'problem_reason'])
-                    continue
-
-                if order_by_date and today > order_by_date:
-                    if not item.has_problem or item.problem_reason_id != reason_not_ordered.id:
-                        item.has_problem = True
-                        item.problem_reason = reason_not_ordered
-                        item.save(update_fields=['has_problem', 'problem_reason'])
-                else:
-                    if item.has_problem and item.problem_reason_id == reason_not_ordered.id:
-                        item.has_problem = False
-                        item.problem_reason = None
-                        item.save(update_fields=['has_problem', 'problem_reason'])
-
-        # 2. Заказано с просрочкой / Задержка поставки
-        # in_order AND order_date < order.order_date -> ordered_late
-        # in_order AND today > expected_delivery_date -> delivery_delay (имеет приоритет)
-        reason_ordered_late = ProblemReason.objects.filter(code='ordered_late').first()
-        reason_delay = ProblemReason.objects.filter(code='delivery_delay').first()
-        items_in_order = ProjectItem.objects.filter(
-            project_id=project_id
-        ).filter(
-            Q(purchase_status__in=['in_order', 'ordered', 'pending']) |
-            Q(purchase_order_items__order__status__in=['ordered', 'partially_delivered', 'closed']) |
-            Q(material_requirements__purchase_order__status__in=['ordered', 'partially_delivered', 'closed'])
-        ).distinct()
-        for item in items_in_order:
-            requirement = MaterialRequirement.objects.filter(
-                project_item_id=item.id,
-                is_active=True,
-                deleted_at__isnull=True
-            ).order_by('-created_at').first()
-
-            po_item = (
-                PurchaseOrderItem.objects.filter(project_item_id=item.id)
-                .exclude(order__status='draft')
-                .select_related('order')
-                .order_by('-created_at')
-                .first()
-            )
-
-            expected_delivery_date = None
-            ordered_late = False
-            order_by_date = item.order_date
-            if not order_by_date and requirement and requirement.order_by_date:
-                order_by_date = requirement.order_by_date
-            if po_item:
-                if po_item.order and po_item.order.order_date and order_by_date:
-                    if po_item.order.order_date > order_by_date:
-                        ordered_late = True
-                expected_delivery_date = (
-                    po_item.expected_delivery_date
-                    or po_item.order.expected_delivery_date
-                )
-            elif requirement and requirement.purchase_order and requirement.purchase_order.status in ['ordered', 'partially_delivered', 'closed']:
-                po = requirement.purchase_order
-                if po.order_date and order_by_date and po.order_date > order_by_date:
-                    ordered_late = True
-                expected_delivery_date = po.expected_delivery_date
-            expected_delivery_date = expected_delivery_date or item.required_date
-
-            # Приоритет: задержка поставки
-            if reason_delay and expected_delivery_date and today > expected_delivery_date:
-                if not item.has_problem or item.problem_reason_id != reason_delay.id:
-                    item.has_problem = True
-                    item.problem_reason = reason_delay
-                    item.save(update_fields=['has_problem', 'problem_reason'])
-                continue
-
-            # Заказано с просрочкой
-            if reason_ordered_late and ordered_late:
-                if not item.has_problem or item.problem_reason_id != reason_ordered_late.id:
-                    item.has_problem = True
-                    item.problem_reason = reason_ordered_late
-                    item.save(update_fields=['has_problem', 'problem_reason'])
-                continue
-
-            # Нет проблемы
-            if item.has_problem:
-                item.has_problem = False
-                item.problem_reason = None
-                item.save(update_fields=['has_problem', 'problem_reason'])
-
-        # 3. Закрытые
-        ProjectItem.objects.filter(
-            project_id=project_id,
-            purchase_status__in=['closed', 'written_off'],
-            has_problem=True
-        ).update(has_problem=False)
-    
     def get_serializer_class(self):
         return self.serializer_classes.get(
             self.action,
@@ -1967,7 +1518,7 @@ class ProjectItemViewSet(BaseModelViewSet):
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         from infrastructure.persistence.models import MaterialRequirement
-        from infrastructure.persistence.models import ProjectItem, PurchaseOrderItem, StockReservation, StockItem, StockMovement, Warehouse
+        from infrastructure.persistence.models import ProjectItem, PurchaseOrderItem, StockReservation, StockItem, Warehouse
         from django.db.models.deletion import ProtectedError
         from django.utils import timezone
         from decimal import Decimal
@@ -2007,16 +1558,12 @@ class ProjectItemViewSet(BaseModelViewSet):
 
                 if item.purchase_status == PurchaseStatusChoices.CLOSED:
                     # Освободить резерв
-                    reservations = StockReservation.objects.filter(
+                    reservations = list(StockReservation.objects.filter(
                         project_item=item,
                         status__in=['pending', 'confirmed']
-                    ).select_related('stock_item')
+                    ))
+                    StockLedger(user=request.user).release_reserved(reservations)
                     for reservation in reservations:
-                        stock_item = reservation.stock_item
-                        stock_item.reserved_quantity = max(
-                            0, stock_item.reserved_quantity - reservation.quantity
-                        )
-                        stock_item.save(update_fields=['reserved_quantity'])
                         reservation.status = 'cancelled'
                         reservation.save(update_fields=['status'])
 
@@ -2038,20 +1585,17 @@ class ProjectItemViewSet(BaseModelViewSet):
                             )
 
                     if stock_item:
-                        stock_item.quantity += restore_qty
-                        stock_item.save(update_fields=['quantity'])
-
-                        StockMovement.objects.create(
-                            stock_item=stock_item,
-                            movement_type='receipt',
+                        StockLedger(user=request.user).apply([StockMove(
+                            stock_item.id,
                             quantity=restore_qty,
-                            balance_after=stock_item.quantity,
-                            project=item.project,
-                            project_item=item,
-                            performed_by=request.user,
-                            reason='Возврат списанной позиции при удалении из проекта',
-                            notes=f'Удаление позиции проекта ({timezone.now().date()})',
-                        )
+                            movement_type='receipt',
+                            details={
+                                'project_id': item.project_id,
+                                'project_item_id': item.id,
+                                'reason': 'Возврат списанной позиции при удалении из проекта',
+                                'notes': f'Удаление позиции проекта ({timezone.now().date()})',
+                            },
+                        )])
 
             for req in requirements:
                 req.soft_delete(user=request.user)
@@ -2066,7 +1610,7 @@ class ProjectItemViewSet(BaseModelViewSet):
         """
         from decimal import Decimal
         from django.db import transaction
-        from infrastructure.persistence.models import StockItem, StockReservation, MaterialRequirement
+        from infrastructure.persistence.models import StockReservation, MaterialRequirement
 
         item = self.get_object()
 
@@ -2097,8 +1641,9 @@ class ProjectItemViewSet(BaseModelViewSet):
             )
 
         with transaction.atomic():
+            ledger = StockLedger(user=request.user)
             for allocation in allocations:
-                stock_item = StockItem.objects.select_for_update().filter(id=allocation['stock_item_id']).first()
+                stock_item = ledger.lock([allocation['stock_item_id']]).get(allocation['stock_item_id'])
                 if not stock_item:
                     return Response({'error': 'Складская позиция не найдена.'}, status=status.HTTP_404_NOT_FOUND)
                 if stock_item.nomenclature_item_id != item.nomenclature_item_id:
@@ -2115,8 +1660,7 @@ class ProjectItemViewSet(BaseModelViewSet):
                     required_date=item.required_date,
                     notes='Резерв по позиции проекта',
                 )
-                stock_item.reserved_quantity += allocation['quantity']
-                stock_item.save(update_fields=['reserved_quantity'])
+                ledger.apply([StockMove(stock_item.id, reserved=allocation['quantity'])])
 
             item.purchase_status = PurchaseStatusChoices.CLOSED
             if not item.actual_start:
@@ -2144,7 +1688,7 @@ class ProjectItemViewSet(BaseModelViewSet):
         from decimal import Decimal
         from django.db import transaction
         from django.utils import timezone
-        from infrastructure.persistence.models import StockItem, StockMovement, StockReservation, MaterialRequirement
+        from infrastructure.persistence.models import StockItem, StockReservation, MaterialRequirement
 
         item = self.get_object()
 
@@ -2175,6 +1719,7 @@ class ProjectItemViewSet(BaseModelViewSet):
             )
 
         with transaction.atomic():
+            ledger = StockLedger(user=request.user)
             for allocation in allocations:
                 stock_item, _ = StockItem.objects.get_or_create(
                     warehouse_id=allocation['warehouse_id'],
@@ -2185,20 +1730,17 @@ class ProjectItemViewSet(BaseModelViewSet):
                     }
                 )
 
-                stock_item.quantity += allocation['quantity']
-                stock_item.save(update_fields=['quantity'])
-
-                StockMovement.objects.create(
-                    stock_item=stock_item,
-                    movement_type='receipt',
+                ledger.apply([StockMove(
+                    stock_item.id,
                     quantity=allocation['quantity'],
-                    balance_after=stock_item.quantity,
-                    project=item.project,
-                    project_item=item,
-                    performed_by=request.user,
-                    reason='Поступление по закрытию позиции проекта',
-                    notes=f'Поступление при переводе позиции в статус «На складе» ({timezone.now().date()})',
-                )
+                    movement_type='receipt',
+                    details={
+                        'project_id': item.project_id,
+                        'project_item_id': item.id,
+                        'reason': 'Поступление по закрытию позиции проекта',
+                        'notes': f'Поступление при переводе позиции в статус «На складе» ({timezone.now().date()})',
+                    },
+                )])
 
                 StockReservation.objects.create(
                     stock_item=stock_item,
@@ -2209,8 +1751,7 @@ class ProjectItemViewSet(BaseModelViewSet):
                     required_date=item.required_date,
                     notes='Резерв по позиции проекта',
                 )
-                stock_item.reserved_quantity += allocation['quantity']
-                stock_item.save(update_fields=['reserved_quantity'])
+                ledger.apply([StockMove(stock_item.id, reserved=allocation['quantity'])])
 
             item.purchase_status = PurchaseStatusChoices.CLOSED
             if not item.actual_start:
@@ -2262,8 +1803,6 @@ class ProjectItemViewSet(BaseModelViewSet):
         Add a child ProjectItem under the specified parent item.
         Automatically calculates dates based on parent's dates.
         """
-        from datetime import timedelta
-        
         parent_item = self.get_object()
         nomenclature_id = request.data.get('nomenclature_item')
         quantity = request.data.get('quantity') or 1
@@ -2285,155 +1824,24 @@ class ProjectItemViewSet(BaseModelViewSet):
         if not child_nomenclature.catalog_category or not allowed_categories.filter(id=child_nomenclature.catalog_category_id).exists():
             return Response({'error': 'child category is not allowed for this parent'}, status=status.HTTP_400_BAD_REQUEST)
 
-        category_code = child_nomenclature.catalog_category.code if child_nomenclature.catalog_category else 'material'
-        is_purchased = bool(child_nomenclature.catalog_category and child_nomenclature.catalog_category.is_purchased)
-
         # Determine position among siblings
         max_position = parent_item.children.aggregate(max_pos=Max('position')).get('max_pos') or 0
         position = max_position + 1
         
-        # Determine next item number (Project global)
-        # item_number is assigned automatically by ProjectItem.save()
-
-        # Calculate dates automatically based on parent's planned_start
-        planned_end = None
-        required_date = None
-        order_date = None
-        
-        if parent_item.planned_start:
-            if is_purchased:
-                # Purchased items: required_date = parent_start - 1 day
-                planned_end = parent_item.planned_start - timedelta(days=1)
-                required_date = planned_end
-                
-                # Calculate order_date based on supplier lead time (will be recalculated after supplier assignment)
-                order_date = required_date - timedelta(days=14)  # Default 14 days
-            else:
-                # Manufactured items: planned_end = parent_start - 1 day
-                planned_end = parent_item.planned_start - timedelta(days=1)
-
-        project_item = ProjectItem.objects.create(
-            project=parent_item.project,
-            nomenclature_item=child_nomenclature,
-            parent_item=parent_item,
-            category=category_code,
-            name=child_nomenclature.name,
-            drawing_number=child_nomenclature.drawing_number or '',
+        # Create the item with its BOM subtree:
+        # - dates are calculated from parent's planned_start
+        #   (purchased: required_date/order_date by supplier lead time)
+        # - responsible, contractor, material_supply_type are copied from parent
+        # - default supplier is applied to purchased items
+        result = BOMExpansionEngine(parent_item.project).expand(
+            child_nomenclature,
             quantity=quantity,
-            unit=child_nomenclature.unit or 'шт',
+            parent_item=parent_item,
             position=position,
-            manufacturing_status='not_started',
-            purchase_status=PurchaseStatusChoices.WAITING_ORDER if is_purchased else PurchaseStatusChoices.CLOSED,
-            planned_end=planned_end,
-            required_date=required_date,
-            order_date=order_date,
-            # Copy from parent: responsible, contractor, material_supply_type
-            responsible=parent_item.responsible,
-            contractor=parent_item.contractor if not is_purchased else None,
-            manufacturer_type=parent_item.manufacturer_type if not is_purchased else 'internal',
-            material_supply_type=parent_item.material_supply_type if not is_purchased else 'our_supply',
+            inherit_from=parent_item,
+            anchor_date=parent_item.planned_start,
         )
-
-        # Apply default supplier for purchased items and recalculate order_date
-        if is_purchased:
-            primary_supplier = NomenclatureSupplier.objects.filter(
-                nomenclature_item=child_nomenclature,
-                is_primary=True,
-                is_active=True
-            ).select_related('supplier').first()
-            if primary_supplier:
-                project_item.supplier = primary_supplier.supplier
-                project_item.article_number = primary_supplier.supplier_article or ''
-                
-                # Recalculate order_date based on actual supplier lead time
-                if required_date and primary_supplier.delivery_days:
-                    project_item.order_date = required_date - timedelta(days=primary_supplier.delivery_days)
-                
-                project_item.save(update_fields=['supplier', 'article_number', 'order_date'])
-        else:
-            def expand_child_bom(parent_project_item, parent_nomenclature, parent_planned_start):
-                bom = BOMStructure.objects.filter(
-                    root_item=parent_nomenclature,
-                    is_active=True
-                ).first()
-                if not bom:
-                    return
-
-                bom_items = BOMItem.objects.filter(
-                    bom=bom,
-                    parent_item=parent_nomenclature
-                ).select_related(
-                    'child_item',
-                    'child_item__catalog_category'
-                ).order_by('position')
-
-                for idx, bom_item in enumerate(bom_items):
-                    child_item = bom_item.child_item
-                    child_category_code = child_item.catalog_category.code if child_item.catalog_category else 'material'
-                    child_is_purchased = bool(child_item.catalog_category and child_item.catalog_category.is_purchased)
-                    
-                    # Calculate dates for nested child
-                    child_planned_end = None
-                    child_required_date = None
-                    child_order_date = None
-                    
-                    # For nested items, use parent_project_item's planned_start if available
-                    nested_parent_start = parent_planned_start
-                    if nested_parent_start:
-                        if child_is_purchased:
-                            child_planned_end = nested_parent_start - timedelta(days=1)
-                            child_required_date = child_planned_end
-                            child_order_date = child_required_date - timedelta(days=14)
-                        else:
-                            child_planned_end = nested_parent_start - timedelta(days=1)
-
-                    child_project_item = ProjectItem.objects.create(
-                        project=parent_project_item.project,
-                        nomenclature_item=child_item,
-                        parent_item=parent_project_item,
-                        category=child_category_code,
-                        name=child_item.name,
-                        drawing_number=child_item.drawing_number or '',
-                        quantity=float(bom_item.quantity),
-                        unit=child_item.unit or 'шт',
-                        position=idx + 1,
-                        manufacturing_status='not_started',
-                        purchase_status=PurchaseStatusChoices.WAITING_ORDER if child_is_purchased else PurchaseStatusChoices.CLOSED,
-                        planned_end=child_planned_end,
-                        required_date=child_required_date,
-                        order_date=child_order_date,
-                        # Copy from parent: responsible, contractor, material_supply_type
-                        responsible=parent_project_item.responsible,
-                        contractor=parent_project_item.contractor if not child_is_purchased else None,
-                        manufacturer_type=parent_project_item.manufacturer_type if not child_is_purchased else 'internal',
-                        material_supply_type=parent_project_item.material_supply_type if not child_is_purchased else 'our_supply',
-                    )
-
-                    if child_is_purchased:
-                        primary_supplier = NomenclatureSupplier.objects.filter(
-                            nomenclature_item=child_item,
-                            is_primary=True,
-                            is_active=True
-                        ).select_related('supplier').first()
-                        if primary_supplier:
-                            child_project_item.supplier = primary_supplier.supplier
-                            child_project_item.article_number = primary_supplier.supplier_article or ''
-                            
-                            # Recalculate order_date based on supplier lead time
-                            if child_required_date and primary_supplier.delivery_days:
-                                child_project_item.order_date = child_required_date - timedelta(days=primary_supplier.delivery_days)
-                            
-                            child_project_item.save(update_fields=['supplier', 'article_number', 'order_date'])
-                        continue
-
-                    # For manufactured children, set planned_start if parent has dates
-                    if child_planned_end and not child_is_purchased:
-                        expand_child_bom(child_project_item, child_item, child_planned_end)
-                    else:
-                        expand_child_bom(child_project_item, child_item, None)
-
-            # Pass parent's planned_start (or planned_end as the target) for recursive date calculation
-            expand_child_bom(project_item, child_nomenclature, project_item.planned_end)
+        project_item = result.root_item
 
         serializer = ProjectItemDetailSerializer(project_item, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -27,6 +27,7 @@ from ..serializers.users import (
     UserRoleSerializer,
 )
 from .base import BaseModelViewSet
+from application.services.access import get_request_permissions, invalidate_user_permissions
 
 User = get_user_model()
 
@@ -268,8 +269,9 @@ class UserViewSet(BaseModelViewSet):
         user = self.get_object()
         role_ids = request.data.get('role_ids', [])
         
-        # Deactivate current global roles
+        # Deactivate current global roles (update() bypasses signals - reset cached permissions explicitly)
         user.user_roles.filter(project_id__isnull=True).update(is_active=False)
+        invalidate_user_permissions([user.pk])
         
         # Assign new roles
         for role_id in role_ids:
@@ -504,42 +506,9 @@ class UserModuleAccessViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def my_access(self, request):
         """Get current user's module access."""
-        user = request.user
-        
-        # Get direct user access
-        user_access = self.queryset.filter(user=user)
-        
-        # Get role-based access
-        from infrastructure.persistence.models import RoleModuleAccess, UserRole
-        user_role_ids = UserRole.objects.filter(
-            user=user, 
-            is_active=True, 
-            project_id__isnull=True
-        ).values_list('role_id', flat=True)
-        
-        role_access = RoleModuleAccess.objects.filter(role_id__in=user_role_ids)
-        
-        # Merge access (user access overrides role access)
-        access_map = {}
-        for ra in role_access:
-            access_map[str(ra.module_id)] = {
-                'module_id': str(ra.module_id),
-                'module_code': ra.module.code,
-                'module_name': ra.module.name,
-                'access_level': ra.access_level,
-                'source': 'role'
-            }
-        
-        for ua in user_access:
-            access_map[str(ua.module_id)] = {
-                'module_id': str(ua.module_id),
-                'module_code': ua.module.code,
-                'module_name': ua.module.name,
-                'access_level': ua.access_level,
-                'source': 'user'
-            }
-        
-        return Response(list(access_map.values()))
+        # Role-based access merged with direct user access (user access overrides role access)
+        permissions = get_request_permissions(request)
+        return Response(list(permissions.module_access.values()))
     
     @action(detail=False, methods=['post'])
     def bulk_update(self, request):
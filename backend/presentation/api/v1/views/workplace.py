@@ -74,37 +74,12 @@ class WorkplaceViewSet(viewsets.ViewSet):
         if not include_children_items:
             return direct_items
         
-        # Collect all descendants in-memory to avoid iterative DB queries.
-        direct_rows = list(direct_items.values_list('id', 'project_id'))
-        if not direct_rows:
+        # Поддеревья своих позиций - по материализованному пути (tree_path)
+        responsible_paths = list(direct_items.values_list('tree_path', flat=True))
+        if not responsible_paths:
             return base_qs.none()
 
-        responsible_item_ids = {row[0] for row in direct_rows}
-        project_ids = {row[1] for row in direct_rows}
-
-        rel_rows = list(
-            ProjectItem.objects.filter(
-                is_active=True,
-                project__is_active=True,
-                project_id__in=project_ids,
-            ).values_list('id', 'parent_item_id')
-        )
-
-        children_by_parent = {}
-        for child_id, parent_id in rel_rows:
-            children_by_parent.setdefault(parent_id, []).append(child_id)
-
-        all_item_ids = set(responsible_item_ids)
-        stack = list(responsible_item_ids)
-        while stack:
-            parent_id = stack.pop()
-            for child_id in children_by_parent.get(parent_id, []):
-                if child_id in all_item_ids:
-                    continue
-                all_item_ids.add(child_id)
-                stack.append(child_id)
-
-        return base_qs.filter(id__in=all_item_ids)
+        return base_qs.filter(ProjectItem.subtree_q(responsible_paths))
     
     def _get_item_type(self, item):
         """Determine if item is manufactured or purchased."""
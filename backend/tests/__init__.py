@@ -0,0 +1,3 @@
+"""
+Backend test suite.
+"""
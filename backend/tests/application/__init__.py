@@ -0,0 +1,3 @@
+"""
+Application service tests (Django).
+"""
@@ -0,0 +1,72 @@
+"""
+BOM cloning through the API.
+
+root_item is validated by BOMCloneSerializer (400 for a malformed or
+unknown id); a copy built for another root takes root_category from the
+catalog category of that root.
+"""
+
+import uuid
+from decimal import Decimal
+
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from infrastructure.persistence.models import (
+    BOMItem,
+    BOMStructure,
+    CatalogCategory,
+    NomenclatureItem,
+    User,
+)
+
+
+class BOMCloneTests(TestCase):
+
+    def setUp(self):
+        self.stand = CatalogCategory.objects.create(code='stand', name='Стенд')
+        self.system = CatalogCategory.objects.create(code='system', name='Система')
+        self.part = CatalogCategory.objects.create(code='part', name='Деталь')
+
+        self.root = NomenclatureItem.objects.create(code='ST-1', name='Стенд', catalog_category=self.stand)
+        self.other_root = NomenclatureItem.objects.create(code='SYS-1', name='Система', catalog_category=self.system)
+        child = NomenclatureItem.objects.create(code='P-1', name='Деталь', catalog_category=self.part)
+
+        self.bom = BOMStructure.objects.create(name='Стенд', root_item=self.root, root_category='stand')
+        BOMItem.objects.create(
+            bom=self.bom,
+            parent_item=self.root,
+            child_item=child,
+            child_category='part',
+            quantity=Decimal('2'),
+        )
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+
+    def clone(self, **data):
+        return self.client.post(f'/api/v1/bom/{self.bom.pk}/clone/', data, format='json')
+
+    def test_invalid_root_item_is_rejected(self):
+        for root_item in ('notauuid', str(uuid.uuid4())):
+            response = self.clone(name='Копия', root_item=root_item)
+            self.assertEqual(response.status_code, 400, root_item)
+            self.assertIn('root_item', response.data)
+        self.assertEqual(BOMStructure.objects.count(), 1)
+
+    def test_name_is_required(self):
+        response = self.clone(root_item=str(self.other_root.pk))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('name', response.data)
+
+    def test_root_category_follows_new_root(self):
+        response = self.clone(name='Копия', root_item=str(self.other_root.pk))
+
+        self.assertEqual(response.status_code, 201)
+        copy = BOMStructure.objects.get(pk=response.data['id'])
+        self.assertEqual(copy.root_item_id, self.other_root.pk)
+        self.assertEqual(copy.root_category, 'system')
+        self.assertEqual(
+            list(copy.items.values_list('parent_item_id', 'child_item__code')),
+            [(self.other_root.pk, 'P-1')],
+        )
@@ -0,0 +1,125 @@
+"""
+BOM explosion and where-used.
+
+The cache generation is bumped only when nomenclature or catalog categories
+change in fields BOMs depend on; a branch cut at MAX_DEPTH raises
+BOMDepthExceeded (409 from the API) instead of returning a partial result.
+"""
+
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from application.services import bom_explosion
+from infrastructure.persistence.models import (
+    BOMItem,
+    BOMStructure,
+    CatalogCategory,
+    NomenclatureItem,
+    User,
+)
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class BOMExplosionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.assembly = CatalogCategory.objects.create(code='assembly', name='Сборка')
+        self.material = CatalogCategory.objects.create(code='material', name='Материал', is_purchased=True)
+
+        # Стенд -> Узел -> Болт (2 узла по 4 болта)
+        self.stand = NomenclatureItem.objects.create(code='ST-1', name='Стенд', catalog_category=self.assembly)
+        self.unit = NomenclatureItem.objects.create(code='U-1', name='Узел', catalog_category=self.assembly)
+        self.bolt = NomenclatureItem.objects.create(code='B-1', name='Болт', catalog_category=self.material)
+        self.bom = self.create_bom(self.stand, self.unit, '2')
+        self.create_bom(self.unit, self.bolt, '4')
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+
+    def create_bom(self, root, child, quantity):
+        bom = BOMStructure.objects.create(name=root.name, root_item=root, root_category='assembly')
+        BOMItem.objects.create(
+            bom=bom,
+            parent_item=root,
+            child_item=child,
+            child_category=child.catalog_category.code,
+            quantity=Decimal(quantity),
+        )
+        return bom
+
+    def save_and_get_generation(self, instance):
+        with self.captureOnCommitCallbacks(execute=True):
+            instance.save()
+        return bom_explosion.bom_cache_generation()
+
+    def test_explode_and_where_used(self):
+        rows = bom_explosion.explode_bom(self.bom)
+        self.assertEqual(
+            [(row['nomenclature_id'], row['quantity'], row['level']) for row in rows],
+            [(str(self.bolt.pk), Decimal('8'), 2)],
+        )
+
+        rows = {row['nomenclature_id']: row for row in bom_explosion.where_used(self.bolt.pk)}
+        self.assertEqual(rows[str(self.stand.pk)]['quantity'], Decimal('8'))
+        self.assertTrue(rows[str(self.stand.pk)]['is_top_level'])
+        self.assertFalse(rows[str(self.unit.pk)]['is_top_level'])
+
+    def test_irrelevant_nomenclature_change_keeps_generation(self):
+        generation = bom_explosion.bom_cache_generation()
+        bolt = NomenclatureItem.objects.get(pk=self.bolt.pk)
+
+        bolt.description = 'М8x20'
+        bolt.drawing_number = 'ГОСТ 7798'
+        self.assertEqual(self.save_and_get_generation(bolt), generation)
+
+        bolt.name = 'Болт М8'
+        self.assertEqual(self.save_and_get_generation(bolt), generation + 1)
+
+        bolt.unit = 'кг'
+        self.assertEqual(self.save_and_get_generation(bolt), generation + 2)
+
+    def test_category_change_bumps_generation_only_for_bom_fields(self):
+        generation = bom_explosion.bom_cache_generation()
+        category = CatalogCategory.objects.get(pk=self.material.pk)
+
+        category.sort_order = 10
+        self.assertEqual(self.save_and_get_generation(category), generation)
+
+        category.is_purchased = False
+        self.assertEqual(self.save_and_get_generation(category), generation + 1)
+
+    def test_new_nomenclature_keeps_generation(self):
+        generation = bom_explosion.bom_cache_generation()
+        item = NomenclatureItem(code='N-1', name='Новая', catalog_category=self.material)
+        self.assertEqual(self.save_and_get_generation(item), generation)
+
+    def test_truncated_explosion_raises(self):
+        with mock.patch.object(bom_explosion, 'MAX_DEPTH', 1):
+            with self.assertRaises(bom_explosion.BOMDepthExceeded) as raised:
+                bom_explosion.explode_bom(self.bom)
+            self.assertEqual(raised.exception.nomenclature_ids, [str(self.unit.pk)])
+
+            response = self.client.get(f'/api/v1/bom/{self.bom.pk}/exploded/')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('error', response.data)
+
+    def test_truncated_where_used_raises(self):
+        with mock.patch.object(bom_explosion, 'MAX_DEPTH', 1):
+            with self.assertRaises(bom_explosion.BOMDepthExceeded):
+                bom_explosion.where_used(self.bolt.pk)
+
+            response = self.client.get(f'/api/v1/nomenclature/{self.bolt.pk}/where-used/')
+        self.assertEqual(response.status_code, 409)
+
+    def test_truncated_result_is_not_cached(self):
+        with mock.patch.object(bom_explosion, 'MAX_DEPTH', 1):
+            with self.assertRaises(bom_explosion.BOMDepthExceeded):
+                bom_explosion.explode_bom(self.bom)
+        self.assertEqual(len(bom_explosion.explode_bom(self.bom)), 1)
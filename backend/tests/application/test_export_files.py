@@ -0,0 +1,73 @@
+"""
+Background export files.
+
+Files are stored under EXPORT_ROOT/<user id>/<task id>/: only the user who
+started an export finds it, task ids cannot point outside that directory and
+expired exports are removed.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from django.test import SimpleTestCase, override_settings
+
+from application.services.export import cleanup_exports, create_export_dir, find_export, is_export_owner
+
+
+class ExportFilesTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        override = override_settings(EXPORT_ROOT=self.root, EXPORT_FILE_TTL=3600)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.owner = str(uuid.uuid4())
+        self.task_id = str(uuid.uuid4())
+
+    def create_export(self, user_id, task_id, name='BOM_20260101_120000.xlsx'):
+        directory = create_export_dir(user_id, task_id)
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as output:
+            output.write(b'data')
+        return path
+
+    def test_only_owner_finds_export(self):
+        path = self.create_export(self.owner, self.task_id)
+
+        self.assertEqual(find_export(self.owner, self.task_id), path)
+        self.assertTrue(is_export_owner(self.owner, self.task_id))
+        self.assertIsNone(find_export(uuid.uuid4(), self.task_id))
+        self.assertFalse(is_export_owner(uuid.uuid4(), self.task_id))
+
+    def test_started_export_without_file(self):
+        create_export_dir(self.owner, self.task_id)
+
+        self.assertTrue(is_export_owner(self.owner, self.task_id))
+        self.assertIsNone(find_export(self.owner, self.task_id))
+
+    def test_task_id_must_be_uuid(self):
+        self.create_export(self.owner, self.task_id)
+
+        for task_id in (None, '', '..', f'../{self.owner}/{self.task_id}', 'BOM_20260101_120000.xlsx'):
+            self.assertIsNone(find_export(self.owner, task_id))
+            self.assertFalse(is_export_owner(self.owner, task_id))
+
+    def test_cleanup_removes_expired_exports(self):
+        expired = self.create_export(self.owner, self.task_id)
+        fresh = self.create_export(self.owner, str(uuid.uuid4()))
+        old = time.time() - 7200
+        os.utime(os.path.dirname(expired), (old, old))
+
+        self.assertEqual(cleanup_exports(), 1)
+        self.assertIsNone(find_export(self.owner, self.task_id))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertEqual(cleanup_exports(), 0)
+
+    def test_cleanup_without_export_root(self):
+        with override_settings(EXPORT_ROOT=os.path.join(self.root, 'missing')):
+            self.assertEqual(cleanup_exports(), 0)
@@ -0,0 +1,159 @@
+"""
+Goods receipt confirmation and cancellation (GoodsReceiptProcessor).
+
+Confirmation adds the received quantities to stock with a 'receipt'
+movement per line and moves delivered_quantity/status of the order lines;
+cancellation reverses both with 'correction' movements. A receipt is
+confirmed once: a second confirmation (also through a stale copy) changes
+nothing.
+"""
+
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from infrastructure.persistence.models import (
+    CatalogCategory,
+    GoodsReceipt,
+    GoodsReceiptItem,
+    NomenclatureItem,
+    PurchaseOrder,
+    PurchaseOrderItem,
+    StockItem,
+    StockMovement,
+    Supplier,
+    User,
+    Warehouse,
+)
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class GoodsReceiptProcessorTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('application.services.problem_detection.schedule_order_refresh')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(username='storekeeper', password='x')
+        self.warehouse = Warehouse.objects.create(code='WH-1', name='Основной склад')
+        material = CatalogCategory.objects.create(code='material', name='Материал', is_purchased=True)
+        self.bolt = NomenclatureItem.objects.create(code='B-1', name='Болт', catalog_category=material)
+        self.nut = NomenclatureItem.objects.create(code='G-1', name='Гайка', catalog_category=material)
+
+        # Болт уже есть на складе, гайки - нет
+        StockItem.objects.create(warehouse=self.warehouse, nomenclature_item=self.bolt, quantity=Decimal('3'))
+
+        self.order = PurchaseOrder.objects.create(supplier=Supplier.objects.create(name='Поставщик'))
+        self.bolt_line = self.create_line(self.bolt, '10')
+        self.nut_line = self.create_line(self.nut, '4')
+        PurchaseOrder.objects.filter(pk=self.order.pk).update(status='ordered')
+        self.order.refresh_from_db()
+
+        # Болты - частично, гайки - полностью
+        self.receipt = GoodsReceipt.objects.create(
+            purchase_order=self.order,
+            warehouse=self.warehouse,
+            received_by=self.user,
+        )
+        GoodsReceiptItem.objects.create(
+            goods_receipt=self.receipt, purchase_order_item=self.bolt_line, quantity=Decimal('4')
+        )
+        GoodsReceiptItem.objects.create(
+            goods_receipt=self.receipt, purchase_order_item=self.nut_line, quantity=Decimal('4')
+        )
+
+    def create_line(self, nomenclature, quantity):
+        return PurchaseOrderItem.objects.create(
+            order=self.order,
+            nomenclature_item=nomenclature,
+            quantity=Decimal(quantity),
+            unit_price=Decimal('5'),
+            status='ordered',
+        )
+
+    def stock_quantity(self, nomenclature):
+        return StockItem.objects.get(warehouse=self.warehouse, nomenclature_item=nomenclature).quantity
+
+    def movements(self, movement_type):
+        return list(
+            StockMovement.objects.filter(movement_type=movement_type)
+            .order_by('stock_item__nomenclature_item__code')
+            .values_list('stock_item__nomenclature_item__code', 'quantity', 'balance_after')
+        )
+
+    def assert_confirmed_state(self):
+        self.assertEqual(self.stock_quantity(self.bolt), Decimal('7'))
+        self.assertEqual(self.stock_quantity(self.nut), Decimal('4'))
+        self.assertEqual(
+            self.movements('receipt'),
+            [('B-1', Decimal('4'), Decimal('7')), ('G-1', Decimal('4'), Decimal('4'))],
+        )
+
+        self.bolt_line.refresh_from_db()
+        self.nut_line.refresh_from_db()
+        self.assertEqual(self.bolt_line.delivered_quantity, Decimal('4'))
+        self.assertEqual(self.bolt_line.status, 'in_transit')
+        self.assertIsNone(self.bolt_line.actual_delivery_date)
+        self.assertEqual(self.nut_line.delivered_quantity, Decimal('4'))
+        self.assertEqual(self.nut_line.status, 'delivered')
+        self.assertEqual(self.nut_line.actual_delivery_date, self.receipt.receipt_date)
+
+    def test_confirm(self):
+        self.receipt.confirm(user=self.user)
+
+        self.assertEqual(GoodsReceipt.objects.get(pk=self.receipt.pk).status, 'confirmed')
+        self.assert_confirmed_state()
+        self.assertEqual(
+            set(StockMovement.objects.values_list('performed_by_id', flat=True)), {self.user.pk}
+        )
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'partially_delivered')
+
+    def test_double_confirm_is_rejected(self):
+        stale = GoodsReceipt.objects.get(pk=self.receipt.pk)
+        self.receipt.confirm(user=self.user)
+
+        with self.assertRaises(ValueError):
+            self.receipt.confirm(user=self.user)
+        # Копия, загруженная до подтверждения, проходит проверку статуса в памяти,
+        # но не проверку под блокировкой
+        with self.assertRaises(ValueError):
+            stale.confirm(user=self.user)
+
+        self.assert_confirmed_state()
+
+    def test_cancel(self):
+        self.receipt.confirm(user=self.user)
+        self.receipt.cancel_confirmation(user=self.user)
+
+        self.assertEqual(GoodsReceipt.objects.get(pk=self.receipt.pk).status, 'cancelled')
+        self.assertEqual(self.stock_quantity(self.bolt), Decimal('3'))
+        self.assertEqual(self.stock_quantity(self.nut), Decimal('0'))
+        self.assertEqual(
+            self.movements('correction'),
+            [('B-1', Decimal('-4'), Decimal('3')), ('G-1', Decimal('-4'), Decimal('0'))],
+        )
+
+        for line in (self.bolt_line, self.nut_line):
+            line.refresh_from_db()
+            self.assertEqual(line.delivered_quantity, Decimal('0'))
+            self.assertEqual(line.status, 'ordered')
+            self.assertIsNone(line.actual_delivery_date)
+
+    def test_cancel_requires_confirmed_receipt(self):
+        with self.assertRaises(ValueError):
+            self.receipt.cancel_confirmation(user=self.user)
+
+        self.receipt.confirm(user=self.user)
+        self.receipt.cancel_confirmation(user=self.user)
+        with self.assertRaises(ValueError):
+            self.receipt.cancel_confirmation(user=self.user)
+
+        self.assertEqual(self.stock_quantity(self.bolt), Decimal('3'))
+        self.assertEqual(len(self.movements('correction')), 2)
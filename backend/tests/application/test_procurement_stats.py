@@ -0,0 +1,105 @@
+"""
+Procurement statistics.
+
+/purchase-orders/stats/ keeps its total_amount: the sum of total_amount of
+orders that are not cancelled (cancelled lines of those orders included).
+The summary is cached apart from the full analytics, and /analytics/
+rejects supplier/project values that are not UUIDs with 400.
+"""
+
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from application.services import procurement_stats
+from infrastructure.persistence.models import (
+    NomenclatureItem,
+    PurchaseOrder,
+    PurchaseOrderItem,
+    Supplier,
+    User,
+)
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ProcurementStatsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('application.services.problem_detection.schedule_order_refresh')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.supplier = Supplier.objects.create(name='Поставщик')
+        self.nomenclature = NomenclatureItem.objects.create(code='N-0001', name='Подшипник')
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='buyer', password='x'))
+
+    def create_order(self, lines, status='draft'):
+        order = PurchaseOrder.objects.create(supplier=self.supplier)
+        for unit_price, line_status in lines:
+            PurchaseOrderItem.objects.create(
+                order=order,
+                nomenclature_item=self.nomenclature,
+                quantity=Decimal('2'),
+                unit_price=Decimal(unit_price),
+                status=line_status,
+            )
+        PurchaseOrder.objects.filter(pk=order.pk).update(status=status)
+        order.refresh_from_db()
+        return order
+
+    def test_stats_total_amount_is_sum_of_order_totals(self):
+        # 2 * 100 + 2 * 50 (отменённая строка остаётся в сумме заказа)
+        first = self.create_order([('100', 'ordered'), ('50', 'cancelled')], status='ordered')
+        second = self.create_order([('10', 'pending')])
+        self.create_order([('1000', 'ordered')], status='cancelled')
+
+        response = self.client.get('/api/v1/purchase-orders/stats/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data['total_amount']), first.total_amount + second.total_amount)
+        self.assertEqual(Decimal(response.data['total_amount']), Decimal('320'))
+        self.assertEqual(response.data['total_orders'], 3)
+
+    def test_stats_does_not_build_breakdowns(self):
+        self.create_order([('100', 'ordered')])
+
+        with mock.patch.object(procurement_stats.ProcurementStats, 'build') as build:
+            response = self.client.get('/api/v1/purchase-orders/stats/')
+
+        self.assertEqual(response.status_code, 200)
+        build.assert_not_called()
+
+    def test_summary_and_analytics_cached_separately(self):
+        self.create_order([('100', 'ordered')])
+
+        summary = procurement_stats.get_procurement_summary()
+        analytics = procurement_stats.get_procurement_stats()
+
+        self.assertEqual(analytics['summary'], summary)
+        self.assertIn('by_supplier', analytics)
+        self.assertNotIn('by_supplier', summary)
+
+    def test_analytics_rejects_invalid_uuid(self):
+        for params in ({'project': 'notauuid'}, {'supplier': '123'}):
+            response = self.client.get('/api/v1/purchase-orders/analytics/', params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_analytics_filters_by_supplier(self):
+        self.create_order([('100', 'ordered')])
+
+        response = self.client.get(
+            '/api/v1/purchase-orders/analytics/',
+            {'supplier': str(self.supplier.pk), 'project': ''},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['summary']['total_orders'], 1)
+        self.assertEqual([row['supplier_id'] for row in response.data['by_supplier']], [self.supplier.pk])
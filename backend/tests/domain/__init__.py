@@ -0,0 +1,3 @@
+"""
+Domain layer tests (no Django required).
+"""
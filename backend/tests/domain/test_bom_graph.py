@@ -0,0 +1,203 @@
+"""
+BOMGraph property tests.
+
+Random DAGs are built through the BOMStructure aggregate and every indexed
+lookup is compared with the linear scans over the item list that the
+aggregate used before BOMGraph.
+"""
+
+import random
+from decimal import Decimal
+from uuid import uuid4
+
+import pytest
+
+from domain.bom.aggregates import BOMStructure
+from domain.shared.exceptions import CircularReferenceException
+from domain.shared.value_objects import NomenclatureCategory, Quantity
+
+SEEDS = range(300)
+# Подсистема может содержать подсистемы - любые DAG проходят проверку категорий
+CATEGORY = NomenclatureCategory.SUBSYSTEM
+
+
+# =============================================================================
+# Previous linear-scan implementations
+# =============================================================================
+
+def scan_children(items, parent_item_id):
+    return [item for item in items if item.parent_item_id == parent_item_id]
+
+
+def scan_item_by_child_id(items, child_item_id, parent_item_id=None):
+    for item in items:
+        if item.child_item_id == child_item_id:
+            if parent_item_id is None or item.parent_item_id == parent_item_id:
+                return item
+    return None
+
+
+def scan_descendants(items, parent_item_id):
+    descendants = []
+    for child in scan_children(items, parent_item_id):
+        descendants.append(child)
+        descendants.extend(scan_descendants(items, child.child_item_id))
+    return descendants
+
+
+def scan_path_to_root(items, item_id):
+    path = []
+    current_id = item_id
+    while current_id is not None:
+        item = scan_item_by_child_id(items, current_id)
+        if item:
+            path.append(item)
+            current_id = item.parent_item_id
+        else:
+            break
+    return path
+
+
+def scan_total_quantity(items, child_item_id, root_quantity=Decimal('1')):
+    total = Decimal('0')
+
+    def find_paths(current_id, accumulated_qty):
+        nonlocal total
+        for item in items:
+            if item.child_item_id == current_id:
+                current_qty = accumulated_qty * item.quantity.value
+                if item.is_root:
+                    total += current_qty
+                else:
+                    find_paths(item.parent_item_id, current_qty)
+
+    find_paths(child_item_id, root_quantity)
+    return total
+
+
+def scan_first_usage_ancestors(items, parent_item_id):
+    """Ancestors checked by the previous _check_circular_reference."""
+    return {item.child_item_id for item in scan_path_to_root(items, parent_item_id)}
+
+
+def scan_all_ancestors(items, node_id):
+    """The node and every node above it along any usage."""
+    seen = {node_id}
+    changed = True
+    while changed:
+        changed = False
+        for item in items:
+            if item.child_item_id in seen and item.parent_item_id is not None and item.parent_item_id not in seen:
+                seen.add(item.parent_item_id)
+                changed = True
+    return seen
+
+
+# =============================================================================
+# Helpers
+# =============================================================================
+
+def random_bom(rng):
+    """BOM over a random DAG: edges only go from lower to higher node index."""
+    nodes = [uuid4() for _ in range(rng.randint(2, 25))]
+    bom = BOMStructure(root_item_id=nodes[0], root_category=CATEGORY)
+
+    for index in range(1, len(nodes)):
+        parents = rng.sample(nodes[:index], rng.randint(1, min(index, 3)))
+        for parent_id in parents:
+            bom.add_item(
+                parent_item_id=parent_id,
+                child_item_id=nodes[index],
+                child_category=CATEGORY,
+                quantity=Quantity(Decimal(rng.randint(1, 5)), "шт"),
+            )
+
+    # Часть позиций удаляется, чтобы проверить поддержку индексов
+    for _ in range(rng.randint(0, 3)):
+        removable = [item for item in bom.items if not item.is_root]
+        if not removable:
+            break
+        item = rng.choice(removable)
+        bom.remove_item(item.child_item_id, item.parent_item_id, remove_descendants=True)
+    return bom, nodes
+
+
+def same_items(left, right):
+    return [id(item) for item in left] == [id(item) for item in right]
+
+
+# =============================================================================
+# Properties
+# =============================================================================
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_lookups_match_linear_scans(seed):
+    rng = random.Random(seed)
+    bom, nodes = random_bom(rng)
+    items = bom.items
+
+    for node_id in nodes + [uuid4()]:
+        assert same_items(bom.get_children(node_id), scan_children(items, node_id))
+        assert bom.get_item_by_child_id(node_id) is scan_item_by_child_id(items, node_id)
+        for parent_id in nodes:
+            assert bom.get_item_by_child_id(node_id, parent_id) is scan_item_by_child_id(items, node_id, parent_id)
+        assert same_items(bom.get_path_to_root(node_id), scan_path_to_root(items, node_id))
+        assert same_items(bom.get_all_descendants(node_id), scan_descendants(items, node_id))
+
+    assert same_items(bom.get_children(None), scan_children(items, None))
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_total_quantities_match_path_enumeration(seed):
+    rng = random.Random(seed)
+    bom, nodes = random_bom(rng)
+    items = bom.items
+    root_quantity = Decimal(rng.randint(1, 4))
+
+    totals = bom.calculate_total_quantities(root_quantity)
+    for node_id in nodes:
+        expected = scan_total_quantity(items, node_id, root_quantity)
+        actual = totals[node_id].value if node_id in totals else Decimal('0')
+        assert actual == expected
+        assert bom.calculate_total_quantity(node_id, root_quantity).value == expected
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_circular_reference_checks_all_ancestors(seed):
+    rng = random.Random(seed)
+    bom, nodes = random_bom(rng)
+    items = bom.items
+
+    for parent_id in nodes:
+        if bom.get_item_by_child_id(parent_id) is None:
+            continue
+        ancestors = scan_all_ancestors(items, parent_id)
+        # Прежняя проверка шла только по первой связи - новая её не ослабляет
+        assert scan_first_usage_ancestors(items, parent_id) <= ancestors
+        for child_id in nodes:
+            if child_id in ancestors:
+                with pytest.raises(CircularReferenceException):
+                    bom._check_circular_reference(parent_id, child_id)
+            else:
+                bom._check_circular_reference(parent_id, child_id)
+
+    bom.validate()
+
+
+def test_circular_reference_through_second_usage():
+    """
+    A -> B -> D and A -> C -> D: D is first used under B, so adding C under
+    D closes a cycle that the first-usage path D -> B -> A does not see.
+    """
+    a, b, c, d = (uuid4() for _ in range(4))
+    bom = BOMStructure(root_item_id=a, root_category=CATEGORY)
+    one = Quantity(Decimal('1'), "шт")
+    bom.add_item(a, b, CATEGORY, one)
+    bom.add_item(a, c, CATEGORY, one)
+    bom.add_item(b, d, CATEGORY, one)
+    bom.add_item(c, d, CATEGORY, one)
+
+    assert c not in scan_first_usage_ancestors(bom.items, d)
+    with pytest.raises(CircularReferenceException):
+        bom.add_item(d, c, CATEGORY, one)
+    bom.validate()
@@ -0,0 +1,3 @@
+"""
+Infrastructure tests (Django, PostgreSQL).
+"""
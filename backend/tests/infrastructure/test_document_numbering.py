@@ -0,0 +1,132 @@
+"""
+Document numbering under concurrent load.
+
+Purchase orders, goods receipts and inventory documents are created from
+parallel threads (own database connection and transaction per document);
+every save draws its number from DocumentNumbering. The numbers must be
+unique and no save may fail on the unique constraint.
+"""
+
+import threading
+import unittest
+from collections import Counter
+from datetime import date
+from unittest import mock
+
+from django.db import connection, transaction
+from django.test import TransactionTestCase, override_settings
+
+from infrastructure.persistence.models import (
+    DocumentSequence,
+    GoodsReceipt,
+    InventoryDocument,
+    PurchaseOrder,
+    Supplier,
+    Warehouse,
+)
+
+THREADS = 8
+PER_THREAD = 25
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Счётчики документов рассчитаны на PostgreSQL')
+class DocumentNumberingConcurrencyTests(TransactionTestCase):
+
+    def setUp(self):
+        # Заказы ставят пересчёт флагов проблем в Celery - брокер в тестах не нужен
+        patcher = mock.patch('application.services.problem_detection.schedule_order_refresh')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.supplier = Supplier.objects.create(name='Поставщик')
+        self.warehouse = Warehouse.objects.create(code='WH-1', name='Склад')
+        self.order = PurchaseOrder.objects.create(supplier=self.supplier)
+
+    def tearDown(self):
+        # Счётчики очищаются вместе с таблицами - кэш номеров процесса тоже
+        for model in (PurchaseOrder, GoodsReceipt, InventoryDocument):
+            model.numbering.reset()
+
+    def create_concurrently(self, create, atomic=True):
+        """
+        Создать THREADS * PER_THREAD документов параллельно; вернуть номера и ошибки.
+        atomic=False - сохранение в autocommit (так работает кэш номеров процесса).
+        """
+        barrier = threading.Barrier(THREADS)
+        numbers, errors = [], []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(PER_THREAD):
+                    try:
+                        if atomic:
+                            with transaction.atomic():
+                                document = create()
+                        else:
+                            document = create()
+                    except Exception as exc:
+                        with lock:
+                            errors.append(exc)
+                    else:
+                        with lock:
+                            numbers.append(document.number)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return numbers, errors
+
+    def assert_unique(self, model, numbers, errors):
+        self.assertEqual(errors, [])
+        self.assertEqual(len(numbers), THREADS * PER_THREAD)
+        duplicates = [number for number, count in Counter(numbers).items() if count > 1]
+        self.assertEqual(duplicates, [])
+        stored = model.all_objects.filter(number__in=numbers).values_list('number', flat=True)
+        self.assertEqual(sorted(stored), sorted(numbers))
+
+    def test_purchase_orders(self):
+        numbers, errors = self.create_concurrently(
+            lambda: PurchaseOrder.objects.create(supplier=self.supplier)
+        )
+        self.assert_unique(PurchaseOrder, numbers, errors)
+
+    def test_goods_receipts(self):
+        numbers, errors = self.create_concurrently(
+            lambda: GoodsReceipt.objects.create(purchase_order=self.order, warehouse=self.warehouse)
+        )
+        self.assert_unique(GoodsReceipt, numbers, errors)
+
+    def test_inventory_documents(self):
+        numbers, errors = self.create_concurrently(
+            lambda: InventoryDocument.objects.create(warehouse=self.warehouse, planned_date=date.today())
+        )
+        self.assert_unique(InventoryDocument, numbers, errors)
+
+    def test_first_use_seeds_counter_from_existing_numbers(self):
+        # Документ с номером, выданным до появления счётчика (в т.ч. удалённый)
+        DocumentSequence.objects.filter(key=GoodsReceipt.numbering.key).delete()
+        existing = GoodsReceipt.objects.create(
+            number='П-0041', purchase_order=self.order, warehouse=self.warehouse,
+        )
+        existing.soft_delete()
+
+        numbers, errors = self.create_concurrently(
+            lambda: GoodsReceipt.objects.create(purchase_order=self.order, warehouse=self.warehouse)
+        )
+        self.assert_unique(GoodsReceipt, numbers, errors)
+        self.assertNotIn('П-0041', numbers)
+        self.assertEqual(min(numbers), 'П-0042')
+
+    @override_settings(DOCUMENT_NUMBER_CACHE_SIZE=10)
+    def test_purchase_orders_with_process_cache(self):
+        numbers, errors = self.create_concurrently(
+            lambda: PurchaseOrder.objects.create(supplier=self.supplier),
+            atomic=False,
+        )
+        self.assert_unique(PurchaseOrder, numbers, errors)
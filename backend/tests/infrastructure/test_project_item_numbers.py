@@ -0,0 +1,137 @@
+"""
+Project item IDs under concurrent load.
+
+ProjectItem.item_number comes from the project_item_number_seq sequence.
+Items of different projects are created from parallel threads inside open
+transactions: the numbers must be unique and a transaction that has not
+committed yet must not hold other projects back.
+"""
+
+import threading
+import unittest
+from collections import Counter
+
+from django.db import connection, transaction
+from django.test import TransactionTestCase, override_settings
+
+from infrastructure.persistence.models import NomenclatureItem, Project, ProjectItem
+from infrastructure.persistence.models.project import item_number_allocator
+
+THREADS = 8
+PER_THREAD = 25
+WAIT_TIMEOUT = 10
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'ID позиций выдаёт последовательность PostgreSQL')
+class ProjectItemNumberConcurrencyTests(TransactionTestCase):
+
+    def setUp(self):
+        self.nomenclature = NomenclatureItem.objects.create(code='N-0001', name='Деталь')
+        self.projects = [Project.objects.create(name=f'Проект {index}') for index in range(THREADS)]
+        item_number_allocator.reset()
+
+    def tearDown(self):
+        item_number_allocator.reset()
+
+    def create_item(self, project):
+        return ProjectItem.objects.create(
+            project=project,
+            nomenclature_item=self.nomenclature,
+            category='part',
+            name='Деталь',
+        )
+
+    def run_threads(self, targets):
+        threads = [threading.Thread(target=target) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_items_of_parallel_projects_get_unique_numbers(self):
+        barrier = threading.Barrier(THREADS)
+        numbers, errors = [], []
+        lock = threading.Lock()
+
+        def worker(project):
+            def run():
+                try:
+                    barrier.wait()
+                    for _ in range(PER_THREAD):
+                        try:
+                            with transaction.atomic():
+                                item = self.create_item(project)
+                        except Exception as exc:
+                            with lock:
+                                errors.append(exc)
+                        else:
+                            with lock:
+                                numbers.append(item.item_number)
+                finally:
+                    connection.close()
+            return run
+
+        self.run_threads([worker(project) for project in self.projects])
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(numbers), THREADS * PER_THREAD)
+        duplicates = [number for number, count in Counter(numbers).items() if count > 1]
+        self.assertEqual(duplicates, [])
+
+    def test_block_allocation_inside_transaction(self):
+        with transaction.atomic():
+            block = item_number_allocator.allocate_block(50)
+        self.assertEqual(len(set(block)), 50)
+        self.assertEqual(block, sorted(block))
+        self.assertGreater(self.create_item(self.projects[0]).item_number, block[-1])
+
+    @override_settings(PROJECT_ITEM_NUMBER_CACHE_SIZE=1)
+    def test_open_transaction_does_not_block_other_projects(self):
+        created = threading.Event()
+        release = threading.Event()
+        numbers = []
+
+        def hold():
+            # Позиция создана, транзакция не зафиксирована
+            try:
+                with transaction.atomic():
+                    numbers.append(self.create_item(self.projects[0]).item_number)
+                    created.set()
+                    release.wait(WAIT_TIMEOUT)
+            finally:
+                connection.close()
+
+        def other():
+            try:
+                with transaction.atomic():
+                    numbers.append(self.create_item(self.projects[1]).item_number)
+            finally:
+                connection.close()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        try:
+            self.assertTrue(created.wait(WAIT_TIMEOUT))
+            worker = threading.Thread(target=other)
+            worker.start()
+            worker.join(WAIT_TIMEOUT / 2)
+            self.assertFalse(worker.is_alive(), 'Номер позиции ждёт чужую транзакцию')
+        finally:
+            release.set()
+            holder.join()
+
+        self.assertEqual(len(set(numbers)), 2)
+
+    def test_sync_with_items_only_raises_sequence(self):
+        current = item_number_allocator.last_value()
+        ProjectItem.objects.create(
+            project=self.projects[0],
+            nomenclature_item=self.nomenclature,
+            item_number=current + 1000,
+            category='part',
+            name='Загружено в обход приложения',
+        )
+
+        self.assertEqual(item_number_allocator.sync_with_items(), (current, current + 1000))
+        self.assertEqual(item_number_allocator.sync_with_items(), (current + 1000, current + 1000))
+        self.assertEqual(self.create_item(self.projects[0]).item_number, current + 1001)